@@ -54,13 +54,15 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
     implements(IBuildSlave)
     keepalive_timer = None
     keepalive_interval = None
+    compress_updates = False
 
     # reconfig slaves after builders
     reconfig_priority = 64
 
     def __init__(self, name, password, max_builds=None,
                  notify_on_missing=[], missing_timeout=3600,
-                 properties={}, locks=None, keepalive_interval=3600):
+                 properties={}, locks=None, keepalive_interval=3600,
+                 compress_updates=False):
         """
         @param name: botname this machine will supply when it connects
         @param password: password this machine will supply when
@@ -74,6 +76,8 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         @param locks: A list of locks that must be acquired before this slave
                       can be used
         @type locks: dictionary
+        @param compress_updates: if true, ask the slave to compress the
+                                 output it sends, if it knows how
         """
         service.MultiService.__init__(self)
         self.slavename = name
@@ -113,6 +117,7 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.missing_timeout = missing_timeout
         self.missing_timer = None
         self.keepalive_interval = keepalive_interval
+        self.compress_updates = compress_updates
 
         self.detached_subs = None
 
@@ -251,6 +256,7 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
         self.access = new.access
         self.notify_on_missing = new.notify_on_missing
         self.keepalive_interval = new.keepalive_interval
+        self.compress_updates = new.compress_updates
 
         if self.missing_timeout != new.missing_timeout:
             running_missing_timer = self.missing_timer
@@ -474,6 +480,36 @@ class AbstractBuildSlave(config.ReconfigurableServiceMixin, pb.Avatar,
             d1.addCallbacks(_got_commands, _commands_unavailable)
             return d1
 
+        def shellVersionIsOlderThan(minversion):
+            commands = state.get("slave_commands")
+            if not isinstance(commands, dict) or "shell" not in commands:
+                return True
+            return (map(int, commands["shell"].split(".")) <
+                    map(int, minversion.split(".")))
+
+        @d.addCallback
+        def _set_update_compression(_):
+            # slaves from command version 2.21 on can compress their output
+            if not self.compress_updates:
+                return
+            if shellVersionIsOlderThan("2.21"):
+                log.msg("buildslave '%s' cannot compress updates"
+                        % self.slavename)
+                return
+            d1 = bot.callRemote("setUpdateCompression", True)
+            d1.addErrback(log.err, "while enabling update compression")
+            return d1
+
+        @d.addCallback
+        def _set_ordered_updates(_):
+            # slaves from command version 2.22 on can batch output from
+            # several logs into one ordered update
+            if shellVersionIsOlderThan("2.22"):
+                return
+            d1 = bot.callRemote("setOrderedUpdates", True)
+            d1.addErrback(log.err, "while enabling ordered updates")
+            return d1
+
         @d.addCallback
         def _accept_slave(res):
             self.slave_status.setConnected(True)
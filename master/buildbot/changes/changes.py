@@ -57,9 +57,16 @@ class Change:
 
         @returns: L{Change} via Deferred
         """
-        cache = master.caches.get_cache("Changes", cls._make_ch)
+        cache = master.caches.get_cache("Changes", cls._make_ch,
+                                        weight_fn=cls._weigh_ch)
         return cache.get(chdict['changeid'], chdict=chdict, master=master)
 
+    @classmethod
+    def _weigh_ch(cls, change):
+        # a rough estimate of the bytes held by the change
+        return (1024 + len(change.comments or '') +
+                sum(len(f) for f in change.files))
+
     @classmethod
     def _make_ch(cls, changeid, master, chdict):
         change = cls(None, None, None, _fromChdict=True)
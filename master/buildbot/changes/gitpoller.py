@@ -142,6 +142,24 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         return "refs/buildbot/%s/%s" % (urllib.quote(self.repourl, ''),
                                         self._removeHeads(branch))
 
+    def _getTrackerTips(self):
+        """Resolve all of this repository's tracking refs with a single
+        for-each-ref, returning a dictionary mapping ref to revision."""
+        args = ['--format=%(objectname) %(refname)',
+                'refs/buildbot/%s' % urllib.quote(self.repourl, '')]
+        d = self._dovccmd('for-each-ref', args, path=self.workdir)
+
+        @d.addCallback
+        def parseRefs(rows):
+            tips = {}
+            for row in rows.splitlines():
+                if ' ' not in row:
+                    continue
+                sha, ref = row.split(' ', 1)
+                tips[ref] = sha
+            return tips
+        return d
+
     @defer.inlineCallbacks
     def poll(self):
         yield self._dovccmd('init', ['--bare', self.workdir])
@@ -161,11 +179,15 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         yield self._dovccmd('fetch',
                             [self.repourl] + refspecs, path=self.workdir)
 
+        tips = yield self._getTrackerTips()
         revs = {}
         for branch in branches:
             try:
-                revs[branch] = rev = yield self._dovccmd(
-                    'rev-parse', [self._trackerBranch(branch)], path=self.workdir)
+                rev = tips.get(self._trackerBranch(branch))
+                if rev is None:
+                    raise EnvironmentError('no tracking ref for branch %s'
+                                           % branch)
+                revs[branch] = rev
                 yield self._process_changes(rev, branch)
             except:
                 log.err(_why="trying to poll branch %s of %s"
@@ -187,57 +209,93 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         # unix timestamp
         args = ['--no-walk', r'--format=%ct', rev, '--']
         d = self._dovccmd('log', args, path=self.workdir)
-
-        def process(git_output):
-            if self.usetimestamps:
-                try:
-                    stamp = float(git_output)
-                except Exception, e:
-                        log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % git_output)
-                        raise e
-                return stamp
-            else:
-                return None
-        d.addCallback(process)
+        d.addCallback(self._decode_timestamp)
         return d
 
     def _get_commit_files(self, rev):
         args = ['--name-only', '--no-walk', r'--format=%n', rev, '--']
         d = self._dovccmd('log', args, path=self.workdir)
 
-        def decode_file(file):
-            # git use octal char sequences in quotes when non ASCII
-            match = re.match('^"(.*)"$', file)
-            if match:
-                file = match.groups()[0].decode('string_escape')
-            return self._decode(file)
-
         def process(git_output):
-            fileList = [decode_file(file) for file in itertools.ifilter(lambda s: len(s), git_output.splitlines())]
-            return fileList
+            return self._decode_files(git_output)
         d.addCallback(process)
         return d
 
+    def _decode_file(self, file):
+        # git use octal char sequences in quotes when non ASCII
+        match = re.match('^"(.*)"$', file)
+        if match:
+            file = match.groups()[0].decode('string_escape')
+        return self._decode(file)
+
+    def _decode_files(self, git_output):
+        return [self._decode_file(file) for file in
+                itertools.ifilter(lambda s: len(s), git_output.splitlines())]
+
+    def _decode_author(self, git_output):
+        git_output = self._decode(git_output)
+        if len(git_output) == 0:
+            raise EnvironmentError('could not get commit author for rev')
+        return git_output
+
+    def _decode_timestamp(self, git_output):
+        if self.usetimestamps:
+            try:
+                stamp = float(git_output)
+            except Exception, e:
+                    log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % git_output)
+                    raise e
+            return stamp
+        else:
+            return None
+
     def _get_commit_author(self, rev):
         args = ['--no-walk', r'--format=%aN <%aE>', rev, '--']
         d = self._dovccmd('log', args, path=self.workdir)
-
-        def process(git_output):
-            git_output = self._decode(git_output)
-            if len(git_output) == 0:
-                raise EnvironmentError('could not get commit author for rev')
-            return git_output
-        d.addCallback(process)
+        d.addCallback(self._decode_author)
         return d
 
+    # Each commit is written as NUL-separated fields, followed by the
+    # --name-only file list.  NUL cannot appear in hashes, names, commit
+    # messages or (quoted) file names, so the fields need no escaping.
+    LOG_FORMAT = r'--format=%x00%H%x00%ct%x00%aN <%aE>%x00%s%n%b%x00'
+    LOG_FIELDS = 5
+
+    def _parse_log(self, git_output):
+        """
+        Parse the output of C{git log} with L{LOG_FORMAT}, yielding a tuple
+        (rev, timestamp, author, files, comments) for each commit as soon as
+        its fields have been read.
+        """
+        pos = git_output.find('\0')
+        if pos < 0:
+            return
+        pos += 1
+        while pos < len(git_output):
+            fields = []
+            while len(fields) < self.LOG_FIELDS:
+                end = git_output.find('\0', pos)
+                if end < 0:
+                    # the file list of the last commit runs to the end
+                    if len(fields) < self.LOG_FIELDS - 1:
+                        raise EnvironmentError('truncated output from git log')
+                    end = len(git_output)
+                fields.append(git_output[pos:end])
+                pos = end + 1
+            rev, timestamp, author, comments, files = fields
+            yield (rev,
+                   self._decode_timestamp(timestamp),
+                   self._decode_author(author),
+                   self._decode_files(files),
+                   self._decode(comments.strip()))
+
     @defer.inlineCallbacks
     def _process_changes(self, newRev, branch):
         """
         Read changes since last change.
 
-        - Read list of commit hashes.
-        - Extract details from each commit.
-        - Add changes to database.
+        - Read the details of all new commits with a single git log.
+        - Add changes to database, oldest first.
         """
 
         lastRev = self.lastRev.get(branch)
@@ -245,36 +303,14 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         if not lastRev:
             return
 
-        # get the change list
-        revListArgs = [r'--format=%H', '%s..%s' % (lastRev, newRev), '--']
+        logArgs = ['--reverse', '--name-only', self.LOG_FORMAT,
+                   '%s..%s' % (lastRev, newRev), '--']
         self.changeCount = 0
-        results = yield self._dovccmd('log', revListArgs, path=self.workdir)
+        results = yield self._dovccmd('log', logArgs, path=self.workdir)
 
-        # process oldest change first
-        revList = results.split()
-        revList.reverse()
-        self.changeCount = len(revList)
-
-        log.msg('gitpoller: processing %d changes: %s from "%s"'
-                % (self.changeCount, revList, self.repourl))
-
-        for rev in revList:
-            dl = defer.DeferredList([
-                self._get_commit_timestamp(rev),
-                self._get_commit_author(rev),
-                self._get_commit_files(rev),
-                self._get_commit_comments(rev),
-            ], consumeErrors=True)
-
-            results = yield dl
-
-            # check for failures
-            failures = [r[1] for r in results if not r[0]]
-            if failures:
-                # just fail on the first error; they're probably all related!
-                raise failures[0]
-
-            timestamp, author, files, comments = [r[1] for r in results]
+        for rev, timestamp, author, files, comments in \
+                self._parse_log(results):
+            self.changeCount += 1
             yield self.master.addChange(
                 author=author,
                 revision=rev,
@@ -287,6 +323,10 @@ class GitPoller(base.PollingChangeSource, StateMixin):
                 repository=self.repourl,
                 src='git')
 
+        if self.changeCount:
+            log.msg('gitpoller: processed %d changes on branch %s from "%s"'
+                    % (self.changeCount, branch, self.repourl))
+
     def _dovccmd(self, command, args, path=None):
         d = utils.getProcessOutputAndValue(self.gitbin,
                                            [command] + args, path=path, env=os.environ)
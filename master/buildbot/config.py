@@ -59,6 +59,7 @@ class MasterConfig(object):
     def __init__(self):
         # local import to avoid circular imports
         from buildbot.process import properties
+        from buildbot.status import logstorage
         # default values for all attributes
 
         # global
@@ -71,12 +72,17 @@ class MasterConfig(object):
         self.buildHorizon = None
         self.logCompressionLimit = 4 * 1024
         self.logCompressionMethod = 'bz2'
+        self.logCompressionWorkers = 2
+        self.logCompressionQueueSize = 100
+        self.logCompressionMaxDelay = 1.0
         self.logMaxTailSize = None
         self.logMaxSize = None
+        self.logStorage = logstorage.FileLogStorage()
         self.properties = properties.Properties()
         self.mergeRequests = None
         self.codebaseGenerator = None
         self.prioritizeBuilders = None
+        self.buildDistributionConcurrency = 1
         self.slavePortnum = None
         self.multiMaster = False
         self.debugPassword = None
@@ -98,6 +104,7 @@ class MasterConfig(object):
             Builds=15,
             Changes=10,
         )
+        self.cacheMemoryLimit = None
         self.schedulers = {}
         self.builders = []
         self.slaves = []
@@ -107,11 +114,14 @@ class MasterConfig(object):
         self.revlink = default_revlink_matcher
 
     _known_config_keys = set([
-        "buildbotURL", "buildCacheSize", "builders", "buildHorizon", "caches",
+        "buildbotURL", "buildCacheSize", "buildDistributionConcurrency",
+        "builders", "buildHorizon", "cacheMemoryLimit", "caches",
         "change_source", "codebaseGenerator", "changeCacheSize", "changeHorizon",
         'db', "db_poll_interval", "db_url", "debugPassword", "eventHorizon",
-        "logCompressionLimit", "logCompressionMethod", "logHorizon",
-        "logMaxSize", "logMaxTailSize", "manhole", "mergeRequests", "metrics",
+        "logCompressionLimit", "logCompressionMaxDelay",
+        "logCompressionMethod", "logCompressionQueueSize",
+        "logCompressionWorkers", "logHorizon",
+        "logMaxSize", "logMaxTailSize", "logStorage", "manhole", "mergeRequests", "metrics",
         "multiMaster", "prioritizeBuilders", "projectName", "projectURL",
         "properties", "protocols", "revlink", "schedulers", "slavePortnum",
         "slaves", "status", "title", "titleURL", "user_managers", "validation"
@@ -261,9 +271,24 @@ class MasterConfig(object):
                 error("c['logCompressionMethod'] must be 'bz2' or 'gz'")
             self.logCompressionMethod = logCompressionMethod
 
+        copy_int_param('logCompressionWorkers')
+        if self.logCompressionWorkers < 1:
+            error("c['logCompressionWorkers'] must be at least 1")
+        copy_int_param('logCompressionQueueSize')
+        copy_param('logCompressionMaxDelay', check_type=(int, float),
+                   check_type_name='a number')
+
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
 
+        if 'logStorage' in config_dict:
+            from buildbot.status import logstorage
+            logStorage = config_dict['logStorage']
+            if not isinstance(logStorage, logstorage.LogStorage):
+                error("c['logStorage'] must be a LogStorage instance")
+            else:
+                self.logStorage = logStorage
+
         properties = config_dict.get('properties', {})
         if not isinstance(properties, dict):
             error("c['properties'] must be a dictionary")
@@ -290,6 +315,10 @@ class MasterConfig(object):
         else:
             self.prioritizeBuilders = prioritizeBuilders
 
+        copy_int_param('buildDistributionConcurrency')
+        if self.buildDistributionConcurrency < 1:
+            error("c['buildDistributionConcurrency'] must be at least 1")
+
         protocols = config_dict.get('protocols', {})
         if isinstance(protocols, dict):
             for proto, options in protocols.iteritems():
@@ -407,6 +436,16 @@ class MasterConfig(object):
                 error(msg)
             self.caches['Changes'] = config_dict['changeCacheSize']
 
+        if 'cacheMemoryLimit' in config_dict:
+            limit = config_dict['cacheMemoryLimit']
+            if limit is not None:
+                if not isinstance(limit, (int, long)):
+                    error("c['cacheMemoryLimit'] must be an integer or None")
+                elif limit < 1:
+                    error("c['cacheMemoryLimit'] must be at least 1, got '%s'"
+                          % (limit,))
+            self.cacheMemoryLimit = limit
+
     def load_schedulers(self, filename, config_dict):
         if 'schedulers' not in config_dict:
             return
@@ -72,7 +72,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
     @with_master_objectid
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-                         bsid=None, _master_objectid=None, branch=None, repository=None):
+                         bsid=None, _master_objectid=None, branch=None, repository=None,
+                         after_brid=None):
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
@@ -111,6 +112,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     q = q.where(reqs_tbl.c.complete == 0)
             if bsid is not None:
                 q = q.where(reqs_tbl.c.buildsetid == bsid)
+            if after_brid is not None:
+                q = q.where(reqs_tbl.c.id > after_brid)
 
             if branch is not None:
                 q = q.where(sstamps_tbls.c.branch == branch)
@@ -268,6 +271,7 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             if count != 0:
                 log.msg("unclaimed %d expired buildrequests (over %d seconds "
                         "old)" % (count, old))
+            return count
         d.addCallback(log_nonzero_count)
         return d
 
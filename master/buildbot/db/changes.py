@@ -164,6 +164,18 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         d.addCallback(get_changes)
         return d
 
+    def getChangesAfter(self, changeid, count):
+        def thd(conn):
+            changes_tbl = self.db.model.changes
+            q = changes_tbl.select(
+                whereclause=(changes_tbl.c.changeid > changeid),
+                order_by=[changes_tbl.c.changeid],
+                limit=count)
+            rows = conn.execute(q).fetchall()
+            return self._chdicts_from_change_rows_thd(conn, rows)
+        d = self.db.pool.do(thd)
+        return d
+
     def getLatestChangeid(self):
         def thd(conn):
             changes_tbl = self.db.model.changes
@@ -214,30 +226,45 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
     def _chdict_from_change_row_thd(self, conn, ch_row):
         # This method must be run in a db.pool thread, and returns a chdict
         # given a row from the 'changes' table
+        return self._chdicts_from_change_rows_thd(conn, [ch_row])[0]
+
+    def _chdicts_from_change_rows_thd(self, conn, ch_rows):
+        # This method must be run in a db.pool thread, and returns a list of
+        # chdicts given a list of rows from the 'changes' table, fetching the
+        # ancillary data for all of them at once
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
 
-        chdict = ChDict(
-            changeid=ch_row.changeid,
-            author=ch_row.author,
-            files=[],  # see below
-            comments=ch_row.comments,
-            is_dir=ch_row.is_dir,
-            revision=ch_row.revision,
-            when_timestamp=epoch2datetime(ch_row.when_timestamp),
-            branch=ch_row.branch,
-            category=ch_row.category,
-            revlink=ch_row.revlink,
-            properties={},  # see below
-            repository=ch_row.repository,
-            codebase=ch_row.codebase,
-            project=ch_row.project)
+        chdicts = []
+        by_changeid = {}
+        for ch_row in ch_rows:
+            chdict = ChDict(
+                changeid=ch_row.changeid,
+                author=ch_row.author,
+                files=[],  # see below
+                comments=ch_row.comments,
+                is_dir=ch_row.is_dir,
+                revision=ch_row.revision,
+                when_timestamp=epoch2datetime(ch_row.when_timestamp),
+                branch=ch_row.branch,
+                category=ch_row.category,
+                revlink=ch_row.revlink,
+                properties={},  # see below
+                repository=ch_row.repository,
+                codebase=ch_row.codebase,
+                project=ch_row.project)
+            chdicts.append(chdict)
+            by_changeid[ch_row.changeid] = chdict
+
+        if not chdicts:
+            return chdicts
+        changeids = by_changeid.keys()
 
         query = change_files_tbl.select(
-            whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
+            whereclause=(change_files_tbl.c.changeid.in_(changeids)))
         rows = conn.execute(query)
         for r in rows:
-            chdict['files'].append(r.filename)
+            by_changeid[r.changeid]['files'].append(r.filename)
 
         # and properties must be given without a source, so strip that, but
         # be flexible in case users have used a development version where the
@@ -252,13 +279,13 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             return v, s
 
         query = change_properties_tbl.select(
-            whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
+            whereclause=(change_properties_tbl.c.changeid.in_(changeids)))
         rows = conn.execute(query)
         for r in rows:
             try:
                 v, s = split_vs(json.loads(r.property_value))
-                chdict['properties'][r.property_name] = (v, s)
+                by_changeid[r.changeid]['properties'][r.property_name] = (v, s)
             except ValueError:
                 pass
 
-        return chdict
+        return chdicts
@@ -0,0 +1,44 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+
+
+def upgrade(migrate_engine):
+
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    logchunks = sa.Table("logchunks", metadata,
+                         sa.Column("logid", sa.String(40), nullable=False),
+                         sa.Column("mastername", sa.String(256),
+                                   nullable=False),
+                         sa.Column("buildername", sa.String(256),
+                                   nullable=False),
+                         sa.Column("buildnumber", sa.Integer, nullable=False),
+                         sa.Column("stream", sa.SmallInteger, nullable=False),
+                         sa.Column("seq", sa.Integer, nullable=False),
+                         sa.Column("length", sa.Integer, nullable=False),
+                         sa.Column("written_at", sa.Integer, nullable=False),
+                         sa.Column("content", sa.LargeBinary, nullable=False),
+                         )
+    logchunks.create()
+
+    idx = sa.Index('logchunks_identity', logchunks.c.logid,
+                   logchunks.c.stream, logchunks.c.seq, unique=True)
+    idx.create()
+    idx = sa.Index('logchunks_buildername', logchunks.c.buildername,
+                   logchunks.c.buildnumber)
+    idx.create()
@@ -142,6 +142,31 @@ class Model(base.DBConnectorComponent):
                            sa.Column("info", JsonObject, nullable=False),
                            )
 
+    # logs
+
+    # This table holds the contents of logs when c['logStorage'] keeps them
+    # in the database; see master/buildbot/status/logstorage.py.  Each row
+    # is one compressed chunk of the data or the index of a log.
+    logchunks = sa.Table("logchunks", metadata,
+                         # hash of the master, builder and log's filename
+                         sa.Column("logid", sa.String(40), nullable=False),
+                         # name of the master that wrote the log
+                         sa.Column("mastername", sa.String(256),
+                                   nullable=False),
+                         sa.Column("buildername", sa.String(256),
+                                   nullable=False),
+                         sa.Column("buildnumber", sa.Integer, nullable=False),
+                         # 0 for the log's data, 1 for its index
+                         sa.Column("stream", sa.SmallInteger, nullable=False),
+                         # chunk number within the stream
+                         sa.Column("seq", sa.Integer, nullable=False),
+                         # uncompressed length of the chunk
+                         sa.Column("length", sa.Integer, nullable=False),
+                         sa.Column("written_at", sa.Integer, nullable=False),
+                         # zlib-compressed chunk
+                         sa.Column("content", sa.LargeBinary, nullable=False),
+                         )
+
     # changes
 
     # Files touched in changes
@@ -369,6 +394,10 @@ class Model(base.DBConnectorComponent):
     sa.Index('buildset_properties_buildsetid',
              buildset_properties.c.buildsetid)
     sa.Index('buildslaves_name', buildslaves.c.name, unique=True)
+    sa.Index('logchunks_identity', logchunks.c.logid, logchunks.c.stream,
+             logchunks.c.seq, unique=True)
+    sa.Index('logchunks_buildername', logchunks.c.buildername,
+             logchunks.c.buildnumber)
     sa.Index('changes_branch', changes.c.branch)
     sa.Index('changes_revision', changes.c.revision)
     sa.Index('changes_author', changes.c.author)
@@ -377,6 +377,15 @@ class IBuilderStatus(Interface):
         longer available. Older builds are likely to have less information
         stored: Logs are the first to go, then Steps."""
 
+    def getBuildSummary(number):
+        """Like getBuild(), but for a finished build this returns a
+        lightweight summary from the builder's summary index instead of
+        loading the full build from disk. The summary provides getNumber,
+        getTimes, isFinished, getResults, getSourceStamps, getChanges,
+        getResponsibleUsers, getSlavename and getSteps; its steps only
+        provide getName, getTimes and getResults (a result code, without
+        text). Builds that are not in the index are returned by getBuild()."""
+
     def getEvent(number):
         """Return an IStatusEvent object for a recent Event. Builders
         connecting and disconnecting are events, as are ping attempts.
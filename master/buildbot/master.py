@@ -44,6 +44,7 @@ from buildbot.process.builder import BuilderControl
 from buildbot.process.users import users
 from buildbot.process.users.manager import UserManagerManager
 from buildbot.schedulers.manager import SchedulerManager
+from buildbot.status.logcompressor import LogCompressor
 from buildbot.status.master import Status
 from buildbot.status.results import FAILURE
 from buildbot.status.results import SUCCESS
@@ -77,6 +78,10 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
     # database poll operation.
     WARNING_UNCLAIMED_COUNT = 10000
 
+    # frequency with which to re-read the full set of unclaimed build
+    # requests; in between, only requests newer than any seen so far are read
+    UNCLAIMED_RECONCILE_INTERVAL = 60
+
     def __init__(self, basedir, configFileName="master.cfg", umask=None):
         service.MultiService.__init__(self)
         self.setName("buildmaster")
@@ -129,6 +134,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self.caches = cache.CacheManager()
         self.caches.setServiceParent(self)
 
+        self.logCompressor = LogCompressor()
+        self.logCompressor.setServiceParent(self)
+
         self.pbmanager = buildbot.pbmanager.PBManager()
         self.pbmanager.setServiceParent(self)
 
@@ -324,6 +332,8 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 self.db_loop = task.LoopingCall(self.pollDatabase)
                 self.db_loop.start(self.configured_poll_interval, now=False)
 
+        new_config.logStorage.setMaster(self)
+
         return config.ReconfigurableServiceMixin.reconfigService(self,
                                                                  new_config)
 
@@ -337,6 +347,18 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         """
         return self.status
 
+    def getMasterName(self):
+        """
+        Return the name of this master, made of its hostname and base
+        directory, which tells it apart from other masters sharing its
+        database.
+        """
+        try:
+            hostname = os.uname()[1]  # only on unix
+        except AttributeError:
+            hostname = socket.getfqdn()
+        return "%s:%s" % (hostname, os.path.abspath(self.basedir))
+
     def getObjectId(self):
         """
         Return the obejct id for this master, for associating state with the
@@ -350,13 +372,7 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
         # failing that, get it from the DB; multiple calls to this function
         # at the same time will not hurt
-        try:
-            hostname = os.uname()[1]  # only on unix
-        except AttributeError:
-            hostname = socket.getfqdn()
-        master_name = "%s:%s" % (hostname, os.path.abspath(self.basedir))
-
-        d = self.db.state.getObjectId(master_name,
+        d = self.db.state.getObjectId(self.getMasterName(),
                                       "buildbot.master.BuildMaster")
 
         def keep(id):
@@ -613,6 +629,22 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self._new_buildrequest_subs.deliver(
             dict(bsid=bsid, brid=brid, buildername=buildername))
 
+    def buildRequestsClaimed(self, brids):
+        """
+        Notifies the master that this master has claimed the given build
+        requests, so they are no longer counted as unclaimed.  Requests
+        claimed by other masters are only noticed by the next full
+        reconciliation in L{pollDatabaseBuildRequests}, so until then the
+        count of unclaimed requests may be too high.
+
+        @param brids: buildrequest IDs
+        """
+        if self._last_unclaimed_brids_set:
+            self._last_unclaimed_brids_set.difference_update(brids)
+            metrics.MetricCountEvent.log(
+                "BuildMaster.unclaimed_buildrequests",
+                len(self._last_unclaimed_brids_set), absolute=True)
+
     def subscribeToBuildRequests(self, callback):
         """
         Request that C{callback} be invoked with a dictionary with keys C{brid}
@@ -641,6 +673,7 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         return d
 
     _last_processed_change = None
+    changeBatchSize = 100
 
     @defer.inlineCallbacks
     def pollDatabaseChanges(self):
@@ -679,20 +712,28 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             return
 
         while True:
-            changeid = self._last_processed_change + 1
-            chdict = yield self.db.changes.getChange(changeid)
+            # fetch the next batch of changes
+            chdicts = yield self.db.changes.getChangesAfter(
+                self._last_processed_change, self.changeBatchSize)
 
-            # if there's no such change, we've reached the end and can
-            # stop polling
-            if not chdict:
-                break
+            for chdict in chdicts:
+                # a gap in the changeids may be a change that another master
+                # is still adding, so stop there and pick it up next time
+                if chdict['changeid'] != self._last_processed_change + 1:
+                    break
 
-            change = yield changes.Change.fromChdict(self, chdict)
+                change = yield changes.Change.fromChdict(self, chdict)
 
-            self._change_subs.deliver(change)
+                self._change_subs.deliver(change)
 
-            self._last_processed_change = changeid
-            need_setState = True
+                self._last_processed_change = chdict['changeid']
+                need_setState = True
+            else:
+                # a short batch means we've reached the end and can stop
+                # polling
+                if len(chdicts) == self.changeBatchSize:
+                    continue
+            break
 
         # write back the updated state, if it's changed
         if need_setState:
@@ -701,6 +742,8 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         timer.stop()
 
     _last_unclaimed_brids_set = None
+    _last_unclaimed_brid = 0
+    _last_unclaimed_reconcile = 0
     _last_claim_cleanup = 0
 
     @defer.inlineCallbacks
@@ -711,11 +754,13 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         timer.start()
 
         # cleanup unclaimed builds
+        expired = 0
         since_last_cleanup = reactor.seconds() - self._last_claim_cleanup
         if since_last_cleanup < self.RECLAIM_BUILD_INTERVAL:
             unclaimed_age = (self.RECLAIM_BUILD_INTERVAL
                              * self.UNCLAIMED_BUILD_FACTOR)
-            yield self.db.buildrequests.unclaimExpiredRequests(unclaimed_age)
+            expired = yield self.db.buildrequests.unclaimExpiredRequests(
+                unclaimed_age)
 
             self._last_claim_cleanup = reactor.seconds()
 
@@ -724,6 +769,20 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         # the last poll, it notifies the subscribers.  It only tracks that
         # state within the master instance, though; on startup, it notifies for
         # all unclaimed requests in the database.
+        #
+        # Reading every unclaimed request is expensive when there are many of
+        # them, so most polls only read the requests added since the newest
+        # one seen so far (_last_unclaimed_brid).  Requests that were claimed
+        # and then released in the meantime are only found by the full
+        # reconciliation, which runs every UNCLAIMED_RECONCILE_INTERVAL seconds
+        # and whenever expired claims have just been released.  Requests
+        # released by this master's own builders do not need to wait for it,
+        # as the builder tries to start them again right away.
+        #
+        # Requests claimed on this master are dropped from the set as they
+        # are claimed (buildRequestsClaimed); those claimed by other masters
+        # stay in it until the next reconciliation, so between
+        # reconciliations the count of unclaimed requests is approximate.
 
         last_unclaimed = self._last_unclaimed_brids_set or set()
         if len(last_unclaimed) > self.WARNING_UNCLAIMED_COUNT:
@@ -731,13 +790,40 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                     "producing builds for which no builder is running?"
                     % len(last_unclaimed))
 
-        # get the current set of unclaimed buildrequests
-        now_unclaimed_brdicts = \
-            yield self.db.buildrequests.getBuildRequests(claimed=False)
-        now_unclaimed = set([brd['brid'] for brd in now_unclaimed_brdicts])
+        since_last_reconcile = reactor.seconds() - \
+            self._last_unclaimed_reconcile
+        reconcile = (self._last_unclaimed_brids_set is None or expired
+                     or since_last_reconcile >= self.UNCLAIMED_RECONCILE_INTERVAL)
+
+        if reconcile:
+            # get the current set of unclaimed buildrequests
+            now_unclaimed_brdicts = \
+                yield self.db.buildrequests.getBuildRequests(claimed=False)
+            now_unclaimed = set([brd['brid'] for brd in now_unclaimed_brdicts])
+            self._last_unclaimed_reconcile = reactor.seconds()
+            metrics.MetricCountEvent.log(
+                "BuildMaster.unclaimed_buildrequests_reconciled", 1)
+        else:
+            # get just the unclaimed buildrequests that are newer than any
+            # seen so far; the rest are assumed to be unchanged
+            now_unclaimed_brdicts = \
+                yield self.db.buildrequests.getBuildRequests(
+                    claimed=False, after_brid=self._last_unclaimed_brid)
+            now_unclaimed = last_unclaimed | \
+                set([brd['brid'] for brd in now_unclaimed_brdicts])
+
+        metrics.MetricCountEvent.log(
+            "BuildMaster.unclaimed_buildrequests_read",
+            len(now_unclaimed_brdicts))
+        metrics.MetricCountEvent.log("BuildMaster.unclaimed_buildrequests",
+                                     len(now_unclaimed), absolute=True)
 
         # and store that for next time
         self._last_unclaimed_brids_set = now_unclaimed
+        if now_unclaimed_brdicts:
+            self._last_unclaimed_brid = max(
+                self._last_unclaimed_brid,
+                max(brd['brid'] for brd in now_unclaimed_brdicts))
 
         # see what's new, and notify if anything is
         new_unclaimed = now_unclaimed - last_unclaimed
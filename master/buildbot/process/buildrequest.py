@@ -188,6 +188,27 @@ class BuildRequest(object):
                 return False
         return True
 
+    def getMergeKey(self):
+        """
+        Returns a hashable key such that two requests can be merged, according
+        to L{canBeMergedWith}, exactly when their keys are equal.  This allows
+        mergeable requests to be found by grouping, rather than by comparing
+        every pair of requests.
+        """
+        key = []
+        for codebase, ss in sorted(self.sources.iteritems()):
+            if ss.patch:
+                # patched sourcestamps only merge with themselves
+                key.append((codebase, 'patch', ss.ssid))
+            elif ss.changes:
+                # any two sets of changes can be merged
+                key.append((codebase, ss.repository, ss.branch, ss.project,
+                            True, None))
+            else:
+                key.append((codebase, ss.repository, ss.branch, ss.project,
+                            False, ss.revision))
+        return tuple(key)
+
     def mergeSourceStampsWith(self, others):
         """ Returns one merged sourcestamp for every codebase """
         # get all codebases from all requests
@@ -229,6 +250,7 @@ class BuildRequest(object):
         except buildrequests.AlreadyClaimedError:
             log.msg("build request already claimed; cannot cancel")
             return
+        self.master.buildRequestsClaimed([self.id])
 
         # then complete it with 'FAILURE'; this is the closest we can get to
         # cancelling a request without running into trouble with dangling
@@ -19,8 +19,10 @@ from twisted.internet import defer
 from twisted.python import log
 from twisted.python.failure import Failure
 
+from buildbot import config
 from buildbot.db.buildrequests import AlreadyClaimedError
 from buildbot.process import metrics
+from buildbot.process.builder import Builder
 from buildbot.process.buildrequest import BuildRequest
 
 import random
@@ -50,6 +52,7 @@ class BuildChooserBase(object):
         self.master = master
         self.breqCache = {}
         self.unclaimedBrdicts = None
+        self.unclaimedBrdictsById = {}
 
     @defer.inlineCallbacks
     def chooseNextBuild(self):
@@ -61,8 +64,7 @@ class BuildChooserBase(object):
             return
 
         breqs = yield self.mergeRequests(breq)
-        for b in breqs:
-                self._removeBuildRequest(b)
+        self._removeBuildRequests(breqs)
 
         defer.returnValue((slave, breqs))
 
@@ -93,6 +95,8 @@ class BuildChooserBase(object):
             # sort by submitted_at, so the first is the oldest
             brdicts.sort(key=lambda brd: brd['submitted_at'])
             self.unclaimedBrdicts = brdicts
+            self.unclaimedBrdictsById = dict((brd['brid'], brd)
+                                             for brd in brdicts)
         defer.returnValue(self.unclaimedBrdicts)
 
     @defer.inlineCallbacks
@@ -114,11 +118,7 @@ class BuildChooserBase(object):
         if breq is None:
             return None
 
-        brid = breq.id
-        for brdict in self.unclaimedBrdicts:
-            if brid == brdict['brid']:
-                return brdict
-        return None
+        return self.unclaimedBrdictsById.get(breq.id)
 
     def _removeBuildRequest(self, breq):
         # Remove a BuildrRequest object (and its brdict)
@@ -127,13 +127,33 @@ class BuildChooserBase(object):
         if breq is None:
             return
 
-        brdict = self._getBrdictForBuildRequest(breq)
+        brdict = self.unclaimedBrdictsById.pop(breq.id, None)
         if brdict is not None:
-            self.unclaimedBrdicts.remove(brdict)
+            # compare by identity; comparing brdicts by value is slow
+            for i, b in enumerate(self.unclaimedBrdicts):
+                if b is brdict:
+                    del self.unclaimedBrdicts[i]
+                    break
 
         if breq.id in self.breqCache:
             del self.breqCache[breq.id]
 
+    def _removeBuildRequests(self, breqs):
+        # Remove several BuildRequest objects (and their brdicts) from the
+        # caches, in a single pass over the brdicts
+
+        brids = set()
+        for breq in breqs:
+            if breq is None:
+                continue
+            brids.add(breq.id)
+            self.unclaimedBrdictsById.pop(breq.id, None)
+            self.breqCache.pop(breq.id, None)
+
+        if brids and self.unclaimedBrdicts:
+            self.unclaimedBrdicts = [brd for brd in self.unclaimedBrdicts
+                                     if brd['brid'] not in brids]
+
     def _getUnclaimedBuildRequests(self):
         # Retrieve the list of BuildRequest objects for all unclaimed builds
         return defer.gatherResults([
@@ -163,6 +183,11 @@ class BasicBuildChooser(BuildChooserBase):
     # slaves in the order originally generated. By setting self.rejectedSlaves
     # to None, the behavior will instead refuse to ever assign to a slave that
     # fails the generic test.
+    #
+    # Slaves and requests are matched one build at a time, since nextSlave,
+    # nextBuild and canStartBuild may be arbitrary functions; only merging
+    # with the default mergeRequests function avoids comparing every pair of
+    # requests (see mergeRequests).
 
     def __init__(self, bldr, master):
         BuildChooserBase.__init__(self, bldr, master)
@@ -184,6 +209,10 @@ class BasicBuildChooser(BuildChooserBase):
 
         self.mergeRequestsFn = self.bldr.getMergeRequestsFn()
 
+        # unclaimed requests grouped by their merge key, for use with the
+        # default merge function; see _getMergeIndex
+        self.mergeIndex = None
+
     @defer.inlineCallbacks
     def popNextBuild(self):
         nextBuild = (None, None)
@@ -233,6 +262,16 @@ class BasicBuildChooser(BuildChooserBase):
             defer.returnValue(mergedRequests)
             return
 
+        if self.mergeRequestsFn == Builder._defaultMergeRequestFn:
+            # the default merge function only compares the requests' merge
+            # keys, so the mergeable requests can be looked up directly
+            mergeIndex = yield self._getMergeIndex()
+            mergedRequests.extend(
+                req for req in mergeIndex.get(breq.getMergeKey(), [])
+                if req.id in self.unclaimedBrdictsById and req is not breq)
+            defer.returnValue(mergedRequests)
+            return
+
         # we'll need BuildRequest objects, so get those first
         unclaimedBreqs = yield self._getUnclaimedBuildRequests()
 
@@ -244,6 +283,19 @@ class BasicBuildChooser(BuildChooserBase):
 
         defer.returnValue(mergedRequests)
 
+    @defer.inlineCallbacks
+    def _getMergeIndex(self):
+        # Group the unclaimed requests by merge key, once for the lifetime of
+        # this chooser.  Requests are not removed from the index when they are
+        # claimed, so users must check that they are still unclaimed.
+        if self.mergeIndex is None:
+            unclaimedBreqs = yield self._getUnclaimedBuildRequests()
+            mergeIndex = {}
+            for req in unclaimedBreqs:
+                mergeIndex.setdefault(req.getMergeKey(), []).append(req)
+            self.mergeIndex = mergeIndex
+        defer.returnValue(self.mergeIndex)
+
     @defer.inlineCallbacks
     def _getNextUnclaimedBuildRequest(self):
         # ensure the cache is there
@@ -315,7 +367,8 @@ class BasicBuildChooser(BuildChooserBase):
         return self.bldr.canStartBuild(slave, breq)
 
 
-class BuildRequestDistributor(service.Service):
+class BuildRequestDistributor(config.ReconfigurableServiceMixin,
+                              service.Service):
 
     """
     Special-purpose class to handle distributing build requests to builders by
@@ -326,6 +379,12 @@ class BuildRequestDistributor(service.Service):
     are still working on the previous build request, then this class will
     correctly re-prioritize invocations of builders' C{maybeStartBuild}
     methods.
+
+    If C{buildDistributionConcurrency} is more than 1, up to that many
+    builders are handled at once.  Builders that share slaves are never
+    handled at the same time, and a builder that has to wait for a slave it
+    shares with a running builder keeps its priority over the lower-priority
+    builders that also use that slave.
     """
 
     BuildChooser = BasicBuildChooser
@@ -345,6 +404,20 @@ class BuildRequestDistributor(service.Service):
 
         self._pendingMSBOCalls = []
 
+        # maximum number of builders to handle at once
+        self.concurrency = 1
+
+        # builders being handled by the concurrent activity loop, mapped to
+        # the names of their slaves, and Deferreds waiting for one to finish
+        self._activeBuilders = {}
+        self._activeBuilderCalls = []
+        self._activityWaiters = []
+
+    def reconfigService(self, new_config):
+        self.concurrency = new_config.buildDistributionConcurrency
+        return config.ReconfigurableServiceMixin.reconfigService(self,
+                                                                 new_config)
+
     @defer.inlineCallbacks
     def stopService(self):
         # Lots of stuff happens asynchronously here, so we need to let it all
@@ -353,6 +426,10 @@ class BuildRequestDistributor(service.Service):
         # self.running is false.
         yield self.activity_lock.run(service.Service.stopService, self)
 
+        # in concurrent mode, builders may still be in progress
+        if self._activeBuilderCalls:
+            yield defer.DeferredList(self._activeBuilderCalls)
+
         # now let any outstanding calls to maybeStartBuildsOn to finish, so
         # they don't get interrupted in mid-stride.  This tends to be
         # particularly painful because it can occur when a generator is gc'd.
@@ -405,6 +482,8 @@ class BuildRequestDistributor(service.Service):
                 # working on that.
                 if not self.active:
                     self._activityLoop()
+                else:
+                    self._wakeActivityLoop()
             except Exception:
                 log.err(Failure(),
                         "while attempting to start builds on %s" % self.name)
@@ -479,6 +558,14 @@ class BuildRequestDistributor(service.Service):
         timer = metrics.Timer('BuildRequestDistributor._activityLoop()')
         timer.start()
 
+        if self.concurrency > 1:
+            yield self._concurrentActivityLoop()
+            timer.stop()
+
+            self.active = False
+            self._quiet()
+            return
+
         while True:
             yield self.activity_lock.acquire()
 
@@ -494,14 +581,7 @@ class BuildRequestDistributor(service.Service):
             bldr_name = self._pending_builders.pop(0)
             self.pending_builders_lock.release()
 
-            # get the actual builder object
-            bldr = self.botmaster.builders.get(bldr_name)
-            try:
-                if bldr:
-                    yield self._maybeStartBuildsOnBuilder(bldr)
-            except Exception:
-                log.err(Failure(),
-                        "from maybeStartBuild for builder '%s'" % (bldr_name,))
+            yield self._runBuilder(bldr_name)
 
             self.activity_lock.release()
 
@@ -510,6 +590,101 @@ class BuildRequestDistributor(service.Service):
         self.active = False
         self._quiet()
 
+    @defer.inlineCallbacks
+    def _concurrentActivityLoop(self):
+        while True:
+            yield self.activity_lock.acquire()
+
+            # lock pending_builders, pick a builder that can run now, if
+            # there's room for one, and release
+            yield self.pending_builders_lock.acquire()
+
+            if not self.running:
+                self.pending_builders_lock.release()
+                self.activity_lock.release()
+                break
+
+            bldr_name = None
+            if len(self._activeBuilders) < self.concurrency:
+                bldr_name = self._popIndependentBuilder()
+            self.pending_builders_lock.release()
+            self.activity_lock.release()
+
+            if bldr_name:
+                self._startBuilder(bldr_name)
+            elif self._activeBuilders:
+                # wait for a running builder to finish, freeing up its slaves,
+                # or for more builders to become pending
+                d = defer.Deferred()
+                self._activityWaiters.append(d)
+                yield d
+            else:
+                # nothing is running, so nothing is waiting for a slave
+                break
+
+    def _popIndependentBuilder(self):
+        # Pop the highest-priority pending builder that does not share any
+        # slaves with an active builder, or any higher-priority pending
+        # builder that is waiting for one; must be called with
+        # pending_builders_lock held
+
+        busySlaves = set()
+        for slavenames in self._activeBuilders.itervalues():
+            busySlaves.update(slavenames)
+
+        for i, bldr_name in enumerate(self._pending_builders):
+            if bldr_name in self._activeBuilders:
+                continue
+            slavenames = self._getSlaveNames(bldr_name)
+            if slavenames & busySlaves:
+                # reserve this builder's slaves for it
+                busySlaves.update(slavenames)
+                continue
+            del self._pending_builders[i]
+            return bldr_name
+        return None
+
+    def _getSlaveNames(self, bldr_name):
+        bldr = self.botmaster.builders.get(bldr_name)
+        if not bldr:
+            return set()
+        return set(bldr.config.slavenames)
+
+    def _startBuilder(self, bldr_name):
+        self._activeBuilders[bldr_name] = self._getSlaveNames(bldr_name)
+        d = self._runBuilder(bldr_name)
+        self._activeBuilderCalls.append(d)
+
+        @d.addBoth
+        def finished(_):
+            del self._activeBuilders[bldr_name]
+            self._activeBuilderCalls.remove(d)
+            self._wakeActivityLoop()
+
+    def _wakeActivityLoop(self):
+        # let a concurrent activity loop that is waiting have another look
+        waiters, self._activityWaiters = self._activityWaiters, []
+        for waiter in waiters:
+            waiter.callback(None)
+
+    @defer.inlineCallbacks
+    def _runBuilder(self, bldr_name):
+        # get the actual builder object
+        bldr = self.botmaster.builders.get(bldr_name)
+        if not bldr:
+            return
+
+        timer = metrics.Timer(
+            'BuildRequestDistributor._maybeStartBuildsOnBuilder(%s)'
+            % (bldr_name,))
+        timer.start()
+        try:
+            yield self._maybeStartBuildsOnBuilder(bldr)
+        except Exception:
+            log.err(Failure(),
+                    "from maybeStartBuild for builder '%s'" % (bldr_name,))
+        timer.stop()
+
     @defer.inlineCallbacks
     def _maybeStartBuildsOnBuilder(self, bldr):
         # create a chooser to give us our next builds
@@ -530,6 +705,7 @@ class BuildRequestDistributor(service.Service):
                 # some brids were already claimed, so start over
                 bc = self.createBuildChooser(bldr, self.master)
                 continue
+            self.master.buildRequestsClaimed(brids)
 
             buildStarted = yield bldr.maybeStartBuild(slave, breqs)
 
@@ -31,6 +31,8 @@ from buildbot.process import logobserver
 from buildbot.process import properties
 from buildbot.process import remotecommand
 from buildbot.status import progress
+from buildbot.status.logfile import STDERR
+from buildbot.status.logfile import STDOUT
 from buildbot.status.results import EXCEPTION
 from buildbot.status.results import FAILURE
 from buildbot.status.results import RETRY
@@ -659,6 +661,93 @@ def regex_log_evaluator(cmd, step_status, regexes):
                     worst = possible_status
     return worst
 
+
+def _combineRegexes(regexes):
+    # Group the regexes by status, worst status first, and join the regexes
+    # for each status into as few patterns as possible.  Regexes with groups
+    # are kept on their own, since combining them would renumber the groups
+    # that their backreferences refer to.
+    byStatus = {}
+    for err, status in regexes:
+        if isinstance(err, basestring):
+            err = re.compile(err)
+        byStatus.setdefault(status, []).append(err)
+
+    combined = []
+    while byStatus:
+        status = reduce(worst_status, byStatus)
+        matchers = []
+        byFlags = {}
+        for err in byStatus.pop(status):
+            if err.groups:
+                matchers.append(err)
+            else:
+                byFlags.setdefault(err.flags, []).append(err)
+        for flags, errs in byFlags.iteritems():
+            if len(errs) == 1:
+                matchers.extend(errs)
+                continue
+            pattern = "|".join(["(?:%s)" % err.pattern for err in errs])
+            try:
+                matchers.append(re.compile(pattern, flags))
+            except re.error:
+                matchers.extend(errs)
+        combined.append((status, matchers))
+    return combined
+
+
+# Like regex_log_evaluator, but reads the logs a chunk at a time and matches
+# each line separately, so memory use does not depend on the size of the logs,
+# and stops reading as soon as no worse status can be found.  A regex can only
+# match within a single line.  Lines longer than maxLineLength are matched in
+# overlapping pieces, so matches longer than half that may be missed.
+def streaming_regex_log_evaluator(cmd, step_status, regexes,
+                                  maxLineLength=64 * 1024):
+    worst = cmd.results()
+    candidates = [(status, matchers)
+                  for status, matchers in _combineRegexes(regexes)
+                  if status != worst and
+                  worst_status(worst, status) == status]
+
+    def matchLine(line):
+        for i, (status, matchers) in enumerate(candidates):
+            for m in matchers:
+                if m.search(line):
+                    # only statuses worse than this one are still of interest
+                    del candidates[i:]
+                    return status
+
+    for l in cmd.logs.values():
+        if not candidates:
+            break
+        chunks = iter(l.getChunks([STDOUT, STDERR], onlyText=True))
+        partial = ''
+        try:
+            for chunk in chunks:
+                lines = (partial + chunk).split("\n")
+                partial = lines.pop()
+                for line in lines:
+                    status = matchLine(line)
+                    if status is not None:
+                        worst = status
+                        if not candidates:
+                            return worst
+                if len(partial) > maxLineLength:
+                    status = matchLine(partial)
+                    if status is not None:
+                        worst = status
+                        if not candidates:
+                            return worst
+                    partial = partial[-(maxLineLength // 2):]
+            if partial:
+                status = matchLine(partial)
+                if status is not None:
+                    worst = status
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+    return worst
+
 # (WithProperties used to be available in this module)
 from buildbot.process.properties import WithProperties
 _hush_pyflakes = [WithProperties]
@@ -13,6 +13,8 @@
 #
 # Copyright Buildbot Team Members
 
+import weakref
+
 from buildbot import config
 from buildbot.util import lru
 from twisted.application import service
@@ -26,6 +28,10 @@ class CacheManager(config.ReconfigurableServiceMixin, service.Service):
 
     There is generally only one instance of this class, available at
     C{master.caches}.
+
+    All of the caches share one L{lru.MemoryBudget}, limited by
+    C{c['cacheMemoryLimit']}; only caches given a weight function count
+    against it.
     """
 
     # a cache of length one still has many benefits: it collects objects that
@@ -37,8 +43,10 @@ class CacheManager(config.ReconfigurableServiceMixin, service.Service):
         self.setName('caches')
         self.config = {}
         self._caches = {}
+        self._registered = {}
+        self.budget = lru.MemoryBudget()
 
-    def get_cache(self, cache_name, miss_fn):
+    def get_cache(self, cache_name, miss_fn, weight_fn=None):
         """
         Get an L{AsyncLRUCache} object with the given name.  If such an object
         does not exist, it will be created.  Since the cache is permanent, this
@@ -49,6 +57,9 @@ class CacheManager(config.ReconfigurableServiceMixin, service.Service):
         object it stores)
         @param miss_fn: miss function for the cache; see L{AsyncLRUCache}
         constructor.
+        @param weight_fn: weight function for the cache, returning the
+        approximate size in bytes of a cached object; see L{AsyncLRUCache}
+        constructor.
         @returns: L{AsyncLRUCache} instance
         """
         try:
@@ -56,20 +67,53 @@ class CacheManager(config.ReconfigurableServiceMixin, service.Service):
         except KeyError:
             max_size = self.config.get(cache_name, self.DEFAULT_CACHE_SIZE)
             assert max_size >= 1
-            c = self._caches[cache_name] = lru.AsyncLRUCache(miss_fn, max_size)
+            c = self._caches[cache_name] = lru.AsyncLRUCache(
+                miss_fn, max_size, weight_fn=weight_fn)
+            self.budget.add(c)
             return c
 
+    def register_cache(self, cache_name, cache):
+        """
+        Add an L{LRUCache} created elsewhere to the memory budget, and
+        include it in the metrics under the given name.  Several caches may
+        be registered with the same name (such as the per-builder build
+        caches), in which case their metrics are summed.  The manager does
+        not keep the cache alive, and does not set its size.
+
+        @param cache_name: name of the cache
+        @param cache: L{LRUCache} instance
+        """
+        caches = self._registered.setdefault(cache_name,
+                                             weakref.WeakKeyDictionary())
+        if cache not in caches:
+            caches[cache] = None
+            self.budget.add(cache)
+
     def reconfigService(self, new_config):
         self.config = new_config.caches
         for name, cache in self._caches.iteritems():
             cache.set_max_size(new_config.caches.get(name,
                                                      self.DEFAULT_CACHE_SIZE))
+        self.budget.set_max_weight(new_config.cacheMemoryLimit)
 
         return config.ReconfigurableServiceMixin.reconfigService(self,
                                                                  new_config)
 
     def get_metrics(self):
-        return dict([
-            (n, dict(hits=c.hits, refhits=c.refhits,
-                     misses=c.misses, max_size=c.max_size))
-            for n, c in self._caches.iteritems()])
+        metrics = {}
+        for n, c in self._caches.iteritems():
+            metrics[n] = dict(hits=c.hits, refhits=c.refhits,
+                              misses=c.misses, max_size=c.max_size,
+                              size=len(c.cache), weight=c.weight)
+        for n, caches in self._registered.iteritems():
+            caches = caches.keys()
+            if not caches:
+                continue
+            m = metrics.setdefault(n, dict(hits=0, refhits=0, misses=0,
+                                           max_size=0, size=0, weight=0))
+            for c in caches:
+                for k in 'hits', 'refhits', 'misses', 'max_size':
+                    m[k] += getattr(c, k)
+                m['size'] += len(c.cache)
+                m['weight'] += c.weight
+        return metrics
@@ -13,6 +13,8 @@
 #
 # Copyright Buildbot Team Members
 
+import zlib
+
 from buildbot import interfaces
 from buildbot import util
 from buildbot.process import metrics
@@ -53,6 +55,11 @@ class RemoteCommand(pb.Referenceable):
         self.ignore_updates = ignore_updates
         self.decodeRC = decodeRC
 
+        # output received from the slave, as sent and once decompressed
+        self.outputWireBytes = 0
+        self.outputBytes = 0
+        self.compressedUpdates = False
+
     def __repr__(self):
         return "<RemoteCommand '%s' at %d>" % (self.remote_command, id(self))
 
@@ -165,6 +172,7 @@ class RemoteCommand(pb.Referenceable):
         for (update, num) in updates:
             #log.msg("update[%d]:" % num)
             try:
+                update = self._decompressUpdate(update)
                 if self.active and not self.ignore_updates:
                     self.remoteUpdate(update)
             except:
@@ -176,6 +184,55 @@ class RemoteCommand(pb.Referenceable):
                 max_updatenum = num
         return max_updatenum
 
+    def _decompressUpdate(self, update):
+        # Slaves asked to compress their updates send large output as a list
+        # of (key, logname, data) in a 'compressed' key, with zlib-compressed
+        # data; put it back where remoteUpdate expects it.  Count the output
+        # bytes both as sent and as decompressed.
+        for key in ('stdout', 'stderr', 'header'):
+            if key in update:
+                self.outputWireBytes += len(update[key])
+                self.outputBytes += len(update[key])
+        if 'log' in update:
+            self.outputWireBytes += len(update['log'][1])
+            self.outputBytes += len(update['log'][1])
+        for key, logname, data in update.get('output', ()):
+            self.outputWireBytes += len(data)
+            self.outputBytes += len(data)
+        if 'compressed_output' in update:
+            return self._decompressOutput(update)
+        if 'compressed' not in update:
+            return update
+
+        self.compressedUpdates = True
+        update = update.copy()
+        for key, logname, zdata in update.pop('compressed'):
+            data = zlib.decompress(zdata)
+            self.outputWireBytes += len(zdata)
+            self.outputBytes += len(data)
+            if key == 'log':
+                update['log'] = (logname, data)
+            else:
+                update[key] = data
+        return update
+
+    def _decompressOutput(self, update):
+        # an ordered 'output' batch is compressed as a single zlib frame,
+        # with an index of (key, logname, length) to split it up again
+        self.compressedUpdates = True
+        update = update.copy()
+        index, zdata = update.pop('compressed_output')
+        data = zlib.decompress(zdata)
+        self.outputWireBytes += len(zdata)
+        self.outputBytes += len(data)
+        output = []
+        pos = 0
+        for key, logname, length in index:
+            output.append((key, logname, data[pos:pos + length]))
+            pos += length
+        update['output'] = output
+        return update
+
     def remote_complete(self, failure=None):
         """
         Called by the slave's L{buildbot.slave.bot.SlaveBuilder} to
@@ -227,6 +284,13 @@ class RemoteCommand(pb.Referenceable):
         if self.debug:
             for k, v in update.items():
                 log.msg("Update[%s]: %s" % (k, v))
+        if "output" in update:
+            # 'output': [(key, logname, data), ..], applied in order
+            for key, logname, data in update['output']:
+                if key == 'log':
+                    self.remoteUpdate({'log': (logname, data)})
+                else:
+                    self.remoteUpdate({key: data})
         if "stdout" in update:
             # 'stdout': data
             self.addStdout(update['stdout'])
@@ -249,7 +313,7 @@ class RemoteCommand(pb.Referenceable):
 
         # TODO: these should be handled at the RemoteCommand level
         for k in update:
-            if k not in ('stdout', 'stderr', 'header', 'rc'):
+            if k not in ('stdout', 'stderr', 'header', 'rc', 'output'):
                 if k not in self.updates:
                     self.updates[k] = []
                 self.updates[k].append(update[k])
@@ -259,6 +323,17 @@ class RemoteCommand(pb.Referenceable):
             delta = (util.now() - self._startTime) - self._remoteElapsed
             metrics.MetricTimeEvent.log("RemoteCommand.overhead", delta)
 
+        if self.compressedUpdates:
+            # add to any output already counted by this step, so that the
+            # summary over the build covers every command
+            ss = self.step.step_status
+            ss.setStatistic('output_bytes',
+                            ss.getStatistic('output_bytes', 0) +
+                            self.outputBytes)
+            ss.setStatistic('output_wire_bytes',
+                            ss.getStatistic('output_wire_bytes', 0) +
+                            self.outputWireBytes)
+
         for name, loog in self.logs.items():
             if self._closeWhenFinished[name]:
                 if maybeFailure:
@@ -286,7 +361,8 @@ class RemoteShellCommand(RemoteCommand):
                  logfiles={}, usePTY="slave-config", logEnviron=True,
                  collectStdout=False, collectStderr=False,
                  interruptSignal=None,
-                 initialStdin=None, decodeRC={0: SUCCESS}):
+                 initialStdin=None, decodeRC={0: SUCCESS},
+                 outputBuffering=None):
 
         self.command = command  # stash .command, set it later
         if isinstance(self.command, basestring):
@@ -320,6 +396,8 @@ class RemoteShellCommand(RemoteCommand):
                 }
         if interruptSignal is not None:
             args['interruptSignal'] = interruptSignal
+        if outputBuffering is not None:
+            args['outputBuffering'] = outputBuffering
         RemoteCommand.__init__(self, "shell", args, collectStdout=collectStdout,
                                collectStderr=collectStderr,
                                decodeRC=decodeRC)
@@ -83,6 +83,9 @@ class UpgradeMasterOptions(base.BasedirMixin, base.SubcommandOptions):
     pickle files into it, then move the pickle files out of the way (e.g. to
     changes.pck.old).
 
+    Builds that were saved as pickles by older versions are rewritten in the
+    current build file format.
+
     When upgrading the database, this command uses the database specified in
     the master configuration file.  If you wish to use a database other than
     the default (sqlite), be sure to set that parameter before upgrading.
@@ -16,6 +16,7 @@
 from __future__ import with_statement
 
 import os
+import re
 import sys
 import traceback
 
@@ -24,6 +25,7 @@ from buildbot import monkeypatches
 from buildbot.db import connector
 from buildbot.master import BuildMaster
 from buildbot.scripts import base
+from buildbot.status import buildfile
 from buildbot.util import in_reactor
 from twisted.internet import defer
 from twisted.python import runtime
@@ -142,6 +144,29 @@ def upgradeFiles(config):
                                                      str(e))
 
 
+def upgradeBuildFiles(config, master_cfg):
+    if not config['quiet']:
+        print "converting build pickles"
+
+    for builder_config in master_cfg.builders:
+        builddir = os.path.join(config['basedir'], builder_config.builddir)
+        if not os.path.isdir(builddir):
+            continue
+        converted = 0
+        for filename in os.listdir(builddir):
+            if not re.match(r"^\d+$", filename):
+                continue
+            path = os.path.join(builddir, filename)
+            try:
+                if buildfile.convertPickle(path):
+                    converted += 1
+            except Exception, e:
+                print "Can't convert '%s': %s" % (path, e)
+        if converted and not config['quiet']:
+            print " converted %d builds of %s" % (converted,
+                                                 builder_config.name)
+
+
 @defer.inlineCallbacks
 def upgradeDatabase(config, master_cfg):
     if not config['quiet']:
@@ -180,6 +205,7 @@ def upgradeMaster(config, _noMonkey=False):
         return
 
     upgradeFiles(config)
+    upgradeBuildFiles(config, master_cfg)
     yield upgradeDatabase(config, master_cfg)
 
     if not config['quiet']:
@@ -94,9 +94,19 @@ class SourceStamp(util.ComparableMixin, styles.Versioned):
         """
         # try to fetch from the cache, falling back to _make_ss if not
         # found
-        cache = master.caches.get_cache("SourceStamps", cls._make_ss)
+        cache = master.caches.get_cache("SourceStamps", cls._make_ss,
+                                        weight_fn=cls._weigh_ss)
         return cache.get(ssdict['ssid'], ssdict=ssdict, master=master)
 
+    @classmethod
+    def _weigh_ss(cls, sourcestamp):
+        # a rough estimate of the bytes held by the sourcestamp, not counting
+        # its changes, which are cached separately
+        weight = 1024
+        if sourcestamp.patch:
+            weight += len(sourcestamp.patch[1])
+        return weight
+
     @classmethod
     def _make_ss(cls, ssid, ssdict, master):
         sourcestamp = cls(_fromSsdict=True)
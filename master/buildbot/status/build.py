@@ -23,8 +23,8 @@ from buildbot import interfaces
 from buildbot import sourcestamp
 from buildbot import util
 from buildbot.process import properties
+from buildbot.status import buildfile
 from buildbot.status.buildstep import BuildStepStatus
-from cPickle import dump
 from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.persisted import styles
@@ -53,6 +53,7 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     slavename = "???"
 
     set_runtime_properties = True
+    stepsPending = False
 
     # these lists/dicts are defined here so that unserialized instances have
     # (empty) values. They are set in __init__ to new objects to make sure
@@ -81,6 +82,14 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     def __repr__(self):
         return "<%s #%s>" % (self.__class__.__name__, self.number)
 
+    def __getattr__(self, name):
+        # builds read from a build file load their steps on first use
+        if name == 'steps' and self.stepsPending:
+            self.stepsPending = False
+            self.steps = self._loadSteps()
+            return self.steps
+        raise AttributeError(name)
+
     # IBuildStatus
 
     def getBuilder(self):
@@ -438,8 +447,27 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     def checkLogfiles(self):
         # check that all logfiles exist, and remove references to any that
         # have been deleted (e.g., by purge())
+        stored = self.listStoredLogs()
         for s in self.steps:
-            s.checkLogfiles()
+            s.checkLogfiles(stored)
+
+    def listStoredLogs(self):
+        # the filenames of this build's stored logs, or None if the log
+        # storage cannot list them
+        return self.master.config.logStorage.listLogs(self.builder,
+                                                      self.number)
+
+    def _loadSteps(self):
+        filename = os.path.join(self.builder.basedir, "%d" % self.number)
+        try:
+            with open(filename, "rb") as f:
+                steps = buildfile.loadSteps(f, self)
+        except (IOError, ValueError, buildfile.UnknownVersionError), e:
+            log.msg("unable to load the steps of build %s-#%d: %s"
+                    % (self.builder.name, self.number, e))
+            return []
+        # each step's logfiles are checked as the step is materialized
+        return steps
 
     def saveYourself(self):
         filename = os.path.join(self.builder.basedir, "%d" % self.number)
@@ -449,7 +477,7 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         tmpfilename = filename + ".tmp"
         try:
             with open(tmpfilename, "wb") as f:
-                dump(self, f, -1)
+                buildfile.dumpBuild(self, f)
             if runtime.platformType == 'win32':
                 # windows cannot rename a file on top of an existing one, so
                 # fall back to delete-first. There are ways this can fail and
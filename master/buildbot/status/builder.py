@@ -25,8 +25,11 @@ from cPickle import load
 
 from buildbot import interfaces
 from buildbot import util
+from buildbot.status import buildfile
 from buildbot.status.build import BuildStatus
 from buildbot.status.buildrequest import BuildRequestStatus
+from buildbot.status.buildsummary import BuildSummary
+from buildbot.status.buildsummary import BuildSummaryIndex
 from buildbot.status.event import Event
 from buildbot.util.lru import LRUCache
 from twisted.persisted import styles
@@ -92,7 +95,8 @@ class BuilderStatus(styles.Versioned):
         self.currentBuilds = []
         self.nextBuild = None
         self.watchers = []
-        self.buildCache = LRUCache(self.cacheMiss)
+        self.buildCache = LRUCache(self.cacheMiss, weight_fn=self.weighBuild)
+        self.summaries = BuildSummaryIndex(self)
 
     # persistence
 
@@ -104,6 +108,7 @@ class BuilderStatus(styles.Versioned):
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
+        d.pop('summaries', None)
         for b in self.currentBuilds:
             b.saveYourself()
             # TODO: push a 'hey, build was interrupted' event
@@ -120,7 +125,8 @@ class BuilderStatus(styles.Versioned):
         # when loading, re-initialize the transient stuff. Remember that
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
-        self.buildCache = LRUCache(self.cacheMiss)
+        self.buildCache = LRUCache(self.cacheMiss, weight_fn=self.weighBuild)
+        self.summaries = BuildSummaryIndex(self)
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
@@ -174,6 +180,8 @@ class BuilderStatus(styles.Versioned):
 
     def setCacheSize(self, size):
         self.buildCache.set_max_size(size)
+        # count the build cache against the master's cache memory limit
+        self.master.caches.register_cache('Builds', self.buildCache)
 
     def makeBuildFilename(self, number):
         return os.path.join(self.basedir, "%d" % number)
@@ -184,10 +192,16 @@ class BuilderStatus(styles.Versioned):
     def loadBuildFromFile(self, number):
         filename = self.makeBuildFilename(number)
         try:
-            log.msg("Loading builder %s's build %d from on-disk pickle"
-                    % (self.name, number))
             with open(filename, "rb") as f:
-                build = load(f)
+                if buildfile.isBuildFile(f):
+                    build = buildfile.loadBuild(f, self, self.master)
+                else:
+                    log.msg("Loading builder %s's build %d from on-disk pickle"
+                            % (self.name, number))
+                    build = load(f)
+            if build.stepsPending:
+                # the steps (and their logfiles) are checked once loaded
+                return self._indexBuild(build)
             build.setProcessObjects(self, self.master)
 
             # (bug #1068) if we need to upgrade, we probably need to rewrite
@@ -198,16 +212,25 @@ class BuilderStatus(styles.Versioned):
             versioneds = styles.versionedsToUpgrade
             styles.doUpgrade()
             if True in [hasattr(o, 'wasUpgraded') for o in versioneds.values()]:
-                log.msg("re-writing upgraded build pickle")
+                log.msg("re-writing upgraded build in the build file format")
                 build.saveYourself()
 
             # check that logfiles exist
             build.checkLogfiles()
-            return build
+            return self._indexBuild(build)
         except IOError:
             raise IndexError("no such build %d" % number)
         except EOFError:
             raise IndexError("corrupted build pickle %d" % number)
+        except (ValueError, buildfile.UnknownVersionError):
+            raise IndexError("unreadable build file %d" % number)
+
+    def _indexBuild(self, build):
+        # builds finished before the summary index existed are added to it
+        # as they are loaded
+        if build.isFinished() and build.number not in self.summaries:
+            self._addBuildSummary(build)
+        return build
 
     def cacheMiss(self, number, **kwargs):
         # If kwargs['val'] exists, this is a new value being added to
@@ -223,6 +246,18 @@ class BuilderStatus(styles.Versioned):
         # then fall back to loading it from disk
         return self.loadBuildFromFile(number)
 
+    def weighBuild(self, build):
+        # Estimate the memory held by a cached build from the size of its
+        # build file, which holds everything but the contents of its logs.
+        # Running builds are held by currentBuilds anyway, so evicting them
+        # would not free anything; they are weighed again once saved.
+        if not build.isFinished():
+            return 0
+        try:
+            return os.path.getsize(self.makeBuildFilename(build.number))
+        except OSError:
+            return 0
+
     def prune(self, events_only=False):
         # begin by pruning our own events
         eventHorizon = self.master.config.eventHorizon
@@ -250,6 +285,12 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
+        self.summaries.prune(earliest_build)
+
+        # logs kept outside of the builder directory are deleted in bulk
+        self.master.config.logStorage.pruneLogs(
+            self, earliest_log, self.buildCache.cache.keys())
+
         # skim the directory and delete anything that shouldn't be there anymore
         build_re = re.compile(r"^([0-9]+)$")
         build_log_re = re.compile(r"^([0-9]+)-.*$")
@@ -340,6 +381,31 @@ class BuilderStatus(styles.Versioned):
         except IndexError:
             return None
 
+    def getBuildSummary(self, number):
+        if number < 0:
+            number = self.nextBuildNumber + number
+        if number < 0 or number >= self.nextBuildNumber:
+            return None
+
+        summary = self.summaries.getSummary(number)
+        if summary is not None:
+            return summary
+        return self.getBuild(number)
+
+    def _addBuildSummary(self, build):
+        try:
+            self.summaries.addBuild(build)
+        except:
+            log.msg("unable to add build %s-#%d to the summary index"
+                    % (self.name, build.number))
+            log.err()
+
+    def _getFullBuild(self, build):
+        # turn a summary that has passed all filters into the real build
+        if isinstance(build, BuildSummary):
+            return self.getBuild(build.getNumber())
+        return build
+
     def getEvent(self, number):
         try:
             return self.events[number]
@@ -364,7 +430,7 @@ class BuilderStatus(styles.Versioned):
                 break
             if Nb > max_search:
                 break
-            build = self.getBuild(-Nb)
+            build = self.getBuildSummary(-Nb)
             if build is None:
                 continue
             if max_buildnum is not None:
@@ -383,6 +449,9 @@ class BuilderStatus(styles.Versioned):
             if results is not None:
                 if build.getResults() not in results:
                     continue
+            build = self._getFullBuild(build)
+            if build is None:
+                continue
             if filter_fn is not None:
                 if not filter_fn(build):
                     continue
@@ -410,7 +479,7 @@ class BuilderStatus(styles.Versioned):
         e = self.getEvent(eventIndex)
         branches = set(branches)
         for Nb in range(1, self.nextBuildNumber + 1):
-            b = self.getBuild(-Nb)
+            b = self.getBuildSummary(-Nb)
             if not b:
                 # HACK: If this is the first build we are looking at, it is
                 # possible it's in progress but locked before it has written a
@@ -424,12 +493,15 @@ class BuilderStatus(styles.Versioned):
             # sourcestamps match, skip this build
             if branches and not branches & self._getBuildBranches(b):
                 continue
-            if categories and not b.getBuilder().getCategory() in categories:
+            if categories and not self.getCategory() in categories:
                 continue
             if committers and not [True for c in b.getChanges() if c.who in committers]:
                 continue
             if projects and not b.getProperty('project') in projects:
                 continue
+            b = self._getFullBuild(b)
+            if b is None:
+                continue
             steps = b.getSteps()
             for Ns in range(1, len(steps) + 1):
                 if steps[-Ns].started:
@@ -551,7 +623,10 @@ class BuilderStatus(styles.Versioned):
     def _buildFinished(self, s):
         assert s in self.currentBuilds
         s.saveYourself()
+        self._addBuildSummary(s)
         self.currentBuilds.remove(s)
+        # now that the build is saved, it has a weight
+        self.buildCache.put(s.number, s)
 
         name = self.getName()
         results = s.getResults()
@@ -0,0 +1,404 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+The on-disk format of finished builds.
+
+A build file starts with a line holding L{MAGIC} and the format version,
+followed by one line with a JSON object describing the build itself, then
+one JSON line per step (each including its logs).  Only the first two lines
+are read when a build is loaded; the steps are read the first time they are
+needed.
+
+Unlike pickles, these files do not depend on the layout of the status
+classes.  Strings are stored as unicode; byte strings that are not valid
+UTF-8, and patch bodies, are stored base64-encoded.
+"""
+
+from __future__ import with_statement
+
+import base64
+import os
+import types
+
+from buildbot import util
+from buildbot.changes.changes import Change
+from buildbot.process.properties import Properties
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status.buildstep import BuildStepStatus
+from buildbot.status.logfile import HTMLLogFile
+from buildbot.status.logfile import LogFile
+from buildbot.status.testresult import TestResult
+from buildbot.util import json
+from twisted.python import log
+from twisted.python import runtime
+
+MAGIC = "buildbot-build-status"
+VERSION = 1
+
+
+class UnknownVersionError(Exception):
+    pass
+
+
+def isBuildFile(f):
+    """Return true if F, a file open for reading, holds a build in this
+    format rather than a pickle.  F is left at its start."""
+    f.seek(0)
+    isbuild = f.read(len(MAGIC)) == MAGIC
+    f.seek(0)
+    return isbuild
+
+
+def _bare(cls):
+    # create an instance without calling __init__, as unpickling does
+    if isinstance(cls, types.ClassType):
+        return types.InstanceType(cls)
+    return cls.__new__(cls)
+
+
+def _str(s):
+    # names and filenames are byte strings throughout the status classes
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+def _encodeValue(value):
+    if isinstance(value, str):
+        try:
+            value.decode('utf-8')
+        except UnicodeDecodeError:
+            return {'__bytes__': base64.b64encode(value)}
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_encodeValue(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _encodeValue(v)) for k, v in value.iteritems())
+    if value is None or isinstance(value, (unicode, bool, int, long, float)):
+        return value
+    log.msg("storing non-JSON value %r as a string" % (value,))
+    return str(value)
+
+
+def _decodeValue(value):
+    if isinstance(value, list):
+        return [_decodeValue(v) for v in value]
+    if isinstance(value, dict):
+        if value.keys() == ['__bytes__']:
+            return base64.b64decode(value['__bytes__'])
+        return dict((k, _decodeValue(v)) for k, v in value.iteritems())
+    return value
+
+
+def _encodeProperties(props):
+    return [[name, _encodeValue(value), source]
+            for name, value, source in props.asList()]
+
+
+def _decodeProperties(l):
+    props = Properties()
+    for name, value, source in l:
+        props.setProperty(name, _decodeValue(value), source)
+    return props
+
+
+def _encodeChange(change):
+    return dict(
+        number=getattr(change, 'number', None),
+        who=change.who,
+        comments=_encodeValue(change.comments),
+        isdir=getattr(change, 'isdir', 0),
+        revision=change.revision,
+        when=change.when,
+        branch=change.branch,
+        category=change.category,
+        revlink=getattr(change, 'revlink', ''),
+        repository=getattr(change, 'repository', ''),
+        codebase=getattr(change, 'codebase', ''),
+        project=getattr(change, 'project', ''),
+        files=_encodeValue(change.files),
+        properties=_encodeProperties(change.properties))
+
+
+def _decodeChange(d):
+    change = Change(None, None, None, _fromChdict=True)
+    for k in ('number', 'who', 'isdir', 'revision', 'when', 'branch',
+              'category', 'revlink', 'repository', 'codebase', 'project'):
+        setattr(change, k, d[k])
+    change.comments = _decodeValue(d['comments'])
+    change.files = _decodeValue(d['files'])
+    change.properties = _decodeProperties(d['properties'])
+    return change
+
+
+def _encodeSourceStamp(ss):
+    patch = None
+    if ss.patch:
+        patch = [ss.patch[0], base64.b64encode(ss.patch[1])] + \
+            list(ss.patch[2:])
+    return dict(
+        ssid=ss.ssid,
+        sourcestampsetid=ss.sourcestampsetid,
+        branch=ss.branch,
+        revision=ss.revision,
+        patch=patch,
+        patch_info=_encodeValue(ss.patch_info),
+        project=ss.project,
+        repository=ss.repository,
+        codebase=ss.codebase,
+        changes=[_encodeChange(c) for c in ss.changes])
+
+
+def _decodeSourceStamp(d):
+    ss = SourceStamp(_fromSsdict=True)
+    for k in ('ssid', 'sourcestampsetid', 'branch', 'revision', 'project',
+              'repository', 'codebase'):
+        setattr(ss, k, d[k])
+    if d['patch']:
+        patch = d['patch']
+        ss.patch = tuple([patch[0], base64.b64decode(patch[1])] + patch[2:])
+    if d['patch_info']:
+        ss.patch_info = tuple(_decodeValue(d['patch_info']))
+    ss.changes = tuple(_decodeChange(c) for c in d['changes'])
+    return ss
+
+
+def _encodeTestResult(tr):
+    return dict(name=list(tr.getName()), results=tr.getResults(),
+                text=_encodeValue(tr.getText()),
+                logs=_encodeValue(tr.getLogs()))
+
+
+def _decodeTestResult(d):
+    return TestResult(tuple(d['name']), d['results'],
+                      _decodeValue(d['text']), _decodeValue(d['logs']))
+
+
+def _encodeLog(loog):
+    if isinstance(loog, HTMLLogFile):
+        return dict(kind='html', name=_encodeValue(loog.name),
+                    filename=loog.filename,
+                    html=_encodeValue(loog.html))
+    return dict(kind='log', name=_encodeValue(loog.name),
+                filename=loog.filename,
+                length=loog.length, nonHeaderLength=loog.nonHeaderLength,
+                tailLength=loog.tailLength,
+                indexedLength=loog.indexedLength,
+                indexedLines=loog.indexedLines,
+                maxLengthExceeded=loog.maxLengthExceeded)
+
+
+def _decodeLog(d, step):
+    if d['kind'] == 'html':
+        loog = _bare(HTMLLogFile)
+        loog.html = _decodeValue(d['html'])
+    else:
+        loog = _bare(LogFile)
+        for k in ('length', 'nonHeaderLength', 'tailLength',
+                  'indexedLength', 'indexedLines', 'maxLengthExceeded'):
+            setattr(loog, k, d[k])
+        loog.finished = True
+        loog.runEntries = []
+        loog.watchers = []
+        loog.finishedWatchers = []
+        loog.master = step.master
+    loog.step = step
+    loog.name = _str(_decodeValue(d['name']))
+    loog.filename = _str(d['filename'])
+    return loog
+
+
+def _encodeStep(step):
+    return dict(
+        name=_encodeValue(step.name),
+        step_number=step.step_number,
+        text=_encodeValue(step.text),
+        text2=_encodeValue(step.text2),
+        results=step.results,
+        started=step.started,
+        finished=step.finished,
+        hidden=step.hidden,
+        skipped=getattr(step, 'skipped', False),
+        statistics=_encodeValue(step.statistics),
+        urls=_encodeValue(step.urls),
+        logs=[_encodeLog(l) for l in step.logs])
+
+
+def _decodeStep(d, build):
+    step = _bare(BuildStepStatus)
+    step.build = build
+    step.master = build.master
+    step.name = _str(_decodeValue(d['name']))
+    for k in ('step_number', 'results', 'started', 'finished', 'hidden',
+              'skipped'):
+        setattr(step, k, d[k])
+    for k in ('text', 'text2', 'statistics', 'urls'):
+        setattr(step, k, _decodeValue(d[k]))
+    step.waitingForLocks = False
+    step.watchers = []
+    step.updates = {}
+    step.finishedWatchers = []
+    step.logs = [_decodeLog(l, step) for l in d['logs']]
+    return step
+
+
+def dumpBuild(build, f):
+    """Write BUILD, a L{BuildStatus}, to the file F."""
+    # like pickled builds, a saved build is always "finished"
+    finished = build.finished
+    if finished is None:
+        finished = util.now()
+    header = dict(
+        number=build.number,
+        reason=_encodeValue(build.reason),
+        started=build.started,
+        finished=finished,
+        results=build.results,
+        text=_encodeValue(build.text),
+        slavename=build.slavename,
+        blamelist=_encodeValue(build.blamelist),
+        properties=_encodeProperties(build.properties),
+        sources=[_encodeSourceStamp(ss) for ss in build.sources or []],
+        testResults=[_encodeTestResult(tr)
+                     for tr in build.testResults.itervalues()],
+        steps=len(build.steps))
+    f.write("%s %d\n" % (MAGIC, VERSION))
+    f.write(json.dumps(header) + "\n")
+    for step in build.steps:
+        f.write(json.dumps(_encodeStep(step)) + "\n")
+
+
+def _readVersion(f):
+    magic, version = f.readline().split()
+    version = int(version)
+    if magic != MAGIC or version > VERSION:
+        raise UnknownVersionError("build file format %s %d is not supported"
+                                  % (magic, version))
+    return version
+
+
+def loadBuild(f, builder, master):
+    """Read a L{BuildStatus} for BUILDER from the file F.  Only the build's
+    own details are read; its steps are read from the same file when they
+    are first used."""
+    from buildbot.status.build import BuildStatus
+    _readVersion(f)
+    d = json.loads(f.readline())
+
+    build = _bare(BuildStatus)
+    build.builder = builder
+    build.master = master
+    build.stepsPending = True
+    build.watchers = []
+    build.updates = {}
+    build.finishedWatchers = []
+    for k in ('number', 'started', 'finished', 'results', 'slavename'):
+        setattr(build, k, d[k])
+    build.slavename = _str(build.slavename)
+    for k in ('reason', 'text', 'blamelist'):
+        setattr(build, k, _decodeValue(d[k]))
+    build.properties = _decodeProperties(d['properties'])
+    build.sources = [_decodeSourceStamp(ss) for ss in d['sources']]
+    build.changes = []
+    for ss in build.sources:
+        build.changes.extend(ss.changes)
+    build.testResults = dict((tr.getName(), tr) for tr in
+                             [_decodeTestResult(t) for t in d['testResults']])
+    return build
+
+
+class StepList(object):
+
+    """The steps of a build read from a build file.
+
+    Each step is kept as the line of JSON it was read from until it is
+    first used, at which point it (and its logs) is turned into a
+    L{BuildStepStatus}, leaving out any logs that have since been pruned.
+    Apart from that, I behave like the list of steps of a running build."""
+
+    def __init__(self, build, lines):
+        self.build = build
+        self.items = lines
+        # the filenames of the build's stored logs, listed when the first
+        # step is materialized
+        self.listed = False
+        self.storedLogs = None
+
+    def materialize(self, i):
+        item = self.items[i]
+        if isinstance(item, str):
+            item = self.items[i] = _decodeStep(json.loads(item), self.build)
+            # leave out any logs that have been pruned
+            if not self.listed:
+                self.storedLogs = self.build.listStoredLogs()
+                self.listed = True
+            item.checkLogfiles(self.storedLogs)
+        return item
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.materialize(j)
+                    for j in xrange(*i.indices(len(self.items)))]
+        return self.materialize(i)
+
+    def __iter__(self):
+        for i in xrange(len(self.items)):
+            yield self.materialize(i)
+
+    def index(self, step):
+        for i, s in enumerate(self):
+            if s == step:
+                return i
+        raise ValueError("%r is not in the list of steps" % (step,))
+
+    def append(self, step):
+        self.items.append(step)
+
+    def isMaterialized(self, i):
+        return not isinstance(self.items[i], str)
+
+
+def loadSteps(f, build):
+    """Read the steps of BUILD from the file F, which holds it.  The steps
+    are returned as a L{StepList}."""
+    _readVersion(f)
+    f.readline()
+    return StepList(build, [line for line in f])
+
+
+def convertPickle(filename):
+    """Rewrite the pickled build in FILENAME in this format.  Returns false
+    if the file already uses it."""
+    from cPickle import load
+    from twisted.persisted import styles
+
+    with open(filename, "rb") as f:
+        if isBuildFile(f):
+            return False
+        build = load(f)
+    styles.doUpgrade()
+
+    tmpfilename = filename + ".tmp"
+    with open(tmpfilename, "wb") as f:
+        dumpBuild(build, f)
+    if runtime.platformType == 'win32':
+        # windows cannot rename a file on top of an existing one
+        os.unlink(filename)
+    os.rename(tmpfilename, filename)
+    return True
@@ -13,8 +13,6 @@
 #
 # Copyright Buildbot Team Members
 
-import os
-
 from buildbot import interfaces
 from buildbot import util
 from buildbot.status.logfile import HTMLLogFile
@@ -289,7 +287,7 @@ class BuildStepStatus(styles.Versioned):
             # HTMLLogFiles aren't files
             if logCompressionLimit is not False and \
                     isinstance(loog, LogFile):
-                if os.path.getsize(loog.getFilename()) > logCompressionLimit:
+                if loog.getStoredSize() > logCompressionLimit:
                     loog_deferred = loog.compressLog()
                     if loog_deferred:
                         cld.append(loog_deferred)
@@ -306,9 +304,16 @@ class BuildStepStatus(styles.Versioned):
         if cld:
             return defer.DeferredList(cld)
 
-    def checkLogfiles(self):
-        # filter out logs that have been deleted
-        self.logs = [l for l in self.logs if l.hasContents()]
+    def checkLogfiles(self, stored=None):
+        # filter out logs that have been deleted; if given, STORED is the
+        # set of filenames of the build's stored logs, from
+        # LogStorage.listLogs
+        if stored is None:
+            self.logs = [l for l in self.logs if l.hasContents()]
+        else:
+            # HTML logs are held in the build itself
+            self.logs = [l for l in self.logs
+                         if isinstance(l, HTMLLogFile) or l.filename in stored]
 
     def isWaitingForLocks(self):
         return self.waitingForLocks
@@ -0,0 +1,260 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+
+from buildbot.util import json
+from twisted.python import log
+from twisted.python import runtime
+
+
+class SourceStampSummary(object):
+
+    """The parts of a sourcestamp that history filters look at."""
+
+    def __init__(self, branch=None, revision=None, codebase='', project=''):
+        self.branch = branch
+        self.revision = revision
+        self.codebase = codebase
+        self.project = project
+
+
+class ChangeSummary(object):
+
+    """The number and author of a change that went into a build."""
+
+    def __init__(self, number, who):
+        self.number = number
+        self.who = who
+
+
+class StepSummary(object):
+
+    """The name, times and result of a finished build step."""
+
+    def __init__(self, name, started=None, finished=None, results=None):
+        self.name = name
+        self.started = started
+        self.finished = finished
+        self.results = results
+
+    def getName(self):
+        return self.name
+
+    def getTimes(self):
+        return (self.started, self.finished)
+
+    def getResults(self):
+        return self.results
+
+
+class BuildSummary(object):
+
+    """I am a small, read-only stand-in for a finished L{BuildStatus}.
+
+    I answer the subset of L{IBuildStatus} that history walkers use to
+    filter builds (number, times, results, sourcestamps, changes, blamelist,
+    slave and steps) without the build pickle having to be loaded.  Steps
+    are represented by L{StepSummary} instances, and only carry the
+    step's result code, not its text."""
+
+    def __init__(self, number, started=None, finished=None, results=None,
+                 sourcestamps=(), changes=(), blamelist=(), slavename=None,
+                 project=None, steps=()):
+        self.number = number
+        self.started = started
+        self.finished = finished
+        self.results = results
+        self.sourcestamps = list(sourcestamps)
+        self.changes = list(changes)
+        self.blamelist = list(blamelist)
+        self.slavename = slavename
+        self.project = project
+        self.steps = list(steps)
+
+    def __repr__(self):
+        return "<%s #%s>" % (self.__class__.__name__, self.number)
+
+    @classmethod
+    def fromBuild(cls, build):
+        sourcestamps = []
+        if build.sources:
+            for ss in build.getSourceStamps(absolute=True):
+                sourcestamps.append(SourceStampSummary(
+                    ss.branch, ss.revision, ss.codebase, ss.project))
+        changes = [ChangeSummary(c.number, c.who)
+                   for c in build.getChanges()]
+        steps = []
+        for step in build.getSteps():
+            started, finished = step.getTimes()
+            steps.append(StepSummary(step.getName(), started, finished,
+                                     step.getResults()[0]))
+        started, finished = build.getTimes()
+        return cls(build.getNumber(), started, finished, build.getResults(),
+                   sourcestamps=sourcestamps, changes=changes,
+                   blamelist=build.getResponsibleUsers(),
+                   slavename=build.getSlavename(),
+                   project=build.getProperty('project', None), steps=steps)
+
+    @classmethod
+    def fromDict(cls, d):
+        return cls(d['number'], d['started'], d['finished'], d['results'],
+                   sourcestamps=[SourceStampSummary(*ss)
+                                 for ss in d['sourcestamps']],
+                   changes=[ChangeSummary(*c) for c in d['changes']],
+                   blamelist=d['blamelist'], slavename=d['slavename'],
+                   project=d['project'],
+                   steps=[StepSummary(*st) for st in d['steps']])
+
+    def asDict(self):
+        return dict(
+            number=self.number,
+            started=self.started,
+            finished=self.finished,
+            results=self.results,
+            sourcestamps=[[ss.branch, ss.revision, ss.codebase, ss.project]
+                          for ss in self.sourcestamps],
+            changes=[[c.number, c.who] for c in self.changes],
+            blamelist=self.blamelist,
+            slavename=self.slavename,
+            project=self.project,
+            steps=[[st.name, st.started, st.finished, st.results]
+                   for st in self.steps])
+
+    def getNumber(self):
+        return self.number
+
+    def getTimes(self):
+        return (self.started, self.finished)
+
+    def isFinished(self):
+        return self.finished is not None
+
+    def getResults(self):
+        return self.results
+
+    def getSourceStamps(self, absolute=False):
+        # summaries always record the absolute revision, if one was known
+        return self.sourcestamps
+
+    def getChanges(self):
+        return self.changes
+
+    def getResponsibleUsers(self):
+        return self.blamelist
+
+    def getSlavename(self):
+        return self.slavename
+
+    def getProperty(self, propname, default=None):
+        # only the 'project' property is kept in the summary
+        if propname == 'project' and self.project is not None:
+            return self.project
+        return default
+
+    def getSteps(self):
+        return self.steps
+
+
+class BuildSummaryIndex(object):
+
+    """I keep a L{BuildSummary} for each finished build of a builder.
+
+    Summaries are appended, one JSON document per line, to the 'summaries'
+    file in the builder's basedir as builds finish, and the file is read
+    once, the first time a summary is asked for.  Pruned builds are dropped
+    from memory immediately, but the file is only rewritten once it holds
+    more stale lines than live ones."""
+
+    filename = "summaries"
+
+    def __init__(self, builder_status):
+        self.builder_status = builder_status
+        self.summaries = None
+        self.stale = 0
+
+    def getFilename(self):
+        return os.path.join(self.builder_status.basedir, self.filename)
+
+    def _load(self):
+        if self.summaries is not None:
+            return
+        self.summaries = {}
+        self.stale = 0
+        try:
+            f = open(self.getFilename(), "r")
+        except IOError:
+            return
+        with f:
+            for line in f:
+                try:
+                    summary = BuildSummary.fromDict(json.loads(line))
+                except Exception:
+                    # most likely a line truncated by a crash; the build
+                    # will be loaded from its pickle instead
+                    log.msg("ignoring bad line in %s" % self.getFilename())
+                    self.stale += 1
+                    continue
+                if summary.number in self.summaries:
+                    self.stale += 1
+                self.summaries[summary.number] = summary
+
+    def addBuild(self, build):
+        """Summarize a finished L{BuildStatus} and append it to the index."""
+        self._load()
+        summary = BuildSummary.fromBuild(build)
+        if summary.number in self.summaries:
+            self.stale += 1
+        self.summaries[summary.number] = summary
+        with open(self.getFilename(), "a") as f:
+            f.write(json.dumps(summary.asDict()) + "\n")
+        return summary
+
+    def getSummary(self, number):
+        self._load()
+        return self.summaries.get(number)
+
+    def __contains__(self, number):
+        self._load()
+        return number in self.summaries
+
+    def prune(self, earliest):
+        """Forget the summaries of builds numbered below EARLIEST."""
+        self._load()
+        for number in self.summaries.keys():
+            if number < earliest:
+                del self.summaries[number]
+                self.stale += 1
+        if self.stale > len(self.summaries):
+            self._rewrite()
+
+    def _rewrite(self):
+        filename = self.getFilename()
+        tmpfilename = filename + ".tmp"
+        try:
+            with open(tmpfilename, "w") as f:
+                for number in sorted(self.summaries):
+                    f.write(json.dumps(self.summaries[number].asDict()) + "\n")
+            if runtime.platformType == 'win32':
+                # windows cannot rename a file on top of an existing one
+                if os.path.exists(filename):
+                    os.unlink(filename)
+            os.rename(tmpfilename, filename)
+            self.stale = 0
+        except:
+            log.msg("unable to rewrite %s" % filename)
+            log.err()
@@ -0,0 +1,177 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import time
+
+from collections import deque
+
+from buildbot import config
+from buildbot.process import metrics
+from twisted.application import service
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.internet import threads
+from twisted.python import log
+from twisted.python import threadpool
+
+
+class LogCompressor(config.ReconfigurableServiceMixin, service.Service):
+
+    """
+    Runs log compression jobs on a dedicated thread pool, so that a burst of
+    finished logs does not starve other users of the reactor's thread pool.
+    The bz2 and zlib codecs release the GIL while they work, so the threads
+    compress on several cores at once.
+
+    At most C{logCompressionWorkers} jobs run at once, and at most
+    C{logCompressionQueueSize} more wait for a thread; jobs submitted beyond
+    that are set aside, and join the queue as it drains.  While the reactor
+    is running more than C{logCompressionMaxDelay} seconds late, queued jobs
+    are held back until the master is less busy.
+
+    There is generally only one instance of this class, available at
+    C{master.logCompressor}.
+    """
+
+    _reactor = reactor
+    checkInterval = 1
+
+    def __init__(self):
+        self.setName('logCompressor')
+        self.workers = 2
+        self.queueSize = 100
+        self.maxDelay = 1.0
+        self.queue = deque()
+        # jobs waiting for room in the queue
+        self.overflow = deque()
+        self.active = 0
+        self.overloaded = False
+        self.pool = None
+        self.loadCheck = None
+        self.lastCheck = None
+
+    def startService(self):
+        self.pool = threadpool.ThreadPool(minthreads=0,
+                                          maxthreads=self.workers,
+                                          name='LogCompressor')
+        self.pool.start()
+        self.lastCheck = self._reactor.seconds()
+        self.loadCheck = task.LoopingCall(self._checkLoad)
+        self.loadCheck.clock = self._reactor
+        self.loadCheck.start(self.checkInterval, now=False)
+        return service.Service.startService(self)
+
+    def stopService(self):
+        if self.loadCheck:
+            self.loadCheck.stop()
+            self.loadCheck = None
+        # jobs that have not started yet are not going to
+        queue, self.queue = self.queue, deque()
+        overflow, self.overflow = self.overflow, deque()
+        for fn, d in list(queue) + list(overflow):
+            d.callback(None)
+        self._reportQueue()
+        pool, self.pool = self.pool, None
+        service.Service.stopService(self)
+        # stopping the pool waits for running jobs to finish, so do that in
+        # another thread rather than blocking the reactor
+        return threads.deferToThread(pool.stop)
+
+    def reconfigService(self, new_config):
+        self.workers = new_config.logCompressionWorkers
+        self.queueSize = new_config.logCompressionQueueSize
+        self.maxDelay = new_config.logCompressionMaxDelay
+        if self.pool:
+            self.pool.adjustPoolsize(minthreads=0, maxthreads=self.workers)
+            self._dispatch()
+        return config.ReconfigurableServiceMixin.reconfigService(self,
+                                                                 new_config)
+
+    def compress(self, fn):
+        """
+        Queue C{fn} to be called in a compression thread.  C{fn} must return
+        a tuple giving the number of bytes it read and wrote.
+
+        @returns: Deferred firing with the result of C{fn}, or with None if
+        the service stopped before C{fn} was called
+        """
+        if not self.pool:
+            # not running (e.g., status loaded by a script), so just use the
+            # reactor's pool
+            return threads.deferToThread(fn)
+        d = defer.Deferred()
+        if len(self.queue) >= self.queueSize:
+            # set the job aside until the queue has room for it
+            metrics.MetricCountEvent.log('LogCompressor.overflowed')
+            self.overflow.append((fn, d))
+        else:
+            self.queue.append((fn, d))
+        self._dispatch()
+        self._reportQueue()
+        return d
+
+    def _dispatch(self):
+        while self.queue and self.active < self.workers \
+                and not self.overloaded:
+            fn, d = self.queue.popleft()
+            self.active += 1
+            job = threads.deferToThreadPool(self._reactor, self.pool,
+                                            self._timed, fn)
+            job.addBoth(self._jobDone, d)
+        while self.overflow and len(self.queue) < self.queueSize:
+            self.queue.append(self.overflow.popleft())
+
+    def _timed(self, fn):
+        # runs in the compression thread
+        start = time.time()
+        rv = fn()
+        return rv, time.time() - start
+
+    def _jobDone(self, res, d):
+        self.active -= 1
+        if isinstance(res, tuple):
+            rv, elapsed = res
+            bytesIn, bytesOut = rv
+            metrics.MetricTimeEvent.log('LogCompressor.compress', elapsed)
+            metrics.MetricCountEvent.log('LogCompressor.seconds', elapsed)
+            metrics.MetricCountEvent.log('LogCompressor.bytes_in', bytesIn)
+            metrics.MetricCountEvent.log('LogCompressor.bytes_out', bytesOut)
+            res = rv
+        if self.pool:
+            self._dispatch()
+        self._reportQueue()
+        d.callback(res)
+
+    def _reportQueue(self):
+        metrics.MetricCountEvent.log('LogCompressor.queued',
+                                     len(self.queue), absolute=True)
+        metrics.MetricCountEvent.log('LogCompressor.overflow',
+                                     len(self.overflow), absolute=True)
+        metrics.MetricCountEvent.log('LogCompressor.active',
+                                     self.active, absolute=True)
+
+    def _checkLoad(self):
+        # the lateness of this call is a measure of how busy the reactor is
+        now = self._reactor.seconds()
+        delay = now - self.lastCheck - self.checkInterval
+        self.lastCheck = now
+        overloaded = delay > self.maxDelay
+        if overloaded != self.overloaded:
+            if overloaded:
+                log.msg("master is busy (reactor %.2fs late); holding back "
+                        "log compression" % delay)
+            self.overloaded = overloaded
+            self._dispatch()
@@ -14,19 +14,16 @@
 # Copyright Buildbot Team Members
 
 import os
+import struct
 
-from bz2 import BZ2File
 from cStringIO import StringIO
-from gzip import GzipFile
 
 from buildbot import interfaces
 from buildbot.util import netstrings
 from buildbot.util.eventual import eventually
 from twisted.internet import defer
 from twisted.internet import reactor
-from twisted.internet import threads
 from twisted.python import log
-from twisted.python import runtime
 from zope.interface import implements
 
 STDOUT = interfaces.LOG_CHANNEL_STDOUT
@@ -34,6 +31,10 @@ STDERR = interfaces.LOG_CHANNEL_STDERR
 HEADER = interfaces.LOG_CHANNEL_HEADER
 ChunkTypes = ["stdout", "stderr", "header"]
 
+# fields of a LogChunkIndex entry
+INDEX_OFFSET, INDEX_CHANNEL, INDEX_LENGTH, INDEX_LINES, \
+    INDEX_TEXTSTART, INDEX_LINESTART = range(6)
+
 
 class LogFileScanner(netstrings.NetstringParser):
 
@@ -48,6 +49,123 @@ class LogFileScanner(netstrings.NetstringParser):
             self.chunk_cb((channel, line[1:]))
 
 
+class LogChunkIndex:
+
+    """
+    A sidecar index for a L{LogFile}, stored alongside it by the log's
+    storage (for files, next to it with an C{.idx} suffix).  Each netstring
+    chunk written by L{LogFile._merge} gets one fixed-size record giving its
+    byte offset in the (uncompressed) log file, its channel, the length of
+    its text and the number of newlines in that text, followed by the total
+    text length and newline count of all of the chunks that precede it.
+
+    Because the records are of fixed size, entries can be fetched and
+    binary-searched with a few seeks, so readers can find the chunk holding
+    a particular line or text offset without parsing the log from the
+    beginning.  Entries are tuples, indexed with the C{INDEX_*} constants.
+    """
+
+    record = struct.Struct("!QBLLQQ")
+
+    def __init__(self, fp):
+        self.fp = fp
+        fp.seek(0, 2)
+        self.count = fp.tell() // self.record.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        self.fp.seek(i * self.record.size)
+        return self.record.unpack(self.fp.read(self.record.size))
+
+    def iterEntries(self, blocksize=4096):
+        """Generate every entry in order, reading C{blocksize} at a time"""
+        size = self.record.size
+        for first in xrange(0, self.count, blocksize):
+            self.fp.seek(first * size)
+            data = self.fp.read(min(blocksize, self.count - first) * size)
+            for pos in xrange(0, len(data), size):
+                yield self.record.unpack_from(data, pos)
+
+    def bisect(self, key, value):
+        """
+        Return the index of the first entry for which C{key(entry) > value},
+        or the number of entries if there is no such entry.  C{key} must be
+        non-decreasing over the index.
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(self[mid]) > value:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def getTextLength(self):
+        """Return the total length of the text covered by this index"""
+        if not self.count:
+            return 0
+        last = self[-1]
+        return last[INDEX_TEXTSTART] + last[INDEX_LENGTH]
+
+    def getLineCount(self):
+        """Return the total number of newlines covered by this index"""
+        if not self.count:
+            return 0
+        last = self[-1]
+        return last[INDEX_LINESTART] + last[INDEX_LINES]
+
+    def getFileLength(self):
+        """Return the length of the log file covered by this index"""
+        if not self.count:
+            return 0
+        last = self[-1]
+        return last[INDEX_OFFSET] + _chunkHeaderLength(last) + \
+            last[INDEX_LENGTH] + 1
+
+    @classmethod
+    def pack(cls, offset, channel, text, textstart, linestart):
+        return cls.record.pack(offset, channel, len(text), text.count("\n"),
+                               textstart, linestart)
+
+
+def _chunkHeaderLength(entry):
+    return len("%d:%d" % (entry[INDEX_LENGTH] + 1, entry[INDEX_CHANNEL]))
+
+
+def _scanChunks(f, bufsize=64 * 1024):
+    """
+    Generate (offset, channel, text) for each complete chunk in the given
+    log file, without seeking backward.  A truncated chunk at the end of
+    the file is ignored.
+    """
+    f.seek(0)
+    buf = ""
+    pos = 0
+    base = 0  # file offset of buf[0]
+    while True:
+        colon = buf.find(":", pos)
+        if colon >= 0:
+            length = int(buf[pos:colon])
+            end = colon + 1 + length + 1
+        if colon < 0 or len(buf) < end:
+            data = f.read(bufsize)
+            if not data:
+                return
+            base += pos
+            buf = buf[pos:] + data
+            pos = 0
+            continue
+        yield base + pos, int(buf[colon + 1]), buf[colon + 2:end - 1]
+        pos = end
+
+
 class LogFileProducer:
 
     """What's the plan?
@@ -202,6 +320,7 @@ class LogFile:
     nonHeaderLength = 0
     tailLength = 0
     chunkSize = 10 * 1000
+    compressionFrameSize = 256 * 1024
     runLength = 0
     # No max size by default
     # Don't keep a tail buffer by default
@@ -212,6 +331,9 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None  # relative to the Builder's basedir
     openfile = None
+    openindex = None
+    indexedLength = 0
+    indexedLines = 0
 
     def __init__(self, parent, name, logfilename):
         """
@@ -226,17 +348,7 @@ class LogFile:
         self.master = parent.build.builder.master
         self.name = name
         self.filename = logfilename
-        fn = self.getFilename()
-        if os.path.exists(fn):
-            # the buildmaster was probably stopped abruptly, before the
-            # BuilderStatus could be saved, so BuilderStatus.nextBuildNumber
-            # is out of date, and we're overlapping with earlier builds now.
-            # Warn about it, but then overwrite the old pickle file
-            log.msg("Warning: Overwriting old serialized Build at %s" % fn)
-        dirname = os.path.dirname(fn)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
-        self.openfile = open(fn, "w+")
+        self.openfile, self.openindex = self.getStorage().openLog(self)
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -250,6 +362,13 @@ class LogFile:
         """
         return os.path.join(self.step.build.builder.basedir, self.filename)
 
+    def getStorage(self):
+        """
+        Get the L{buildbot.status.logstorage.LogStorage} holding this log's
+        contents, as configured with C{c['logStorage']}.
+        """
+        return self.master.config.logStorage
+
     def hasContents(self):
         """
         Return true if this logfile's contents are available.  For a newly
@@ -259,9 +378,7 @@ class LogFile:
 
         @returns: boolean
         """
-        return os.path.exists(self.getFilename() + '.bz2') or \
-            os.path.exists(self.getFilename() + '.gz') or \
-            os.path.exists(self.getFilename())
+        return self.getStorage().hasLog(self)
 
     def getName(self):
         """
@@ -315,16 +432,7 @@ class LogFile:
             # don't close it!
             return self.openfile
         # otherwise they get their own read-only handle
-        # try a compressed log first
-        try:
-            return BZ2File(self.getFilename() + ".bz2", "r")
-        except IOError:
-            pass
-        try:
-            return GzipFile(self.getFilename() + ".gz", "r")
-        except IOError:
-            pass
-        return open(self.getFilename(), "r")
+        return self.getStorage().getLogFile(self)
 
     def getText(self):
         # this produces one ginormous string
@@ -401,6 +509,283 @@ class LogFile:
             else:
                 yield leftover
 
+    def _getChunkIndex(self, f):
+        """
+        Get a L{LogChunkIndex} for this log, given the open log file C{f}.
+        Logs written before the index was introduced, or whose index is
+        damaged, are scanned once to rebuild it; the rebuilt index is saved
+        if the log is finished.
+        """
+        storage = self.getStorage()
+        fp = storage.getIndexFile(self)
+        if fp is not None:
+            index = LogChunkIndex(fp)
+            if storage.isIndexCurrent(self, index.getFileLength()):
+                return index
+            fp.close()
+
+        fp = StringIO()
+        textstart = linestart = 0
+        for offset, channel, text in _scanChunks(f):
+            fp.write(LogChunkIndex.pack(offset, channel, text,
+                                        textstart, linestart))
+            textstart += len(text)
+            linestart += text.count("\n")
+        if self.finished:
+            storage.saveIndex(self, fp.getvalue())
+        return LogChunkIndex(fp)
+
+    def _readIndexedChunk(self, f, entry):
+        f.seek(entry[INDEX_OFFSET] + _chunkHeaderLength(entry))
+        return f.read(entry[INDEX_LENGTH])
+
+    def _getLeftover(self):
+        if self.runEntries:
+            return (self.runEntries[0][0],
+                    "".join([c[1] for c in self.runEntries]))
+        return None
+
+    def getChunksForRange(self, start, end=None, channels=[], onlyText=False):
+        """
+        Generate the chunks covering the text between offsets C{start} and
+        C{end} (or the end of the log), trimmed to exactly that range.
+        Offsets count the text of all channels, not the on-disk encoding.
+        Only the chunks in the requested range are read from disk.
+
+        @param start: text offset of the first character
+        @param end: text offset just past the last character, or None
+        @param channels: channels to include, or an empty list for all
+        @param onlyText: if true, generate only the text of each chunk
+        """
+        f = self.getFile()
+        index = self._getChunkIndex(f)
+        return self._generateRangeChunks(f, index, start, end,
+                                         self._getLeftover(), channels,
+                                         onlyText)
+
+    def getChunksForLines(self, first, last=None, channels=[],
+                          onlyText=False):
+        """
+        Generate the chunks covering lines C{first} up to, but not
+        including, C{last} (or the end of the log).  Lines are numbered from
+        zero and counted across all channels, including headers.
+
+        @param first: number of the first line
+        @param last: number of the line after the last line, or None
+        @param channels: channels to include, or an empty list for all
+        @param onlyText: if true, generate only the text of each chunk
+        """
+        f = self.getFile()
+        index = self._getChunkIndex(f)
+        leftover = self._getLeftover()
+        start = self._findLine(f, index, leftover, first)
+        end = None
+        if last is not None:
+            end = self._findLine(f, index, leftover, last)
+        return self._generateRangeChunks(f, index, start, end, leftover,
+                                         channels, onlyText)
+
+    def getTail(self, nlines, channels=[], onlyText=False):
+        """
+        Return a list of the chunks making up the last C{nlines} lines of
+        the requested channels, reading backward from the end of the log.
+
+        @param nlines: number of lines to return
+        @param channels: channels to include, or an empty list for all
+        @param onlyText: if true, return only the text of each chunk
+        """
+        f = self.getFile()
+        index = self._getChunkIndex(f)
+
+        def candidates():
+            leftover = self._getLeftover()
+            if leftover:
+                yield leftover
+            for i in xrange(len(index) - 1, -1, -1):
+                entry = index[i]
+                if not channels or entry[INDEX_CHANNEL] in channels:
+                    yield (entry[INDEX_CHANNEL],
+                           self._readIndexedChunk(f, entry))
+
+        collected = []
+        needed = newlines = 0
+        if nlines > 0:
+            for channel, text in candidates():
+                if channels and channel not in channels or not text:
+                    continue
+                if not collected:
+                    # a trailing newline does not start another line
+                    needed = nlines + (text.endswith("\n") and 1 or 0)
+                collected.append((channel, text))
+                newlines += text.count("\n")
+                if newlines >= needed:
+                    # trim the earliest chunk just after the newline that
+                    # precedes the first wanted line
+                    pos = len(text)
+                    for _ in xrange(needed - (newlines - text.count("\n"))):
+                        pos = text.rfind("\n", 0, pos)
+                    collected[-1] = (channel, text[pos + 1:])
+                    break
+        collected.reverse()
+        if onlyText:
+            return [text for channel, text in collected if text]
+        return [chunk for chunk in collected if chunk[1]]
+
+    def getChannelTextLength(self, channels=[]):
+        """
+        Return the length of the text logged so far in the given channels,
+        or in all channels if C{channels} is empty.  Only the chunk index is
+        read.
+        """
+        f = self.getFile()
+        index = self._getChunkIndex(f)
+        leftover = self._getLeftover()
+        if not channels:
+            return index.getTextLength() + (leftover and len(leftover[1]) or 0)
+        length = sum([e[INDEX_LENGTH] for e in index.iterEntries()
+                      if e[INDEX_CHANNEL] in channels])
+        if leftover and leftover[0] in channels:
+            length += len(leftover[1])
+        return length
+
+    def getChunksForChannelRange(self, start, end=None, channels=[],
+                                 onlyText=False):
+        """
+        Like L{getChunksForRange}, but with offsets counting only the text
+        of the requested channels, so that they are offsets into the text
+        this generates.  Only the chunk index and the chunks holding the
+        ends of the range are read to find it.
+        """
+        if not channels:
+            return self.getChunksForRange(start, end, channels, onlyText)
+        f = self.getFile()
+        index = self._getChunkIndex(f)
+        leftover = self._getLeftover()
+        start = self._findChannelPosition(f, index, leftover, channels,
+                                          start, False)
+        if end is not None:
+            end = self._findChannelPosition(f, index, leftover, channels,
+                                            end, False)
+        return self._generateRangeChunks(f, index, start, end, leftover,
+                                         channels, onlyText)
+
+    def getChunksForChannelLines(self, first, last=None, channels=[],
+                                 onlyText=False):
+        """
+        Like L{getChunksForLines}, but with lines counted only in the
+        requested channels.
+        """
+        if not channels:
+            return self.getChunksForLines(first, last, channels, onlyText)
+        f = self.getFile()
+        index = self._getChunkIndex(f)
+        leftover = self._getLeftover()
+        start = self._findChannelPosition(f, index, leftover, channels,
+                                          first, True)
+        end = None
+        if last is not None:
+            end = self._findChannelPosition(f, index, leftover, channels,
+                                            last, True)
+        return self._generateRangeChunks(f, index, start, end, leftover,
+                                         channels, onlyText)
+
+    def _findChannelPosition(self, f, index, leftover, channels, n, lines):
+        # return the text offset (counting all channels) at which offset n,
+        # or line n if lines is true, of the text in channels starts
+        if n <= 0:
+            return 0
+
+        def find(text, textstart, count):
+            if not lines:
+                return textstart + n - count
+            pos = -1
+            for _ in xrange(n - count):
+                pos = text.find("\n", pos + 1)
+            return textstart + pos + 1
+
+        count = 0
+        for entry in index.iterEntries():
+            if entry[INDEX_CHANNEL] not in channels:
+                continue
+            size = entry[lines and INDEX_LINES or INDEX_LENGTH]
+            if count + size >= n + (not lines):
+                text = lines and self._readIndexedChunk(f, entry) or None
+                return find(text, entry[INDEX_TEXTSTART], count)
+            count += size
+        textstart = index.getTextLength()
+        if not leftover:
+            return textstart
+        text = leftover[1]
+        if leftover[0] in channels:
+            size = lines and text.count("\n") or len(text)
+            if count + size >= n + (not lines):
+                return find(text, textstart, count)
+        return textstart + len(text)
+
+    def getModificationTime(self):
+        """
+        Return the time at which this log was last written, or None if it
+        cannot be found.
+        """
+        return self.getStorage().getModificationTime(self)
+
+    def getStoredSize(self):
+        """
+        Return the number of bytes this log takes up in its storage.
+        """
+        return self.getStorage().getSize(self)
+
+    def _findLine(self, f, index, leftover, n):
+        # return the text offset at which line n starts
+        if n <= 0:
+            return 0
+        i = index.bisect(lambda e: e[INDEX_LINESTART] + e[INDEX_LINES], n - 1)
+        if i < len(index):
+            entry = index[i]
+            text = self._readIndexedChunk(f, entry)
+            textstart = entry[INDEX_TEXTSTART]
+            skip = n - entry[INDEX_LINESTART]
+        else:
+            textstart = index.getTextLength()
+            if not leftover:
+                return textstart
+            text = leftover[1]
+            skip = n - index.getLineCount()
+        pos = -1
+        for _ in xrange(skip):
+            pos = text.find("\n", pos + 1)
+            if pos < 0:
+                return textstart + len(text)
+        return textstart + pos + 1
+
+    def _generateRangeChunks(self, f, index, start, end, leftover,
+                             channels, onlyText):
+        def ranged():
+            i = max(index.bisect(lambda e: e[INDEX_TEXTSTART], start) - 1, 0)
+            for i in xrange(i, len(index)):
+                entry = index[i]
+                if end is not None and entry[INDEX_TEXTSTART] >= end:
+                    return
+                if channels and entry[INDEX_CHANNEL] not in channels:
+                    continue
+                yield (entry[INDEX_CHANNEL], entry[INDEX_TEXTSTART],
+                       self._readIndexedChunk(f, entry))
+            if leftover:
+                yield leftover[0], index.getTextLength(), leftover[1]
+
+        for channel, textstart, text in ranged():
+            if channels and channel not in channels:
+                continue
+            if end is not None:
+                text = text[:max(end - textstart, 0)]
+            text = text[max(start - textstart, 0):]
+            if not text:
+                continue
+            if onlyText:
+                yield text
+            else:
+                yield (channel, text)
+
     def readlines(self):
         """Return an iterator that produces newline-terminated lines,
         excluding header chunks."""
@@ -441,13 +826,25 @@ class LogFile:
         offset = 0
         while offset < len(text):
             size = min(len(text) - offset, self.chunkSize)
+            chunk = text[offset:offset + size]
+            self._indexChunk(f.tell(), channel, chunk)
             f.write("%d:%d" % (1 + size, channel))
-            f.write(text[offset:offset + size])
+            f.write(chunk)
             f.write(",")
             offset += size
         self.runEntries = []
         self.runLength = 0
 
+    def _indexChunk(self, offset, channel, text):
+        # add an entry for a chunk about to be written to the sidecar index
+        if not self.openindex:
+            return
+        self.openindex.write(LogChunkIndex.pack(offset, channel, text,
+                                                self.indexedLength,
+                                                self.indexedLines))
+        self.indexedLength += len(text)
+        self.indexedLines += text.count("\n")
+
     def addEntry(self, channel, text, _no_watchers=False):
         """
         Add an entry to the logfile.  The C{channel} is one of L{STDOUT},
@@ -566,6 +963,9 @@ class LogFile:
             # filehandle will be released and automatically closed.
             self.openfile.flush()
             self.openfile = None
+        if self.openindex:
+            self.openindex.close()
+            self.openindex = None
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -574,53 +974,13 @@ class LogFile:
         self.watchers = []
 
     def compressLog(self):
-        logCompressionMethod = self.master.config.logCompressionMethod
-        # bail out if there's no compression support
-        if logCompressionMethod == "bz2":
-            compressed = self.getFilename() + ".bz2.tmp"
-        elif logCompressionMethod == "gz":
-            compressed = self.getFilename() + ".gz.tmp"
-        else:
-            return defer.succeed(None)
-
-        def _compressLog():
-            infile = self.getFile()
-            if logCompressionMethod == "bz2":
-                cf = BZ2File(compressed, 'w')
-            elif logCompressionMethod == "gz":
-                cf = GzipFile(compressed, 'w')
-            bufsize = 1024 * 1024
-            while True:
-                buf = infile.read(bufsize)
-                cf.write(buf)
-                if len(buf) < bufsize:
-                    break
-            cf.close()
-        d = threads.deferToThread(_compressLog)
-
-        def _renameCompressedLog(rv):
-            if logCompressionMethod == "bz2":
-                filename = self.getFilename() + '.bz2'
-            else:
-                filename = self.getFilename() + '.gz'
-            if runtime.platformType == 'win32':
-                # windows cannot rename a file on top of an existing one, so
-                # fall back to delete-first. There are ways this can fail and
-                # lose the builder's history, so we avoid using it in the
-                # general (non-windows) case
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            os.rename(compressed, filename)
-            _tryremove(self.getFilename(), 1, 5)
-        d.addCallback(_renameCompressedLog)
-
-        def _cleanupFailedCompress(failure):
-            log.msg("failed to compress %s" % self.getFilename())
-            if os.path.exists(compressed):
-                _tryremove(compressed, 1, 5)
-            failure.trap()  # reraise the failure
-        d.addErrback(_cleanupFailedCompress)
-        return d
+        """
+        Compress the finished logfile, if its storage does not already keep
+        it compressed.  Files are compressed into independently compressed
+        frames of L{compressionFrameSize} bytes each, with a frame index
+        alongside, so that later reads only decompress the frames they need.
+        """
+        return self.getStorage().compressLog(self)
 
     # persistence stuff
     def __getstate__(self):
@@ -634,6 +994,8 @@ class LogFile:
             del d['finished']
         if "openfile" in d:
             del d['openfile']
+        if "openindex" in d:
+            del d['openindex']
         return d
 
     def __setstate__(self, d):
@@ -696,6 +1058,20 @@ class HTMLLogFile:
         return d
 
 
+def loadLogs(logs, contents=False):
+    """
+    Fetch what reading the given logs needs from their storage, using
+    L{buildbot.status.logstorage.LogStorage.loadLogs}, so that the reads
+    that follow do not wait for it.  HTML logs are always in memory.
+
+    @returns: Deferred
+    """
+    logs = [l for l in logs if isinstance(l, LogFile)]
+    if not logs:
+        return defer.succeed(None)
+    return logs[0].getStorage().loadLogs(logs, contents)
+
+
 def _tryremove(filename, timeout, retries):
     """Try to remove a file, and if failed, try again in timeout.
     Increases the timeout by a factor of 4, and only keeps trying for
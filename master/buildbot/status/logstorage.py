@@ -0,0 +1,1160 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Pluggable storage for the contents of L{buildbot.status.logfile.LogFile}s.
+
+A log is kept as two byte streams: the netstring-encoded chunks written by
+the LogFile, and its L{buildbot.status.logfile.LogChunkIndex}.  A storage
+backend hands out writable file objects for both while the log is running,
+and seekable, read-only file objects once it has finished.  The LogFile does
+all of its parsing and indexing on top of those, so range, line and tail
+reads work the same way with every backend.
+
+The backend in use is C{c['logStorage']}: L{FileLogStorage}, the default,
+keeps logs as files in the builder's directory, while L{ChunkedLogStorage}
+keeps them as compressed, fixed-size chunks in a L{ChunkStore}, which can be
+the master's database (L{DBChunkStore}) or a directory standing in for an
+object store (L{DirectoryChunkStore}).
+"""
+
+from __future__ import with_statement
+
+import hashlib
+import os
+import shutil
+import time
+import zlib
+
+import sqlalchemy as sa
+
+from collections import deque
+
+from cStringIO import StringIO
+
+from buildbot.status import logfile as logfile_module
+from buildbot.util import framedfile
+from buildbot.util import safeTranslate
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import threads
+from twisted.python import log
+from twisted.python import runtime
+
+# the two streams making up a log
+DATA, INDEX = 0, 1
+
+
+class LogStorage(object):
+
+    """
+    Base class for log storage backends.  Every method takes the
+    L{LogFile} concerned, which provides the builder-relative
+    C{filename}, the step and so on.
+    """
+
+    master = None
+
+    def setMaster(self, master):
+        """Called by the master when this storage is configured"""
+        self.master = master
+
+    def openLog(self, logfile):
+        """
+        Start storing a new log, returning a tuple of file objects to which
+        its data and its index will be written.  Both always append.  The
+        data file must also be seekable and readable, since it is used to
+        read the log until it is finished.
+        """
+        raise NotImplementedError
+
+    def getLogFile(self, logfile):
+        """
+        Return a seekable, read-only file object for the data of a finished
+        log, or raise IOError if it is not stored.
+        """
+        raise NotImplementedError
+
+    def getIndexFile(self, logfile):
+        """
+        Return a seekable, read-only file object for the index of a log, or
+        None if there is none.
+        """
+        raise NotImplementedError
+
+    def isIndexCurrent(self, logfile, length):
+        """
+        Return true if an index covering C{length} bytes of data covers
+        the whole of the log as stored.
+        """
+        return True
+
+    def saveIndex(self, logfile, data):
+        """Store an index rebuilt for a finished log"""
+        raise NotImplementedError
+
+    def hasLog(self, logfile):
+        """Return true if the log's data is stored"""
+        raise NotImplementedError
+
+    def loadLogs(self, logfiles, contents=False):
+        """
+        Fetch what reading the given logs needs from storage that is slow
+        to read, so that the reads that follow do not have to wait for it.
+        Without C{contents}, that is only what L{hasLog}, L{getSize} and
+        L{getModificationTime} need.
+
+        @returns: Deferred
+        """
+        return defer.succeed(None)
+
+    def listLogs(self, builder, number):
+        """
+        Return the set of the filenames of the stored logs of build
+        C{number} of the given L{BuilderStatus}, or None if there is no
+        cheaper way to find them than calling L{hasLog} for each log.
+        """
+        return None
+
+    def getSize(self, logfile):
+        """Return the number of bytes the log's data takes up in storage"""
+        raise NotImplementedError
+
+    def getModificationTime(self, logfile):
+        """Return the time the log was last written, or None"""
+        raise NotImplementedError
+
+    def compressLog(self, logfile):
+        """
+        Compress a finished log, if the backend does not do so by itself.
+
+        @returns: Deferred
+        """
+        return defer.succeed(None)
+
+    def pruneLogs(self, builder, earliest, keep=()):
+        """
+        Delete the stored logs of all of the builds of the given
+        L{BuilderStatus} numbered below C{earliest}, except those in
+        C{keep}.
+        """
+
+
+class FileLogStorage(LogStorage):
+
+    """
+    Store each log as a file in its builder's directory, named after the
+    log's C{filename}, with its index alongside.  Finished logs may be
+    compressed with C{c['logCompressionMethod']}.  Old logs are deleted by
+    L{buildbot.status.builder.BuilderStatus.prune} along with the build
+    pickles, so L{pruneLogs} has nothing to do.
+    """
+
+    def openLog(self, logfile):
+        fn = logfile.getFilename()
+        if os.path.exists(fn):
+            # the buildmaster was probably stopped abruptly, before the
+            # BuilderStatus could be saved, so BuilderStatus.nextBuildNumber
+            # is out of date, and we're overlapping with earlier builds now.
+            # Warn about it, but then overwrite the old pickle file
+            log.msg("Warning: Overwriting old serialized Build at %s" % fn)
+        dirname = os.path.dirname(fn)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        return open(fn, "w+"), open(fn + ".idx", "wb")
+
+    def getLogFile(self, logfile):
+        fn = logfile.getFilename()
+        # try a compressed log first
+        for method in ('bz2', 'gz'):
+            compressed = fn + '.' + method
+            if os.path.exists(compressed):
+                index = None
+                if not os.path.exists(compressed +
+                                      framedfile.FRAME_INDEX_SUFFIX):
+                    index = self._rebuildFrameIndex(compressed, method)
+                return framedfile.FramedFile(compressed, method, index)
+        return open(fn, "r")
+
+    def _rebuildFrameIndex(self, compressed, method):
+        # the frame index of a log compressed by an older version, or one
+        # that was lost; scan the log for its frames, and save the index
+        # for next time
+        buf = StringIO()
+        with open(compressed, 'rb') as infile:
+            framedfile.indexFramedFile(infile, buf, method)
+        index = buf.getvalue()
+        frames = compressed + framedfile.FRAME_INDEX_SUFFIX
+        try:
+            with open(frames + ".tmp", "wb") as out:
+                out.write(index)
+            if runtime.platformType == 'win32' and os.path.exists(frames):
+                os.unlink(frames)
+            os.rename(frames + ".tmp", frames)
+        except (IOError, OSError):
+            log.msg("could not write frame index for %s" % compressed)
+        return index
+
+    def getIndexFile(self, logfile):
+        if logfile.openindex:
+            logfile.openindex.flush()
+        try:
+            return open(logfile.getFilename() + ".idx", "rb")
+        except IOError:
+            return None
+
+    def isIndexCurrent(self, logfile, length):
+        # an uncompressed log tells us whether the index is complete
+        fn = logfile.getFilename()
+        if logfile.openfile or not os.path.exists(fn):
+            return True
+        return length == os.path.getsize(fn)
+
+    def saveIndex(self, logfile, data):
+        try:
+            with open(logfile.getFilename() + ".idx", "wb") as out:
+                out.write(data)
+        except IOError:
+            log.msg("could not write log index for %s"
+                    % logfile.getFilename())
+
+    def hasLog(self, logfile):
+        fn = logfile.getFilename()
+        return os.path.exists(fn + '.bz2') or \
+            os.path.exists(fn + '.gz') or \
+            os.path.exists(fn)
+
+    def listLogs(self, builder, number):
+        # one directory listing, rather than up to three stats per log
+        prefix = "%d-" % number
+        try:
+            filenames = os.listdir(builder.basedir)
+        except OSError:
+            return set()
+        stored = set()
+        for filename in filenames:
+            if not filename.startswith(prefix):
+                continue
+            for suffix in ('.bz2', '.gz'):
+                if filename.endswith(suffix):
+                    filename = filename[:-len(suffix)]
+                    break
+            stored.add(filename)
+        return stored
+
+    def getSize(self, logfile):
+        return os.path.getsize(logfile.getFilename())
+
+    def getModificationTime(self, logfile):
+        fn = logfile.getFilename()
+        for path in (fn + ".bz2", fn + ".gz", fn):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                pass
+        return None
+
+    def compressLog(self, logfile):
+        """
+        Compress the finished log into independently compressed frames of
+        C{logfile.compressionFrameSize} bytes each, with a frame index
+        alongside, so that later reads only decompress the frames they need.
+        """
+        master = logfile.master
+        logCompressionMethod = master.config.logCompressionMethod
+        # bail out if there's no compression support
+        if logCompressionMethod not in framedfile.codecs:
+            return defer.succeed(None)
+        filename = logfile.getFilename() + '.' + logCompressionMethod
+        compressed = filename + ".tmp"
+        frames = filename + framedfile.FRAME_INDEX_SUFFIX
+        compressedFrames = frames + ".tmp"
+
+        def _compressLog():
+            infile = logfile.getFile()
+            cf = open(compressed, 'wb')
+            try:
+                idx = open(compressedFrames, 'wb')
+                try:
+                    size = framedfile.writeFramedFile(
+                        infile, cf, idx, logCompressionMethod,
+                        logfile.compressionFrameSize)
+                finally:
+                    idx.close()
+                return size, cf.tell()
+            finally:
+                cf.close()
+        d = master.logCompressor.compress(_compressLog)
+
+        def _renameCompressedLog(rv):
+            if rv is None:
+                # the compressor stopped before getting to it, so leave it
+                # uncompressed
+                return
+            if runtime.platformType == 'win32':
+                # windows cannot rename a file on top of an existing one, so
+                # fall back to delete-first. There are ways this can fail and
+                # lose the builder's history, so we avoid using it in the
+                # general (non-windows) case
+                for fn in frames, filename:
+                    if os.path.exists(fn):
+                        os.unlink(fn)
+            # the frame index goes first, so that the compressed file never
+            # appears without it
+            os.rename(compressedFrames, frames)
+            os.rename(compressed, filename)
+            logfile_module._tryremove(logfile.getFilename(), 1, 5)
+        d.addCallback(_renameCompressedLog)
+
+        def _cleanupFailedCompress(failure):
+            log.msg("failed to compress %s" % logfile.getFilename())
+            for fn in compressed, compressedFrames:
+                if os.path.exists(fn):
+                    logfile_module._tryremove(fn, 1, 5)
+            failure.trap()  # reraise the failure
+        d.addErrback(_cleanupFailedCompress)
+        return d
+
+
+class ChunkCache(object):
+
+    """
+    A dictionary holding at most C{maxSize} entries and, if C{weigh} is
+    given, entries weighing at most C{maxWeight} in all.  The least
+    recently used entries are evicted one at a time, but the most recently
+    used one is kept, however heavy it is.
+    """
+
+    def __init__(self, maxSize, maxWeight=None, weigh=None):
+        self.maxSize = maxSize
+        self.maxWeight = maxWeight
+        self.weigh = weigh
+        self.clear()
+
+    def clear(self):
+        self.entries = {}
+        self.weights = {}
+        self.weight = 0
+        # keys in order of use; a key may appear more than once, and only
+        # its last appearance, numbered as in self.used, counts
+        self.queue = deque()
+        self.used = {}
+        self.uses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        value = self.entries[key]
+        self._use(key)
+        return value
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        return self[key]
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+        self.entries[key] = value
+        if self.weigh is not None:
+            self.weights[key] = self.weigh(value)
+            self.weight += self.weights[key]
+        self._use(key)
+        while len(self.entries) > self.maxSize or (
+                self.maxWeight is not None and self.weight > self.maxWeight
+                and len(self.entries) > 1):
+            self._evict()
+
+    def pop(self, key, default=None):
+        if key not in self.entries:
+            return default
+        del self.used[key]
+        self.weight -= self.weights.pop(key, 0)
+        return self.entries.pop(key)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def _use(self, key):
+        self.uses += 1
+        self.used[key] = self.uses
+        self.queue.append((self.uses, key))
+        # drop the appearances that no longer count, now and then
+        if len(self.queue) > 2 * len(self.entries) + 100:
+            self.queue = deque(sorted((uses, key) for key, uses
+                                      in self.used.iteritems()))
+
+    def _evict(self):
+        while True:
+            uses, key = self.queue.popleft()
+            if self.used.get(key) == uses:
+                self.pop(key)
+                return
+
+
+class ChunkStore(object):
+
+    """
+    Base class for the stores used by L{ChunkedLogStorage}.  A store holds
+    numbered chunks for each stream of each log written by its master.
+    Logs are identified by a C{(buildername, buildnumber, logname)} tuple,
+    and each chunk is a tuple C{(seq, length, data)}, where C{data} is the
+    compressed form of C{length} bytes.
+
+    Writes and deletions are queued, and carried out one at a time and in
+    order, in a thread.  Until a chunk has been written, it is read from
+    memory.  A LogFile reads its storage synchronously, so L{loadLogs}
+    fetches what reading a log needs in the same thread, ahead of the
+    reads, and keeps it in memory: the last chunk of each stream, which
+    nearly every read needs, and, for logs that are about to be read
+    whole, all of their chunks.  Reads of anything that has not been
+    fetched, or that has been evicted from those caches since, are made on
+    the reactor thread.  Subclasses implement the C{_putChunks},
+    C{_deleteLog} and C{_deleteLogs} methods called in the thread, and the
+    C{_getChunks} and C{_getLastChunk} methods behind the reads.
+    """
+
+    master = None
+
+    # number of streams whose last chunk is cached
+    lastChunkCacheSize = 10000
+
+    # number of streams, and bytes of compressed chunks, whose chunks are
+    # kept once they are loaded
+    loadedCacheSize = 100
+    loadedCacheWeight = 32 * 1024 * 1024
+
+    def __init__(self):
+        # chunks that are queued to be written, by (key, stream) and seq
+        self.unwritten = {}
+        # counts of the queued deletions of each (key, stream)
+        self.deleting = {}
+        # the last chunk of each (key, stream), or None if there are none
+        self.lastChunks = ChunkCache(self.lastChunkCacheSize)
+        # all of the chunks of each loaded (key, stream), by seq
+        self.loaded = ChunkCache(
+            self.loadedCacheSize, self.loadedCacheWeight,
+            lambda chunks: sum([len(c[2]) for c in chunks.itervalues()]))
+        self.writeLock = defer.DeferredLock()
+        self.shutdownTrigger = None
+
+    def setMaster(self, master):
+        self.master = master
+
+    def _run(self, fn, *args):
+        """Call C{fn(*args)} in a thread, returning a Deferred"""
+        return threads.deferToThread(fn, *args)
+
+    def _queue(self, fn, *args):
+        # make sure that queued writes are done before the master exits
+        if self.shutdownTrigger is None:
+            self.shutdownTrigger = reactor.addSystemEventTrigger(
+                'before', 'shutdown', self._beforeShutdown)
+        d = self.writeLock.run(self._run, fn, *args)
+        d.addErrback(log.err, "while writing log chunks")
+        d.addCallback(self._queueDone)
+        return d
+
+    def _queueDone(self, res):
+        if not self.writeLock.locked and self.shutdownTrigger is not None:
+            reactor.removeSystemEventTrigger(self.shutdownTrigger)
+            self.shutdownTrigger = None
+        return res
+
+    def _beforeShutdown(self):
+        self.shutdownTrigger = None
+        return self.waitForWrites()
+
+    def waitForWrites(self):
+        """
+        Return a Deferred that fires once all of the writes and deletions
+        queued so far are done.
+        """
+        d = self.writeLock.acquire()
+        d.addCallback(lambda lock: lock.release())
+        d.addCallback(self._queueDone)
+        return d
+
+    def putChunks(self, key, stream, chunks):
+        """
+        Queue a batch of chunks to be stored, replacing any already stored
+        with the same numbers.
+
+        @returns: Deferred that fires once they are stored
+        """
+        now = time.time()
+        unwritten = self.unwritten.setdefault((key, stream), {})
+        for seq, length, data in chunks:
+            unwritten[seq] = (length, data, now)
+        seq, length, _ = max(chunks)
+        if (key, stream) in self.lastChunks:
+            last = self.lastChunks[(key, stream)]
+            if last is None or seq >= last[0]:
+                self.lastChunks[(key, stream)] = (seq, length, now)
+        self.loaded.pop((key, stream))
+        d = self._queue(self._putChunks, key, stream, chunks)
+        d.addCallback(lambda _: self._written(key, stream, chunks))
+        return d
+
+    def _written(self, key, stream, chunks):
+        # a load made while the chunks were being written may have missed
+        # them
+        self.loaded.pop((key, stream))
+        unwritten = self.unwritten.get((key, stream))
+        if unwritten is None:
+            return
+        for seq, length, data in chunks:
+            # unless it has been replaced in the meantime
+            if seq in unwritten and unwritten[seq][1] is data:
+                del unwritten[seq]
+        if not unwritten:
+            del self.unwritten[(key, stream)]
+
+    def getChunks(self, key, stream, first, last):
+        """Return the stored chunks numbered C{first} to C{last}, in order"""
+        unwritten = self.unwritten.get((key, stream), {})
+        wanted = [seq for seq in xrange(first, last + 1)
+                  if seq not in unwritten]
+        chunks = {}
+        loaded = self.loaded.get((key, stream))
+        if loaded is not None:
+            for seq in wanted:
+                if seq in loaded:
+                    chunks[seq] = loaded[seq]
+        elif wanted and (key, stream) not in self.deleting:
+            for chunk in self._getChunks(key, stream, wanted[0], wanted[-1]):
+                chunks[chunk[0]] = chunk
+        for seq in xrange(first, last + 1):
+            if seq in unwritten:
+                length, data, _ = unwritten[seq]
+                chunks[seq] = (seq, length, data)
+        return [chunks[seq] for seq in sorted(chunks)]
+
+    def getLastChunk(self, key, stream):
+        """
+        Return C{(seq, length, mtime)} for the highest-numbered chunk of the
+        stream, or None if nothing is stored for it.
+        """
+        if (key, stream) in self.lastChunks:
+            return self.lastChunks[(key, stream)]
+        last = None
+        if (key, stream) not in self.deleting:
+            last = self._getLastChunk(key, stream)
+        return self._cacheLastChunk(key, stream, last)
+
+    def _cacheLastChunk(self, key, stream, last):
+        # cache the last stored chunk, or the last chunk queued to be
+        # stored, if that is later
+        unwritten = self.unwritten.get((key, stream))
+        if unwritten:
+            seq = max(unwritten)
+            if last is None or seq >= last[0]:
+                length, _, mtime = unwritten[seq]
+                last = (seq, length, mtime)
+        self.lastChunks[(key, stream)] = last
+        return last
+
+    def loadLogs(self, keys, contents=False):
+        """
+        Fetch the last chunk of the data of each of the logs with the given
+        keys and, with C{contents}, all of the chunks of their data and
+        index, in the thread, and keep them in memory for the reads that
+        follow.
+
+        @returns: Deferred
+        """
+        wanted = []
+        for key in keys:
+            for stream in (contents and (DATA, INDEX) or (DATA,)):
+                if (key, stream) in self.deleting:
+                    continue
+                if (key, stream) not in self.lastChunks:
+                    wanted.append((key, stream))
+                elif contents and (key, stream) not in self.loaded and \
+                        self.lastChunks[(key, stream)] is not None:
+                    wanted.append((key, stream))
+        if not wanted:
+            return defer.succeed(None)
+        # the loads are queued behind the writes, so that they find the
+        # chunks that were queued to be written before them, and what they
+        # found is cached before any later writes are made
+        return self.writeLock.run(self._load, wanted, contents)
+
+    def _load(self, wanted, contents):
+        d = self._run(self._loadLogs, wanted, contents)
+        d.addCallback(self._loaded)
+        # the reads will fetch what they need themselves
+        d.addErrback(log.err, "while loading log chunks")
+        return d
+
+    def _loadLogs(self, wanted, contents):
+        loaded = []
+        for key, stream in wanted:
+            last = self._getLastChunk(key, stream)
+            chunks = None
+            if contents and last is not None:
+                chunks = self._getChunks(key, stream, 0, last[0])
+            loaded.append((key, stream, last, chunks))
+        return loaded
+
+    def _loaded(self, loaded):
+        for key, stream, last, chunks in loaded:
+            # unless the log was deleted or replaced in the meantime
+            if (key, stream) in self.deleting:
+                continue
+            self._cacheLastChunk(key, stream, last)
+            if chunks is not None and (key, stream) not in self.unwritten:
+                self.loaded[(key, stream)] = dict((c[0], c) for c in chunks)
+
+    def deleteLog(self, key, streams=(DATA, INDEX)):
+        """
+        Queue the deletion of all of the chunks of C{streams} of a log.
+
+        @returns: Deferred that fires once they are deleted
+        """
+        for stream in streams:
+            self.unwritten.pop((key, stream), None)
+            self.loaded.pop((key, stream))
+            self.deleting[(key, stream)] = \
+                self.deleting.get((key, stream), 0) + 1
+            self.lastChunks[(key, stream)] = None
+
+        def deleted(_):
+            for stream in streams:
+                self.deleting[(key, stream)] -= 1
+                if not self.deleting[(key, stream)]:
+                    del self.deleting[(key, stream)]
+        d = self._queue(self._deleteLog, key, streams)
+        d.addCallback(deleted)
+        return d
+
+    def deleteLogs(self, buildername, earliest, keep=()):
+        """
+        Queue the deletion of all of the chunks of all of the logs of builds
+        of C{buildername} numbered below C{earliest}, except those in
+        C{keep}.
+
+        @returns: Deferred that fires once they are deleted
+        """
+        def forget(_=None):
+            for cache in self.unwritten, self.lastChunks, self.loaded:
+                for key, stream in cache.keys():
+                    if key[0] == buildername and key[1] < earliest \
+                            and key[1] not in keep:
+                        cache.pop((key, stream))
+        forget()
+        d = self._queue(self._deleteLogs, buildername, earliest, keep)
+        # the logs may have been read, and their last chunks cached, before
+        # the deletion got to them
+        d.addCallback(forget)
+        return d
+
+    def _putChunks(self, key, stream, chunks):
+        raise NotImplementedError
+
+    def _getChunks(self, key, stream, first, last):
+        raise NotImplementedError
+
+    def _getLastChunk(self, key, stream):
+        raise NotImplementedError
+
+    def _deleteLog(self, key, streams):
+        raise NotImplementedError
+
+    def _deleteLogs(self, buildername, earliest, keep):
+        raise NotImplementedError
+
+
+class DBChunkStore(ChunkStore):
+
+    """
+    Store chunks in the C{logchunks} table of the master's database, or of
+    the database given by C{db_url}, which is created if necessary.  Each
+    row records the master that wrote it, so several masters can share
+    the table.  Writes to the master's database are made on its thread
+    pool.
+    """
+
+    def __init__(self, db_url=None):
+        ChunkStore.__init__(self)
+        self.db_url = db_url
+        self.engine = None
+
+    def _getEngine(self):
+        if self.engine is None:
+            from buildbot.db import enginestrategy
+            from buildbot.db import model
+            if self.db_url is None:
+                self.engine = self.master.db.pool.engine
+            else:
+                self.engine = enginestrategy.create_engine(
+                    self.db_url, basedir=self.master.basedir)
+                model.Model.logchunks.create(bind=self.engine,
+                                             checkfirst=True)
+        return self.engine
+
+    def _getTable(self):
+        from buildbot.db import model
+        return model.Model.logchunks
+
+    def _run(self, fn, *args):
+        if self.db_url is None:
+            self._getEngine()
+            return self.master.db.pool.do_with_engine(
+                lambda engine: fn(*args))
+        return ChunkStore._run(self, fn, *args)
+
+    def _logid(self, key):
+        return hashlib.sha1("%s\0%s\0%s" % (
+            safeTranslate(self.master.getMasterName()),
+            safeTranslate(key[0]), key[2])).hexdigest()
+
+    def _putChunks(self, key, stream, chunks):
+        tbl = self._getTable()
+        logid = self._logid(key)
+        mastername = self.master.getMasterName()
+        now = int(time.time())
+        conn = self._getEngine().connect()
+        try:
+            transaction = conn.begin()
+            conn.execute(tbl.delete(
+                (tbl.c.logid == logid) & (tbl.c.stream == stream) &
+                tbl.c.seq.in_([c[0] for c in chunks])))
+            conn.execute(tbl.insert(), [
+                dict(logid=logid, mastername=mastername,
+                     buildername=key[0], buildnumber=key[1],
+                     stream=stream, seq=seq, length=length,
+                     written_at=now, content=data)
+                for seq, length, data in chunks])
+            transaction.commit()
+        finally:
+            conn.close()
+
+    def _getChunks(self, key, stream, first, last):
+        tbl = self._getTable()
+        q = sa.select([tbl.c.seq, tbl.c.length, tbl.c.content],
+                      whereclause=((tbl.c.logid == self._logid(key)) &
+                                   (tbl.c.stream == stream) &
+                                   (tbl.c.seq >= first) &
+                                   (tbl.c.seq <= last)),
+                      order_by=[tbl.c.seq])
+        conn = self._getEngine().connect()
+        try:
+            return [(row.seq, row.length, str(row.content))
+                    for row in conn.execute(q).fetchall()]
+        finally:
+            conn.close()
+
+    def _getLastChunk(self, key, stream):
+        tbl = self._getTable()
+        q = sa.select([tbl.c.seq, tbl.c.length, tbl.c.written_at],
+                      whereclause=((tbl.c.logid == self._logid(key)) &
+                                   (tbl.c.stream == stream)),
+                      order_by=[sa.desc(tbl.c.seq)], limit=1)
+        conn = self._getEngine().connect()
+        try:
+            row = conn.execute(q).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return row.seq, row.length, row.written_at
+
+    def _deleteLog(self, key, streams):
+        tbl = self._getTable()
+        conn = self._getEngine().connect()
+        try:
+            conn.execute(tbl.delete((tbl.c.logid == self._logid(key)) &
+                                    tbl.c.stream.in_(list(streams))))
+        finally:
+            conn.close()
+
+    def _deleteLogs(self, buildername, earliest, keep):
+        tbl = self._getTable()
+        whereclause = ((tbl.c.buildername == buildername) &
+                       (tbl.c.buildnumber < earliest) &
+                       (tbl.c.mastername == self.master.getMasterName()))
+        if keep:
+            whereclause &= ~tbl.c.buildnumber.in_(list(keep))
+        conn = self._getEngine().connect()
+        try:
+            res = conn.execute(tbl.delete(whereclause))
+            if res.rowcount:
+                log.msg("pruned %d log chunks of builder %s"
+                        % (res.rowcount, buildername))
+        finally:
+            conn.close()
+
+
+class DirectoryChunkStore(ChunkStore):
+
+    """
+    Store each chunk as a separate file under C{basedir}, which is relative
+    to the master's base directory.  The files are named like the objects of
+    an object store, C{$master/$builder/$buildnumber/$logname/$stream-$seq},
+    and are written whole, so this is a stand-in for one on a shared
+    filesystem.
+    """
+
+    def __init__(self, basedir='logchunks'):
+        ChunkStore.__init__(self)
+        self.basedir = basedir
+
+    def _getBasedir(self):
+        return os.path.join(self.master.basedir, self.basedir,
+                            safeTranslate(self.master.getMasterName()))
+
+    def _getBuilderDir(self, buildername):
+        return os.path.join(self._getBasedir(), safeTranslate(buildername))
+
+    def _getLogDir(self, key):
+        return os.path.join(self._getBuilderDir(key[0]), str(key[1]), key[2])
+
+    def _getPath(self, key, stream, seq):
+        return os.path.join(self._getLogDir(key), "%d-%08d" % (stream, seq))
+
+    def _putChunks(self, key, stream, chunks):
+        dirname = self._getLogDir(key)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        for seq, length, data in chunks:
+            path = self._getPath(key, stream, seq)
+            # the length of the data goes in the name of the temporary
+            # file, so that a chunk only appears once it is complete
+            with open(path + ".tmp", "wb") as f:
+                f.write("%d\n" % length)
+                f.write(data)
+            if runtime.platformType == 'win32' and os.path.exists(path):
+                os.unlink(path)
+            os.rename(path + ".tmp", path)
+
+    def _readChunk(self, key, stream, seq):
+        with open(self._getPath(key, stream, seq), "rb") as f:
+            length = int(f.readline())
+            return seq, length, f.read()
+
+    def _getChunks(self, key, stream, first, last):
+        chunks = []
+        for seq in xrange(first, last + 1):
+            try:
+                chunks.append(self._readChunk(key, stream, seq))
+            except IOError:
+                break
+        return chunks
+
+    def _getLastChunk(self, key, stream):
+        prefix = "%d-" % stream
+        try:
+            names = [n for n in os.listdir(self._getLogDir(key))
+                     if n.startswith(prefix) and not n.endswith(".tmp")]
+        except OSError:
+            return None
+        if not names:
+            return None
+        seq = max([int(n[len(prefix):]) for n in names])
+        seq, length, _ = self._readChunk(key, stream, seq)
+        mtime = os.path.getmtime(self._getPath(key, stream, seq))
+        return seq, length, mtime
+
+    def _deleteLog(self, key, streams):
+        logdir = self._getLogDir(key)
+        try:
+            names = os.listdir(logdir)
+        except OSError:
+            return
+        prefixes = tuple(["%d-" % stream for stream in streams])
+        for name in names:
+            if name.startswith(prefixes):
+                os.unlink(os.path.join(logdir, name))
+
+    def _deleteLogs(self, buildername, earliest, keep):
+        builderdir = self._getBuilderDir(buildername)
+        if not os.path.exists(builderdir):
+            return
+        for name in os.listdir(builderdir):
+            if not name.isdigit() or int(name) >= earliest \
+                    or int(name) in keep:
+                continue
+            path = os.path.join(builderdir, name)
+            log.msg("pruning '%s'" % path)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class ChunkReader(object):
+
+    """
+    A read-only, seekable file object over a stream in a L{ChunkStore}.
+    A read fetches all of the chunks it needs that it does not have with
+    a single call to the store; the most recently read chunk is kept so
+    that sequential reads fetch each chunk once.
+    """
+
+    def __init__(self, store, key, stream, chunkSize, length=0):
+        self.store = store
+        self.key = key
+        self.stream = stream
+        self.chunkSize = chunkSize
+        self.length = length
+        self.pos = 0
+        self.cached = None
+        self.cachedData = None
+
+    def _getChunks(self, first, last):
+        # return a dictionary of the uncompressed chunks first to last
+        chunks = {}
+        if self.cached is not None and first <= self.cached <= last:
+            chunks[self.cached] = self.cachedData
+        wanted = [seq for seq in xrange(first, last + 1)
+                  if seq not in chunks]
+        if wanted:
+            for seq, length, data in self.store.getChunks(
+                    self.key, self.stream, wanted[0], wanted[-1]):
+                chunks[seq] = zlib.decompress(data)
+        return chunks
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.length
+        self.pos = max(offset, 0)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.length
+        if size >= 0:
+            end = min(self.pos + size, end)
+        if self.pos >= end:
+            return ""
+        first = self.pos // self.chunkSize
+        last = (end - 1) // self.chunkSize
+        chunks = self._getChunks(first, last)
+        pieces = []
+        for seq in xrange(first, last + 1):
+            data = chunks.get(seq)
+            if data is None:
+                raise IOError("chunk %d of %r is missing" % (seq, self.key))
+            start = self.pos - seq * self.chunkSize
+            piece = data[start:start + end - self.pos]
+            pieces.append(piece)
+            self.pos += len(piece)
+        self.cached, self.cachedData = last, chunks[last]
+        return "".join(pieces)
+
+    def close(self):
+        self.cached = self.cachedData = None
+
+
+class ChunkWriter(ChunkReader):
+
+    """
+    A file object that stores a new stream in a L{ChunkStore}.  Like a file
+    opened for appending, writes go to the end, whatever the position, and
+    leave the position there.  Complete chunks are compressed and
+    queued to be stored in batches of C{batchSize}; until then, and for the
+    incomplete last chunk, reads are served from memory.  L{flush} and
+    L{close} queue everything that has been written.
+    """
+
+    def __init__(self, store, key, stream, chunkSize, batchSize):
+        ChunkReader.__init__(self, store, key, stream, chunkSize)
+        self.batchSize = batchSize
+        self.pending = {}
+        self.tail = []
+        self.tailLength = 0
+
+    def _getChunks(self, first, last):
+        chunks = {}
+        stored = []
+        tailSeq = self.length // self.chunkSize
+        for seq in xrange(first, last + 1):
+            if seq in self.pending:
+                chunks[seq] = self.pending[seq]
+            elif seq == tailSeq:
+                chunks[seq] = "".join(self.tail)
+            else:
+                stored.append(seq)
+        if stored:
+            chunks.update(ChunkReader._getChunks(self, stored[0],
+                                                 stored[-1]))
+        return chunks
+
+    def write(self, data):
+        # the kept chunk may be the incomplete one
+        self.cached = self.cachedData = None
+        while data:
+            # fill up the incomplete last chunk
+            size = min(len(data), self.chunkSize - self.tailLength)
+            self.tail.append(data[:size])
+            self.tailLength += size
+            self.length += size
+            data = data[size:]
+            if self.tailLength == self.chunkSize:
+                seq = self.length // self.chunkSize - 1
+                self.pending[seq] = "".join(self.tail)
+                self.tail = []
+                self.tailLength = 0
+        self.pos = self.length
+        if len(self.pending) >= self.batchSize:
+            self._store(self.pending.items())
+
+    def _store(self, chunks):
+        if not chunks:
+            return
+        chunks.sort()
+        self.store.putChunks(self.key, self.stream,
+                             [(seq, len(data), zlib.compress(data))
+                              for seq, data in chunks])
+        for seq, _ in chunks:
+            self.pending.pop(seq, None)
+
+    def flush(self):
+        chunks = self.pending.items()
+        if self.tailLength:
+            chunks.append((self.length // self.chunkSize,
+                           "".join(self.tail)))
+        elif not self.length:
+            # store an empty chunk, so that an empty log still exists
+            chunks.append((0, ""))
+        self._store(chunks)
+
+    def close(self):
+        self.flush()
+        ChunkReader.close(self)
+
+
+class ChunkedLogStorage(LogStorage):
+
+    """
+    Store logs as compressed chunks of C{chunkSize} bytes in C{store}, which
+    is a L{ChunkStore}, by default the master's database.  Chunks are
+    written in batches of C{batchSize}, reads fetch only the chunks they
+    need, and L{pruneLogs} deletes old logs in bulk.
+
+    Logs that are not in the store, such as those written before this
+    storage was configured, are read from files as L{FileLogStorage} would.
+    """
+
+    chunkSize = 32 * 1024
+    batchSize = 8
+
+    def __init__(self, store=None, chunkSize=None, batchSize=None):
+        if store is None:
+            store = DBChunkStore()
+        self.store = store
+        if chunkSize is not None:
+            self.chunkSize = chunkSize
+        if batchSize is not None:
+            self.batchSize = batchSize
+        self.files = FileLogStorage()
+
+    def setMaster(self, master):
+        LogStorage.setMaster(self, master)
+        self.store.setMaster(master)
+        self.files.setMaster(master)
+
+    def _getKey(self, logfile):
+        build = logfile.step.build
+        return (build.builder.name, build.number, logfile.filename)
+
+    def _getReader(self, logfile, stream):
+        key = self._getKey(logfile)
+        last = self.store.getLastChunk(key, stream)
+        if last is None:
+            return None
+        seq, length, _ = last
+        return ChunkReader(self.store, key, stream, self.chunkSize,
+                           seq * self.chunkSize + length)
+
+    def openLog(self, logfile):
+        key = self._getKey(logfile)
+        # a log of a build with the same number may be stored already, e.g.,
+        # if the master stopped before saving the build's number
+        self.store.deleteLog(key)
+        return (ChunkWriter(self.store, key, DATA, self.chunkSize,
+                            self.batchSize),
+                ChunkWriter(self.store, key, INDEX, self.chunkSize,
+                            self.batchSize))
+
+    def getLogFile(self, logfile):
+        reader = self._getReader(logfile, DATA)
+        if reader is None:
+            return self.files.getLogFile(logfile)
+        return reader
+
+    def getIndexFile(self, logfile):
+        if logfile.openindex:
+            return logfile.openindex
+        if self.store.getLastChunk(self._getKey(logfile), DATA) is None:
+            return self.files.getIndexFile(logfile)
+        return self._getReader(logfile, INDEX)
+
+    def isIndexCurrent(self, logfile, length):
+        if logfile.openfile:
+            return True
+        last = self.store.getLastChunk(self._getKey(logfile), DATA)
+        if last is None:
+            return self.files.isIndexCurrent(logfile, length)
+        return length == last[0] * self.chunkSize + last[1]
+
+    def saveIndex(self, logfile, data):
+        if self.store.getLastChunk(self._getKey(logfile), DATA) is None:
+            return self.files.saveIndex(logfile, data)
+        key = self._getKey(logfile)
+        # the old index may be longer
+        self.store.deleteLog(key, [INDEX])
+        writer = ChunkWriter(self.store, key, INDEX, self.chunkSize,
+                             self.batchSize)
+        writer.write(data)
+        writer.close()
+
+    def hasLog(self, logfile):
+        if logfile.openfile:
+            return True
+        return self.store.getLastChunk(self._getKey(logfile), DATA) \
+            is not None or self.files.hasLog(logfile)
+
+    def loadLogs(self, logfiles, contents=False):
+        # running logs are read from memory
+        return self.store.loadLogs([self._getKey(logfile)
+                                    for logfile in logfiles
+                                    if not logfile.openfile], contents)
+
+    def getSize(self, logfile):
+        if logfile.openfile:
+            return logfile.openfile.length
+        reader = self._getReader(logfile, DATA)
+        if reader is None:
+            return self.files.getSize(logfile)
+        return reader.length
+
+    def getModificationTime(self, logfile):
+        last = self.store.getLastChunk(self._getKey(logfile), DATA)
+        if last is None:
+            return self.files.getModificationTime(logfile)
+        return last[2]
+
+    def compressLog(self, logfile):
+        # chunks are compressed as they are stored
+        return defer.succeed(None)
+
+    def pruneLogs(self, builder, earliest, keep=()):
+        return self.store.deleteLogs(builder.name, earliest, keep)
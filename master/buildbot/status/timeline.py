@@ -0,0 +1,334 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+An in-memory timeline of what each builder has done, from which the
+waterfall is rendered.
+
+The timeline holds the start time of every build and build step it knows
+about, in order, along with indexes of the builds by branch, committer and
+project.  Running builds are added as status notifications arrive; older
+builds are read from the builder's build summaries, a batch at a time, the
+first time a page reaches back that far.  Rendering a page then only looks
+at the slice of the timeline the page covers, and only loads the builds
+that appear on it.
+"""
+
+import bisect
+
+from buildbot import interfaces
+from buildbot.status import base
+from zope.interface import implements
+
+
+class BuilderTimeline(object):
+
+    """The timeline of a single builder.
+
+    I provide L{IEventSource}, like the L{BuilderStatus} I follow, but my
+    event generator also accepts C{maxTime}, and skips straight to the
+    events that started at or before it."""
+
+    implements(interfaces.IEventSource)
+
+    # number of builds read from the build summaries at a time
+    backfillSize = 50
+
+    # at most this many of the newest builds are kept; older builds are read
+    # from the build summaries again if a page reaches back that far
+    maxBuilds = 500
+
+    def __init__(self, builder_status):
+        self.builder_status = builder_status
+        # start times, and the (build number, step index) started at each;
+        # a step index of None stands for the build itself
+        self.starts = []
+        self.entries = []
+        self.steps = {}
+        self.branches = {}
+        self.committers = {}
+        self.projects = {}
+        # builds that have been pruned since they were added
+        self.gone = set()
+        # the oldest build number read from history so far
+        self.oldest = builder_status.nextBuildNumber
+        self.backfilled = False
+
+        for build in builder_status.getCurrentBuilds():
+            self.addBuild(build)
+
+    def _insert(self, start, entry, before):
+        # a build goes before any steps that started at the same time, so
+        # that its steps come out first when walking backwards in time
+        if before:
+            i = bisect.bisect_left(self.starts, start)
+        else:
+            i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.entries.insert(i, entry)
+
+    def _index(self, index, key, number):
+        index.setdefault(key, set()).add(number)
+
+    def addBuild(self, build):
+        """Add BUILD, a L{BuildStatus} or L{BuildSummary}, and any of its
+        steps that have started."""
+        number = build.getNumber()
+        if number in self.steps:
+            return
+        started = build.getTimes()[0]
+        if started is None:
+            return
+        self.steps[number] = set()
+        self._insert(started, (number, None), True)
+
+        for ss in build.getSourceStamps():
+            self._index(self.branches, ss.branch, number)
+        for change in build.getChanges():
+            self._index(self.committers, change.who, number)
+        self._index(self.projects, build.getProperty('project'), number)
+
+        for i, step in enumerate(build.getSteps()):
+            self._addStep(number, i, step)
+
+    def _addStep(self, number, i, step):
+        started = step.getTimes()[0]
+        if started is None or i in self.steps[number]:
+            return
+        self.steps[number].add(i)
+        self._insert(started, (number, i), False)
+
+    def addStep(self, build, step):
+        """Add STEP, which has just started in the running BUILD."""
+        number = build.getNumber()
+        if number not in self.steps:
+            # this adds the step, too
+            self.addBuild(build)
+            return
+        self._addStep(number, build.getSteps().index(step), step)
+
+    def backfill(self):
+        """Read the next batch of older builds from the builder's history.
+        Returns false once there are no more."""
+        if self.backfilled:
+            return False
+        builder_status = self.builder_status
+        newest = builder_status.nextBuildNumber - 1
+        count = 0
+        while count < self.backfillSize:
+            number = self.oldest - 1
+            if number < 0:
+                self.backfilled = True
+                break
+            self.oldest = number
+            if number in self.steps:
+                continue
+            build = builder_status.getBuildSummary(number)
+            if build is None:
+                # the newest build may be in progress but not yet saved;
+                # anything else means the rest of the history is gone
+                if number == newest:
+                    continue
+                self.backfilled = True
+                break
+            self.addBuild(build)
+            count += 1
+        return count > 0 or not self.backfilled
+
+    def prune(self):
+        """Forget the builds older than the builder's C{buildHorizon}, and
+        those beyond the newest C{maxBuilds}.  Builds are forgotten a batch
+        at a time, so that this is cheap to call as each build finishes."""
+        builder_status = self.builder_status
+        nextBuildNumber = builder_status.nextBuildNumber
+        earliest = nextBuildNumber - self.maxBuilds
+        buildHorizon = builder_status.master.config.buildHorizon
+        if buildHorizon is not None:
+            earliest = max(earliest, nextBuildNumber - buildHorizon)
+        # every build in the timeline is at least self.oldest
+        if earliest - self.oldest < self.backfillSize:
+            return
+
+        keep = [i for i, (number, step) in enumerate(self.entries)
+                if number >= earliest]
+        self.starts = [self.starts[i] for i in keep]
+        self.entries = [self.entries[i] for i in keep]
+        for number in self.steps.keys():
+            if number < earliest:
+                del self.steps[number]
+        for index in (self.branches, self.committers, self.projects):
+            for key, numbers in index.items():
+                numbers.intersection_update(self.steps)
+                if not numbers:
+                    del index[key]
+        self.gone.intersection_update(self.steps)
+        # anything older that is still on disk can be read back in
+        self.oldest = earliest
+        self.backfilled = False
+
+    def _filter(self, branches, committers, projects):
+        # return the set of build numbers passing the filters, or None if
+        # there are no filters
+        allowed = None
+        for index, keys in ((self.branches, branches),
+                            (self.committers, committers),
+                            (self.projects, projects)):
+            if not keys:
+                continue
+            matching = set()
+            for key in keys:
+                matching.update(index.get(key, ()))
+            if allowed is None:
+                allowed = matching
+            else:
+                allowed &= matching
+        return allowed
+
+    def _top(self, maxTime):
+        # the index of the newest entry that started no later than maxTime
+        if maxTime is None:
+            return len(self.starts) - 1
+        return bisect.bisect_right(self.starts, maxTime) - 1
+
+    def eventGenerator(self, branches=[], categories=[], committers=[],
+                       projects=[], minTime=0, maxTime=None):
+        builder_status = self.builder_status
+        showBuilds = (not categories or
+                      builder_status.getCategory() in categories)
+        allowed = self._filter(branches, committers, projects)
+        events = list(builder_status.events)
+        eventIndex = len(events) - 1
+        if maxTime is not None:
+            while eventIndex >= 0 and events[eventIndex].started > maxTime:
+                eventIndex -= 1
+        i = self._top(maxTime)
+        lastStart = None
+        builds = {}
+
+        while showBuilds:
+            if i < 0:
+                if not self.backfill():
+                    break
+                # the batch went in below the entries seen so far, moving
+                # them up; carry on after the last one
+                if lastStart is None:
+                    i = self._top(maxTime)
+                else:
+                    i = bisect.bisect_left(self.starts, lastStart) - 1
+                allowed = self._filter(branches, committers, projects)
+                continue
+
+            start = lastStart = self.starts[i]
+            number, step = self.entries[i]
+            i -= 1
+            if start < minTime:
+                break
+            if number in self.gone:
+                continue
+            if allowed is not None and number not in allowed:
+                continue
+
+            if number not in builds:
+                builds[number] = builder_status.getBuild(number)
+                if builds[number] is None:
+                    self.gone.add(number)
+                    continue
+            build = builds[number]
+            if step is not None:
+                steps = build.getSteps()
+                if step >= len(steps):
+                    continue
+                build = steps[step]
+
+            while eventIndex >= 0 and events[eventIndex].started > start:
+                yield events[eventIndex]
+                eventIndex -= 1
+            yield build
+
+        while eventIndex >= 0:
+            e = events[eventIndex]
+            if e.started < minTime:
+                break
+            yield e
+            eventIndex -= 1
+
+
+class WaterfallTimeline(base.StatusReceiverService):
+
+    """I keep a L{BuilderTimeline} for each builder, up to date with the
+    builds and steps started since the master started."""
+
+    def __init__(self, status):
+        self.status = status
+        self.builders = {}
+
+    def startService(self):
+        base.StatusReceiverService.startService(self)
+        self.status.subscribe(self)
+
+    def stopService(self):
+        self.status.unsubscribe(self)
+        for timeline in self.builders.itervalues():
+            builder_status = timeline.builder_status
+            if self in builder_status.watchers:
+                builder_status.unsubscribe(self)
+            for build in builder_status.getCurrentBuilds():
+                build.unsubscribe(self)
+        self.builders = {}
+        return base.StatusReceiverService.stopService(self)
+
+    def getBuilderTimeline(self, builder_status):
+        """Return the L{BuilderTimeline} of BUILDER_STATUS, or None if the
+        builder has not been announced to me (yet), in which case its
+        events must come from the builder itself."""
+        timeline = self.builders.get(builder_status.getName())
+        if timeline is None or timeline.builder_status is not builder_status:
+            return None
+        return timeline
+
+    # IStatusReceiver methods
+
+    def builderAdded(self, builderName, builder):
+        self.builders[builderName] = BuilderTimeline(builder)
+        for build in builder.getCurrentBuilds():
+            build.subscribe(self)
+        return self
+
+    def builderRemoved(self, builderName):
+        self.builders.pop(builderName, None)
+
+    def buildStarted(self, builderName, build):
+        timeline = self.builders.get(builderName)
+        if timeline is not None:
+            timeline.addBuild(build)
+        # subscribe to the build's steps
+        return self
+
+    def stepStarted(self, build, step):
+        timeline = self.builders.get(build.getBuilder().getName())
+        if timeline is not None:
+            timeline.addStep(build, step)
+
+    def stepFinished(self, build, step, results):
+        # a step is normally added when it starts; this catches steps that
+        # started before we subscribed to the build
+        self.stepStarted(build, step)
+
+    def buildFinished(self, builderName, build, results):
+        build.unsubscribe(self)
+        # the builder prunes its history next, so follow suit
+        timeline = self.builders.get(builderName)
+        if timeline is not None:
+            timeline.prune()
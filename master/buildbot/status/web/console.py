@@ -143,6 +143,14 @@ class ConsoleStatusResource(HtmlResource):
 
         return build
 
+    def getPreviousBuildSummary(self, builder, build):
+        """Get the summary of the build preceding the given build (or
+        summary), so that walking back through history does not load builds
+        that will be skipped anyway."""
+        if build.getNumber() == 0:
+            return None
+        return builder.getBuildSummary(build.getNumber() - 1)
+
     def fetchChangesFromHistory(self, status, max_depth, max_builds, debugInfo):
         """Look at the history of the builders and try to fetch as many changes
         as possible. We need this when the main source does not contain enough
@@ -168,9 +176,12 @@ class ConsoleStatusResource(HtmlResource):
             while build and depth < max_depth and build_count < max_builds:
                 depth += 1
                 build_count += 1
-                sourcestamp = build.getSourceStamps()[0]
-                allChanges.extend(sourcestamp.changes[:])
-                build = build.getPreviousBuild()
+                if build.getChanges():
+                    full = builder.getBuild(build.getNumber())
+                    if full is not None:
+                        sourcestamp = full.getSourceStamps()[0]
+                        allChanges.extend(sourcestamp.changes[:])
+                build = self.getPreviousBuildSummary(builder, build)
 
         debugInfo["source_fetch_len"] = len(allChanges)
         return allChanges
@@ -248,12 +259,14 @@ class ConsoleStatusResource(HtmlResource):
             # With multiple codebases cannot determine the last required build,
             # so take them all except forced builds.
             if len(build.getChanges()):
-                details = self.getBuildDetails(request, builderName, build)
-                devBuild = DevBuild(build, details)
-                builds.append(devBuild)
-                number += 1
-
-            build = build.getPreviousBuild()
+                full = builder.getBuild(build.getNumber())
+                if full is not None:
+                    details = self.getBuildDetails(request, builderName, full)
+                    devBuild = DevBuild(full, details)
+                    builds.append(devBuild)
+                    number += 1
+
+            build = self.getPreviousBuildSummary(builder, build)
 
         return builds
 
@@ -123,7 +123,9 @@ class GridStatusMixin(object):
         """
         get a list of most recent builds on given builder
         """
-        build = builder.getBuild(-1)
+        # walk the builder's summary index, and only load the builds that
+        # are actually going to be displayed
+        build = builder.getBuildSummary(-1)
         num = 0
         while build and num < numBuilds:
             start = build.getTimes()[0]
@@ -141,10 +143,14 @@ class GridStatusMixin(object):
                 okay_build = False
 
             if okay_build:
-                num += 1
-                yield build
-
-            build = build.getPreviousBuild()
+                full = builder.getBuild(build.getNumber())
+                if full is not None:
+                    num += 1
+                    yield full
+
+            if build.getNumber() == 0:
+                break
+            build = builder.getBuildSummary(build.getNumber() - 1)
         return
 
     def getRecentSourcestamps(self, status, numBuilds, categories, branch):
@@ -14,8 +14,13 @@
 # Copyright Buildbot Team Members
 
 
+import hashlib
+import re
+
+from twisted.internet.interfaces import IPushProducer
 from twisted.python import components
 from twisted.spread import pb
+from twisted.web import http
 from twisted.web import server
 from twisted.web.resource import NoResource
 from twisted.web.resource import Resource
@@ -26,9 +31,35 @@ from buildbot.status import logfile
 from buildbot.status.web.base import HtmlResource
 from buildbot.status.web.base import IHTMLLog
 from buildbot.status.web.base import path_to_root
+from buildbot.util import json
 from buildbot.util.ansicodes import parse_ansi_sgr
 
 
+def renderLoaded(log, req, render):
+    """
+    Render a request for a log with C{render(req)}, once whatever the log
+    needs has been fetched from its storage, so that reading it does not
+    block.  Logs that are not stored get a 404.
+    """
+    d = logfile.loadLogs([log], contents=True)
+
+    def rendered(_):
+        if log.hasContents():
+            data = render(req)
+        else:
+            data = NoResource("Empty Log '%s'" % log.getName()).render(req)
+        if data is not server.NOT_DONE_YET:
+            req.write(data)
+            req.finish()
+    d.addCallback(rendered)
+
+    def fail(f):
+        req.processingFailed(f)
+        return None  # processingFailed will log this for us
+    d.addErrback(fail)
+    return server.NOT_DONE_YET
+
+
 class ChunkConsumer:
     implements(interfaces.IStatusLogConsumer)
 
@@ -55,6 +86,206 @@ class ChunkConsumer:
     def finish(self):
         self.textlog.finished()
 
+
+class SliceProducer:
+
+    """
+    Feed the chunks of part of a log, as returned by one of the
+    L{buildbot.status.logfile.LogFile} range methods, to a ChunkConsumer.
+    Unlike L{buildbot.status.logfile.LogFileProducer}, this does not follow
+    the log once those chunks have been written.
+    """
+    implements(IPushProducer)
+
+    paused = False
+
+    def __init__(self, chunks, consumer):
+        self.chunks = iter(chunks)
+        self.consumer = consumer
+        consumer.registerProducer(self, True)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        while not self.paused and self.consumer:
+            try:
+                chunk = self.chunks.next()
+            except StopIteration:
+                consumer, self.consumer = self.consumer, None
+                consumer.unregisterProducer()
+                consumer.finish()
+                return
+            self.consumer.writeChunk(chunk)
+
+    def stopProducing(self):
+        self.consumer = None
+
+
+class LogFanout:
+
+    """
+    Relay the chunks added to a running log to every client streaming it,
+    so that however many clients there are, the log has a single entry in
+    its C{watchers} list.  Use L{get} to find the fan-out for a log; it
+    unsubscribes when its last client goes away or the log finishes.
+    """
+
+    fanouts = {}
+
+    def __init__(self, log):
+        self.log = log
+        self.clients = []
+        log.subscribe(self, False)
+        log.waitUntilFinished().addCallback(self._logFinished)
+
+    @classmethod
+    def get(cls, log):
+        if log not in cls.fanouts:
+            cls.fanouts[log] = cls(log)
+        return cls.fanouts[log]
+
+    def addClient(self, client):
+        self.clients.append(client)
+
+    def removeClient(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        if not self.clients:
+            self._close()
+
+    def _close(self):
+        self.log.unsubscribe(self)
+        if self.fanouts.get(self.log) is self:
+            del self.fanouts[self.log]
+
+    def logChunk(self, build, step, log, channel, text):
+        for client in self.clients[:]:
+            client.logChunk(channel, text)
+
+    def _logFinished(self, log):
+        clients, self.clients = self.clients, []
+        self._close()
+        for client in clients:
+            client.logFinished()
+
+
+class LogEventStream(Resource):
+
+    """
+    Send a log as a stream of server-sent events, following it until it
+    finishes.  Each chunk is an event named after its channel, whose data
+    is the chunk's text as a JSON string and whose id is the offset,
+    counting all channels, just after it.  A client can resume a broken
+    stream from such an offset, using either the C{Last-Event-ID} header
+    or the C{offset} argument.
+    """
+    # like TextLog, there is an instance of this for each client
+
+    req = None
+    producer = None
+    fanout = None
+    live = False
+    logDone = False
+
+    def __init__(self, original):
+        Resource.__init__(self)
+        self.original = original
+        self.pending = []
+
+    def render(self, req):
+        return renderLoaded(self.original, req,
+                            lambda req: Resource.render(self, req))
+
+    def render_GET(self, req):
+        offset = req.getHeader("last-event-id")
+        if offset is None and "offset" in req.args:
+            offset = req.args["offset"][0]
+        try:
+            self.offset = max(int(offset or 0), 0)
+        except ValueError:
+            req.setResponseCode(http.BAD_REQUEST)
+            req.setHeader("content-type", "text/plain; charset=utf-8")
+            return "offset must be a number of bytes"
+
+        req.setHeader("content-type", "text/event-stream")
+        req.setHeader("cache-control", "no-cache")
+        self.req = req
+        req.notifyFinish().addErrback(self._disconnected)
+
+        # the catch-up stops at the end of the log as it is now, and the
+        # fan-out relays everything added from here on, so nothing is missed
+        # or repeated
+        end = self.original.getChannelTextLength()
+        chunks = self.original.getChunksForRange(self.offset, end)
+        if self.original.isFinished():
+            self.logDone = True
+        else:
+            self.fanout = LogFanout.get(self.original)
+            self.fanout.addClient(self)
+
+        self.producer = SliceProducer(chunks, self)
+        self.producer.resumeProducing()
+        return server.NOT_DONE_YET
+
+    # the consumer interface used by SliceProducer for the catch-up
+
+    def registerProducer(self, producer, streaming):
+        self.req.registerProducer(producer, streaming)
+
+    def unregisterProducer(self):
+        self.req.unregisterProducer()
+
+    def writeChunk(self, chunk):
+        self._sendEvent(*chunk)
+
+    def finish(self):
+        self.producer = None
+        pending, self.pending = self.pending, None
+        for channel, text in pending:
+            self._sendEvent(channel, text)
+        self.live = True
+        if self.logDone:
+            self._finishStream()
+
+    # called by LogFanout
+
+    def logChunk(self, channel, text):
+        if self.live:
+            self._sendEvent(channel, text)
+        else:
+            self.pending.append((channel, text))
+
+    def logFinished(self):
+        self.fanout = None
+        self.logDone = True
+        if self.live:
+            self._finishStream()
+
+    def _sendEvent(self, channel, text):
+        self.offset += len(text)
+        if not self.req or not 0 <= channel < len(logfile.ChunkTypes):
+            return
+        data = json.dumps(unicode(text, 'utf-8', 'replace'))
+        self.req.write("id: %d\nevent: %s\ndata: %s\n\n"
+                       % (self.offset, logfile.ChunkTypes[channel], data))
+
+    def _finishStream(self):
+        req, self.req = self.req, None
+        if req:
+            req.write("event: finished\ndata: \n\n")
+            req.finish()
+
+    def _disconnected(self, why):
+        self.req = None
+        if self.producer:
+            self.producer.stopProducing()
+            self.producer = None
+        if self.fanout:
+            self.fanout.removeClient(self)
+            self.fanout = None
+
 # /builders/$builder/builds/$buildnum/steps/$stepname/logs/$logname
 
 
@@ -70,10 +301,16 @@ class TextLog(Resource):
         Resource.__init__(self)
         self.original = original
 
+    def render(self, req):
+        return renderLoaded(self.original, req,
+                            lambda req: Resource.render(self, req))
+
     def getChild(self, path, req):
         if path == "text":
             self.asText = True
             return self
+        if path == "events":
+            return LogEventStream(self.original)
         return Resource.getChild(self, path, req)
 
     def content(self, entries):
@@ -113,6 +350,8 @@ class TextLog(Resource):
 
     def render_HEAD(self, req):
         self._setContentType(req)
+        if self.original.isFinished() and self._setValidators(req):
+            return ''
 
         # vague approximation, ignores markup
         req.setHeader("content-length", self.original.length)
@@ -124,9 +363,20 @@ class TextLog(Resource):
 
         if self.original.isFinished():
             req.setHeader("Cache-Control", "max-age=604800")
+            if self._setValidators(req):
+                self.req = None
+                return ''
         else:
             req.setHeader("Cache-Control", "no-cache")
 
+        try:
+            chunks = self._getSlice(req)
+        except ValueError, e:
+            self.req = None
+            req.setResponseCode(http.BAD_REQUEST)
+            req.setHeader("content-type", "text/plain; charset=utf-8")
+            return str(e)
+
         if not self.asText:
             self.template = req.site.buildbot_service.templates.get_template("logs.html")
 
@@ -137,9 +387,92 @@ class TextLog(Resource):
             data = data.encode('utf-8')
             req.write(data)
 
-        self.original.subscribeConsumer(ChunkConsumer(req, self))
+        if chunks is None:
+            self.original.subscribeConsumer(ChunkConsumer(req, self))
+        else:
+            producer = SliceProducer(chunks, ChunkConsumer(req, self))
+            req.notifyFinish().addErrback(
+                lambda _: producer.stopProducing())
+            producer.resumeProducing()
         return server.NOT_DONE_YET
 
+    def _getETag(self):
+        # a finished log does not change, so its name and length identify it
+        if not self.original.isFinished():
+            return None
+        digest = hashlib.md5(self.original.getFilename()).hexdigest()
+        return '"%s-%d%s"' % (digest[:16], self.original.length,
+                              self.asText and "-text" or "")
+
+    def _setValidators(self, req):
+        # set ETag and Last-Modified for a finished log, and return true if
+        # the client's cached copy is still good
+        if req.setETag(self._getETag()) == http.CACHED:
+            return True
+        mtime = self.original.getModificationTime()
+        if mtime is not None:
+            if req.getHeader("if-none-match"):
+                # the entity tag takes precedence over the date
+                req.setHeader("last-modified", http.datetimeToString(mtime))
+            elif req.setLastModified(mtime) == http.CACHED:
+                return True
+        return False
+
+    def _getSlice(self, req):
+        """
+        Return the chunks for a request for part of the log, using the
+        C{tail} or C{lines} arguments or, for plain text, a C{Range}
+        header, or None to send the whole log.  Lines are numbered from 1,
+        and both ends of C{lines=a-b} are included.  Plain text counts only
+        stdout and stderr, since it leaves out the headers.
+        """
+        channels = []
+        if self.asText:
+            channels = [logfile.STDOUT, logfile.STDERR]
+            req.setHeader("accept-ranges", "bytes")
+
+        if "tail" in req.args:
+            try:
+                nlines = int(req.args["tail"][0])
+            except ValueError:
+                raise ValueError("tail must be a number of lines")
+            return self.original.getTail(max(nlines, 0), channels)
+
+        if "lines" in req.args:
+            mo = re.match(r"^(\d+)-(\d*)$", req.args["lines"][0])
+            if not mo or int(mo.group(1)) < 1:
+                raise ValueError("lines must be a range like 10-20 or 10-")
+            last = mo.group(2) and int(mo.group(2)) or None
+            return self.original.getChunksForChannelLines(
+                int(mo.group(1)) - 1, last, channels)
+
+        byterange = self.asText and req.getHeader("range")
+        ifrange = req.getHeader("if-range")
+        if ifrange and ifrange != self._getETag():
+            # the client's copy is out of date, so send all of the log
+            byterange = None
+        mo = byterange and re.match(r"^bytes=(\d*)-(\d*)$", byterange.strip())
+        if not mo or mo.groups() == ("", ""):
+            # no range, or several ranges, which we don't bother with
+            return None
+
+        length = self.original.getChannelTextLength(channels)
+        first, last = mo.groups()
+        if not first:
+            start, end = max(length - int(last), 0), length
+        else:
+            start = int(first)
+            end = last and min(int(last) + 1, length) or length
+        if start >= length or start >= end:
+            req.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            req.setHeader("content-range", "bytes */%d" % length)
+            return []
+        req.setResponseCode(http.PARTIAL_CONTENT)
+        req.setHeader("content-range",
+                      "bytes %d-%d/%d" % (start, end - 1, length))
+        req.setHeader("content-length", end - start)
+        return self.original.getChunksForChannelRange(start, end, channels)
+
     def _setContentType(self, req):
         if self.asText:
             req.setHeader("content-type", "text/plain; charset=utf-8")
@@ -191,7 +524,6 @@ class LogsResource(HtmlResource):
     def getChild(self, path, req):
         for log in self.step_status.getLogs():
             if path == log.getName():
-                if log.hasContents():
-                    return IHTMLLog(interfaces.IStatusLog(log))
-                return NoResource("Empty Log '%s'" % path)
+                # an empty log gets a 404 when it is rendered
+                return IHTMLLog(interfaces.IStatusLog(log))
         return HtmlResource.getChild(self, path, req)
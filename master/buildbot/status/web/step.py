@@ -17,12 +17,14 @@
 import urllib
 
 from buildbot import util
+from buildbot.status import logfile
 from buildbot.status.web.base import HtmlResource
 from buildbot.status.web.base import css_classes
 from buildbot.status.web.base import path_to_build
 from buildbot.status.web.base import path_to_builder
 from buildbot.status.web.logs import LogsResource
 from time import ctime
+from twisted.internet import defer
 
 # /builders/$builder/builds/$buildnum/steps/$stepname
 
@@ -36,10 +38,14 @@ class StatusResourceBuildStep(HtmlResource):
         self.status = build_status
         self.step_status = step_status
 
+    @defer.inlineCallbacks
     def content(self, req, cxt):
         s = self.step_status
         b = s.getBuild()
 
+        # find out which logs are stored without blocking
+        yield logfile.loadLogs(s.getLogs())
+
         logs = cxt['logs'] = []
         for l in s.getLogs():
             # FIXME: If the step name has a / in it, this is broken
@@ -74,7 +80,7 @@ class StatusResourceBuildStep(HtmlResource):
                         result_css=css_classes[s.getResults()[0]]))
 
         template = req.site.buildbot_service.templates.get_template("buildstep.html")
-        return template.render(**cxt)
+        defer.returnValue(template.render(**cxt))
 
     def getChild(self, path, req):
         if path == "logs":
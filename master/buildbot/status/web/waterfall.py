@@ -31,6 +31,8 @@ from buildbot.changes import changes
 from buildbot.status import build
 from buildbot.status import builder
 from buildbot.status import buildstep
+from buildbot.status import logfile
+from buildbot.status.timeline import WaterfallTimeline
 
 from buildbot.status.web.base import Box
 from buildbot.status.web.base import HtmlResource
@@ -375,6 +377,7 @@ class WaterfallStatusResource(HtmlResource):
         self.categories = categories
         self.num_events = num_events
         self.num_events_max = num_events_max
+        self.timeline = None
         self.putChild("help", WaterfallHelp(categories))
 
     def getPageTitle(self, request):
@@ -389,6 +392,14 @@ class WaterfallStatusResource(HtmlResource):
         # TODO: this wants to go away, access it through IStatus
         return request.site.buildbot_service.getChangeSvc()
 
+    def getTimeline(self, request):
+        # the timeline is kept up to date by status notifications from the
+        # first page view on, and stops with the WebStatus
+        if self.timeline is None:
+            self.timeline = WaterfallTimeline(self.getStatus(request))
+            self.timeline.setServiceParent(request.site.buildbot_service)
+        return self.timeline
+
     def get_reload_time(self, request):
         if "reload" in request.args:
             try:
@@ -507,6 +518,23 @@ class WaterfallStatusResource(HtmlResource):
         (changeNames, builderNames, timestamps, eventGrid, sourceEvents) = \
             self.buildGrid(request, builders, changes)
 
+        # the step boxes link to the logs that are stored, so find out
+        # which those are before drawing them, without blocking
+        logs = []
+        for event in sourceEvents + [e for row in eventGrid
+                                     for cell in row for e in cell]:
+            if isinstance(event, buildstep.BuildStepStatus):
+                logs.extend(event.getLogs())
+        d = logfile.loadLogs(logs)
+        d.addCallback(lambda _: self.content_with_grid(
+            changeNames, builderNames, timestamps, eventGrid, sourceEvents,
+            brcounts, request, ctx))
+        return d
+
+    def content_with_grid(self, changeNames, builderNames, timestamps,
+                          eventGrid, sourceEvents, brcounts, request, ctx):
+        status = self.getStatus(request)
+
         # start the table: top-header material
         locale_enc = locale.getdefaultlocale()[1]
         if locale_enc is not None:
@@ -576,7 +604,6 @@ class WaterfallStatusResource(HtmlResource):
 
     def buildGrid(self, request, builders, changes):
         debug = False
-        # TODO: see if we can use a cached copy
 
         showEvents = False
         if request.args.get("show_events", ["false"])[0].lower() == "true":
@@ -604,12 +631,14 @@ class WaterfallStatusResource(HtmlResource):
 
         # first step is to walk backwards in time, asking each column
         # (commit, all builders) if they have any events there. Build up the
-        # array of events, and stop when we have a reasonable number.
+        # array of events, and stop when we have a reasonable number.  The
+        # builders' events come from the timeline, which can skip straight
+        # to those before last_time.
 
         commit_source = ChangeEventSource(changes)
+        timeline = self.getTimeline(request)
 
         lastEventTime = util.now()
-        sources = [commit_source] + builders
         changeNames = ["changes"]
         builderNames = map(lambda builder: builder.getName(), builders)
         sourceNames = changeNames + builderNames
@@ -641,14 +670,22 @@ class WaterfallStatusResource(HtmlResource):
                 event = None
             return event
 
-        for s in sources:
-            gen = insertGaps(s.eventGenerator(filterBranches,
-                                              filterCategories,
-                                              filterCommitters,
-                                              filterProjects,
-                                              minTime),
-                             showEvents,
-                             lastEventTime)
+        filters = (filterBranches, filterCategories, filterCommitters,
+                   filterProjects, minTime)
+        generators = [commit_source.eventGenerator(*filters)]
+        sliceTime = None
+        if "last_time" in request.args:
+            sliceTime = maxTime
+        for b in builders:
+            source = timeline.getBuilderTimeline(b)
+            if source is None:
+                # a builder the timeline has not heard of yet
+                generators.append(b.eventGenerator(*filters))
+                continue
+            generators.append(source.eventGenerator(*filters,
+                                                    maxTime=sliceTime))
+        for g in generators:
+            gen = insertGaps(g, showEvents, lastEventTime)
             sourceGenerators.append(gen)
             # get the first event
             sourceEvents.append(get_event_from(gen))
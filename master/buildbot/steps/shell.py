@@ -16,6 +16,7 @@
 
 import inspect
 import re
+import tempfile
 
 from buildbot import config
 from buildbot.process import buildstep
@@ -134,6 +135,8 @@ class ShellCommand(buildstep.LoggingBuildStep):
         if invalid_args:
             config.error("Invalid argument(s) passed to RemoteShellCommand: "
                          + ', '.join(invalid_args))
+        if kwargs.get('outputBuffering') not in (None, 'adaptive', 'fixed'):
+            config.error("outputBuffering must be 'adaptive' or 'fixed'")
 
         # everything left over goes to the RemoteShellCommand
         kwargs['workdir'] = workdir  # including a copy of 'workdir'
@@ -256,6 +259,11 @@ class ShellCommand(buildstep.LoggingBuildStep):
             warnings.append("NOTE: slave does not allow master to specify interruptSignal\n")
             del kwargs['interruptSignal']
 
+        # check for the outputBuffering flag
+        if "outputBuffering" in kwargs and self.slaveVersionIsOlderThan("shell", "2.23"):
+            warnings.append("NOTE: slave does not allow master to specify outputBuffering\n")
+            del kwargs['outputBuffering']
+
         return kwargs
 
     def start(self):
@@ -391,6 +399,81 @@ class StringFileWriter(pb.Referenceable):
         pass
 
 
+class WarningCollector(object):
+
+    """
+    A list-like collection of warning lines that keeps at most C{maxSize}
+    bytes in memory, spilling to a temporary file beyond that.
+    """
+
+    def __init__(self, maxSize=1024 * 1024):
+        self.maxSize = maxSize
+        self.lines = []
+        self.size = 0
+        self.spill = None
+
+    def append(self, line):
+        if self.spill is None:
+            self.lines.append(line)
+            self.size += len(line) + 1
+            if self.size <= self.maxSize:
+                return
+            self.spill = tempfile.TemporaryFile()
+            lines, self.lines = self.lines, []
+        else:
+            lines = [line]
+        for line in lines:
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            self.spill.write(line + "\n")
+
+    def isSpilled(self):
+        return self.spill is not None
+
+    def getText(self):
+        """Return all of the lines, each terminated by a newline"""
+        return "".join(self.iterChunks())
+
+    def iterChunks(self, chunkSize=64 * 1024):
+        """Generate the text of all of the lines, in chunks"""
+        if self.spill is None:
+            if self.lines:
+                yield "\n".join(self.lines) + "\n"
+            return
+        self.spill.seek(0)
+        while True:
+            chunk = self.spill.read(chunkSize)
+            if not chunk:
+                break
+            yield chunk
+
+
+class WarningCountingLogObserver(logobserver.LogObserver):
+
+    """
+    Feeds the lines of a step's log to its warning scanner as they arrive.
+    Stdout and stderr are treated as a single stream, split only on
+    newlines, just as C{log.getText().split("\n")} would split them.
+    """
+
+    def __init__(self, scanLine):
+        self.scanLine = scanLine
+        self.partial = ""
+
+    def outReceived(self, data):
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.scanLine(line)
+
+    errReceived = outReceived
+
+    def finish(self):
+        # the text after the last newline is a line, too (even if empty)
+        line, self.partial = self.partial, ""
+        self.scanLine(line)
+
+
 class WarningCountingShellCommand(ShellCommand):
     renderables = ['suppressionFile']
 
@@ -401,6 +484,8 @@ class WarningCountingShellCommand(ShellCommand):
                              u"[\u2019\"`'](.*)[\u2019'`\"]")
     directoryLeavePattern = "make.*: Leaving directory"
     suppressionFile = None
+    # bytes of warning text to keep in memory before spilling to disk
+    warningsMemoryLimit = 1024 * 1024
 
     commentEmptyLineRe = re.compile(r"^\s*(\#.*)?$")
     suppressionLineRe = re.compile(r"^\s*(.+?)\s*:\s*(.+?)\s*(?:[:]\s*([0-9]+)(?:-([0-9]+))?\s*)?$")
@@ -408,7 +493,7 @@ class WarningCountingShellCommand(ShellCommand):
     def __init__(self,
                  warningPattern=None, warningExtractor=None, maxWarnCount=None,
                  directoryEnterPattern=None, directoryLeavePattern=None,
-                 suppressionFile=None, **kwargs):
+                 suppressionFile=None, streamWarnings=False, **kwargs):
         # See if we've been given a regular expression to use to match
         # warnings. If not, use a default that assumes any line with "warning"
         # present is a warning. This may lead to false positives in some cases.
@@ -432,6 +517,17 @@ class WarningCountingShellCommand(ShellCommand):
         self.suppressions = []
         self.directoryStack = []
 
+        # In streaming mode, lines are scanned as they arrive, rather than
+        # all at once in createSummary
+        self.streamWarnings = streamWarnings
+        self.warnings = None
+        self.warningObserver = None
+        self.streamFailure = None
+        if streamWarnings:
+            self.warningObserver = WarningCountingLogObserver(
+                self._scanStreamedLine)
+            self.addLogObserver('stdio', self.warningObserver)
+
     def addSuppression(self, suppressionList):
         """
         This method can be used to add patters of warnings that should
@@ -541,58 +637,90 @@ class WarningCountingShellCommand(ShellCommand):
         self.addSuppression(list)
         return ShellCommand.start(self)
 
-    def createSummary(self, log):
-        """
-        Match log lines against warningPattern.
-
-        Warnings are collected into another log for this step, and the
-        build-wide 'warnings-count' is updated."""
-
-        self.warnCount = 0
-
-        # Now compile a regular expression from whichever warning pattern we're
+    def _compilePatterns(self):
+        # compile regular expressions from whichever warning patterns we're
         # using
         wre = self.warningPattern
         if isinstance(wre, str):
             wre = re.compile(wre)
+        self._warningRe = wre
 
         directoryEnterRe = self.directoryEnterPattern
         if (directoryEnterRe is not None
                 and isinstance(directoryEnterRe, basestring)):
             directoryEnterRe = re.compile(directoryEnterRe)
+        self._directoryEnterRe = directoryEnterRe
 
         directoryLeaveRe = self.directoryLeavePattern
         if (directoryLeaveRe is not None
                 and isinstance(directoryLeaveRe, basestring)):
             directoryLeaveRe = re.compile(directoryLeaveRe)
+        self._directoryLeaveRe = directoryLeaveRe
+
+    def _scanLine(self, line, warnings):
+        # Check if the line matched our warnings regular expressions. If
+        # did, bump the warnings count and add the line to the collection of
+        # lines with warnings
+        if self._directoryEnterRe:
+            match = self._directoryEnterRe.search(line)
+            if match:
+                self.directoryStack.append(match.group(1))
+                return
+        if (self._directoryLeaveRe and
+            self.directoryStack and
+                self._directoryLeaveRe.search(line)):
+                self.directoryStack.pop()
+                return
 
-        # Check if each line in the output from this command matched our
-        # warnings regular expressions. If did, bump the warnings count and
-        # add the line to the collection of lines with warnings
-        warnings = []
-        # TODO: use log.readlines(), except we need to decide about stdout vs
-        # stderr
-        for line in log.getText().split("\n"):
-            if directoryEnterRe:
-                match = directoryEnterRe.search(line)
-                if match:
-                    self.directoryStack.append(match.group(1))
-                    continue
-            if (directoryLeaveRe and
-                self.directoryStack and
-                    directoryLeaveRe.search(line)):
-                    self.directoryStack.pop()
-                    continue
+        match = self._warningRe.match(line)
+        if match:
+            self.maybeAddWarning(warnings, line, match)
 
-            match = wre.match(line)
-            if match:
-                self.maybeAddWarning(warnings, line, match)
+    def _scanStreamedLine(self, line):
+        if self.streamFailure:
+            return
+        if self.warnings is None:
+            self._compilePatterns()
+            self.warnings = WarningCollector(self.warningsMemoryLimit)
+        try:
+            self._scanLine(line, self.warnings)
+        except Exception:
+            # don't disturb the log; report this from createSummary instead
+            self.streamFailure = failure.Failure()
+
+    def createSummary(self, log):
+        """
+        Match log lines against warningPattern.
+
+        Warnings are collected into another log for this step, and the
+        build-wide 'warnings-count' is updated."""
+
+        if self.streamWarnings:
+            # everything but the last line has been scanned already
+            self.warningObserver.finish()
+            if self.streamFailure:
+                self.streamFailure.raiseException()
+        else:
+            self.warnCount = 0
+            self._compilePatterns()
+            self.warnings = WarningCollector(self.warningsMemoryLimit)
+            # TODO: use log.readlines(), except we need to decide about
+            # stdout vs stderr
+            for line in log.getText().split("\n"):
+                self._scanLine(line, self.warnings)
 
         # If there were any warnings, make the log if lines with warnings
         # available
         if self.warnCount:
-            self.addCompleteLog("warnings (%d)" % self.warnCount,
-                                "\n".join(warnings) + "\n")
+            name = "warnings (%d)" % self.warnCount
+            if self.warnings.isSpilled():
+                loog = self.addLog(name)
+                for chunk in self.warnings.iterChunks():
+                    loog.addStdout(chunk)
+                loog.finish()
+            else:
+                self.addCompleteLog(name, self.warnings.getText())
+        self.warnings = None
 
         warnings_stat = self.step_status.getStatistic('warnings', 0)
         self.step_status.setStatistic('warnings', warnings_stat + self.warnCount)
@@ -16,15 +16,25 @@
 from __future__ import with_statement
 
 
+import Queue
 import os.path
+import shutil
 import stat
 import tarfile
 import tempfile
+import threading
+import time
 try:
     from cStringIO import StringIO
     assert StringIO
 except ImportError:
     from StringIO import StringIO
+try:
+    from hashlib import sha1
+    assert sha1
+except ImportError:
+    # For Python 2.4
+    from sha import new as sha1
 from buildbot import config
 from buildbot.interfaces import BuildSlaveTooOldError
 from buildbot.process import buildstep
@@ -33,9 +43,14 @@ from buildbot.process.buildstep import FAILURE
 from buildbot.process.buildstep import SKIPPED
 from buildbot.process.buildstep import SUCCESS
 from buildbot.util import json
+from buildbot.util import now
 from buildbot.util.eventual import eventually
 from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import threads
+from twisted.python import failure
 from twisted.python import log
+from twisted.python import runtime
 from twisted.spread import pb
 
 
@@ -57,6 +72,7 @@ class _FileWriter(pb.Referenceable):
         fd, self.tmpname = tempfile.mkstemp(dir=dirname)
         self.fp = os.fdopen(fd, 'wb')
         self.remaining = maxsize
+        self.nbytes = 0
 
     def remote_write(self, data):
         """
@@ -73,6 +89,7 @@ class _FileWriter(pb.Referenceable):
             self.remaining = self.remaining - len(data)
         else:
             self.fp.write(data)
+        self.nbytes += len(data)
 
     def remote_utime(self, accessed_modified):
         os.utime(self.destfile, accessed_modified)
@@ -139,6 +156,23 @@ def _extractall(self, path=".", members=None):
                 self._dbg(1, "tarfile: %s" % e)
 
 
+def _replacing(archive, path):
+    """
+    Iterate over the members of ARCHIVE, for extraction to PATH, deleting
+    each file that a member would overwrite first.  Files uploaded with
+    dedup are read-only hard links into the content store, which must be
+    replaced rather than written to.
+    """
+    for tarinfo in archive:
+        if not tarinfo.isdir():
+            target = os.path.join(path, tarinfo.name)
+            if os.path.islink(target) or os.path.isfile(target):
+                if runtime.platformType == 'win32':
+                    os.chmod(target, stat.S_IWRITE)
+                os.unlink(target)
+        yield tarinfo
+
+
 class _DirectoryWriter(_FileWriter):
 
     """
@@ -176,11 +210,409 @@ class _DirectoryWriter(_FileWriter):
 
         # Unpack archive and clean up after self
         archive = tarfile.open(name=self.tarname, mode=mode)
-        archive.extractall(path=self.destroot)
+        archive.extractall(path=self.destroot,
+                           members=_replacing(archive, self.destroot))
         archive.close()
         os.remove(self.tarname)
 
 
+class _DirectoryStreamWriter(pb.Referenceable):
+
+    """
+    Like L{_DirectoryWriter}, but extracts the archive in a thread while it
+    is being received, rather than writing it to a temporary file and
+    unpacking it at the end.
+
+    Each call to C{remote_write} returns a Deferred that fires once the
+    extracting thread has consumed the data, so a slow extraction holds back
+    the slave.
+
+    Each upload has a thread of its own, since the thread spends most of
+    its time waiting for data; taking threads from the reactor's pool would
+    let a few slow uploads starve everything else that uses it.
+    """
+
+    def __init__(self, destroot, maxsize, compress):
+        self.destroot = destroot
+        self.remaining = maxsize
+        self.nbytes = 0
+        if compress in ('bz2', 'gz'):
+            self.mode = 'r|' + compress
+        else:
+            self.mode = 'r|'
+
+        self.queue = Queue.Queue()
+        self.buf = ''
+        self.pos = 0
+        self.done = False
+        self.result = None
+        self.cancelled = False
+        self.waiters = []
+        thread = threading.Thread(target=self._run,
+                                  name='DirectoryUpload %s' % destroot)
+        # an upload abandoned by its slave must not keep the master running
+        thread.setDaemon(True)
+        thread.start()
+
+    # the extracting thread's side
+
+    def _run(self):
+        try:
+            self._extract()
+        except:
+            res = failure.Failure()
+        else:
+            res = None
+        reactor.callFromThread(self._extracted, res)
+
+    def _extract(self):
+        archive = tarfile.open(mode=self.mode, fileobj=self)
+        archive.extractall(path=self.destroot,
+                           members=_replacing(archive, self.destroot))
+        archive.close()
+
+    def read(self, size):
+        # called by tarfile, in the extracting thread
+        while len(self.buf) - self.pos < size:
+            item = self.queue.get()
+            if item is None:
+                # put it back for any later reads
+                self.queue.put(None)
+                break
+            data, d = item
+            reactor.callFromThread(d.callback, None)
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    # the reactor's side
+
+    def remote_write(self, data):
+        """
+        Called from remote slave to pass the next block of the archive
+
+        @type  data: C{string}
+        @param data: String of data to write
+        """
+        if self.done:
+            return self._result()
+        if self.remaining is not None:
+            data = data[:self.remaining]
+            self.remaining -= len(data)
+        self.nbytes += len(data)
+        d = defer.Deferred()
+        self.queue.put((data, d))
+        return d
+
+    def remote_unpack(self):
+        """
+        Called by remote slave to state that no more data will be transfered
+        """
+        self.queue.put(None)
+        if self.done:
+            return self._result()
+        d = defer.Deferred()
+        self.waiters.append(d)
+        return d
+
+    def _extracted(self, res):
+        self.done = True
+        self.result = res
+        if isinstance(res, failure.Failure) and not self.cancelled:
+            log.err(res, "while extracting an uploaded directory")
+        # anything the extraction did not read (padding at the end of the
+        # archive, or everything after an error) is answered now
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None:
+                self._result().chainDeferred(item[1])
+        waiters, self.waiters = self.waiters, []
+        for d in waiters:
+            self._result().chainDeferred(d)
+
+    def _result(self):
+        if isinstance(self.result, failure.Failure):
+            return defer.fail(self.result)
+        return defer.succeed(None)
+
+    def cancel(self):
+        # let the extraction end; whatever was extracted is left in place
+        self.cancelled = True
+        self.queue.put(None)
+
+
+class _ContentWriter(pb.Referenceable):
+
+    """
+    Receive a file or a directory from the slave, keeping file contents in a
+    content-addressed store so that content the master has seen before is
+    hard-linked into place rather than transferred again.
+
+    Objects in the store are named after the SHA1 of their content and their
+    mode, since all hard links to a file share its mode.  Unless a C{mode}
+    is given, objects are read-only, so the files linked to them are too;
+    either way, an object's content is checked against its name before it
+    is used again.  Objects that no
+    file links to any more are deleted once they have been unused for
+    C{pruneAge} seconds; the store is checked for them at most every
+    C{pruneInterval} seconds, as uploads finish.
+    """
+
+    pruneAge = 24 * 3600
+    pruneInterval = 3600
+    # the time each store was last pruned
+    lastPruned = {}
+
+    def __init__(self, destroot, storedir, mode):
+        self.destroot = os.path.abspath(destroot)
+        self.storedir = os.path.abspath(storedir)
+        self.mode = mode
+        self.nbytes = 0
+        self.reusedFiles = 0
+        self.reusedBytes = 0
+        self.expected = {}
+        self.requested = set()
+        self.verified = set()
+        self.links = []
+        self.dirs = []
+        self.fp = None
+        self.tmpname = None
+
+    def _destpath(self, name):
+        if not name:
+            return self.destroot
+        path = os.path.normpath(os.path.join(self.destroot, *name.split('/')))
+        if not path.startswith(self.destroot + os.sep):
+            raise ValueError("%r is outside of %r" % (name, self.destroot))
+        return path
+
+    def _objpath(self, sha, mode):
+        return os.path.join(self.storedir, sha[:2], '%s-%04o' % (sha, mode))
+
+    def _objmode(self, mode):
+        # the mode given to the upload is used as it is
+        if self.mode is not None:
+            return self.mode
+        return mode & ~0222
+
+    def remote_manifest(self, manifest):
+        """
+        Called by remote slave with the files and directories to upload
+
+        @type  manifest: list of (name, sha1, size, mode) tuples, with a sha1
+            of None for directories
+        @returns: Deferred firing with the names of the files whose content
+            is needed
+        """
+        return threads.deferToThread(self._plan, manifest)
+
+    def _plan(self, manifest):
+        # runs in a thread
+        needed = []
+        for name, sha, size, mode in manifest:
+            path = self._destpath(name)
+            if sha is None:
+                self.dirs.append((path, mode))
+                continue
+            if self.mode is not None:
+                mode = self.mode
+            obj = self._objpath(sha, mode)
+            if not self._isStored(obj, sha, size) and \
+                    self._matches(path, sha, size):
+                # the file at the destination is already right; add it to
+                # the store rather than asking for it
+                os.chmod(path, self._objmode(mode))
+                self._link(path, obj)
+                self.verified.add(obj)
+            if obj in self.verified:
+                self.reusedFiles += 1
+                self.reusedBytes += size
+            elif obj not in self.requested:
+                self.requested.add(obj)
+                self.expected[name] = obj
+                needed.append(name)
+            self.links.append((obj, path))
+        return needed
+
+    def _isStored(self, obj, sha, size):
+        # true if the store holds obj, with the right content
+        if obj in self.verified:
+            return True
+        if not os.path.exists(obj):
+            return False
+        if not self._matches(obj, sha, size):
+            log.msg("content store object %s is corrupt; replacing it" % obj)
+            self._remove(obj)
+            return False
+        # mark the object as used, so that it is not pruned before the
+        # upload is installed
+        os.utime(obj, None)
+        self.verified.add(obj)
+        return True
+
+    def _matches(self, path, sha, size):
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return False
+        digest = sha1()
+        f = open(path, 'rb')
+        try:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            f.close()
+        return digest.hexdigest() == sha
+
+    def _remove(self, path):
+        if runtime.platformType == 'win32':
+            # windows will not delete read-only files; there are no hard
+            # links there, so this does not affect the store
+            os.chmod(path, stat.S_IWRITE)
+        os.unlink(path)
+
+    def _link(self, src, dest):
+        # atomically replace dest with a hard link to src, or with a copy
+        # where hard links are not available
+        dirname = os.path.dirname(dest)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        fd, tmpname = tempfile.mkstemp(dir=dirname)
+        os.close(fd)
+        os.unlink(tmpname)
+        try:
+            os.link(src, tmpname)
+        except (AttributeError, OSError):
+            shutil.copy2(src, tmpname)
+        # on windows, os.rename does not automatically unlink, so do it manually
+        if os.path.exists(dest):
+            self._remove(dest)
+        os.rename(tmpname, dest)
+
+    def remote_begin(self, name):
+        """
+        Called by remote slave before sending the content of file L{name}
+        """
+        obj = self.expected[name]
+        dirname = os.path.dirname(obj)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        fd, self.tmpname = tempfile.mkstemp(dir=dirname)
+        self.fp = os.fdopen(fd, 'wb')
+        self.digest = sha1()
+        self.current = name
+
+    def remote_write(self, data):
+        """
+        Called by remote slave to write the next block of the current file
+
+        @type  data: C{string}
+        @param data: String of data to write
+        """
+        self.fp.write(data)
+        self.digest.update(data)
+        self.nbytes += len(data)
+
+    def remote_finish(self):
+        """
+        Called by remote slave once the whole current file has been sent;
+        the file is checked against its hash and moved into the store
+        """
+        self.fp.close()
+        self.fp = None
+        obj = self.expected[self.current]
+        sha, mode = os.path.basename(obj).split('-')
+        if self.digest.hexdigest() != sha:
+            os.unlink(self.tmpname)
+            self.tmpname = None
+            raise ValueError("content of %r changed during the upload"
+                             % self.current)
+        os.chmod(self.tmpname, self._objmode(int(mode, 8)))
+        if os.path.exists(obj):
+            self._remove(obj)
+        os.rename(self.tmpname, obj)
+        self.tmpname = None
+        self.verified.add(obj)
+
+    def remote_close(self):
+        """
+        Called by remote slave to state that no more data will be transfered
+        """
+        return threads.deferToThread(self._install)
+
+    def _install(self):
+        # runs in a thread
+        for obj, path in self.links:
+            if obj not in self.verified:
+                # e.g., the slave stopped sending at its maxsize; install
+                # nothing rather than an incomplete tree
+                self.cancel()
+                raise ValueError("the content of %r was not uploaded"
+                                 % path)
+        for path, mode in self.dirs:
+            if not os.path.exists(path):
+                os.makedirs(path)
+        for obj, path in self.links:
+            self._link(obj, path)
+        for path, mode in self.dirs:
+            os.chmod(path, mode)
+        self._maybePrune()
+
+    def _maybePrune(self):
+        # runs in a thread
+        now = time.time()
+        if now - self.lastPruned.get(self.storedir, 0) < self.pruneInterval:
+            return
+        self.lastPruned[self.storedir] = now
+        pruneContentStore(self.storedir, self.pruneAge)
+
+    def cancel(self):
+        # the store only ever holds complete objects; just drop the file
+        # being received
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+        if self.tmpname and os.path.exists(self.tmpname):
+            os.unlink(self.tmpname)
+
+
+def pruneContentStore(storedir, age):
+    """
+    Delete the objects in the content store at C{storedir} that no file
+    links to, and that have not been used for C{age} seconds.  Where there
+    are no hard links, objects are deleted once they are that old.  This
+    also removes temporary files left behind by uploads that were cut off.
+    """
+    cutoff = time.time() - age
+    try:
+        subdirs = os.listdir(storedir)
+    except OSError:
+        return
+    for subdir in subdirs:
+        subdir = os.path.join(storedir, subdir)
+        if not os.path.isdir(subdir):
+            continue
+        for name in os.listdir(subdir):
+            path = os.path.join(subdir, name)
+            try:
+                st = os.stat(path)
+                # the inode's change time is updated when a link to it is
+                # removed, and when the object is used
+                if st.st_nlink <= 1 and st.st_ctime < cutoff:
+                    log.msg("pruning content store object %s" % path)
+                    if runtime.platformType == 'win32':
+                        os.chmod(path, stat.S_IWRITE)
+                    os.unlink(path)
+            except OSError:
+                pass
+
+
 def makeStatusRemoteCommand(step, remote_command, args):
     self = buildstep.RemoteCommand(remote_command, args, decodeRC={None: SUCCESS, 0: SUCCESS})
     callback = lambda arg: step.step_status.addLog('stdio')
@@ -201,10 +633,95 @@ class _TransferBuildStep(BuildStep):
     haltOnFailure = True
     flunkOnFailure = True
 
+    # number of blocks to keep in flight, and the largest block size to use,
+    # for slaves that support windowed transfers
+    window = 1
+    maxBlocksize = 256 * 1024
+
+    # whether to upload only the content the master does not already have,
+    # and how much content such uploads did not need to transfer
+    dedup = False
+    reusedFiles = 0
+    reusedBytes = 0
+
     def __init__(self, workdir=None, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.workdir = workdir
 
+    def checkWindow(self, window, maxBlocksize):
+        if not isinstance(window, int) or window < 1:
+            config.error('window must be a positive integer')
+        self.window = window
+        self.maxBlocksize = maxBlocksize
+
+    def addWindowArgs(self, command, args):
+        # Ask for a windowed transfer, if the slave knows how to do one;
+        # older slaves fall back to sending one block at a time.
+        if self.window <= 1:
+            return
+        if self.slaveVersionIsOlderThan(command, "2.18"):
+            log.msg("buildslave does not support windowed %s; "
+                    "sending one block at a time" % command)
+            return
+        args['window'] = self.window
+        args['maxblocksize'] = max(self.maxBlocksize, self.blocksize)
+
+    def reportTransfer(self, cmd, nbytes, elapsed):
+        """
+        Record the number of bytes transferred, the throughput and, for
+        windowed transfers, the round-trip time measured by the slave, as
+        step statistics.
+        """
+        rtt = None
+        if cmd.updates.get('transfer'):
+            stats = cmd.updates['transfer'][-1]
+            elapsed = stats.get('elapsed', elapsed)
+            rtt = stats.get('rtt')
+        self.step_status.setStatistic('transfer_bytes', nbytes)
+        if elapsed > 0:
+            self.step_status.setStatistic('transfer_throughput',
+                                          nbytes / elapsed)
+        if rtt is not None:
+            self.step_status.setStatistic('transfer_rtt', rtt)
+
+    def useContentUpload(self):
+        # Upload only the content the master lacks, if asked to and if the
+        # slave knows how; older slaves upload everything.
+        if not self.dedup:
+            return False
+        if not self.slaveVersion("uploadContent"):
+            log.msg("buildslave does not support uploadContent; "
+                    "uploading every file")
+            return False
+        return True
+
+    def runContentUpload(self, source, masterdest, mode=None):
+        storedir = os.path.join(self.master.basedir, 'artifacts')
+        contentWriter = _ContentWriter(masterdest, storedir, mode)
+
+        args = {
+            'slavesrc': source,
+            'workdir': self._getWorkdir(),
+            'writer': contentWriter,
+            'maxsize': self.maxsize,
+            'blocksize': self.blocksize,
+        }
+        self.addWindowArgs('uploadContent', args)
+
+        cmd = makeStatusRemoteCommand(self, 'uploadContent', args)
+        d = self.runTransferCommand(cmd, contentWriter)
+
+        @d.addCallback
+        def reportReused(result):
+            self.reusedFiles += contentWriter.reusedFiles
+            self.reusedBytes += contentWriter.reusedBytes
+            self.step_status.setStatistic('transfer_reused_files',
+                                          self.reusedFiles)
+            self.step_status.setStatistic('transfer_reused_bytes',
+                                          self.reusedBytes)
+            return result
+        return d
+
     # Check that buildslave version used have implementation for
     # a remote command. Raise exception if buildslave is to old.
     def checkSlaveVersion(self, command):
@@ -223,14 +740,18 @@ class _TransferBuildStep(BuildStep):
             workdir = self.workdir
         return workdir
 
-    def runTransferCommand(self, cmd, writer=None):
+    def runTransferCommand(self, cmd, writer=None, reader=None):
         # Run a transfer step, add a callback to extract the command status,
         # add an error handler that cancels the writer.
         self.cmd = cmd
+        started = now()
         d = self.runCommand(cmd)
 
         @d.addCallback
         def checkResult(_):
+            helper = writer or reader
+            if helper is not None:
+                self.reportTransfer(cmd, helper.nbytes, now() - started)
             if cmd.didFail():
                 writer.cancel()
             return FAILURE if cmd.didFail() else SUCCESS
@@ -258,7 +779,8 @@ class FileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
-                 keepstamp=False, url=None,
+                 keepstamp=False, url=None, window=1,
+                 maxBlocksize=256 * 1024, dedup=False,
                  **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
@@ -272,6 +794,10 @@ class FileUpload(_TransferBuildStep):
         self.mode = mode
         self.keepstamp = keepstamp
         self.url = url
+        self.checkWindow(window, maxBlocksize)
+        if dedup and keepstamp:
+            config.error("'dedup' and 'keepstamp' cannot be used together")
+        self.dedup = dedup
 
     def start(self):
         self.checkSlaveVersion("uploadFile")
@@ -290,6 +816,11 @@ class FileUpload(_TransferBuildStep):
         if self.url is not None:
             self.addURL(os.path.basename(masterdest), self.url)
 
+        if self.useContentUpload():
+            d = self.runContentUpload(source, masterdest, self.mode)
+            d.addCallback(self.finished).addErrback(self.failed)
+            return
+
         # we use maxsize to limit the amount of data on both sides
         fileWriter = _FileWriter(masterdest, self.maxsize, self.mode)
 
@@ -307,6 +838,7 @@ class FileUpload(_TransferBuildStep):
             'blocksize': self.blocksize,
             'keepstamp': self.keepstamp,
         }
+        self.addWindowArgs('uploadFile', args)
 
         cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
         d = self.runTransferCommand(cmd, fileWriter)
@@ -321,7 +853,8 @@ class DirectoryUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16 * 1024,
-                 compress=None, url=None, **buildstep_kwargs):
+                 compress=None, url=None, stream=False, window=1,
+                 maxBlocksize=256 * 1024, dedup=False, **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
         self.slavesrc = slavesrc
@@ -333,6 +866,11 @@ class DirectoryUpload(_TransferBuildStep):
                 "'compress' must be one of None, 'gz', or 'bz2'")
         self.compress = compress
         self.url = url
+        self.stream = stream
+        self.checkWindow(window, maxBlocksize)
+        if dedup and stream:
+            config.error("'dedup' and 'stream' cannot be used together")
+        self.dedup = dedup
 
     def start(self):
         self.checkSlaveVersion("uploadDirectory")
@@ -351,8 +889,24 @@ class DirectoryUpload(_TransferBuildStep):
         if self.url is not None:
             self.addURL(os.path.basename(masterdest), self.url)
 
+        if self.useContentUpload():
+            d = self.runContentUpload(source, masterdest)
+            d.addCallback(self.finished).addErrback(self.failed)
+            return
+
+        stream = self.stream
+        if stream and self.slaveVersionIsOlderThan("uploadDirectory", "2.19"):
+            log.msg("buildslave does not support streaming uploadDirectory; "
+                    "sending a temporary archive")
+            stream = False
+
         # we use maxsize to limit the amount of data on both sides
-        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
+        if stream:
+            dirWriter = _DirectoryStreamWriter(masterdest, self.maxsize,
+                                               self.compress)
+        else:
+            dirWriter = _DirectoryWriter(masterdest, self.maxsize,
+                                         self.compress, 0600)
 
         # default arguments
         args = {
@@ -363,6 +917,9 @@ class DirectoryUpload(_TransferBuildStep):
             'blocksize': self.blocksize,
             'compress': self.compress
         }
+        if stream:
+            args['stream'] = True
+        self.addWindowArgs('uploadDirectory', args)
 
         cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         d = self.runTransferCommand(cmd, dirWriter)
@@ -377,7 +934,8 @@ class MultipleFileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrcs, masterdest,
                  workdir=None, maxsize=None, blocksize=16 * 1024,
-                 mode=None, compress=None, keepstamp=False, url=None, **buildstep_kwargs):
+                 mode=None, compress=None, keepstamp=False, url=None,
+                 dedup=False, **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
         self.slavesrcs = slavesrcs
@@ -394,6 +952,9 @@ class MultipleFileUpload(_TransferBuildStep):
         self.compress = compress
         self.keepstamp = keepstamp
         self.url = url
+        if dedup and keepstamp:
+            config.error("'dedup' and 'keepstamp' cannot be used together")
+        self.dedup = dedup
 
     def uploadFile(self, source, masterdest):
         fileWriter = _FileWriter(masterdest, self.maxsize, self.mode)
@@ -438,6 +999,12 @@ class MultipleFileUpload(_TransferBuildStep):
         @d.addCallback
         def checkStat(_):
             s = cmd.updates['stat'][-1]
+            if self.useContentUpload():
+                if stat.S_ISDIR(s[stat.ST_MODE]):
+                    return self.runContentUpload(source, masterdest)
+                elif stat.S_ISREG(s[stat.ST_MODE]):
+                    return self.runContentUpload(source, masterdest,
+                                                 self.mode)
             if stat.S_ISDIR(s[stat.ST_MODE]):
                 return self.uploadDirectory(source, masterdest)
             elif stat.S_ISREG(s[stat.ST_MODE]):
@@ -512,6 +1079,7 @@ class _FileReader(pb.Referenceable):
 
     def __init__(self, fp):
         self.fp = fp
+        self.nbytes = 0
 
     def remote_read(self, maxlength):
         """
@@ -527,6 +1095,7 @@ class _FileReader(pb.Referenceable):
             return ''
 
         data = self.fp.read(maxlength)
+        self.nbytes += len(data)
         return data
 
     def remote_close(self):
@@ -546,6 +1115,7 @@ class FileDownload(_TransferBuildStep):
 
     def __init__(self, mastersrc, slavedest,
                  workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
+                 window=1, maxBlocksize=256 * 1024,
                  **buildstep_kwargs):
         _TransferBuildStep.__init__(self, workdir=workdir, **buildstep_kwargs)
 
@@ -557,6 +1127,7 @@ class FileDownload(_TransferBuildStep):
             config.error(
                 'mode must be an integer or None')
         self.mode = mode
+        self.checkWindow(window, maxBlocksize)
 
     def start(self):
         self.checkSlaveVersion("downloadFile")
@@ -593,9 +1164,10 @@ class FileDownload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'mode': self.mode,
         }
+        self.addWindowArgs('downloadFile', args)
 
         cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
-        d = self.runTransferCommand(cmd)
+        d = self.runTransferCommand(cmd, reader=fileReader)
         d.addCallback(self.finished).addErrback(self.failed)
 
 
@@ -432,6 +432,11 @@ class FakeChangesComponent(FakeDBComponent):
         chdicts = [self._chdict(self.changes[id]) for id in ids[-count:]]
         return defer.succeed(chdicts)
 
+    def getChangesAfter(self, changeid, count):
+        ids = sorted(id for id in self.changes if id > changeid)
+        chdicts = [self._chdict(self.changes[id]) for id in ids[:count]]
+        return defer.succeed(chdicts)
+
     def getChanges(self):
         chdicts = [self._chdict(v) for v in self.changes.values()]
         return defer.succeed(chdicts)
@@ -992,7 +997,8 @@ class FakeBuildRequestsComponent(FakeDBComponent):
 
     @defer.inlineCallbacks
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-                         bsid=None, branch=None, repository=None):
+                         bsid=None, branch=None, repository=None,
+                         after_brid=None):
         rv = []
         for br in self.reqs.itervalues():
             if buildername and br.buildername != buildername:
@@ -1016,6 +1022,9 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             if bsid is not None:
                 if br.buildsetid != bsid:
                     continue
+            if after_brid is not None:
+                if br.id <= after_brid:
+                    continue
 
             if branch or repository:
                 buildset = yield self.db.buildsets.getBuildset(br.buildsetid)
@@ -1079,6 +1088,7 @@ class FakeBuildRequestsComponent(FakeDBComponent):
     def unclaimExpiredRequests(self, old, _reactor=reactor):
         old_epoch = _reactor.seconds() - old
 
+        count = 0
         for br in self.reqs.itervalues():
             if br.complete == 1:
                 continue
@@ -1086,6 +1096,8 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             claim_row = self.claims.get(br.id)
             if claim_row and claim_row.claimed_at < old_epoch:
                 del self.claims[br.id]
+                count += 1
+        return defer.succeed(count)
 
     # Code copied from buildrequests.BuildRequestConnectorComponent
     def _brdictFromRow(self, row):
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import mock
+import os
 import weakref
 
 from buildbot import config
@@ -42,12 +43,18 @@ class FakeCache(object):
         d.addCallback(mkref)
         return d
 
+    def put(self, key, value):
+        pass
+
 
 class FakeCaches(object):
 
-    def get_cache(self, name, miss_fn):
+    def get_cache(self, name, miss_fn, weight_fn=None):
         return FakeCache(name, miss_fn)
 
+    def register_cache(self, name, cache):
+        pass
+
 
 class FakeStatus(object):
 
@@ -102,12 +109,18 @@ class FakeMaster(object):
         self.status = FakeStatus()
         self.status.master = self
 
+    def getMasterName(self):
+        return 'fakehost:%s' % os.path.abspath(self.basedir)
+
     def getObjectId(self):
         return defer.succeed(self._master_id)
 
     def subscribeToBuildRequests(self, callback):
         pass
 
+    def buildRequestsClaimed(self, brids):
+        pass
+
     # work around http://code.google.com/p/mock/issues/detail?id=105
     def _get_child_mock(self, **kw):
         return mock.Mock(**kw)
@@ -86,12 +86,15 @@ class FakeRemoteShellCommand(FakeRemoteCommand):
                  timeout=20 * 60, maxTime=None, sigtermTime=None, logfiles={},
                  usePTY="slave-config", logEnviron=True, collectStdout=False,
                  collectStderr=False,
-                 interruptSignal=None, initialStdin=None, decodeRC={0: SUCCESS}):
+                 interruptSignal=None, initialStdin=None, decodeRC={0: SUCCESS},
+                 outputBuffering=None):
         args = dict(workdir=workdir, command=command, env=env or {},
                     want_stdout=want_stdout, want_stderr=want_stderr,
                     initial_stdin=initialStdin,
                     timeout=timeout, maxTime=maxTime, logfiles=logfiles,
                     usePTY=usePTY, logEnviron=logEnviron)
+        if outputBuffering is not None:
+            args['outputBuffering'] = outputBuffering
         FakeRemoteCommand.__init__(self, "shell", args,
                                    collectStdout=collectStdout,
                                    collectStderr=collectStderr,
@@ -297,12 +300,14 @@ class ExpectShell(Expect):
     def __init__(self, workdir, command, env={},
                  want_stdout=1, want_stderr=1, initialStdin=None,
                  timeout=20 * 60, maxTime=None, logfiles={},
-                 usePTY="slave-config", logEnviron=True):
+                 usePTY="slave-config", logEnviron=True, outputBuffering=None):
         args = dict(workdir=workdir, command=command, env=env,
                     want_stdout=want_stdout, want_stderr=want_stderr,
                     initial_stdin=initialStdin,
                     timeout=timeout, maxTime=maxTime, logfiles=logfiles,
                     usePTY=usePTY, logEnviron=logEnviron)
+        if outputBuffering is not None:
+            args['outputBuffering'] = outputBuffering
         Expect.__init__(self, "shell", args)
 
     def __repr__(self):
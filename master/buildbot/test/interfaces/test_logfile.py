@@ -16,6 +16,7 @@
 import mock
 import textwrap
 
+from buildbot import config
 from buildbot.status import logfile
 from buildbot.test.fake import remotecommand
 from buildbot.test.util import dirs
@@ -143,6 +144,7 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin, RealTests):
         # this is one reason this interface sucks:
         parent = mock.Mock(name='fake StepStatus')
         parent.build.builder.basedir = 'basedir'
+        parent.build.builder.master.config = config.MasterConfig()
         return logfile.LogFile(parent, name, logfilename)
 
 
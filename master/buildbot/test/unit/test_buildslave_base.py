@@ -66,13 +66,15 @@ class TestAbstractBuildSlave(unittest.TestCase):
                                      missing_timeout=120,
                                      properties={'a': 'b'},
                                      locks=[lock1, lock2],
-                                     keepalive_interval=60)
+                                     keepalive_interval=60,
+                                     compress_updates=True)
         self.assertEqual(bs.max_builds, 2)
         self.assertEqual(bs.notify_on_missing, ['me@me.com'])
         self.assertEqual(bs.missing_timeout, 120)
         self.assertEqual(bs.properties.getProperty('a'), 'b')
         self.assertEqual(bs.access, [lock1, lock2])
         self.assertEqual(bs.keepalive_interval, 60)
+        self.assertTrue(bs.compress_updates)
 
     def test_constructor_notify_on_missing_not_list(self):
         bs = self.ConcreteBuildSlave('bot', 'pass',
@@ -385,6 +387,58 @@ class TestAbstractBuildSlave(unittest.TestCase):
         # check the values get set right
         self.assertEqual(slave.slave_commands, COMMANDS)
 
+    @defer.inlineCallbacks
+    def test_attached_compress_updates(self):
+        slave = self.createBuildslave(compress_updates=True)
+        yield slave.startService()
+
+        bot = self.createRemoteBot()
+        bot.response['getCommands'] = mock.Mock(
+            return_value=defer.succeed({'shell': '2.21'}))
+        yield slave.attached(bot)
+
+        self.assertEqual(bot.commands[4], ('setUpdateCompression', True))
+        self.assertEqual(6, len(bot.commands))
+
+    @defer.inlineCallbacks
+    def test_attached_compress_updates_old_slave(self):
+        slave = self.createBuildslave(compress_updates=True)
+        yield slave.startService()
+
+        bot = self.createRemoteBot()
+        bot.response['getCommands'] = mock.Mock(
+            return_value=defer.succeed({'shell': '2.20'}))
+        yield slave.attached(bot)
+
+        self.assertEqual(5, len(bot.commands))
+        self.assertNotIn(('setUpdateCompression', True), bot.commands)
+
+    @defer.inlineCallbacks
+    def test_attached_ordered_updates(self):
+        slave = self.createBuildslave()
+        yield slave.startService()
+
+        bot = self.createRemoteBot()
+        bot.response['getCommands'] = mock.Mock(
+            return_value=defer.succeed({'shell': '2.22'}))
+        yield slave.attached(bot)
+
+        self.assertEqual(bot.commands[4], ('setOrderedUpdates', True))
+        self.assertEqual(6, len(bot.commands))
+
+    @defer.inlineCallbacks
+    def test_attached_ordered_updates_old_slave(self):
+        slave = self.createBuildslave()
+        yield slave.startService()
+
+        bot = self.createRemoteBot()
+        bot.response['getCommands'] = mock.Mock(
+            return_value=defer.succeed({'shell': '2.21'}))
+        yield slave.attached(bot)
+
+        self.assertEqual(5, len(bot.commands))
+        self.assertNotIn(('setOrderedUpdates', True), bot.commands)
+
     @defer.inlineCallbacks
     def test_attached_callsMaybeStartBuildsForSlave(self):
         slave = self.createBuildslave()
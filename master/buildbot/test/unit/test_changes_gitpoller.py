@@ -143,7 +143,41 @@ class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
                                              ['log', '--no-walk', '--format=%ct', self.dummyRevStr, '--'],
                                              stampStr, float(stampStr))
 
-    # _get_changes is tested in TestGitPoller, below
+    # output of 'git log --reverse --name-only' with LOG_FORMAT, as stripped
+    # by _dovccmd; the second commit is a merge, so it lists no files
+    logOutput = ('\0abc123\0001273258009\0Sammy Jankis <email@example.com>'
+                 '\0subject\n\nbody line\n\0\n\nfile1\n"\\146ile_octal"\n'
+                 'file space\n'
+                 '\0def456\0001273258010\0Sammy Jankis <email@example.com>'
+                 '\0merge\n\0')
+
+    def test_parse_log(self):
+        self.assertEqual(list(self.poller._parse_log(self.logOutput)), [
+            ('abc123', 1273258009.0, u'Sammy Jankis <email@example.com>',
+             [u'file1', u'file_octal', u'file space'],
+             u'subject\n\nbody line'),
+            ('def456', 1273258010.0, u'Sammy Jankis <email@example.com>',
+             [], u'merge'),
+        ])
+
+    def test_parse_log_empty(self):
+        self.assertEqual(list(self.poller._parse_log('')), [])
+
+    def test_parse_log_no_timestamps(self):
+        self.poller.usetimestamps = False
+        self.assertEqual([c[1] for c in self.poller._parse_log(self.logOutput)],
+                         [None, None])
+
+    def test_parse_log_no_author(self):
+        output = '\0abc123\0001273258009\0\0subject\n\0\n\nfile1'
+        self.assertRaises(EnvironmentError,
+                          list, self.poller._parse_log(output))
+
+    def test_parse_log_truncated(self):
+        self.assertRaises(EnvironmentError,
+                          list, self.poller._parse_log('\0abc123\0001273258009'))
+
+    # _process_changes is tested in TestGitPoller, below
 
 
 class TestGitPoller(gpo.GetProcessOutputMixin,
@@ -166,6 +200,28 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
     def tearDown(self):
         return self.tearDownChangeSource()
 
+    def expectTips(self, tips):
+        return gpo.Expect('git', 'for-each-ref',
+                          '--format=%(objectname) %(refname)',
+                          'refs/buildbot/%s' % self.REPOURL_QUOTED) \
+            .path('gitpoller-work') \
+            .stdout(''.join('%s refs/buildbot/%s/%s\n'
+                            % (rev, self.REPOURL_QUOTED, branch)
+                            for branch, rev in tips))
+
+    def expectLog(self, lastRev, newRev):
+        return gpo.Expect('git', 'log', '--reverse', '--name-only',
+                          gitpoller.GitPoller.LOG_FORMAT,
+                          '%s..%s' % (lastRev, newRev), '--') \
+            .path('gitpoller-work')
+
+    def logOutput(self, revs):
+        # fake commit details, derived from the revision
+        return ''.join('\0%s\0%s\0%s\0%s\n\0\n\n%s\n'
+                       % (rev, '1273258009', 'by:' + rev[:8], 'hello!',
+                          '/etc/' + rev[:3])
+                       for rev in revs)
+
     def test_describe(self):
         self.assertSubstring("GitPoller", self.poller.describe())
 
@@ -175,10 +231,9 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             gpo.Expect('git', 'fetch', self.REPOURL,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5\n'),
+            self.expectTips([
+                ('master', 'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5'),
+            ]),
         )
 
         d = self.poller.poll()
@@ -220,16 +275,13 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
         d.addCallback(lambda _: self.assertAllCommandsRan)
         return d
 
-    def test_poll_failRevParse(self):
+    def test_poll_missingTrackerRef(self):
         self.expectCommands(
             gpo.Expect('git', 'init', '--bare', 'gitpoller-work'),
             gpo.Expect('git', 'fetch', self.REPOURL,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .exit(1),
+            self.expectTips([]),
         )
 
         d = self.poller.poll()
@@ -246,15 +298,11 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             gpo.Expect('git', 'fetch', self.REPOURL,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       'fa3ae8ed68e664d4db24798611b352e3c6509930..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+            ]),
+            self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930',
+                           '4423cdbcbb89c14e50dd5f4152415afd686c5241')
             .exit(1),
         )
 
@@ -284,15 +332,11 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('no interesting output'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       '4423cdbcbb89c14e50dd5f4152415afd686c5241..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+            ]),
+            self.expectLog('4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                           '4423cdbcbb89c14e50dd5f4152415afd686c5241')
             .stdout(''),
         )
 
@@ -318,14 +362,10 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED,
                        '+release:refs/buildbot/%s/release' % self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/release' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+                ('release', '9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
+            ]),
         )
 
         # do the poll
@@ -349,50 +389,23 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED,
                        '+release:refs/buildbot/%s/release' % self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       'fa3ae8ed68e664d4db24798611b352e3c6509930..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+                ('release', '9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
+            ]),
+            self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930',
+                           '4423cdbcbb89c14e50dd5f4152415afd686c5241')
+            .stdout(self.logOutput([
+                '4423cdbcbb89c14e50dd5f4152415afd686c5241',
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/release' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
-                       '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
-                '9118f4ab71963d23d02d4bdc54876ac8bf05acf2'
+            ])),
+            self.expectLog('bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
+                           '9118f4ab71963d23d02d4bdc54876ac8bf05acf2')
+            .stdout(self.logOutput([
+                '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
             ])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = ['master', 'release']
         self.poller.lastRev = {
@@ -444,39 +457,17 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             gpo.Expect('git', 'fetch', self.REPOURL,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'fa3ae8ed68e664d4db24798611b352e3c6509930..'
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+            ]),
+            self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930',
+                           '4423cdbcbb89c14e50dd5f4152415afd686c5241')
+            .stdout(self.logOutput([
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
+            ])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = True
         self.poller.lastRev = {
@@ -524,15 +515,11 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('no interesting output'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       '4423cdbcbb89c14e50dd5f4152415afd686c5241..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+            ]),
+            self.expectLog('4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                           '4423cdbcbb89c14e50dd5f4152415afd686c5241')
             .stdout(''),
         )
 
@@ -562,51 +549,23 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                 '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED,
                 '+release:refs/buildbot/%s/release' % self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'fa3ae8ed68e664d4db24798611b352e3c6509930..'
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+                ('release', '9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
+            ]),
+            self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930',
+                           '4423cdbcbb89c14e50dd5f4152415afd686c5241')
+            .stdout(self.logOutput([
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
-            gpo.Expect(
-                'git', 'rev-parse', 'refs/buildbot/%s/release' %
-                self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..'
+            ])),
+            self.expectLog('bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
+                           '9118f4ab71963d23d02d4bdc54876ac8bf05acf2')
+            .stdout(self.logOutput([
                 '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join(['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])),
+            ])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = True
         self.poller.lastRev = {
@@ -664,39 +623,17 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                 'git', 'fetch', self.REPOURL,
                 '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'fa3ae8ed68e664d4db24798611b352e3c6509930..'
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+            ]),
+            self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930',
+                           '4423cdbcbb89c14e50dd5f4152415afd686c5241')
+            .stdout(self.logOutput([
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241']))
+            ]))
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         class TestCallable:
 
@@ -758,38 +695,16 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                 '+refs/pull/410/head:refs/buildbot/%s/refs/pull/410/head' %
                 self.REPOURL_QUOTED)
             .path('gitpoller-work'),
-            gpo.Expect(
-                'git', 'rev-parse',
-                'refs/buildbot/%s/refs/pull/410/head' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
-            gpo.Expect(
-                'git', 'log', '--format=%H',
-                'bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5..'
+            self.expectTips([
+                ('refs/pull/410/head', '9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
+            ]),
+            self.expectLog('bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
+                           '9118f4ab71963d23d02d4bdc54876ac8bf05acf2')
+            .stdout(self.logOutput([
                 '9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
-                '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join(['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])),
+            ])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         def pullFilter(branch):
             """
             Note that this isn't useful in practice, because it will only
@@ -838,39 +753,17 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        '+master:refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path('gitpoller-work')
             .stdout('no interesting output'),
-            gpo.Expect('git', 'rev-parse',
-                       'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
-            .path('gitpoller-work')
-            .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect('git', 'log',
-                       '--format=%H',
-                       'fa3ae8ed68e664d4db24798611b352e3c6509930..4423cdbcbb89c14e50dd5f4152415afd686c5241',
-                       '--')
-            .path('gitpoller-work')
-            .stdout('\n'.join([
+            self.expectTips([
+                ('master', '4423cdbcbb89c14e50dd5f4152415afd686c5241'),
+            ]),
+            self.expectLog('fa3ae8ed68e664d4db24798611b352e3c6509930',
+                           '4423cdbcbb89c14e50dd5f4152415afd686c5241')
+            .stdout(self.logOutput([
+                '4423cdbcbb89c14e50dd5f4152415afd686c5241',
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                '4423cdbcbb89c14e50dd5f4152415afd686c5241'
             ])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.lastRev = {
             'master': 'fa3ae8ed68e664d4db24798611b352e3c6509930'
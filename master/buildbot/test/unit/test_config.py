@@ -31,6 +31,7 @@ from buildbot.process import factory
 from buildbot.process import properties
 from buildbot.schedulers import base as schedulers_base
 from buildbot.status import base as status_base
+from buildbot.status import logstorage
 from buildbot.test.util import compat
 from buildbot.test.util import dirs
 from buildbot.test.util.config import ConfigErrorsMixin
@@ -49,11 +50,15 @@ global_defaults = dict(
     buildHorizon=None,
     logCompressionLimit=4096,
     logCompressionMethod='bz2',
+    logCompressionWorkers=2,
+    logCompressionQueueSize=100,
+    logCompressionMaxDelay=1.0,
     logMaxTailSize=None,
     logMaxSize=None,
     properties=properties.Properties(),
     mergeRequests=None,
     prioritizeBuilders=None,
+    buildDistributionConcurrency=1,
     protocols={},
     slavePortnum=None,
     multiMaster=False,
@@ -176,6 +181,7 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
                 db_poll_interval=None),
             metrics=None,
             caches=dict(Changes=10, Builds=15),
+            cacheMemoryLimit=None,
             schedulers={},
             builders=[],
             slaves=[],
@@ -431,6 +437,28 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                              dict(logCompressionMethod='foo'))
         self.assertConfigError(self.errors, "must be 'bz2' or 'gz'")
 
+    def test_load_global_logCompressionWorkers(self):
+        self.do_test_load_global(dict(logCompressionWorkers=4),
+                                 logCompressionWorkers=4)
+
+    def test_load_global_logCompressionWorkers_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(logCompressionWorkers=0))
+        self.assertConfigError(self.errors, "must be at least 1")
+
+    def test_load_global_logCompressionQueueSize(self):
+        self.do_test_load_global(dict(logCompressionQueueSize=10),
+                                 logCompressionQueueSize=10)
+
+    def test_load_global_logCompressionMaxDelay(self):
+        self.do_test_load_global(dict(logCompressionMaxDelay=0.25),
+                                 logCompressionMaxDelay=0.25)
+
+    def test_load_global_logCompressionMaxDelay_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(logCompressionMaxDelay='soon'))
+        self.assertConfigError(self.errors, "must be a number")
+
     def test_load_global_codebaseGenerator(self):
         func = lambda _: "dummy"
         self.do_test_load_global(dict(codebaseGenerator=func),
@@ -449,6 +477,20 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_logMaxTailSize(self):
         self.do_test_load_global(dict(logMaxTailSize=123), logMaxTailSize=123)
 
+    def test_load_global_logStorage(self):
+        storage = logstorage.ChunkedLogStorage()
+        self.do_test_load_global(dict(logStorage=storage),
+                                 logStorage=storage)
+
+    def test_load_global_logStorage_invalid(self):
+        self.cfg.load_global(self.filename, dict(logStorage='db'))
+        self.assertConfigError(self.errors,
+                               "c['logStorage'] must be a LogStorage")
+
+    def test_defaults_logStorage(self):
+        cfg = config.MasterConfig()
+        self.assertIsInstance(cfg.logStorage, logstorage.FileLogStorage)
+
     def test_load_global_properties(self):
         exp = properties.Properties()
         exp.setProperty('x', 10, self.filename)
@@ -479,6 +521,15 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.do_test_load_global(dict(prioritizeBuilders=callable),
                                  prioritizeBuilders=callable)
 
+    def test_load_global_buildDistributionConcurrency(self):
+        self.do_test_load_global(dict(buildDistributionConcurrency=10),
+                                 buildDistributionConcurrency=10)
+
+    def test_load_global_buildDistributionConcurrency_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(buildDistributionConcurrency=0))
+        self.assertConfigError(self.errors, "must be at least 1")
+
     def test_load_global_prioritizeBuilders_invalid(self):
         self.cfg.load_global(self.filename,
                              dict(prioritizeBuilders='yes'))
@@ -633,6 +684,22 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.assertConfigError(self.errors,
                                "'Changes' cache size must be at least 1, got '-12'")
 
+    def test_load_caches_cacheMemoryLimit(self):
+        self.cfg.load_caches(self.filename,
+                             dict(cacheMemoryLimit=256 * 1024 * 1024))
+        self.assertResults(caches=dict(Changes=10, Builds=15),
+                           cacheMemoryLimit=256 * 1024 * 1024)
+
+    def test_load_caches_cacheMemoryLimit_invalid(self):
+        self.cfg.load_caches(self.filename, dict(cacheMemoryLimit='1G'))
+        self.assertConfigError(self.errors,
+                               "c['cacheMemoryLimit'] must be an integer")
+
+    def test_load_caches_cacheMemoryLimit_too_small(self):
+        self.cfg.load_caches(self.filename, dict(cacheMemoryLimit=0))
+        self.assertConfigError(self.errors,
+                               "c['cacheMemoryLimit'] must be at least 1")
+
     def test_load_schedulers_defaults(self):
         self.cfg.load_schedulers(self.filename, {})
         self.assertResults(schedulers={})
@@ -235,6 +235,21 @@ class Tests(interfaces.InterfaceTests):
         d.addCallback(check)
         return d
 
+    def test_getBuildRequests_after_brid_arg(self):
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=70, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=71, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=72, buildsetid=self.BSID),
+        ])
+        d.addCallback(lambda _:
+                      self.db.buildrequests.getBuildRequests(after_brid=70))
+
+        def check(brlist):
+            self.assertEqual(sorted([br['brid'] for br in brlist]),
+                             sorted([71, 72]))
+        d.addCallback(check)
+        return d
+
     def test_getBuildRequests_combo(self):
         d = self.insertTestData([
             # 44: everything we want
@@ -526,6 +526,48 @@ class TestChangesConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getChangesAfter(self):
+        d = self.insertTestData([
+            fakedb.Change(changeid=8),
+            fakedb.Change(changeid=10),
+        ] + self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _:
+                      self.db.changes.getChangesAfter(8, 3))
+
+        def check(chdicts):
+            self.assertEqual([c['changeid'] for c in chdicts], [10, 13, 14])
+            self.assertEqual(sorted(chdicts[1]['files']),
+                             [u'master/README.txt', u'slave/README.txt'])
+            self.assertEqual(chdicts[1]['properties'],
+                             {u'notest': (u'no', u'Change')})
+            self.assertEqual(chdicts[2], self.change14_dict)
+        d.addCallback(check)
+        return d
+
+    def test_getChangesAfter_count(self):
+        d = self.insertTestData([
+            fakedb.Change(changeid=8),
+            fakedb.Change(changeid=9),
+            fakedb.Change(changeid=10),
+        ])
+        d.addCallback(lambda _:
+                      self.db.changes.getChangesAfter(0, 2))
+
+        def check(chdicts):
+            self.assertEqual([c['changeid'] for c in chdicts], [8, 9])
+        d.addCallback(check)
+        return d
+
+    def test_getChangesAfter_none(self):
+        d = self.insertTestData(self.change13_rows)
+        d.addCallback(lambda _:
+                      self.db.changes.getChangesAfter(13, 10))
+
+        def check(chdicts):
+            self.assertEqual(chdicts, [])
+        d.addCallback(check)
+        return d
+
     def test_getRecentChanges_empty(self):
         d = defer.succeed(None)
         d.addCallback(lambda _:
@@ -0,0 +1,54 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+
+from buildbot.test.util import migration
+from twisted.trial import unittest
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def test_empty_migration(self):
+        def setup_thd(conn):
+            pass
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            logchunks = sa.Table('logchunks', metadata, autoload=True)
+
+            # table starts empty
+            res = conn.execute(logchunks.select())
+            self.assertEqual(res.fetchall(), [])
+
+            # and each chunk of a stream is unique, so we'll get an error here
+            chunk = dict(logid='x' * 40, mastername='m', buildername='b',
+                         buildnumber=1, stream=0, seq=0, length=2,
+                         written_at=0, content='xx')
+            dialect = conn.dialect.name
+            exc = (sa.exc.ProgrammingError if dialect == 'postgresql'
+                   else sa.exc.IntegrityError)
+            self.assertRaises(exc, lambda:
+                              conn.execute(logchunks.insert(), chunk, chunk))
+
+        return self.do_test_migration(24, 25, setup_thd, verify_thd)
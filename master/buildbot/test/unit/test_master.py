@@ -510,6 +510,57 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_pollDatabaseChanges_batches(self):
+        self.master.changeBatchSize = 2
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=12),
+            fakedb.Change(changeid=13),
+            fakedb.Change(changeid=14),
+        ])
+        d = self.master.pollDatabaseChanges()
+
+        def check(_):
+            self.assertEqual([ch.number for ch in self.gotten_changes],
+                             [11, 12, 13, 14])
+            self.db.state.assertState(53, last_processed_change=14)
+        d.addCallback(check)
+        return d
+
+    def test_pollDatabaseChanges_gap(self):
+        # change 12 is still being added by another master when 13 appears
+        self.master.changeBatchSize = 2
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=13),
+        ])
+        d = self.master.pollDatabaseChanges()
+
+        def check_first(_):
+            self.assertEqual([ch.number for ch in self.gotten_changes],
+                             [11])
+            self.db.state.assertState(53, last_processed_change=11)
+            self.db.insertTestData([fakedb.Change(changeid=12)])
+        d.addCallback(check_first)
+        d.addCallback(lambda _: self.master.pollDatabaseChanges())
+
+        def check(_):
+            self.assertEqual([ch.number for ch in self.gotten_changes],
+                             [11, 12, 13])
+            self.db.state.assertState(53, last_processed_change=13)
+        d.addCallback(check)
+        return d
+
     def test_pollDatabaseChanges_nothing_new(self):
         self.db.insertTestData([
             fakedb.Object(id=53, name='master',
@@ -554,6 +605,8 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         return d
 
     def test_pollDatabaseBuildRequests_incremental(self):
+        # reconcile on every poll
+        self.master.UNCLAIMED_RECONCILE_INTERVAL = 0
         d = defer.succeed(None)
 
         def insert1(_):
@@ -594,3 +647,77 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
             ])
         d.addCallback(check)
         return d
+
+    def test_pollDatabaseBuildRequests_high_water_mark(self):
+        self.master.UNCLAIMED_RECONCILE_INTERVAL = 1000
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=127),
+            fakedb.SourceStamp(id=127, sourcestampsetid=127),
+            fakedb.Buildset(id=9, sourcestampsetid=127),
+            fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy'),
+        ])
+        d = self.master.pollDatabaseBuildRequests()
+
+        def claim_unclaim_and_insert(_):
+            self.gotten_buildrequest_additions.append('MARK')
+            self.db.buildrequests.fakeClaimBuildRequest(11)
+            self.db.buildrequests.fakeUnclaimBuildRequest(11)
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=12, buildsetid=9,
+                                    buildername='twelve'),
+            ])
+            # only requests newer than brid 11 are read
+            self.db.buildrequests.getBuildRequests = mock.Mock(
+                wraps=self.db.buildrequests.getBuildRequests)
+        d.addCallback(claim_unclaim_and_insert)
+        d.addCallback(lambda _: self.master.pollDatabaseBuildRequests())
+
+        def check(_):
+            self.db.buildrequests.getBuildRequests.assert_called_with(
+                claimed=False, after_brid=11)
+            self.assertEqual(self.gotten_buildrequest_additions, [
+                dict(bsid=9, brid=11, buildername='eleventy'),
+                'MARK',
+                dict(bsid=9, brid=12, buildername='twelve'),
+            ])
+            self.assertEqual(self.master._last_unclaimed_brids_set,
+                             set([11, 12]))
+        d.addCallback(check)
+
+        def claim_and_reconcile(_):
+            self.gotten_buildrequest_additions.append('MARK')
+            self.db.buildrequests.fakeClaimBuildRequest(12)
+            self.master.UNCLAIMED_RECONCILE_INTERVAL = 0
+        d.addCallback(claim_and_reconcile)
+        d.addCallback(lambda _: self.master.pollDatabaseBuildRequests())
+
+        def check_reconciled(_):
+            self.db.buildrequests.getBuildRequests.assert_called_with(
+                claimed=False)
+            self.assertEqual(self.master._last_unclaimed_brids_set, set([11]))
+            self.assertEqual(self.gotten_buildrequest_additions[-1], 'MARK')
+        d.addCallback(check_reconciled)
+        return d
+
+    def test_buildRequestsClaimed(self):
+        self.master.UNCLAIMED_RECONCILE_INTERVAL = 1000
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=127),
+            fakedb.SourceStamp(id=127, sourcestampsetid=127),
+            fakedb.Buildset(id=9, sourcestampsetid=127),
+            fakedb.BuildRequest(id=11, buildsetid=9, buildername='eleventy'),
+            fakedb.BuildRequest(id=12, buildsetid=9, buildername='twelve'),
+        ])
+        d = self.master.pollDatabaseBuildRequests()
+
+        def claim(_):
+            self.db.buildrequests.fakeClaimBuildRequest(11)
+            self.master.buildRequestsClaimed([11])
+            self.assertEqual(self.master._last_unclaimed_brids_set, set([12]))
+        d.addCallback(claim)
+        d.addCallback(lambda _: self.master.pollDatabaseBuildRequests())
+
+        def check(_):
+            self.assertEqual(self.master._last_unclaimed_brids_set, set([12]))
+        d.addCallback(check)
+        return d
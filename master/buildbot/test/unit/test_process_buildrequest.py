@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+from buildbot import sourcestamp
 from buildbot.process import buildrequest
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
@@ -351,3 +352,38 @@ class TestBuildRequest(unittest.TestCase):
         mergeable = r1.canBeMergedWith(r2)
         self.assertFalse(mergeable, "Request containing different codebases " +
                                     "should never be able to merge")
+
+    def test_getMergeKey_agrees_with_canBeMergedWith(self):
+        def mkreq(**sources):
+            r = buildrequest.BuildRequest()
+            r.sources = {}
+            for codebase, kwargs in sources.iteritems():
+                ss = sourcestamp.SourceStamp(codebase=codebase,
+                                             _ignoreChanges=True, **kwargs)
+                ss.ssid = len(r.sources) + 100 * id(r)
+                r.sources[codebase] = ss
+            return r
+
+        reqs = [
+            mkreq(),
+            mkreq(A=dict(branch='trunk', revision='1')),
+            mkreq(A=dict(branch='trunk', revision='1')),
+            mkreq(A=dict(branch='trunk', revision='2')),
+            mkreq(A=dict(branch='stable', revision='1')),
+            mkreq(A=dict(branch='trunk', changes=['c1'])),
+            mkreq(A=dict(branch='trunk', changes=['c2'], revision='3')),
+            mkreq(A=dict(branch='trunk', changes=['c2'], project='p')),
+            mkreq(A=dict(branch='trunk', changes=['c2'], repository='r')),
+            mkreq(A=dict(branch='trunk', revision='1', patch=(1, 'diff'))),
+            mkreq(A=dict(branch='trunk', revision='1', patch=(1, 'diff'))),
+            mkreq(B=dict(branch='trunk', revision='1')),
+            mkreq(A=dict(branch='trunk', revision='1'),
+                  B=dict(changes=['c3'])),
+            mkreq(A=dict(branch='trunk', revision='1'),
+                  B=dict(changes=['c4'])),
+        ]
+        for r1 in reqs:
+            for r2 in reqs:
+                self.assertEqual(r1.getMergeKey() == r2.getMergeKey(),
+                                 r1.canBeMergedWith(r2),
+                                 "%r vs %r" % (r1.sources, r2.sources))
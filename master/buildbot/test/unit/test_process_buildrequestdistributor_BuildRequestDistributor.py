@@ -17,6 +17,7 @@ import mock
 
 from buildbot.db import buildrequests
 from buildbot.process import buildrequestdistributor
+from buildbot.process.builder import Builder
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import compat
@@ -119,6 +120,26 @@ class Test(unittest.TestCase):
             bldr.slaves = []
             bldr.getAvailableSlaves = lambda: [s for s in bldr.slaves if s.isAvailable]
 
+    def useControlled_maybeStartBuildsOnBuilder(self):
+        # sets up a "maybeStartBuildsOnBuilder" that only finishes when the
+        # test says so, and tracks when it starts and finishes
+        self.maybeStartBuildsOnBuilder_calls = []
+        self.running = {}
+
+        def maybeStartBuildsOnBuilder(bldr):
+            self.maybeStartBuildsOnBuilder_calls.append(bldr.name)
+            d = self.running[bldr.name] = defer.Deferred()
+
+            @d.addCallback
+            def finished(_):
+                del self.running[bldr.name]
+                self.maybeStartBuildsOnBuilder_calls.append('~' + bldr.name)
+            return d
+        self.brd._maybeStartBuildsOnBuilder = maybeStartBuildsOnBuilder
+
+    def finishBuilder(self, name):
+        self.running[name].callback(None)
+
     def removeBuilder(self, name):
         del self.builders[name]
         del self.botmaster.builders[name]
@@ -217,6 +238,97 @@ class Test(unittest.TestCase):
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    def do_test_concurrent(self, slavenames, concurrency=3):
+        self.brd.concurrency = concurrency
+        self.useControlled_maybeStartBuildsOnBuilder()
+        self.addBuilders(sorted(slavenames))
+        for name, slaves in slavenames.iteritems():
+            self.builders[name].config.slavenames = slaves
+        # the loop may go quiet before the test gets a chance to look
+        quiet_d = self.quiet_deferred
+        self.brd.maybeStartBuildsOn(sorted(slavenames))
+        return quiet_d
+
+    def test_concurrent_independent(self):
+        quiet_d = self.do_test_concurrent(
+            dict(bldr1=['s1'], bldr2=['s2'], bldr3=['s3'], bldr4=['s4']))
+        # three start at once, and the fourth when there's room
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2', 'bldr3'])
+        self.finishBuilder('bldr2')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2', 'bldr3', '~bldr2', 'bldr4'])
+        for name in 'bldr1', 'bldr3', 'bldr4':
+            self.finishBuilder(name)
+
+        def check(_):
+            self.assertEqual(self.brd._activeBuilders, {})
+            self.checkAllCleanedUp()
+        quiet_d.addCallback(check)
+        return quiet_d
+
+    def test_concurrent_shared_slaves(self):
+        # bldr2 must wait for bldr1's slave, and bldr3 must not take bldr2's
+        # other slave while it waits; bldr4 is independent
+        quiet_d = self.do_test_concurrent(
+            dict(bldr1=['s1'], bldr2=['s1', 's2'], bldr3=['s2'], bldr4=['s4']))
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr4'])
+        self.finishBuilder('bldr1')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls[2:],
+                         ['~bldr1', 'bldr2'])
+        self.finishBuilder('bldr2')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls[4:],
+                         ['~bldr2', 'bldr3'])
+        self.finishBuilder('bldr3')
+        self.finishBuilder('bldr4')
+
+        def check(_):
+            self.checkAllCleanedUp()
+        quiet_d.addCallback(check)
+        return quiet_d
+
+    def test_concurrent_builder_requeued_while_running(self):
+        quiet_d = self.do_test_concurrent(dict(bldr1=['s1']))
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        # a builder is never handled twice at once
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls, ['bldr1'])
+        self.finishBuilder('bldr1')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', '~bldr1', 'bldr1'])
+        self.finishBuilder('bldr1')
+
+        def check(_):
+            self.checkAllCleanedUp()
+        quiet_d.addCallback(check)
+        return quiet_d
+
+    def test_concurrent_stopService(self):
+        self.do_test_concurrent(dict(bldr1=['s1'], bldr2=['s2'],
+                                     bldr3=['s3']), concurrency=2)
+        stop_d = self.brd.stopService()
+        stop_d.addCallback(lambda _:
+                           self.maybeStartBuildsOnBuilder_calls.append('(stopped)'))
+        self.finishBuilder('bldr1')
+        self.finishBuilder('bldr2')
+
+        def check(_):
+            self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                             ['bldr1', 'bldr2', '~bldr1', '~bldr2',
+                              '(stopped)'])
+        stop_d.addCallback(check)
+        return stop_d
+
+    def test_reconfigService(self):
+        new_config = mock.Mock()
+        new_config.buildDistributionConcurrency = 5
+        d = self.brd.reconfigService(new_config)
+
+        def check(_):
+            self.assertEqual(self.brd.concurrency, 5)
+        d.addCallback(check)
+        return d
+
     def do_test_sortBuilders(self, prioritizeBuilders, oldestRequestTimes,
                              expected, returnDeferred=False):
         self.useMock_maybeStartBuildsOnBuilder()
@@ -1046,6 +1158,37 @@ class TestMaybeStartBuilds(unittest.TestCase):
                                                          ('test-slave2', [20]),
                                                      ])
 
+    @mock.patch('random.choice', nth_slave(0))
+    @defer.inlineCallbacks
+    def test_mergeRequests_default(self):
+        rows = []
+        for id, revision in [(19, 'abc'), (20, 'def'), (21, 'abc'),
+                             (22, 'def'), (23, 'ghi')]:
+            rows += [
+                fakedb.SourceStampSet(id=id),
+                fakedb.SourceStamp(id=id, sourcestampsetid=id,
+                                   revision=revision),
+                fakedb.Buildset(id=id, sourcestampsetid=id, reason='foo',
+                                submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=id, buildsetid=id, buildername='A',
+                                    submitted_at=1300305712 + id, results=-1),
+            ]
+
+        self.addSlaves({'test-slave1': 1, 'test-slave2': 1})
+
+        # the merged requests are looked up by merge key, not by calling the
+        # merge function
+        self.patch(Builder, '_defaultMergeRequestFn',
+                   lambda *args: self.fail("should not be called"))
+        self.bldr.getMergeRequestsFn = lambda: Builder._defaultMergeRequestFn
+
+        yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
+                                                     exp_claims=[19, 20, 21, 22],
+                                                     exp_builds=[
+                                                         ('test-slave1', [19, 21]),
+                                                         ('test-slave2', [20, 22]),
+                                                     ])
+
     @defer.inlineCallbacks
     def test_mergeRequests_fails(self):
         def mergeRequests_fn(*args):
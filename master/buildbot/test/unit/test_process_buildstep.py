@@ -15,12 +15,15 @@
 
 import mock
 import re
+import zlib
 
 from buildbot.process import buildstep
 from buildbot.process import properties
 from buildbot.process.buildstep import regex_log_evaluator
+from buildbot.process.buildstep import streaming_regex_log_evaluator
 from buildbot.status.results import EXCEPTION
 from buildbot.status.results import FAILURE
+from buildbot.status.results import RETRY
 from buildbot.status.results import SUCCESS
 from buildbot.status.results import WARNINGS
 from buildbot.test.fake import fakebuild
@@ -95,6 +98,86 @@ class TestRegexLogEvaluator(unittest.TestCase):
                          % (new_status, WARNINGS))
 
 
+class TestStreamingRegexLogEvaluator(unittest.TestCase):
+
+    def makeRemoteCommand(self, rc, chunks):
+        cmd = remotecommand.FakeRemoteCommand('cmd', {})
+        cmd.fakeLogData(self, 'stdio')
+        cmd.logs['stdio'].chunks = chunks
+        cmd.rc = rc
+        return cmd
+
+    def evaluate(self, chunks, regexes, rc=0, **kwargs):
+        cmd = self.makeRemoteCommand(rc, chunks)
+        return streaming_regex_log_evaluator(cmd, FakeStepStatus(), regexes,
+                                             **kwargs)
+
+    def test_no_match(self):
+        self.assertEqual(self.evaluate([(0, "all is well\n")],
+                                       [("error", FAILURE)]), SUCCESS)
+
+    def test_match_split_across_chunks(self):
+        self.assertEqual(self.evaluate([(0, "some err"), (0, "or here\n")],
+                                       [("error", FAILURE)]), FAILURE)
+
+    def test_match_on_last_partial_line(self):
+        self.assertEqual(self.evaluate([(0, "ok\nan error")],
+                                       [(re.compile("error"), FAILURE)]),
+                         FAILURE)
+
+    def test_match_stderr_ignores_header(self):
+        self.assertEqual(self.evaluate([(2, "error in header\n"),
+                                        (1, "warning on stderr\n")],
+                                       [("error", FAILURE),
+                                        ("warning", WARNINGS)]), WARNINGS)
+
+    def test_does_not_match_across_lines(self):
+        self.assertEqual(self.evaluate([(0, "an\nerror")],
+                                       [("an.error", FAILURE)]), SUCCESS)
+
+    def test_worst_status_wins(self):
+        self.assertEqual(self.evaluate([(0, "a warning and an error\n")],
+                                       [("warning", WARNINGS),
+                                        ("error", FAILURE),
+                                        ("nothing", EXCEPTION)]), FAILURE)
+
+    def test_combined_with_flags_and_groups(self):
+        regexes = [(re.compile("ERROR", re.I), FAILURE),
+                   (re.compile("(fatal)"), FAILURE),
+                   ("(x)y\\1", EXCEPTION),
+                   ("boom", WARNINGS)]
+        self.assertEqual(self.evaluate([(0, "an error\n")], regexes),
+                         FAILURE)
+        self.assertEqual(self.evaluate([(0, "fatal\n")], regexes), FAILURE)
+        self.assertEqual(self.evaluate([(0, "xyx\n")], regexes), EXCEPTION)
+        self.assertEqual(self.evaluate([(0, "xyz\n")], regexes), SUCCESS)
+
+    def test_not_better_than_rc(self):
+        self.assertEqual(self.evaluate([(0, "a warning\n")],
+                                       [("warning", WARNINGS)], rc=1),
+                         FAILURE)
+
+    def test_stops_at_worst_status(self):
+        read = []
+
+        def chunks():
+            for text in ("fine\n", "retry please\n", "an error\n"):
+                read.append(text)
+                yield text
+        cmd = self.makeRemoteCommand(0, [])
+        cmd.logs['stdio'].getChunks = lambda channels, onlyText: chunks()
+        self.assertEqual(streaming_regex_log_evaluator(cmd, FakeStepStatus(),
+                                                       [("error", FAILURE),
+                                                        ("retry", RETRY)]),
+                         RETRY)
+        self.assertEqual(read, ["fine\n", "retry please\n"])
+
+    def test_long_line(self):
+        chunks = [(0, "x" * 30)] * 10 + [(0, "error"), (0, "x" * 30)]
+        self.assertEqual(self.evaluate(chunks, [("error", FAILURE)],
+                                       maxLineLength=40), FAILURE)
+
+
 class TestBuildStep(steps.BuildStepMixin, config.ConfigErrorsMixin, unittest.TestCase):
 
     class FakeBuildStep(buildstep.BuildStep):
@@ -333,6 +416,82 @@ class TestCustomStepExecution(steps.BuildStepMixin, unittest.TestCase):
         return d
 
 
+class TestRemoteCommand(unittest.TestCase):
+
+    def makeCommand(self):
+        cmd = buildstep.RemoteCommand('shell', {})
+        cmd.buildslave = mock.Mock()
+        cmd.active = True
+        cmd.step = mock.Mock()
+        cmd.step.step_status.getStatistic = lambda name, default: default
+        cmd.addStdout = mock.Mock()
+        cmd.addToLog = mock.Mock()
+        return cmd
+
+    def test_update_compressed(self):
+        cmd = self.makeCommand()
+        output = 'hello\n' * 1000
+        cmd.remote_update([[{'compressed': [
+            ('stdout', None, zlib.compress(output)),
+            ('log', 'out.log', zlib.compress('log text')),
+        ]}, 0], [{'stdout': 'more'}, 0]])
+
+        self.assertEqual(cmd.addStdout.call_args_list,
+                         [((output,),), (('more',),)])
+        cmd.addToLog.assert_called_once_with('out.log', 'log text')
+        self.assertEqual(cmd.outputBytes, len(output) + 8 + 4)
+        self.assertTrue(cmd.outputWireBytes < cmd.outputBytes)
+        self.assertNotIn('compressed', cmd.updates)
+
+        cmd.remoteComplete(None)
+        cmd.step.step_status.setStatistic.assert_has_calls([
+            mock.call('output_bytes', cmd.outputBytes),
+            mock.call('output_wire_bytes', cmd.outputWireBytes)])
+
+    def test_update_ordered(self):
+        cmd = self.makeCommand()
+        calls = []
+        cmd.addStdout = lambda data: calls.append(('stdout', data))
+        cmd.addStderr = lambda data: calls.append(('stderr', data))
+        cmd.addToLog = lambda name, data: calls.append((name, data))
+        cmd.remote_update([[{'output': [
+            ('stdout', None, 'one'),
+            ('stderr', None, 'two'),
+            ('log', 'out.log', 'three'),
+            ('stdout', None, 'four'),
+        ]}, 0]])
+
+        self.assertEqual(calls, [('stdout', 'one'), ('stderr', 'two'),
+                                 ('out.log', 'three'), ('stdout', 'four')])
+        self.assertEqual(cmd.updates, {'log': [('out.log', 'three')]})
+
+    def test_update_ordered_compressed(self):
+        cmd = self.makeCommand()
+        calls = []
+        cmd.addStdout = lambda data: calls.append(('stdout', data))
+        cmd.addStderr = lambda data: calls.append(('stderr', data))
+        output = 'hello\n' * 1000
+        cmd.remote_update([[{'compressed_output': (
+            [('stdout', None, len(output)), ('stderr', None, 4),
+             ('stdout', None, 3)],
+            zlib.compress(output + 'oops' + 'bye'))}, 0]])
+
+        self.assertEqual(calls, [('stdout', output), ('stderr', 'oops'),
+                                 ('stdout', 'bye')])
+        self.assertEqual(cmd.outputBytes, len(output) + 7)
+        self.assertTrue(cmd.outputWireBytes < cmd.outputBytes)
+        self.assertTrue(cmd.compressedUpdates)
+
+    def test_update_uncompressed(self):
+        cmd = self.makeCommand()
+        cmd.remote_update([[{'stdout': 'hello'}, 0]])
+        cmd.addStdout.assert_called_once_with('hello')
+
+        # statistics are only kept for commands with compressed updates
+        cmd.remoteComplete(None)
+        self.assertFalse(cmd.step.step_status.setStatistic.called)
+
+
 class TestRemoteShellCommand(unittest.TestCase):
 
     def test_obfuscated_arguments(self):
@@ -16,6 +16,8 @@
 import mock
 
 from buildbot.process import cache
+from buildbot.util import lru
+from twisted.internet import defer
 from twisted.trial import unittest
 
 
@@ -27,6 +29,7 @@ class CacheManager(unittest.TestCase):
     def make_config(self, **kwargs):
         cfg = mock.Mock()
         cfg.caches = kwargs
+        cfg.cacheMemoryLimit = None
         return cfg
 
     def test_get_cache_idempotency(self):
@@ -52,5 +55,52 @@ class CacheManager(unittest.TestCase):
         self.caches.get_cache("foo", None)
         self.assertIn('foo', self.caches.get_metrics())
         metric = self.caches.get_metrics()['foo']
-        for k in 'hits', 'refhits', 'misses', 'max_size':
+        for k in 'hits', 'refhits', 'misses', 'max_size', 'size', 'weight':
             self.assertIn(k, metric)
+
+    def test_memory_budget(self):
+        foo_cache = self.caches.get_cache("foo",
+                                          lambda k: defer.succeed(set([k])),
+                                          weight_fn=lambda v: 10)
+        bar_cache = self.caches.get_cache("bar",
+                                          lambda k: defer.succeed(set([k])),
+                                          weight_fn=lambda v: 5)
+        cfg = self.make_config(foo=5, bar=5)
+        cfg.cacheMemoryLimit = 25
+        d = self.caches.reconfigService(cfg)
+
+        @d.addCallback
+        def check(_):
+            for k in 1, 2:
+                foo_cache.get(k)
+            for k in 1, 2, 3:
+                bar_cache.get(k)
+            metrics = self.caches.get_metrics()
+            self.assertEqual((metrics['foo']['size'], metrics['foo']['weight']),
+                             (1, 10))
+            self.assertEqual((metrics['bar']['size'], metrics['bar']['weight']),
+                             (3, 15))
+
+            # and the limit can be lifted
+            cfg.cacheMemoryLimit = None
+            return self.caches.reconfigService(cfg)
+
+        @d.addCallback
+        def check_unlimited(_):
+            foo_cache.get(3)
+            self.assertEqual(self.caches.get_metrics()['foo']['size'], 2)
+        return d
+
+    def test_register_cache(self):
+        c1 = lru.LRUCache(lambda k: set([k]), 3, weight_fn=lambda v: 1)
+        c2 = lru.LRUCache(lambda k: set([k]), 4, weight_fn=lambda v: 1)
+        self.caches.register_cache("Builds", c1)
+        self.caches.register_cache("Builds", c2)
+        self.caches.register_cache("Builds", c2)
+        c1.get('a')
+        c2.get('a')
+        c2.get('b')
+        metric = self.caches.get_metrics()['Builds']
+        self.assertEqual(metric, dict(hits=0, refhits=0, misses=3,
+                                      max_size=7, size=3, weight=3))
+        self.assertEqual(self.caches.budget.get_weight(), 3)
@@ -22,6 +22,7 @@ from buildbot import config as config_module
 from buildbot.db import connector
 from buildbot.db import model
 from buildbot.scripts import upgrade_master
+from buildbot.status import buildfile
 from buildbot.test.util import compat
 from buildbot.test.util import dirs
 from buildbot.test.util import misc
@@ -63,6 +64,10 @@ class TestUpgradeMaster(dirs.DirsMixin, misc.StdoutAssertionsMixin,
             self.calls.append('upgradeFiles')
         self.patch(upgrade_master, 'upgradeFiles', upgradeFiles)
 
+        def upgradeBuildFiles(config, master_cfg):
+            self.calls.append('upgradeBuildFiles')
+        self.patch(upgrade_master, 'upgradeBuildFiles', upgradeBuildFiles)
+
         def upgradeDatabase(config, master_cfg):
             self.assertIsInstance(master_cfg, config_module.MasterConfig)
             self.calls.append('upgradeDatabase')
@@ -78,6 +83,9 @@ class TestUpgradeMaster(dirs.DirsMixin, misc.StdoutAssertionsMixin,
         def check(rv):
             self.assertEqual(rv, 0)
             self.assertInStdout('upgrade complete')
+            self.assertEqual(self.calls, ['checkBasedir', 'loadConfig',
+                                          'upgradeFiles', 'upgradeBuildFiles',
+                                          'upgradeDatabase'])
         return d
 
     def test_upgradeMaster_quiet(self):
@@ -255,6 +263,25 @@ class TestUpgradeMasterFunctions(dirs.DirsMixin, misc.StdoutAssertionsMixin,
         self.assertEqual(self.readFile("test/templates/root.html"), 'ROOT')
         self.assertInStdout('Decide')
 
+    def test_upgradeBuildFiles(self):
+        os.makedirs('test/bldr')
+        for filename in ('builder', '1', '2', '2-log-step-stdio'):
+            self.writeFile(os.path.join('test', 'bldr', filename), 'x')
+        converted = []
+
+        def convertPickle(filename):
+            converted.append(os.path.basename(filename))
+            return filename.endswith('2')
+        self.patch(buildfile, 'convertPickle', convertPickle)
+        master_cfg = config_module.MasterConfig()
+        master_cfg.builders = [mock.Mock(builddir='bldr'),
+                               mock.Mock(builddir='missing')]
+        master_cfg.builders[0].name = 'bldr'
+
+        upgrade_master.upgradeBuildFiles(mkconfig(), master_cfg)
+        self.assertEqual(sorted(converted), ['1', '2'])
+        self.assertInStdout('converted 1 builds of bldr')
+
     @defer.inlineCallbacks
     def test_upgradeDatabase(self):
         setup = mock.Mock(side_effect=lambda **kwargs: defer.succeed(None))
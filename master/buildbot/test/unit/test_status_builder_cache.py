@@ -74,3 +74,12 @@ class TestBuildStatus(unittest.TestCase):
                              'propval%d' % build.number)
             self.assertEqual(b.buildCache.hits, hits + 1)
             hits = hits + 1
+
+    def testBuildCacheWeight(self):
+        b = self.setupBuilder('builder_1')
+        build = b.newBuild()
+        build.buildStarted(build)
+        self.assertEqual(b.buildCache.weight, 0)
+        build.buildFinished()
+        self.assertEqual(b.buildCache.weight,
+                         os.path.getsize(b.makeBuildFilename(build.number)))
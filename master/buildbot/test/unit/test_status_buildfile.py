@@ -0,0 +1,203 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import cPickle
+import mock
+import os
+
+from buildbot import config
+from buildbot import sourcestamp
+from buildbot.changes import changes
+from buildbot.status import builder
+from buildbot.status import buildfile
+from buildbot.status import logfile
+from buildbot.status.results import WARNINGS
+from buildbot.status.testresult import TestResult
+from buildbot.test.fake import fakemaster
+from buildbot.util.lru import LRUCache
+from twisted.trial import unittest
+
+
+class TestBuildFile(unittest.TestCase):
+
+    def setUp(self):
+        m = fakemaster.make_master()
+        m.config = config.MasterConfig()
+        self.builder = builder.BuilderStatus(buildername='bldr', category=None,
+                                             master=m, description=None)
+        self.builder.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.builder.basedir)
+        self.builder.determineNextBuildNumber()
+        self.builder.currentBigState = 'idle'
+        self.builder.status = 'idle'
+
+    def makeBuild(self):
+        build = self.builder.newBuild()
+        ch = changes.Change('me', ['b.c', 'a.c'], 'fix \xc3\xa9', revision='r1',
+                            branch='br', properties={'x': 1})
+        ch.number = 13
+        build.setSourceStamps([sourcestamp.SourceStamp(
+            branch='br', revision='r1', patch=(1, 'diff \xff', 'sub'),
+            patch_info=('me', 'a patch'), changes=[ch], codebase='cb')])
+        build.setReason('because')
+        build.setBlamelist(['me'])
+        build.setSlavename('sl')
+        build.setProperty('list', [1, 'two'], 'test')
+        build.addTestResult(TestResult(('a', 'b'), 0, ['ok'], {'out': 'x'}))
+        step = build.addStepWithName('compile')
+        build.buildStarted(build)
+        step.stepStarted()
+        loog = step.addLog('stdio')
+        loog.addStdout('hello\n')
+        step.addHTMLLog('report', '<b>hi</b>')
+        step.addURL('docs', 'http://docs')
+        step.setText(['compile', 'warnings'])
+        step.setText2(['compile'])
+        step.setStatistic('warnings', 3)
+        step.stepFinished(WARNINGS)
+        build.setText(['build', '\xff warnings'])
+        build.setResults(WARNINGS)
+        build.buildFinished()
+        return build
+
+    def loadBuild(self, number):
+        self.builder.buildCache = LRUCache(self.builder.cacheMiss)
+        return self.builder.loadBuildFromFile(number)
+
+    def test_round_trip(self):
+        orig = self.makeBuild()
+        build = self.loadBuild(orig.number)
+        self.assertEqual(build.getTimes(), orig.getTimes())
+        self.assertEqual(build.getResults(), WARNINGS)
+        self.assertEqual(build.getReason(), 'because')
+        self.assertEqual(build.getResponsibleUsers(), ['me'])
+        self.assertEqual(build.getSlavename(), 'sl')
+        self.assertEqual(build.getText(), ['build', '\xff warnings', 'compile'])
+        self.assertEqual(build.getProperty('list'), [1, 'two'])
+        self.assertEqual(build.getTestResults()[('a', 'b')].getLogs(),
+                         {'out': 'x'})
+
+        ss = build.getSourceStamps()[0]
+        self.assertEqual((ss.branch, ss.revision, ss.codebase),
+                         ('br', 'r1', 'cb'))
+        self.assertEqual(ss.patch, (1, 'diff \xff', 'sub'))
+        self.assertEqual(ss.patch_info, ('me', 'a patch'))
+        ch = build.getChanges()[0]
+        self.assertEqual((ch.number, ch.who, ch.comments, ch.files),
+                         (13, 'me', u'fix \xe9', ['a.c', 'b.c']))
+        self.assertEqual(ch.properties.getProperty('x'), 1)
+
+        step = build.getSteps()[0]
+        self.assertEqual(step.getName(), 'compile')
+        self.assertEqual(step.getResults(), (WARNINGS, ['compile']))
+        self.assertEqual(step.getStatistic('warnings'), 3)
+        self.assertEqual(step.getURLs(), {'docs': 'http://docs'})
+        self.assertIdentical(step.getBuild(), build)
+        stdio, report = step.getLogs()
+        self.assertEqual(stdio.getText(), 'hello\n')
+        self.assertEqual(stdio.getFilename(),
+                         orig.getSteps()[0].getLogs()[0].getFilename())
+        self.assertEqual(report.html, '<b>hi</b>')
+
+    def test_steps_loaded_lazily(self):
+        orig = self.makeBuild()
+        build = self.loadBuild(orig.number)
+        self.assertNotIn('steps', build.__dict__)
+        self.assertEqual(len(build.getSteps()), 1)
+        self.assertIn('steps', build.__dict__)
+
+    def test_steps_materialized_on_use(self):
+        orig = self.makeBuild()
+        orig.addStepWithName('test')
+        orig.saveYourself()
+        build = self.loadBuild(orig.number)
+        steps = build.getSteps()
+        self.assertIsInstance(steps, buildfile.StepList)
+        self.assertEqual(len(steps), 2)
+        self.assertFalse(steps.isMaterialized(0))
+        self.assertEqual(steps[-1].getName(), 'test')
+        self.assertFalse(steps.isMaterialized(0))
+        self.assertTrue(steps.isMaterialized(1))
+        self.assertEqual([s.getName() for s in steps[:1]], ['compile'])
+        self.assertIdentical(steps[0], steps[0])
+        self.assertEqual(steps.index(steps[1]), 1)
+
+    def test_pruned_logs_left_out(self):
+        orig = self.makeBuild()
+        orig.addStepWithName('test')
+        orig.saveYourself()
+        stdio = orig.getSteps()[0].getLogs()[0]
+        os.unlink(stdio.getFilename())
+        build = self.loadBuild(orig.number)
+        listdir = mock.Mock(wraps=os.listdir)
+        self.patch(os, 'listdir', listdir)
+        self.patch(logfile.LogFile, 'hasContents', mock.Mock())
+        steps = build.getSteps()
+        self.assertEqual([l.getName() for l in steps[0].getLogs()],
+                         ['report'])
+        self.assertEqual(steps[1].getLogs(), [])
+        # the builder directory is listed once for the whole build
+        self.assertEqual(listdir.call_count, 1)
+        self.assertFalse(logfile.LogFile.hasContents.called)
+
+    def test_compressed_logs_listed(self):
+        orig = self.makeBuild()
+        filename = orig.getSteps()[0].getLogs()[0].getFilename()
+        os.rename(filename, filename + '.bz2')
+        build = self.loadBuild(orig.number)
+        self.assertEqual([l.getName() for l in build.getSteps()[0].getLogs()],
+                         ['stdio', 'report'])
+
+    def test_file_format(self):
+        orig = self.makeBuild()
+        with open(self.builder.makeBuildFilename(orig.number)) as f:
+            self.assertTrue(buildfile.isBuildFile(f))
+            self.assertEqual(f.readline(), 'buildbot-build-status 1\n')
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_newer_version(self):
+        orig = self.makeBuild()
+        filename = self.builder.makeBuildFilename(orig.number)
+        with open(filename) as f:
+            lines = f.readlines()
+        with open(filename, 'w') as f:
+            f.write('buildbot-build-status 99\n')
+            f.writelines(lines[1:])
+        self.assertRaises(IndexError, self.loadBuild, orig.number)
+
+    def test_pickled_build(self):
+        orig = self.makeBuild()
+        filename = self.builder.makeBuildFilename(orig.number)
+        with open(filename, 'wb') as f:
+            cPickle.dump(orig, f, -1)
+        os.unlink(orig.getSteps()[0].getLogs()[0].getFilename())
+        build = self.loadBuild(orig.number)
+        self.assertEqual(build.getSteps()[0].getName(), 'compile')
+        self.assertEqual([l.getName() for l in build.getSteps()[0].getLogs()],
+                         ['report'])
+
+    def test_convertPickle(self):
+        orig = self.makeBuild()
+        filename = self.builder.makeBuildFilename(orig.number)
+        with open(filename, 'wb') as f:
+            cPickle.dump(orig, f, -1)
+        self.assertTrue(buildfile.convertPickle(filename))
+        self.assertFalse(buildfile.convertPickle(filename))
+        build = self.loadBuild(orig.number)
+        self.assertEqual(build.getProperty('list'), [1, 'two'])
+        self.assertEqual(build.getSteps()[0].getLogs()[0].getText(),
+                         'hello\n')
@@ -0,0 +1,151 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+
+from buildbot import sourcestamp
+from buildbot.changes import changes
+from buildbot.status import builder
+from buildbot.status import buildsummary
+from buildbot.status.results import FAILURE
+from buildbot.status.results import SUCCESS
+from buildbot.test.fake import fakemaster
+from buildbot.util.lru import LRUCache
+from twisted.trial import unittest
+
+
+class TestBuildSummaries(unittest.TestCase):
+
+    def setUp(self):
+        m = fakemaster.make_master()
+        self.builder = builder.BuilderStatus(buildername='bldr', category=None,
+                                             master=m, description=None)
+        self.builder.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.builder.basedir)
+        self.builder.determineNextBuildNumber()
+        self.builder.currentBigState = 'idle'
+        self.builder.status = 'idle'
+
+    def makeBuild(self, branch='master', results=SUCCESS, who=None):
+        build = self.builder.newBuild()
+        chs = []
+        if who:
+            ch = changes.Change(who, ['f'], 'comments', revision='abc',
+                                branch=branch)
+            ch.number = 10 + build.number
+            chs.append(ch)
+        build.setSourceStamps([sourcestamp.SourceStamp(branch=branch,
+                                                       revision='abc',
+                                                       changes=chs)])
+        build.setBlamelist([who] if who else [])
+        build.setSlavename('sl')
+        step = build.addStepWithName('compile')
+        build.buildStarted(build)
+        step.stepStarted()
+        step.stepFinished(results)
+        build.setResults(results)
+        build.buildFinished()
+        return build
+
+    def loadCounter(self):
+        loads = []
+        load = self.builder.loadBuildFromFile
+
+        def loadBuildFromFile(number):
+            loads.append(number)
+            return load(number)
+        self.patch(self.builder, 'loadBuildFromFile', loadBuildFromFile)
+        return loads
+
+    def forgetBuilds(self):
+        # simulate a master restart by emptying the build cache and reading
+        # the index back from disk
+        self.builder.buildCache = LRUCache(self.builder.cacheMiss)
+        self.builder.summaries = buildsummary.BuildSummaryIndex(self.builder)
+
+    def test_summary_written(self):
+        build = self.makeBuild(who='me')
+        self.forgetBuilds()
+        summary = self.builder.getBuildSummary(build.number)
+        self.assertIsInstance(summary, buildsummary.BuildSummary)
+        self.assertEqual(summary.getNumber(), build.number)
+        self.assertEqual(summary.getTimes(), build.getTimes())
+        self.assertEqual(summary.getResults(), SUCCESS)
+        self.assertEqual(summary.getSlavename(), 'sl')
+        self.assertEqual(summary.getResponsibleUsers(), ['me'])
+        self.assertEqual([(c.number, c.who) for c in summary.getChanges()],
+                         [(10, 'me')])
+        self.assertEqual([(ss.branch, ss.revision)
+                          for ss in summary.getSourceStamps()],
+                         [('master', 'abc')])
+        self.assertEqual([(st.getName(), st.getResults())
+                          for st in summary.getSteps()],
+                         [('compile', SUCCESS)])
+
+    def test_generateFinishedBuilds_filters_summaries(self):
+        self.makeBuild(branch='master')
+        self.makeBuild(branch='stable', results=FAILURE)
+        self.makeBuild(branch='master', results=FAILURE)
+        self.forgetBuilds()
+        loads = self.loadCounter()
+        builds = list(self.builder.generateFinishedBuilds(
+            branches=['stable'], results=[FAILURE]))
+        self.assertEqual([b.getNumber() for b in builds], [1])
+        # only the matching build was loaded, as a full BuildStatus
+        self.assertEqual(loads, [1])
+        self.assertEqual(builds[0].getSteps()[0].getName(), 'compile')
+
+    def test_eventGenerator_committers(self):
+        self.makeBuild(who='me')
+        self.makeBuild(who='you')
+        self.forgetBuilds()
+        loads = self.loadCounter()
+        events = list(self.builder.eventGenerator(committers=['me']))
+        self.assertEqual([e.getNumber() for e in events
+                          if hasattr(e, 'getNumber')], [0])
+        self.assertEqual(loads, [0])
+
+    def test_unindexed_builds_backfilled(self):
+        self.makeBuild()
+        os.unlink(os.path.join(self.builder.basedir, 'summaries'))
+        self.forgetBuilds()
+        self.assertEqual(len(list(self.builder.generateFinishedBuilds())), 1)
+        self.forgetBuilds()
+        self.assertIsInstance(self.builder.getBuildSummary(0),
+                              buildsummary.BuildSummary)
+
+    def test_truncated_line_ignored(self):
+        self.makeBuild()
+        with open(os.path.join(self.builder.basedir, 'summaries'), 'a') as f:
+            f.write('{"number": 1, "sta')
+        self.forgetBuilds()
+        self.assertEqual(self.builder.summaries.getSummary(1), None)
+        self.assertNotEqual(self.builder.summaries.getSummary(0), None)
+
+    def test_prune_rewrites(self):
+        for i in range(4):
+            self.makeBuild()
+        index = self.builder.summaries
+        index.prune(2)
+        self.assertEqual(sorted(index.summaries), [2, 3])
+        # two stale lines against two live ones is not enough to rewrite
+        with open(index.getFilename()) as f:
+            self.assertEqual(len(f.readlines()), 4)
+        index.prune(3)
+        with open(index.getFilename()) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        self.forgetBuilds()
+        self.assertEqual(sorted(n for n in range(4)
+                                if n in self.builder.summaries), [3])
@@ -0,0 +1,160 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import threading
+
+from buildbot import config
+from buildbot.process import metrics
+from buildbot.status import logcompressor
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.python import log
+from twisted.trial import unittest
+
+
+class LogCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        # job results come back through the clock
+        self.clock.callFromThread = reactor.callFromThread
+        self.compressor = logcompressor.LogCompressor()
+        self.compressor._reactor = self.clock
+        self.observed = []
+
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                self.observed.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+    def tearDown(self):
+        if self.compressor.running:
+            return self.compressor.stopService()
+
+    def reconfig(self, **kwargs):
+        new_config = config.MasterConfig()
+        for k, v in kwargs.iteritems():
+            setattr(new_config, k, v)
+        return self.compressor.reconfigService(new_config)
+
+    def blocker(self, rv=(10, 5)):
+        # return a job that runs until the returned event is set
+        ev = threading.Event()
+
+        def job():
+            ev.wait()
+            return rv
+        return job, ev
+
+    def counters(self, name):
+        return [m.count for m in self.observed
+                if isinstance(m, metrics.MetricCountEvent)
+                and m.counter == name]
+
+    def test_not_running(self):
+        d = self.compressor.compress(lambda: (1, 1))
+        d.addCallback(self.assertEqual, (1, 1))
+        return d
+
+    @defer.inlineCallbacks
+    def test_compress(self):
+        yield self.reconfig()
+        self.compressor.startService()
+        rv = yield self.compressor.compress(lambda: (100, 20))
+        self.assertEqual(rv, (100, 20))
+        self.assertEqual(self.counters('LogCompressor.bytes_in'), [100])
+        self.assertEqual(self.counters('LogCompressor.bytes_out'), [20])
+        self.assertEqual(self.counters('LogCompressor.queued')[-1], 0)
+
+    @defer.inlineCallbacks
+    def test_failure(self):
+        self.compressor.startService()
+
+        def fail():
+            raise RuntimeError("oops")
+        try:
+            yield self.compressor.compress(fail)
+        except RuntimeError:
+            pass
+        else:
+            self.fail("should have failed")
+        self.assertEqual(self.compressor.active, 0)
+
+    @defer.inlineCallbacks
+    def test_workers_and_queue_bound(self):
+        yield self.reconfig(logCompressionWorkers=1,
+                            logCompressionQueueSize=1)
+        self.compressor.startService()
+        job, ev = self.blocker()
+        d1 = self.compressor.compress(job)
+        d2 = self.compressor.compress(job)
+        self.assertEqual((self.compressor.active,
+                          len(self.compressor.queue)), (1, 1))
+        # the queue is full, so this one waits for room in it
+        d3 = self.compressor.compress(lambda: (20, 5))
+        self.assertEqual(len(self.compressor.overflow), 1)
+        self.assertEqual(self.counters('LogCompressor.overflowed'), [1])
+        ev.set()
+        rvs = yield defer.gatherResults([d1, d2, d3])
+        self.assertEqual(rvs, [(10, 5), (10, 5), (20, 5)])
+        self.assertEqual(len(self.compressor.overflow), 0)
+
+    @defer.inlineCallbacks
+    def test_overloaded(self):
+        yield self.reconfig(logCompressionMaxDelay=0.5)
+        self.compressor.startService()
+        # the reactor is two seconds late for the load check
+        self.clock.advance(3)
+        self.assertTrue(self.compressor.overloaded)
+        d = self.compressor.compress(lambda: (1, 1))
+        self.assertEqual(len(self.compressor.queue), 1)
+        # and then on time again
+        self.clock.advance(1)
+        self.assertFalse(self.compressor.overloaded)
+        self.assertEqual(len(self.compressor.queue), 0)
+        rv = yield d
+        self.assertEqual(rv, (1, 1))
+
+    @defer.inlineCallbacks
+    def test_stop_releases_queue(self):
+        yield self.reconfig(logCompressionWorkers=1)
+        self.compressor.startService()
+        job, ev = self.blocker()
+        d1 = self.compressor.compress(job)
+        d2 = self.compressor.compress(job)
+        self.compressor.queueSize = 1
+        d3 = self.compressor.compress(job)
+        ev.set()
+        yield self.compressor.stopService()
+        rvs = yield defer.gatherResults([d2, d3])
+        self.assertEqual(rvs, [None, None])
+        rv = yield d1
+        self.assertEqual(rv, (10, 5))
+
+    @defer.inlineCallbacks
+    def test_stop_does_not_block(self):
+        self.compressor.startService()
+        job, ev = self.blocker()
+        d1 = self.compressor.compress(job)
+        d = self.compressor.stopService()
+        # the job is still running, so the pool has not stopped yet
+        self.assertFalse(d.called)
+        self.assertFalse(self.compressor.running)
+        ev.set()
+        yield d
+        rv = yield d1
+        self.assertEqual(rv, (10, 5))
@@ -15,14 +15,17 @@
 
 from __future__ import with_statement
 
+import bz2
 import cPickle
 import cStringIO
 import mock
 import os
 
 from buildbot import config
+from buildbot.status import logcompressor
 from buildbot.status import logfile
 from buildbot.test.util import dirs
+from buildbot.util import framedfile
 from twisted.internet import defer
 from twisted.trial import unittest
 
@@ -59,9 +62,10 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         step = self.build_step_status = mock.Mock(name='build_step_status')
         self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
         self.setUpDirs(self.basedir)
+        self.master = step.build.builder.master = mock.Mock()
+        self.config = self.master.config = config.MasterConfig()
+        self.master.logCompressor = logcompressor.LogCompressor()
         self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
-        self.master = self.logfile.master = mock.Mock()
-        self.config = self.logfile.master.config = config.MasterConfig()
 
     def tearDown(self):
         if self.logfile.openfile:
@@ -340,3 +344,192 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
     def test_compressLog_none(self):
         self.config.logCompressionMethod = None
         return self.do_test_compressLog('', expect_comp=False)
+
+    # chunk index
+
+    def add_lines(self, entries):
+        for chan, txt in entries:
+            self.logfile.addEntry(chan, txt)
+
+    def test_chunkIndex_entries(self):
+        self.logfile.chunkSize = 4
+        self.add_lines([(0, 'ab\ncd'), (1, 'e\n')])
+        self.logfile.finish()
+        index = self.logfile._getChunkIndex(self.logfile.getFile())
+        self.assertEqual([index[i] for i in range(len(index))],
+                         [(0, 0, 4, 1, 0, 0), (8, 0, 1, 0, 4, 1),
+                          (13, 1, 2, 1, 5, 1)])
+        self.assertEqual(index.getFileLength(),
+                         os.path.getsize(self.logfile.getFilename()))
+
+    def test_getChunksForRange(self):
+        self.logfile.chunkSize = 4
+        self.add_lines([(0, 'abcdefgh'), (1, 'ijkl'), (0, 'mnop')])
+        self.logfile.finish()
+        self.assertEqual(list(self.logfile.getChunksForRange(3, 10)),
+                         [(0, 'd'), (0, 'efgh'), (1, 'ij')])
+        self.assertEqual(list(self.logfile.getChunksForRange(14)),
+                         [(0, 'op')])
+        self.assertEqual(list(self.logfile.getChunksForRange(
+            2, channels=[0], onlyText=True)), ['cd', 'efgh', 'mnop'])
+
+    def test_getChunksForRange_running(self):
+        self.add_lines([(0, 'abc'), (1, 'def')])
+        # 'def' has not been merged to disk yet
+        self.assertEqual(list(self.logfile.getChunksForRange(1, 5)),
+                         [(0, 'bc'), (1, 'de')])
+
+    def test_getChunksForLines(self):
+        self.logfile.chunkSize = 5
+        self.add_lines([(2, 'hdr\n'), (0, 'one\ntwo\nthree\n'),
+                        (1, 'four\nfive')])
+        self.logfile.finish()
+        self.assertEqual(
+            "".join(self.logfile.getChunksForLines(1, 3, onlyText=True)),
+            'one\ntwo\n')
+        self.assertEqual(
+            "".join(self.logfile.getChunksForLines(4, onlyText=True)),
+            'four\nfive')
+        self.assertEqual(list(self.logfile.getChunksForLines(0, 1)),
+                         [(2, 'hdr\n')])
+        self.assertEqual(list(self.logfile.getChunksForLines(9)), [])
+
+    def test_getChunksForChannelRange(self):
+        self.logfile.chunkSize = 4
+        self.add_lines([(2, 'hdr\n'), (0, 'abcdefgh'), (2, 'xx'),
+                        (1, 'ijkl'), (0, 'mn')])
+        self.assertEqual(self.logfile.getChannelTextLength([0, 1]), 14)
+        self.assertEqual(self.logfile.getChannelTextLength(), 20)
+        self.assertEqual(list(self.logfile.getChunksForChannelRange(
+            3, 10, channels=[0, 1])), [(0, 'd'), (0, 'efgh'), (1, 'ij')])
+        # 'mn' has not been merged to disk yet
+        self.assertEqual(list(self.logfile.getChunksForChannelRange(
+            11, channels=[0, 1], onlyText=True)), ['l', 'mn'])
+        self.assertEqual(list(self.logfile.getChunksForChannelRange(
+            14, channels=[0, 1])), [])
+        self.logfile.finish()
+        self.assertEqual("".join(self.logfile.getChunksForChannelRange(
+            0, 9, channels=[0, 1], onlyText=True)), 'abcdefghi')
+
+    def test_getChunksForChannelLines(self):
+        self.logfile.chunkSize = 5
+        self.add_lines([(2, 'hdr\n'), (0, 'one\ntwo\nthree\n'),
+                        (2, 'hdr\n'), (1, 'four\nfive')])
+        self.logfile.finish()
+        self.assertEqual("".join(self.logfile.getChunksForChannelLines(
+            1, 3, channels=[0, 1], onlyText=True)), 'two\nthree\n')
+        self.assertEqual("".join(self.logfile.getChunksForChannelLines(
+            3, channels=[0, 1], onlyText=True)), 'four\nfive')
+        self.assertEqual("".join(self.logfile.getChunksForChannelLines(
+            0, 1, channels=[0, 1], onlyText=True)), 'one\n')
+        self.assertEqual(list(self.logfile.getChunksForChannelLines(
+            9, channels=[0, 1])), [])
+
+    def test_getModificationTime(self):
+        self.add_lines([(0, 'one\n')])
+        self.logfile.finish()
+        self.assertEqual(self.logfile.getModificationTime(),
+                         os.path.getmtime(self.logfile.getFilename()))
+
+    def test_getTail(self):
+        self.logfile.chunkSize = 5
+        self.add_lines([(0, 'one\ntwo\nthree\n'), (2, 'hdr\n'),
+                        (1, 'four\nfive\n')])
+        self.logfile.finish()
+        self.assertEqual("".join(self.logfile.getTail(3, onlyText=True)),
+                         'hdr\nfour\nfive\n')
+        self.assertEqual(self.logfile.getTail(2, channels=[0]),
+                         [(0, 't'), (0, 'wo\nth'), (0, 'ree\n')])
+        self.assertEqual(self.logfile.getTail(0), [])
+        self.assertEqual(
+            "".join(self.logfile.getTail(100, onlyText=True)),
+            'one\ntwo\nthree\nhdr\nfour\nfive\n')
+
+    def test_getTail_partial_line(self):
+        self.add_lines([(0, 'one\ntwo\nthr')])
+        self.assertEqual(self.logfile.getTail(2, onlyText=True),
+                         ['two\nthr'])
+
+    def test_chunkIndex_rebuilt(self):
+        self.add_lines([(0, 'one\n'), (1, 'two\n')])
+        self.logfile.finish()
+        os.unlink(self.logfile.getFilename() + '.idx')
+        self.pickle_and_restore()
+        self.assertEqual(self.logfile.getTail(1), [(1, 'two\n')])
+        # and the rebuilt index was saved
+        self.assertTrue(os.path.exists(self.logfile.getFilename() + '.idx'))
+
+    def test_chunkIndex_compressed(self):
+        self.logfile.chunkSize = 4
+        self.add_lines([(0, 'one\ntwo\nthree\n')])
+        self.logfile.finish()
+        self.config.logCompressionMethod = 'gz'
+        d = self.logfile.compressLog()
+
+        def check(_):
+            self.assertFalse(os.path.exists(self.logfile.getFilename()))
+            self.assertEqual(
+                "".join(self.logfile.getChunksForLines(1, 2, onlyText=True)),
+                'two\n')
+        d.addCallback(check)
+        return d
+
+    def test_compressLog_framed(self):
+        self.logfile.compressionFrameSize = 16
+        self.add_lines([(0, 'line %d\n' % i) for i in range(20)])
+        self.logfile.finish()
+        self.config.logCompressionMethod = 'bz2'
+        d = self.logfile.compressLog()
+
+        def check(_):
+            self.assertTrue(os.path.exists(
+                self.logfile.getFilename() + '.bz2.frames'))
+            fp = self.logfile.getFile()
+            self.assertIsInstance(fp, framedfile.FramedFile)
+            self.assertEqual(self.logfile.getText(),
+                             "".join(['line %d\n' % i for i in range(20)]))
+            self.assertEqual(self.logfile.getTail(1), [(0, 'line 19\n')])
+        d.addCallback(check)
+        return d
+
+    def test_compressLog_frame_index_lost(self):
+        self.logfile.compressionFrameSize = 16
+        self.add_lines([(0, 'line %d\n' % i) for i in range(20)])
+        self.logfile.finish()
+        self.config.logCompressionMethod = 'bz2'
+        d = self.logfile.compressLog()
+
+        def check(_):
+            frames = self.logfile.getFilename() + '.bz2.frames'
+            os.unlink(frames)
+            # every frame is read, not just the first
+            self.assertEqual(self.logfile.getText(),
+                             "".join(['line %d\n' % i for i in range(20)]))
+            # and the index is saved again
+            self.assertTrue(os.path.exists(frames))
+            self.assertTrue(len(self.logfile.getFile().frames) > 1)
+        d.addCallback(check)
+        return d
+
+    def test_getFile_legacy_bz2(self):
+        self.delete_logfile()
+        f = bz2.BZ2File(os.path.join(self.basedir, '123-stdio.bz2'), 'w')
+        f.write('13:0hello, world,')
+        f.close()
+        self.pickle_and_restore()
+        self.assertEqual(self.logfile.getText(), 'hello, world')
+
+    def test_compressLog_not_run(self):
+        self.add_lines([(0, 'xyz')])
+        self.logfile.finish()
+        self.config.logCompressionMethod = 'gz'
+        self.patch(self.master.logCompressor, 'compress',
+                   lambda fn: defer.succeed(None))
+        d = self.logfile.compressLog()
+
+        def check(_):
+            self.assertTrue(os.path.exists(self.logfile.getFilename()))
+            self.assertFalse(
+                os.path.exists(self.logfile.getFilename() + '.gz'))
+        d.addCallback(check)
+        return d
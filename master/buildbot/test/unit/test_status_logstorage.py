@@ -0,0 +1,521 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import cPickle
+import mock
+import os
+
+from buildbot import config
+from buildbot.status import logfile
+from buildbot.status import logstorage
+from buildbot.test.util import dirs
+from buildbot.util import safeTranslate
+from twisted.internet import defer
+from twisted.trial import unittest
+
+
+class FakeChunkStore(logstorage.ChunkStore):
+
+    def __init__(self):
+        logstorage.ChunkStore.__init__(self)
+        self.chunks = {}
+        self.puts = []
+        self.gets = []
+        # if not None, writes wait here instead of happening at once
+        self.held = None
+
+    def _run(self, fn, *args):
+        if self.held is None:
+            return defer.maybeDeferred(fn, *args)
+        d = defer.Deferred()
+        d.addCallback(lambda _: fn(*args))
+        self.held.append(d)
+        return d
+
+    def _putChunks(self, key, stream, chunks):
+        self.puts.append((stream, [c[0] for c in chunks]))
+        for chunk in chunks:
+            self.chunks[(key, stream, chunk[0])] = chunk
+
+    def _getChunks(self, key, stream, first, last):
+        self.gets.append((stream, first, last))
+        return [self.chunks[(key, stream, seq)]
+                for seq in xrange(first, last + 1)
+                if (key, stream, seq) in self.chunks]
+
+    def _getLastChunk(self, key, stream):
+        seqs = [k[2] for k in self.chunks if k[:2] == (key, stream)]
+        if not seqs:
+            return None
+        return max(seqs), self.chunks[(key, stream, max(seqs))][1], 1234
+
+    def _deleteLog(self, key, streams):
+        for k in self.chunks.keys():
+            if k[0] == key and k[1] in streams:
+                del self.chunks[k]
+
+
+class TestChunkWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.store = FakeChunkStore()
+        self.writer = logstorage.ChunkWriter(self.store, 'k',
+                                             logstorage.DATA, 4, 2)
+
+    def test_batches(self):
+        self.writer.write('abcdefg')
+        self.assertEqual(self.store.puts, [])
+        self.writer.write('hij')
+        self.assertEqual(self.store.puts, [(0, [0, 1])])
+        self.writer.flush()
+        self.assertEqual(self.store.puts, [(0, [0, 1]), (0, [2])])
+        self.assertEqual(self.store.getLastChunk('k', 0), (2, 2, 1234))
+
+    def test_read_while_writing(self):
+        self.writer.write('abcdefghij')
+        self.writer.seek(2)
+        self.assertEqual(self.writer.read(), 'cdefghij')
+        # reads of chunks that are not stored yet come from memory
+        self.writer.write('klm')
+        self.writer.seek(-5, 2)
+        self.assertEqual(self.writer.read(3), 'ijk')
+        self.assertEqual(self.writer.read(), 'lm')
+        self.writer.seek(0)
+        self.assertEqual(self.writer.read(), 'abcdefghijklm')
+
+    def test_write_appends(self):
+        self.writer.write('abc')
+        self.writer.seek(0)
+        self.writer.read(1)
+        self.writer.write('def')
+        self.assertEqual(self.writer.tell(), 6)
+        self.writer.seek(1)
+        self.assertEqual(self.writer.read(), 'bcdef')
+
+    def test_reader(self):
+        self.writer.write('abcdefghijklmn')
+        self.writer.close()
+        reader = logstorage.ChunkReader(self.store, 'k', logstorage.DATA,
+                                        4, 14)
+        reader.seek(5)
+        self.assertEqual(reader.read(6), 'fghijk')
+        # both chunks were fetched at once
+        self.assertEqual(self.store.gets, [(0, 1, 2)])
+        self.assertEqual(reader.read(), 'lmn')
+        # and the kept chunk was not fetched again
+        self.assertEqual(self.store.gets, [(0, 1, 2), (0, 3, 3)])
+
+
+class TestChunkCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = logstorage.ChunkCache(3)
+        for key in 'abc':
+            cache[key] = key.upper()
+        self.assertEqual(cache['a'], 'A')
+        cache['d'] = 'D'
+        self.assertEqual(sorted(cache.keys()), ['a', 'c', 'd'])
+        cache['c'] = 'C2'
+        cache['e'] = 'E'
+        self.assertEqual(sorted(cache.keys()), ['c', 'd', 'e'])
+        self.assertEqual(cache.get('c'), 'C2')
+        self.assertEqual(cache.get('a'), None)
+
+    def test_many_uses(self):
+        cache = logstorage.ChunkCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        for i in range(1000):
+            cache['a']
+        self.assertTrue(len(cache.queue) < 200)
+        cache['c'] = 3
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+
+    def test_weight(self):
+        cache = logstorage.ChunkCache(10, 10, len)
+        cache['a'] = 'xxxx'
+        cache['b'] = 'xxxx'
+        cache['c'] = 'xxxx'
+        self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+        self.assertEqual(cache.weight, 8)
+        self.assertEqual(cache.pop('b'), 'xxxx')
+        self.assertEqual(cache.weight, 4)
+        # the most recently used entry is kept, however heavy
+        cache['d'] = 'x' * 20
+        self.assertEqual(cache.keys(), ['d'])
+        self.assertEqual(cache.weight, 20)
+
+
+class TestChunkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = FakeChunkStore()
+        self.store.held = []
+
+    def release(self):
+        held, self.store.held = self.store.held, []
+        for d in held:
+            d.callback(None)
+
+    def test_unwritten(self):
+        self.store.putChunks('k', 0, [(0, 2, 'ab'), (1, 1, 'c')])
+        self.assertEqual(self.store.puts, [])
+        # queued chunks are read from memory
+        self.assertEqual(self.store.getChunks('k', 0, 0, 1),
+                         [(0, 2, 'ab'), (1, 1, 'c')])
+        self.assertEqual(self.store.getLastChunk('k', 0)[:2], (1, 1))
+        self.assertNotEqual(self.store.shutdownTrigger, None)
+        self.release()
+        self.assertEqual(self.store.puts, [(0, [0, 1])])
+        self.assertEqual(self.store.unwritten, {})
+        self.assertEqual(self.store.shutdownTrigger, None)
+        self.assertEqual(self.store.getChunks('k', 0, 0, 1),
+                         [(0, 2, 'ab'), (1, 1, 'c')])
+
+    def test_writes_in_order(self):
+        self.store.putChunks('k', 0, [(0, 1, 'a')])
+        self.store.putChunks('k', 0, [(0, 2, 'ab')])
+        self.release()
+        self.release()
+        self.assertEqual(self.store.puts, [(0, [0]), (0, [0])])
+        self.assertEqual(self.store.chunks[('k', 0, 0)], (0, 2, 'ab'))
+        self.assertEqual(self.store.unwritten, {})
+
+    def test_last_chunk_cached(self):
+        self.store.held = None
+        self.store.putChunks('k', 0, [(0, 4, 'abcd')])
+        self.store._getLastChunk = mock.Mock(
+            side_effect=self.store._getLastChunk)
+        self.store.lastChunks.clear()
+        self.assertEqual(self.store.getLastChunk('k', 0), (0, 4, 1234))
+        self.assertEqual(self.store.getLastChunk('k', 0), (0, 4, 1234))
+        self.assertEqual(self.store._getLastChunk.call_count, 1)
+        # and kept up to date by writes
+        self.store.putChunks('k', 0, [(1, 2, 'ef')])
+        self.assertEqual(self.store.getLastChunk('k', 0)[:2], (1, 2))
+        self.assertEqual(self.store._getLastChunk.call_count, 1)
+
+    def test_deleteLog(self):
+        self.store.held = None
+        self.store.putChunks('k', 0, [(0, 4, 'abcd'), (1, 4, 'efgh')])
+        self.store.putChunks('k', 1, [(0, 4, 'ijkl')])
+        self.store.held = []
+        self.store.deleteLog('k')
+        self.store.putChunks('k', 0, [(0, 1, 'z')])
+        self.store.lastChunks.clear()
+        # the old chunks are not read while they are being deleted
+        self.assertEqual(self.store.getLastChunk('k', 0)[:2], (0, 1))
+        self.assertEqual(self.store.getLastChunk('k', 1), None)
+        self.assertEqual(self.store.getChunks('k', 0, 0, 1), [(0, 1, 'z')])
+        self.release()
+        self.release()
+        self.assertEqual(sorted(self.store.chunks),
+                         [('k', 0, 0)])
+        self.assertEqual(self.store.deleting, {})
+
+    def test_loadLogs(self):
+        self.store.held = None
+        self.store.putChunks('k', 0, [(0, 4, 'abcd'), (1, 2, 'ef')])
+        self.store.putChunks('k', 1, [(0, 4, 'ijkl')])
+        self.store.lastChunks.clear()
+        self.store.held = []
+        loaded = []
+        self.store.loadLogs(['k'], contents=True).addCallback(loaded.append)
+        self.assertEqual(loaded, [])
+        self.release()
+        self.assertEqual(loaded, [None])
+        # later reads are served from memory
+        self.store._getChunks = mock.Mock()
+        self.store._getLastChunk = mock.Mock()
+        self.assertEqual(self.store.getLastChunk('k', 0), (1, 2, 1234))
+        self.assertEqual(self.store.getChunks('k', 0, 1, 1), [(1, 2, 'ef')])
+        self.assertEqual(self.store.getChunks('k', 1, 0, 0),
+                         [(0, 4, 'ijkl')])
+        self.assertFalse(self.store._getChunks.called)
+        self.assertFalse(self.store._getLastChunk.called)
+        # and loading them again does nothing
+        self.store.loadLogs(['k'], contents=True)
+        self.assertEqual(self.store.held, [])
+
+    def test_loadLogs_after_writes(self):
+        self.store.putChunks('k', 0, [(0, 4, 'abcd')])
+        self.store.loadLogs(['k'], contents=True)
+        self.assertEqual(len(self.store.held), 1)
+        self.release()
+        self.release()
+        self.assertEqual(self.store.loaded[('k', 0)], {0: (0, 4, 'abcd')})
+        # a write replaces what was loaded
+        self.store.putChunks('k', 0, [(0, 1, 'z')])
+        self.assertNotIn(('k', 0), self.store.loaded)
+        self.assertEqual(self.store.getChunks('k', 0, 0, 0), [(0, 1, 'z')])
+        self.release()
+
+    def test_loadLogs_deleted(self):
+        self.store.held = None
+        self.store.putChunks('k', 0, [(0, 4, 'abcd')])
+        self.store.lastChunks.clear()
+        self.store.held = []
+        self.store.loadLogs(['k'], contents=True)
+        self.store.deleteLog('k')
+        self.release()
+        self.release()
+        self.assertNotIn(('k', 0), self.store.loaded)
+        self.assertEqual(self.store.getLastChunk('k', 0), None)
+
+
+class ChunkedLogTests(dirs.DirsMixin):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.master = mock.Mock()
+        self.master.basedir = self.basedir
+        self.master.getMasterName.return_value = 'host:' + self.basedir
+        self.master.config = config.MasterConfig()
+        self.storage = logstorage.ChunkedLogStorage(self.makeStore(),
+                                                    chunkSize=16,
+                                                    batchSize=2)
+        self.storage.setMaster(self.master)
+        self.master.config.logStorage = self.storage
+        self.logfile = self.makeLogFile()
+
+    def tearDown(self):
+        d = self.storage.store.waitForWrites()
+        d.addCallback(lambda _: self.tearDownDirs())
+        return d
+
+    def makeLogFile(self, number=7, filename='7-log-step-stdio'):
+        step = mock.Mock(name='build_step_status')
+        step.build.builder.basedir = self.basedir
+        step.build.builder.master = self.master
+        step.build.builder.name = 'bldr'
+        step.build.number = number
+        lf = logfile.LogFile(step, 'stdio', filename)
+        lf.chunkSize = 10
+        return lf
+
+    def addLines(self, lf, count=20):
+        lf.addHeader('hdr\n')
+        for i in range(count):
+            lf.addStdout('line %d\n' % i)
+        lf.addStderr('oops\n')
+
+    def expectedText(self, count=20):
+        return ''.join(['line %d\n' % i for i in range(count)]) + 'oops\n'
+
+    def test_running(self):
+        self.addLines(self.logfile)
+        self.assertEqual(self.logfile.getText(), self.expectedText())
+        self.assertEqual(''.join(self.logfile.getTail(2, onlyText=True)),
+                         'line 19\noops\n')
+        self.assertTrue(self.logfile.hasContents())
+        # nothing is written to files
+        self.assertEqual(os.listdir(self.basedir),
+                         [n for n in os.listdir(self.basedir)
+                          if not n.startswith('7-log')])
+
+    def test_finished(self):
+        self.addLines(self.logfile)
+        self.logfile.finish()
+        self.assertEqual(self.logfile.openfile, None)
+        self.assertTrue(self.logfile.hasContents())
+        self.assertEqual(self.logfile.getText(), self.expectedText())
+        self.assertEqual(
+            ''.join(self.logfile.getChunksForRange(50, 60, onlyText=True)),
+            self.expectedText()[46:56])
+        self.assertEqual(self.logfile.getTail(1, onlyText=True),
+                         ['oops\n'])
+        self.assertNotEqual(self.logfile.getModificationTime(), None)
+        self.assertEqual(self.logfile.getStoredSize(),
+                         self.logfile.getFile().length)
+
+    def test_index_stored(self):
+        self.addLines(self.logfile)
+        self.logfile.finish()
+        index = self.logfile._getChunkIndex(self.logfile.getFile())
+        self.assertIsInstance(index.fp, logstorage.ChunkReader)
+        self.assertEqual(index.getTextLength(), 4 + len(self.expectedText()))
+
+    def test_pickled(self):
+        self.addLines(self.logfile)
+        self.logfile.finish()
+        restored = cPickle.loads(cPickle.dumps(self.logfile))
+        restored.step = self.logfile.step
+        restored.master = self.master
+        self.assertEqual(restored.getText(), self.expectedText())
+
+    @defer.inlineCallbacks
+    def test_loadLogs(self):
+        self.addLines(self.logfile)
+        self.logfile.finish()
+        store = self.storage.store
+        yield store.waitForWrites()
+        store.lastChunks.clear()
+
+        def noReads():
+            # what was loaded is read from memory
+            store._getChunks = mock.Mock(side_effect=AssertionError)
+            store._getLastChunk = mock.Mock(side_effect=AssertionError)
+
+        def reads():
+            del store._getChunks, store._getLastChunk
+
+        yield self.storage.loadLogs([self.logfile])
+        noReads()
+        self.assertTrue(self.logfile.hasContents())
+        self.assertNotEqual(self.logfile.getModificationTime(), None)
+        reads()
+
+        yield self.storage.loadLogs([self.logfile], contents=True)
+        noReads()
+        self.assertEqual(self.logfile.getText(), self.expectedText())
+        self.assertEqual(self.logfile.getTail(1, onlyText=True),
+                         ['oops\n'])
+        self.assertEqual(self.logfile.getStoredSize(),
+                         self.logfile.getFile().length)
+        reads()
+
+    def test_empty(self):
+        self.logfile.finish()
+        self.assertTrue(self.logfile.hasContents())
+        self.assertEqual(self.logfile.getText(), '')
+
+    def test_file_fallback(self):
+        # a log written to a file before chunked storage was configured
+        self.master.config.logStorage = logstorage.FileLogStorage()
+        lf = self.makeLogFile(filename='7-log-step-old')
+        self.addLines(lf)
+        lf.finish()
+        self.master.config.logStorage = self.storage
+        self.assertTrue(lf.hasContents())
+        self.assertEqual(lf.getText(), self.expectedText())
+        self.assertEqual(lf.getTail(1, onlyText=True), ['oops\n'])
+
+    def test_reused_number(self):
+        # a build number can be used again after the master stops before
+        # saving the builder's state
+        self.addLines(self.logfile, 40)
+        self.logfile.finish()
+        lf = self.makeLogFile()
+        self.addLines(lf, 2)
+        lf.finish()
+        self.assertEqual(lf.getText(), self.expectedText(2))
+        d = self.storage.store.waitForWrites()
+
+        def check(_):
+            self.storage.store.lastChunks.clear()
+            self.assertEqual(lf.getText(), self.expectedText(2))
+            self.assertEqual(lf.getStoredSize(), lf.getFile().length)
+        d.addCallback(check)
+        return d
+
+    @defer.inlineCallbacks
+    def test_masters_apart(self):
+        self.addLines(self.logfile)
+        self.logfile.finish()
+        yield self.storage.store.waitForWrites()
+
+        # another master sharing the store, with a build of the same number
+        other = mock.Mock()
+        other.basedir = self.basedir
+        other.getMasterName.return_value = 'otherhost:' + self.basedir
+        storage = logstorage.ChunkedLogStorage(self.makeStore(),
+                                               chunkSize=16, batchSize=2)
+        storage.setMaster(other)
+        self.master.config.logStorage = storage
+        lf = self.makeLogFile()
+        self.addLines(lf, 2)
+        lf.finish()
+        yield storage.store.waitForWrites()
+        storage.store.lastChunks.clear()
+        self.assertEqual(lf.getText(), self.expectedText(2))
+        builder = mock.Mock()
+        builder.name = 'bldr'
+        yield storage.pruneLogs(builder, 9)
+        if getattr(storage.store, 'engine', None):
+            storage.store.engine.dispose()
+
+        self.master.config.logStorage = self.storage
+        self.storage.store.lastChunks.clear()
+        self.assertEqual(self.logfile.getText(), self.expectedText())
+
+    @defer.inlineCallbacks
+    def test_prune(self):
+        self.addLines(self.logfile)
+        self.logfile.finish()
+        newer = self.makeLogFile(9, '9-log-step-stdio')
+        self.addLines(newer)
+        newer.finish()
+
+        builder = mock.Mock()
+        builder.name = 'bldr'
+        yield self.storage.pruneLogs(builder, 9, keep=[7])
+        self.assertTrue(self.logfile.hasContents())
+        yield self.storage.pruneLogs(builder, 9)
+        self.assertFalse(self.logfile.hasContents())
+        self.assertEqual(newer.getText(), self.expectedText())
+
+
+class TestDirectoryChunkStore(ChunkedLogTests, unittest.TestCase):
+
+    def makeStore(self):
+        return logstorage.DirectoryChunkStore('chunks')
+
+    @defer.inlineCallbacks
+    def test_layout(self):
+        self.addLines(self.logfile)
+        self.logfile.finish()
+        yield self.storage.store.waitForWrites()
+        logdir = os.path.join(self.basedir, 'chunks',
+                              safeTranslate('host:' + self.basedir),
+                              'bldr', '7', '7-log-step-stdio')
+        names = os.listdir(logdir)
+        self.assertIn('0-00000000', names)
+        self.assertIn('1-00000000', names)
+
+
+class TestDBChunkStore(ChunkedLogTests, unittest.TestCase):
+
+    def makeStore(self):
+        return logstorage.DBChunkStore('sqlite:///logs.sqlite')
+
+    def tearDown(self):
+        d = self.storage.store.waitForWrites()
+
+        def dispose(_):
+            if self.storage.store.engine:
+                self.storage.store.engine.dispose()
+        d.addCallback(dispose)
+        d.addCallback(lambda _: ChunkedLogTests.tearDown(self))
+        return d
+
+    @defer.inlineCallbacks
+    def test_batched_writes(self):
+        self.addLines(self.logfile)
+        yield self.storage.store.waitForWrites()
+        tbl = self.storage.store._getTable()
+        engine = self.storage.store.engine
+        q = tbl.select(whereclause=(tbl.c.stream == logstorage.DATA))
+        # full batches of chunks are written while the log is running
+        rows = engine.execute(q).fetchall()
+        self.assertTrue(rows)
+        self.assertEqual(len(rows) % 2, 0)
+        self.assertEqual(set([row.length for row in rows]), set([16]))
+        self.assertEqual(set([row.mastername for row in rows]),
+                         set(['host:' + self.basedir]))
+        self.logfile.finish()
+        yield self.storage.store.waitForWrites()
+        self.assertEqual(len(engine.execute(q).fetchall()),
+                         (self.logfile.getStoredSize() + 15) // 16)
@@ -0,0 +1,212 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+
+from buildbot import config
+from buildbot import sourcestamp
+from buildbot import util
+from buildbot.changes import changes
+from buildbot.status import builder
+from buildbot.status import timeline
+from buildbot.status.build import BuildStatus
+from buildbot.status.event import Event
+from buildbot.status.results import SUCCESS
+from buildbot.test.fake import fakemaster
+from buildbot.util.lru import LRUCache
+from twisted.trial import unittest
+
+
+class TestBuilderTimeline(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000
+        self.patch(util, 'now', lambda *args, **kwargs: self.now)
+        m = fakemaster.make_master()
+        m.config = config.MasterConfig()
+        self.builder = builder.BuilderStatus(buildername='bldr', category='cat',
+                                             master=m, description=None)
+        self.builder.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.builder.basedir)
+        self.builder.determineNextBuildNumber()
+        self.builder.currentBigState = 'idle'
+        self.builder.status = 'idle'
+
+    def runBuild(self, branch='br', who='me', project='proj', finish=True):
+        build = self.builder.newBuild()
+        ch = changes.Change(who, ['a.c'], 'fix', branch=branch)
+        ch.number = build.number
+        build.setSourceStamps([sourcestamp.SourceStamp(
+            branch=branch, revision='r1', changes=[ch])])
+        build.setProperty('project', project, 'test')
+        steps = [build.addStepWithName(name) for name in ('compile', 'test')]
+        build.buildStarted(build)
+        for step in steps:
+            self.now += 10
+            step.stepStarted()
+            self.now += 10
+            step.stepFinished(SUCCESS)
+        self.now += 10
+        if finish:
+            build.setResults(SUCCESS)
+            build.buildFinished()
+        return build
+
+    def describe(self, gen):
+        result = []
+        for e in gen:
+            if isinstance(e, BuildStatus):
+                result.append(('build', e.getNumber()))
+            elif isinstance(e, Event):
+                result.append(('event', e.getText()[0]))
+            else:
+                result.append((e.getName(), e.getBuild().getNumber()))
+        return result
+
+    def test_backfill(self):
+        for i in range(3):
+            self.runBuild()
+        tl = timeline.BuilderTimeline(self.builder)
+        tl.backfillSize = 2
+        # start over with an empty build cache, as after a restart
+        self.builder.buildCache = LRUCache(self.builder.cacheMiss)
+        self.assertEqual(self.describe(tl.eventGenerator()), [
+            ('test', 2), ('compile', 2), ('build', 2),
+            ('test', 1), ('compile', 1), ('build', 1),
+            ('test', 0), ('compile', 0), ('build', 0),
+        ])
+        self.assertTrue(tl.backfilled)
+
+    def test_slice(self):
+        for i in range(3):
+            self.runBuild()
+        tl = timeline.BuilderTimeline(self.builder)
+        # build 1 starts at 1050, and its first step at 1060
+        self.assertEqual(self.describe(
+            tl.eventGenerator(minTime=1050, maxTime=1060)),
+            [('compile', 1), ('build', 1)])
+
+    def test_slice_loads_only_shown_builds(self):
+        for i in range(3):
+            self.runBuild()
+        tl = timeline.BuilderTimeline(self.builder)
+        list(tl.eventGenerator())
+        self.builder.buildCache = LRUCache(self.builder.cacheMiss)
+        list(tl.eventGenerator(minTime=1050, maxTime=1080))
+        self.assertEqual(self.builder.buildCache.keys(), [1])
+
+    def test_filters(self):
+        self.runBuild(branch='br1', who='alice', project='p1')
+        self.runBuild(branch='br2', who='bob', project='p1')
+        self.runBuild(branch='br1', who='bob', project='p2')
+        tl = timeline.BuilderTimeline(self.builder)
+
+        def builds(**kwargs):
+            return [n for kind, n in self.describe(tl.eventGenerator(**kwargs))
+                    if kind == 'build']
+        self.assertEqual(builds(branches=['br1']), [2, 0])
+        self.assertEqual(builds(committers=['bob']), [2, 1])
+        self.assertEqual(builds(projects=['p1']), [1, 0])
+        self.assertEqual(builds(branches=['br1'], committers=['bob']), [2])
+        self.assertEqual(builds(branches=['br3']), [])
+        self.assertEqual(builds(categories=['cat']), [2, 1, 0])
+        self.assertEqual(builds(categories=['other']), [])
+
+    def test_events(self):
+        self.runBuild()
+        self.builder.addPointEvent(['connect'])
+        self.now += 10
+        self.runBuild()
+        tl = timeline.BuilderTimeline(self.builder)
+        self.assertEqual(self.describe(tl.eventGenerator()), [
+            ('test', 1), ('compile', 1), ('build', 1),
+            ('event', 'connect'),
+            ('test', 0), ('compile', 0), ('build', 0),
+        ])
+
+    def test_pruned_build(self):
+        self.runBuild()
+        self.runBuild()
+        tl = timeline.BuilderTimeline(self.builder)
+        list(tl.eventGenerator())
+        os.unlink(self.builder.makeBuildFilename(0))
+        self.builder.buildCache = LRUCache(self.builder.cacheMiss)
+        self.assertEqual(self.describe(tl.eventGenerator()), [
+            ('test', 1), ('compile', 1), ('build', 1)])
+        self.assertEqual(tl.gone, set([0]))
+
+    def test_prune(self):
+        for i in range(4):
+            self.runBuild(branch='br%d' % i)
+        tl = timeline.BuilderTimeline(self.builder)
+        tl.backfillSize = 1
+        tl.maxBuilds = 2
+        list(tl.eventGenerator())
+        tl.prune()
+        self.assertEqual(sorted(tl.steps), [2, 3])
+        self.assertEqual(len(tl.starts), 6)
+        self.assertEqual(sorted(tl.branches), ['br2', 'br3'])
+        # the older builds can still be read back in
+        self.assertEqual([n for kind, n in self.describe(tl.eventGenerator())
+                          if kind == 'build'], [3, 2, 1, 0])
+
+    def test_prune_buildHorizon(self):
+        self.builder.master.config.buildHorizon = 1
+        for i in range(3):
+            self.runBuild()
+        tl = timeline.BuilderTimeline(self.builder)
+        tl.backfillSize = 1
+        list(tl.eventGenerator())
+        tl.prune()
+        self.assertEqual(sorted(tl.steps), [2])
+        self.assertEqual(tl.oldest, 2)
+
+    def test_prune_batches(self):
+        for i in range(3):
+            self.runBuild()
+        tl = timeline.BuilderTimeline(self.builder)
+        tl.maxBuilds = 2
+        list(tl.eventGenerator())
+        # only one build is beyond maxBuilds, less than a batch
+        tl.prune()
+        self.assertEqual(sorted(tl.steps), [0, 1, 2])
+
+    def test_notifications(self):
+        self.runBuild()
+        wt = timeline.WaterfallTimeline(None)
+        wt.builderAdded('bldr', self.builder)
+        self.builder.watchers.append(wt)
+        tl = wt.getBuilderTimeline(self.builder)
+        # the history is read on demand
+        self.assertEqual(tl.entries, [])
+
+        build = self.runBuild(finish=False)
+        self.assertEqual(tl.entries,
+                         [(1, None), (1, 0), (1, 1)])
+        self.assertEqual(self.describe(tl.eventGenerator()), [
+            ('test', 1), ('compile', 1), ('build', 1),
+            ('test', 0), ('compile', 0), ('build', 0),
+        ])
+        self.assertIn(wt, build.watchers)
+        build.buildFinished()
+        self.assertNotIn(wt, build.watchers)
+
+        wt.builderRemoved('bldr')
+        self.assertEqual(wt.getBuilderTimeline(self.builder), None)
+
+    def test_unannounced_builder(self):
+        wt = timeline.WaterfallTimeline(None)
+        self.assertEqual(wt.getBuilderTimeline(self.builder), None)
+        self.assertEqual(wt.builders, {})
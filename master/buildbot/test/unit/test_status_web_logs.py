@@ -0,0 +1,318 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+import os
+
+from buildbot import config
+from buildbot.status import logfile
+from buildbot.status.web import logs
+from buildbot.test.fake.web import FakeRequest
+from buildbot.test.util import dirs
+from buildbot.util import json
+from twisted.internet import defer
+from twisted.trial import unittest
+from twisted.web import http
+
+
+class TestTextLog(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        step = mock.Mock(name='build_step_status')
+        self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        step.build.builder.master.config = config.MasterConfig()
+        self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
+        self.logfile.chunkSize = 4
+        self.logfile.addHeader('hdr\n')
+        for i in range(1, 6):
+            self.logfile.addStdout('line %d\n' % i)
+        self.logfile.addStderr('oops\n')
+
+    def tearDown(self):
+        if self.logfile.openfile:
+            self.logfile.openfile.close()
+        self.tearDownDirs()
+
+    def render(self, args={}, headers={}):
+        req = FakeRequest(args=args)
+        req.method = 'GET'
+        req.code = http.OK
+        req.headers = {}
+        req.getHeader = lambda name: headers.get(name)
+        req.setHeader = lambda name, value: \
+            req.headers.__setitem__(name.lower(), value)
+        req.setResponseCode = lambda code: setattr(req, 'code', code)
+        req.setETag = mock.Mock(return_value=None)
+        req.setLastModified = mock.Mock(return_value=None)
+        resource = logs.TextLog(self.logfile).getChild('text', req)
+        d = req.test_render(resource)
+        d.addCallback(lambda _: req)
+        return d
+
+    def test_whole(self):
+        self.logfile.finish()
+        d = self.render()
+
+        def check(req):
+            self.assertEqual(req.written, ''.join(
+                ['line %d\n' % i for i in range(1, 6)]) + 'oops\n')
+            self.assertEqual(req.headers['accept-ranges'], 'bytes')
+            etag = req.setETag.call_args[0][0]
+            self.assertTrue(etag.endswith('-text"'))
+        d.addCallback(check)
+        return d
+
+    def test_waits_for_storage(self):
+        self.logfile.finish()
+        storage = self.logfile.getStorage()
+        loaded = defer.Deferred()
+        storage.loadLogs = mock.Mock(return_value=loaded)
+        d = self.render(args={'tail': ['1']})
+        storage.loadLogs.assert_called_with([self.logfile], True)
+        self.assertFalse(d.called)
+        loaded.callback(None)
+        self.assertTrue(d.called)
+        d.addCallback(lambda req: self.assertEqual(req.written, 'oops\n'))
+        return d
+
+    def test_not_stored(self):
+        self.logfile.finish()
+        os.unlink(self.logfile.getFilename())
+        d = self.render()
+
+        def check(req):
+            self.assertEqual(req.code, http.NOT_FOUND)
+            self.assertTrue(req.finished)
+        d.addCallback(check)
+        return d
+
+    def test_cached(self):
+        self.logfile.finish()
+        req = FakeRequest()
+        req.setETag = mock.Mock(return_value=http.CACHED)
+        resource = logs.TextLog(self.logfile).getChild('text', req)
+        self.assertEqual(resource.render_GET(req), '')
+        self.assertFalse(req.written)
+
+    def test_running_not_cacheable(self):
+        d = self.render(args={'tail': ['1']})
+
+        def check(req):
+            self.assertFalse(req.setETag.called)
+            self.assertEqual(req.headers['cache-control'], 'no-cache')
+        d.addCallback(check)
+        return d
+
+    def test_tail(self):
+        d = self.render(args={'tail': ['2']})
+
+        def check(req):
+            self.assertEqual(req.written, 'line 5\noops\n')
+            self.assertTrue(req.finished)
+        d.addCallback(check)
+        return d
+
+    def test_lines(self):
+        self.logfile.finish()
+        d = self.render(args={'lines': ['2-3']})
+        d.addCallback(lambda req:
+                      self.assertEqual(req.written, 'line 2\nline 3\n'))
+        return d
+
+    def test_lines_open(self):
+        d = self.render(args={'lines': ['5-']})
+        d.addCallback(lambda req:
+                      self.assertEqual(req.written, 'line 5\noops\n'))
+        return d
+
+    def test_lines_invalid(self):
+        d = self.render(args={'lines': ['0-2']})
+
+        def check(req):
+            self.assertEqual(req.code, http.BAD_REQUEST)
+        d.addCallback(check)
+        return d
+
+    def test_range(self):
+        self.logfile.finish()
+        d = self.render(headers={'range': 'bytes=7-15'})
+
+        def check(req):
+            self.assertEqual(req.code, http.PARTIAL_CONTENT)
+            self.assertEqual(req.written, 'line 2\nli')
+            self.assertEqual(req.headers['content-range'], 'bytes 7-15/40')
+            self.assertEqual(req.headers['content-length'], 9)
+        d.addCallback(check)
+        return d
+
+    def test_range_suffix(self):
+        d = self.render(headers={'range': 'bytes=-7'})
+
+        def check(req):
+            self.assertEqual(req.written, ' 5\noops\n'[-7:])
+            self.assertEqual(req.headers['content-range'], 'bytes 33-39/40')
+        d.addCallback(check)
+        return d
+
+    def test_range_unsatisfiable(self):
+        d = self.render(headers={'range': 'bytes=40-'})
+
+        def check(req):
+            self.assertEqual(req.code, http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.assertEqual(req.headers['content-range'], 'bytes */40')
+            self.assertEqual(req.written, '')
+        d.addCallback(check)
+        return d
+
+    def test_range_stale_if_range(self):
+        self.logfile.finish()
+        d = self.render(headers={'range': 'bytes=7-15',
+                                 'if-range': '"stale"'})
+
+        def check(req):
+            self.assertEqual(req.code, http.OK)
+            self.assertEqual(len(req.written), 40)
+        d.addCallback(check)
+        return d
+
+
+class TestLogEventStream(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        step = mock.Mock(name='build_step_status')
+        self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        step.build.builder.master.config = config.MasterConfig()
+        self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
+        self.logfile.addHeader('hdr\n')
+        self.logfile.addStdout('line 1\n')
+        self.logfile.addStderr('oops\n')
+
+    def tearDown(self):
+        if self.logfile.openfile:
+            self.logfile.openfile.close()
+        self.assertEqual(logs.LogFanout.fanouts, {})
+        self.tearDownDirs()
+
+    def render(self, args={}, headers={}):
+        req = FakeRequest(args=args)
+        req.method = 'GET'
+        req.code = http.OK
+        req.headers = {}
+        req.getHeader = lambda name: headers.get(name)
+        req.setHeader = lambda name, value: \
+            req.headers.__setitem__(name.lower(), value)
+        req.setResponseCode = lambda code: setattr(req, 'code', code)
+        req.disconnected = defer.Deferred()
+        req.notifyFinish = lambda: req.disconnected
+        resource = logs.TextLog(self.logfile).getChild('events', req)
+        req.test_render(resource)
+        return req
+
+    def events(self, req):
+        events = []
+        for block in req.written.split('\n\n')[:-1]:
+            fields = dict(line.split(': ', 1)
+                          for line in block.split('\n'))
+            if fields['event'] == 'finished':
+                events.append(('finished',))
+            else:
+                events.append((fields['event'], int(fields['id']),
+                               json.loads(fields['data'])))
+        return events
+
+    def test_finished_log(self):
+        self.logfile.finish()
+        req = self.render()
+        self.assertEqual(req.headers['content-type'], 'text/event-stream')
+        self.assertEqual(self.events(req), [
+            ('header', 4, 'hdr\n'),
+            ('stdout', 11, 'line 1\n'),
+            ('stderr', 16, 'oops\n'),
+            ('finished',)])
+        self.assertTrue(req.finished)
+
+    def test_resume(self):
+        self.logfile.finish()
+        req = self.render(headers={'last-event-id': '9'})
+        self.assertEqual(self.events(req), [
+            ('stdout', 11, '1\n'),
+            ('stderr', 16, 'oops\n'),
+            ('finished',)])
+
+    def test_resume_offset_arg(self):
+        self.logfile.finish()
+        req = self.render(args={'offset': ['16']})
+        self.assertEqual(self.events(req), [('finished',)])
+
+    def test_bad_offset(self):
+        req = self.render(args={'offset': ['x']})
+        self.assertEqual(req.code, http.BAD_REQUEST)
+        self.assertTrue(req.finished)
+
+    def test_running_log_shared(self):
+        req1 = self.render()
+        req2 = self.render(args={'offset': ['11']})
+        # both clients share one subscription
+        self.assertEqual(len(self.logfile.watchers), 1)
+        self.assertFalse(req1.finished)
+
+        self.logfile.addStdout('line 2\n')
+        self.logfile.finish()
+        self.assertEqual(self.events(req1)[-2:], [
+            ('stdout', 23, 'line 2\n'),
+            ('finished',)])
+        self.assertEqual(self.events(req2), [
+            ('stderr', 16, 'oops\n'),
+            ('stdout', 23, 'line 2\n'),
+            ('finished',)])
+        self.assertTrue(req1.finished and req2.finished)
+
+    def test_output_during_catchup(self):
+        req = FakeRequest()
+        req.args = {}
+        req.getHeader = lambda name: None
+        req.notifyFinish = defer.Deferred
+        write = req.write
+
+        def writeAndPause(data):
+            # the transport's buffer fills after the first event
+            write(data)
+            producer = req.registerProducer.call_args[0][0]
+            producer.pauseProducing()
+        req.write = writeAndPause
+        resource = logs.TextLog(self.logfile).getChild('events', req)
+        resource.render_GET(req)
+        self.assertEqual(len(self.events(req)), 1)
+
+        # output arriving while the catch-up is paused is held back
+        req.write = write
+        self.logfile.addStdout('line 2\n')
+        self.assertEqual(len(self.events(req)), 1)
+        req.registerProducer.call_args[0][0].resumeProducing()
+        self.logfile.finish()
+        self.assertEqual([e[1:] for e in self.events(req)[:-1]], [
+            (4, 'hdr\n'), (11, 'line 1\n'), (16, 'oops\n'),
+            (23, 'line 2\n')])
+
+    def test_disconnect(self):
+        req1 = self.render()
+        req2 = self.render()
+        req1.disconnected.errback(Exception('gone'))
+        self.assertEqual(len(self.logfile.watchers), 1)
+        req2.disconnected.errback(Exception('gone'))
+        self.assertEqual(self.logfile.watchers, [])
+        self.assertEqual(logs.LogFanout.fanouts, {})
@@ -78,6 +78,12 @@ class TestShellCommandExecution(steps.BuildStepMixin, unittest.TestCase, configm
             lambda: shell.ShellCommand('build', "echo Hello World",
                                        wrongArg1=1, wrongArg2='two'))
 
+    def test_constructor_outputBuffering_invalid(self):
+        self.assertRaisesConfigError(
+            "outputBuffering must be 'adaptive' or 'fixed'",
+            lambda: shell.ShellCommand('build', "echo Hello World",
+                                       outputBuffering='sometimes'))
+
     def test_describe_no_command(self):
         step = shell.ShellCommand(workdir='build')
         self.assertEqual((step.describe(), step.describe(done=True)),
@@ -318,6 +324,30 @@ class TestShellCommandExecution(steps.BuildStepMixin, unittest.TestCase, configm
         self.expectOutcome(result=SUCCESS, status_text=["'echo", "hello'"])
         return self.runStep()
 
+    def test_run_outputBuffering(self):
+        self.setupStep(
+            shell.ShellCommand(workdir='build', command="echo hello",
+                               outputBuffering='fixed'))
+        self.expectCommands(
+            ExpectShell(workdir='build', command='echo hello',
+                        outputBuffering='fixed')
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS, status_text=["'echo", "hello'"])
+        return self.runStep()
+
+    def test_run_outputBuffering_old_slave(self):
+        self.setupStep(
+            shell.ShellCommand(workdir='build', command="echo hello",
+                               outputBuffering='fixed'),
+            slave_version=dict(shell='2.22'))
+        self.expectCommands(
+            ExpectShell(workdir='build', command='echo hello')
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS, status_text=["'echo", "hello'"])
+        return self.runStep()
+
     def test_run_decodeRC(self, rc=1, results=WARNINGS, extra_text=["warnings"]):
         self.setupStep(
             shell.ShellCommand(workdir='build', command="echo hello",
@@ -788,6 +818,78 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         return self.do_test_suppressions(step, '', stdout, 2,
                                          exp_warning_log)
 
+    def test_streaming_default_pattern(self):
+        self.setupStep(shell.WarningCountingShellCommand(
+            command=['make'], streamWarnings=True))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='normal: foo\nwarn')
+            + ExpectShell.log('stdio', stderr='ing: blarg!\nalso ')
+            + ExpectShell.log('stdio', stdout='warning: last')
+            + 0
+        )
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 2)
+        self.expectLogfile("warnings (2)",
+                           "warning: blarg!\nalso warning: last\n")
+        return self.runStep()
+
+    def test_streaming_suppressions_directories(self):
+        def warningExtractor(step, line, match):
+            return line.split(':', 2)
+        step = shell.WarningCountingShellCommand(command=['make'],
+                                                 suppressionFile='supps',
+                                                 warningExtractor=warningExtractor,
+                                                 streamWarnings=True)
+        supps_file = "amar-src/amar.c : XXX"
+        stdout = textwrap.dedent(u"""\
+            make: Entering directory 'amar-src'
+            amar.c:164: warning: XXX
+            amar.c:165: warning: YYY
+            make: Leaving directory 'amar-src'
+            amar.c:166: warning: XXX
+            """)
+        exp_warning_log = textwrap.dedent("""\
+            amar.c:165: warning: YYY
+            amar.c:166: warning: XXX
+        """)
+        return self.do_test_suppressions(step, supps_file, stdout, 2,
+                                         exp_warning_log)
+
+    @compat.usesFlushLoggedErrors
+    def test_streaming_warningExtractor_exc(self):
+        def warningExtractor(step, line, match):
+            raise RuntimeError("oh noes")
+        step = shell.WarningCountingShellCommand(command=['make'],
+                                                 suppressionFile='supps',
+                                                 warningExtractor=warningExtractor,
+                                                 streamWarnings=True)
+        stdout = "abc.c:99: warning: seen 1\n"
+        d = self.do_test_suppressions(step, 'x:y', stdout,
+                                      exp_exception=True)
+        d.addCallback(lambda _:
+                      self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1))
+        return d
+
+    def test_streaming_spilled_warnings(self):
+        step = shell.WarningCountingShellCommand(command=['make'],
+                                                 streamWarnings=True)
+        step.warningsMemoryLimit = 20
+        self.setupStep(step)
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='warning: %d\n' * 5
+                              % (1, 2, 3, 4, 5))
+            + 0
+        )
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 5)
+        self.expectLogfile("warnings (5)", "".join(["warning: %d\n" % i
+                                                    for i in range(1, 6)]))
+        return self.runStep()
+
     def test_warnExtractFromRegexpGroups(self):
         step = shell.WarningCountingShellCommand(command=['make'])
         we = shell.WarningCountingShellCommand.warnExtractFromRegexpGroups
@@ -797,6 +899,28 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
                          (exp_file, exp_lineNo, exp_text))
 
 
+class WarningCollector(unittest.TestCase):
+
+    def test_in_memory(self):
+        c = shell.WarningCollector()
+        c.append('a')
+        c.append('b')
+        self.assertFalse(c.isSpilled())
+        self.assertEqual(c.getText(), 'a\nb\n')
+
+    def test_empty(self):
+        self.assertEqual(shell.WarningCollector().getText(), '')
+
+    def test_spilled(self):
+        c = shell.WarningCollector(maxSize=4)
+        for line in ['a', 'b', u'\N{SNOWMAN}', 'd']:
+            c.append(line)
+        self.assertTrue(c.isSpilled())
+        self.assertEqual(c.lines, [])
+        self.assertEqual(list(c.iterChunks(chunkSize=3)),
+                         ['a\nb', '\n\xe2\x98', '\x83\nd', '\n'])
+
+
 class Compile(steps.BuildStepMixin, unittest.TestCase):
 
     def setUp(self):
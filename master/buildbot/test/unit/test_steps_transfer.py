@@ -21,6 +21,8 @@ import stat
 import tarfile
 import tempfile
 
+from twisted.internet import defer
+from twisted.internet import reactor
 from twisted.trial import unittest
 
 from mock import Mock
@@ -41,6 +43,7 @@ from buildbot.test.util import steps
 from buildbot.util import json
 
 from cStringIO import StringIO
+from hashlib import sha1
 
 
 def uploadString(string, timestamp=None):
@@ -65,6 +68,49 @@ def uploadTarFile(filename, **members):
     return behavior
 
 
+def streamTarFile(filename, blocksize=100, **members):
+    def behavior(command):
+        f = StringIO()
+        archive = tarfile.TarFile(fileobj=f, name=filename, mode='w')
+        for name, content in members.iteritems():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, StringIO(content))
+        archive.close()
+        data = f.getvalue()
+        writer = command.args['writer']
+        writes = [writer.remote_write(data[i:i + blocksize])
+                  for i in xrange(0, len(data), blocksize)]
+        d = defer.gatherResults(writes)
+        d.addCallback(lambda _: writer.remote_unpack())
+        return d
+    return behavior
+
+
+def uploadContent(**files):
+    # files maps names to contents; a content of None stands for a directory
+    def behavior(command):
+        writer = command.args['writer']
+        manifest = []
+        for name, content in sorted(files.items()):
+            if content is None:
+                manifest.append((name, None, 0, 0755))
+            else:
+                manifest.append((name, sha1(content).hexdigest(),
+                                 len(content), 0644))
+        d = writer.remote_manifest(manifest)
+
+        @d.addCallback
+        def send(needed):
+            for name in needed:
+                writer.remote_begin(name)
+                writer.remote_write(files[name])
+                writer.remote_finish()
+            return writer.remote_close()
+        return d
+    return behavior
+
+
 class UploadError(object):
 
     def __init__(self, behavior):
@@ -118,6 +164,228 @@ class TestFileWriter(unittest.TestCase):
         mockedMkstemp.assert_called_once_with(dir=absdir)
         mockedFdopen.assert_called_once_with(7, 'wb')
 
+
+class TestDirectoryStreamWriter(unittest.TestCase):
+
+    timeout = 10
+
+    def setUp(self):
+        self.basedir = os.path.abspath('test_directory_stream_writer')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeTar(self, **files):
+        buf = StringIO()
+        archive = tarfile.open(mode='w|', fileobj=buf)
+        for name, content in files.iteritems():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, StringIO(content))
+        archive.close()
+        return buf.getvalue()
+
+    def makeLinked(self, destroot):
+        # a read-only file hard-linked elsewhere, as a dedup upload leaves
+        # it
+        os.makedirs(destroot)
+        other = os.path.join(self.basedir, 'object')
+        open(other, 'w').write('old')
+        os.chmod(other, 0444)
+        os.link(other, os.path.join(destroot, 'test'))
+        return other
+
+    @compat.skipUnlessPlatformIs('posix')
+    @defer.inlineCallbacks
+    def test_replaces_linked_file(self):
+        destroot = os.path.join(self.basedir, 'dest')
+        other = self.makeLinked(destroot)
+        writer = transfer._DirectoryStreamWriter(destroot, None, None)
+        yield writer.remote_write(self.makeTar(test="Hello world!"))
+        yield writer.remote_unpack()
+        self.assertEqual(open(os.path.join(destroot, 'test')).read(),
+                         "Hello world!")
+        self.assertEqual(open(other).read(), 'old')
+
+    @compat.skipUnlessPlatformIs('posix')
+    def test_unpack_replaces_linked_file(self):
+        destroot = os.path.join(self.basedir, 'dest')
+        other = self.makeLinked(destroot)
+        writer = transfer._DirectoryWriter(destroot, None, None, None)
+        writer.remote_write(self.makeTar(test="Hello world!"))
+        writer.remote_unpack()
+        self.assertEqual(open(os.path.join(destroot, 'test')).read(),
+                         "Hello world!")
+        self.assertEqual(open(other).read(), 'old')
+
+    @defer.inlineCallbacks
+    def test_concurrent_uploads(self):
+        # more uploads than the reactor's pool has threads, all of them
+        # waiting for more data at once
+        count = reactor.getThreadPool().max + 2
+        data = self.makeTar(test="Hello world!")
+        writers = [transfer._DirectoryStreamWriter(
+            os.path.join(self.basedir, str(i)), None, None)
+            for i in range(count)]
+        yield defer.gatherResults([w.remote_write(data[:512])
+                                   for w in writers])
+        yield defer.gatherResults([w.remote_write(data[512:])
+                                   for w in writers])
+        yield defer.gatherResults([w.remote_unpack() for w in writers])
+        for i in range(count):
+            self.assertEqual(
+                open(os.path.join(self.basedir, str(i), 'test')).read(),
+                "Hello world!")
+
+
+class TestContentWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('test_content_writer')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.storedir = os.path.join(self.basedir, 'store')
+        self.destdir = os.path.join(self.basedir, 'dest')
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def upload(self, destdir, mode=None, **files):
+        writer = transfer._ContentWriter(destdir, self.storedir, mode)
+        command = Mock()
+        command.args = dict(writer=writer)
+        d = uploadContent(**files)(command)
+        d.addCallback(lambda _: writer)
+        return d
+
+    def read(self, *path):
+        return open(os.path.join(*path)).read()
+
+    @defer.inlineCallbacks
+    def testDedup(self):
+        first = yield self.upload(self.destdir, **{'a': 'abc', 'sub': None,
+                                                   'sub/b': 'defg'})
+        self.assertEqual((first.nbytes, first.reusedFiles), (7, 0))
+
+        otherdir = os.path.join(self.basedir, 'other')
+        second = yield self.upload(otherdir, **{'a': 'abc', 'sub': None,
+                                                'sub/b': 'changed'})
+        self.assertEqual(second.nbytes, 7)
+        self.assertEqual((second.reusedFiles, second.reusedBytes), (1, 3))
+        self.assertEqual(self.read(otherdir, 'a'), 'abc')
+        self.assertEqual(self.read(otherdir, 'sub', 'b'), 'changed')
+        self.assertEqual(self.read(self.destdir, 'sub', 'b'), 'defg')
+        if hasattr(os.path, 'samefile'):
+            self.assertTrue(os.path.samefile(os.path.join(self.destdir, 'a'),
+                                             os.path.join(otherdir, 'a')))
+
+    @defer.inlineCallbacks
+    def testExistingDestination(self):
+        os.makedirs(self.destdir)
+        open(os.path.join(self.destdir, 'a'), 'w').write('abc')
+        writer = yield self.upload(self.destdir, a='abc', b='abc')
+        # a is already there, and b has the same content
+        self.assertEqual(writer.nbytes, 0)
+        self.assertEqual(writer.reusedFiles, 2)
+        self.assertEqual(self.read(self.destdir, 'b'), 'abc')
+
+    @defer.inlineCallbacks
+    def testSingleFile(self):
+        destfile = os.path.join(self.destdir, 'file')
+        writer = yield self.upload(destfile, **{'': 'abc'})
+        self.assertEqual(writer.nbytes, 3)
+        self.assertEqual(self.read(destfile), 'abc')
+
+    @defer.inlineCallbacks
+    def testChangedContent(self):
+        writer = transfer._ContentWriter(self.destdir, self.storedir, None)
+        needed = yield writer.remote_manifest(
+            [('a', sha1('abc').hexdigest(), 3, 0644)])
+        self.assertEqual(needed, ['a'])
+        writer.remote_begin('a')
+        writer.remote_write('abd')
+        self.assertRaises(ValueError, writer.remote_finish)
+        self.assertEqual(os.listdir(os.path.join(self.storedir, 'a9')), [])
+
+    def testOutsideDestination(self):
+        writer = transfer._ContentWriter(self.destdir, self.storedir, None)
+        d = writer.remote_manifest([('../a', sha1('abc').hexdigest(), 3, 0644)])
+        return self.assertFailure(d, ValueError)
+
+    def objpath(self, content, mode=0644):
+        sha = sha1(content).hexdigest()
+        return os.path.join(self.storedir, sha[:2], '%s-%04o' % (sha, mode))
+
+    @defer.inlineCallbacks
+    def testReadOnly(self):
+        yield self.upload(self.destdir, a='abc')
+        self.assertEqual(os.stat(os.path.join(self.destdir, 'a')).st_mode
+                         & 0777, 0444)
+
+    @defer.inlineCallbacks
+    def testExplicitMode(self):
+        yield self.upload(self.destdir, mode=0664, a='abc')
+        self.assertEqual(os.stat(os.path.join(self.destdir, 'a')).st_mode
+                         & 0777, 0664)
+        self.assertTrue(os.path.exists(self.objpath('abc', 0664)))
+
+    @defer.inlineCallbacks
+    def testMissingContent(self):
+        writer = transfer._ContentWriter(self.destdir, self.storedir, None)
+        needed = yield writer.remote_manifest(
+            [('a', sha1('abc').hexdigest(), 3, 0644),
+             ('b', sha1('defg').hexdigest(), 4, 0644)])
+        self.assertEqual(needed, ['a', 'b'])
+        writer.remote_begin('a')
+        writer.remote_write('abc')
+        writer.remote_finish()
+        # the slave reached its maxsize while sending b
+        writer.remote_begin('b')
+        writer.remote_write('de')
+        yield self.assertFailure(writer.remote_close(), ValueError)
+        self.assertFalse(os.path.exists(self.destdir))
+        # and the partial content is not left behind
+        self.assertEqual(os.listdir(os.path.dirname(self.objpath('defg'))),
+                         [])
+
+    @defer.inlineCallbacks
+    def testCorruptObject(self):
+        yield self.upload(self.destdir, a='abc')
+        obj = self.objpath('abc')
+        os.chmod(obj, 0644)
+        open(obj, 'w').write('abd')
+        otherdir = os.path.join(self.basedir, 'other')
+        writer = yield self.upload(otherdir, a='abc')
+        # the corrupt object is not reused, but sent again
+        self.assertEqual((writer.nbytes, writer.reusedFiles), (3, 0))
+        self.assertEqual(self.read(otherdir, 'a'), 'abc')
+        self.assertEqual(self.read(obj), 'abc')
+
+    @defer.inlineCallbacks
+    def testPruneContentStore(self):
+        yield self.upload(self.destdir, a='abc', b='defg')
+        os.unlink(os.path.join(self.destdir, 'b'))
+        transfer.pruneContentStore(self.storedir, 3600)
+        self.assertTrue(os.path.exists(self.objpath('defg')))
+        transfer.pruneContentStore(self.storedir, -1)
+        self.assertFalse(os.path.exists(self.objpath('defg')))
+        # a is still linked from the destination
+        self.assertTrue(os.path.exists(self.objpath('abc')))
+
+    @defer.inlineCallbacks
+    def testPruneInterval(self):
+        prune = Mock()
+        self.patch(transfer, 'pruneContentStore', prune)
+        self.patch(transfer._ContentWriter, 'lastPruned', {})
+        yield self.upload(self.destdir, a='abc')
+        yield self.upload(self.destdir, a='abc')
+        prune.assert_called_once_with(self.storedir,
+                                      transfer._ContentWriter.pruneAge)
+
 # Test buildbot.steps.transfer._TransferBuildStep class.
 
 
@@ -279,6 +547,125 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
 
         return d
 
+    def testConstructorWindow(self):
+        self.assertRaises(config.ConfigErrors, lambda:
+                          transfer.FileUpload(slavesrc=__file__, masterdest='xyz', window=0))
+
+    def testStatistics(self):
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile))
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.step_statistics['transfer_bytes'], 13)
+            self.assertNotIn('transfer_rtt', self.step_statistics)
+        return d
+
+    def testWindowed(self):
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                window=4))
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                window=4, maxblocksize=256 * 1024,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + Expect.update('transfer', dict(bytes=13, blocks=1, rtt=0.04,
+                                             elapsed=0.5, blocksize=16384))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.step_statistics, {
+                'transfer_bytes': 13,
+                'transfer_throughput': 26.0,
+                'transfer_rtt': 0.04,
+            })
+            self.assertEqual(open(self.destfile).read(), "Hello world!\n")
+        return d
+
+    def testWindowedOldSlave(self):
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                window=4),
+            slave_version={'*': '2.17'})
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        return self.runStep()
+
+    def testConstructorDedupKeepstamp(self):
+        self.assertRaises(config.ConfigErrors, lambda:
+                          transfer.FileUpload(slavesrc=__file__, masterdest='xyz',
+                                              dedup=True, keepstamp=True))
+
+    def testDedup(self):
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                dedup=True))
+        self.master.basedir = os.path.dirname(self.destfile)
+        self.addCleanup(shutil.rmtree,
+                        os.path.join(self.master.basedir, 'artifacts'))
+
+        self.expectCommands(
+            Expect('uploadContent', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None,
+                writer=ExpectRemoteRef(transfer._ContentWriter)))
+            + Expect.behavior(uploadContent(**{'': "Hello world!"}))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(open(self.destfile).read(), "Hello world!")
+            self.assertEqual(self.step_statistics['transfer_bytes'], 12)
+            self.assertEqual(self.step_statistics['transfer_reused_files'], 0)
+        return d
+
+    def testDedupOldSlave(self):
+        self.setupStep(
+            transfer.FileUpload(slavesrc='srcfile', masterdest=self.destfile,
+                                dedup=True),
+            slave_version={'uploadFile': '2.19'})
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(transfer._FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcfile"])
+        return self.runStep()
+
 
 class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
 
@@ -326,6 +713,104 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    def testStream(self):
+        self.setupStep(
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir,
+                                     stream=True))
+
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress=None, maxsize=None, stream=True,
+                writer=ExpectRemoteRef(transfer._DirectoryStreamWriter)))
+            + Expect.behavior(streamTarFile('fake.tar', test="Hello world!",
+                                            other="x" * 1000))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(
+                open(os.path.join(self.destdir, 'test')).read(),
+                "Hello world!")
+            self.assertEqual(
+                open(os.path.join(self.destdir, 'other')).read(), "x" * 1000)
+        return d
+
+    def testStreamOldSlave(self):
+        self.setupStep(
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir,
+                                     stream=True),
+            slave_version={'*': '2.18'})
+
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress=None, maxsize=None,
+                writer=ExpectRemoteRef(transfer._DirectoryWriter)))
+            + Expect.behavior(uploadTarFile('fake.tar', test="Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
+        return self.runStep()
+
+    def testDedup(self):
+        self.setupStep(
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir,
+                                     dedup=True))
+        self.master.basedir = self.destdir
+
+        self.expectCommands(
+            Expect('uploadContent', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, maxsize=None,
+                writer=ExpectRemoteRef(transfer._ContentWriter)))
+            + Expect.behavior(uploadContent(**{'test': "Hello world!",
+                                               'sub': None,
+                                               'sub/other': "Hello world!"}))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(
+                open(os.path.join(self.destdir, 'sub', 'other')).read(),
+                "Hello world!")
+            self.assertEqual(self.step_statistics['transfer_bytes'], 12)
+        return d
+
+    @compat.usesFlushLoggedErrors
+    def testStreamCorrupt(self):
+        self.setupStep(
+            transfer.DirectoryUpload(slavesrc="srcdir", masterdest=self.destdir,
+                                     stream=True))
+
+        def behavior(command):
+            writer = command.args['writer']
+            d = writer.remote_write('this is not a tar file' * 100)
+            d.addCallback(lambda _: writer.remote_unpack())
+            return d
+
+        self.expectCommands(
+            Expect('uploadDirectory', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, compress=None, maxsize=None, stream=True,
+                writer=ExpectRemoteRef(transfer._DirectoryStreamWriter)))
+            + Expect.behavior(behavior))
+
+        self.expectOutcome(result=EXCEPTION, status_text=["upload", "exception"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertNotEqual(
+                len(self.flushLoggedErrors(tarfile.ReadError)), 0)
+        return d
+
     @compat.usesFlushLoggedErrors
     def testException(self):
         self.setupStep(
@@ -417,6 +902,46 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    def testDedup(self):
+        self.setupStep(
+            transfer.MultipleFileUpload(slavesrcs=["srcfile", "srcdir"],
+                                        masterdest=self.destdir, dedup=True))
+        self.master.basedir = self.destdir
+
+        self.expectCommands(
+            Expect('stat', dict(file="srcfile",
+                                workdir='wkdir'))
+            + Expect.update('stat', [stat.S_IFREG, 99, 99])
+            + 0,
+            Expect('uploadContent', dict(
+                slavesrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None,
+                writer=ExpectRemoteRef(transfer._ContentWriter)))
+            + Expect.behavior(uploadContent(**{'': "Hello world!"}))
+            + 0,
+            Expect('stat', dict(file="srcdir",
+                                workdir='wkdir'))
+            + Expect.update('stat', [stat.S_IFDIR, 99, 99])
+            + 0,
+            Expect('uploadContent', dict(
+                slavesrc="srcdir", workdir='wkdir',
+                blocksize=16384, maxsize=None,
+                writer=ExpectRemoteRef(transfer._ContentWriter)))
+            + Expect.behavior(uploadContent(test="Hello world!"))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS, status_text=["uploading", "2 files"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(
+                open(os.path.join(self.destdir, 'srcdir', 'test')).read(),
+                "Hello world!")
+            self.assertEqual(self.step_statistics['transfer_reused_files'], 1)
+            self.assertEqual(self.step_statistics['transfer_reused_bytes'], 12)
+        return d
+
     def testMultiple(self):
         self.setupStep(
             transfer.MultipleFileUpload(slavesrcs=["srcfile", "srcdir"], masterdest=self.destdir))
@@ -544,6 +1069,83 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
         return d
 
 
+def downloadString(command):
+    # read everything from the master in blocks, as the slave does
+    reader = command.args['reader']
+    data = []
+    while True:
+        block = reader.remote_read(command.args['blocksize'])
+        if not block:
+            break
+        data.append(block)
+    reader.remote_close()
+    command.downloaded = ''.join(data)
+
+
+class TestFileDownload(steps.BuildStepMixin, unittest.TestCase):
+
+    def setUp(self):
+        fd, self.srcfile = tempfile.mkstemp()
+        os.write(fd, "Hello world!\n")
+        os.close(fd)
+        return self.setUpBuildStep()
+
+    def tearDown(self):
+        os.unlink(self.srcfile)
+        return self.tearDownBuildStep()
+
+    def testWindowed(self):
+        self.setupStep(
+            transfer.FileDownload(mastersrc=self.srcfile, slavedest='dest',
+                                  window=8, maxBlocksize=64 * 1024))
+
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                slavedest='dest', workdir='wkdir', blocksize=16384,
+                maxsize=None, mode=None, window=8, maxblocksize=64 * 1024,
+                reader=ExpectRemoteRef(transfer._FileReader)))
+            + Expect.behavior(downloadString)
+            + Expect.update('transfer', dict(bytes=13, blocks=2, rtt=0.1,
+                                             elapsed=0.25, blocksize=16384))
+            + 0)
+
+        self.expectOutcome(result=SUCCESS,
+                           status_text=["downloading", "to", "dest"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.step_statistics, {
+                'transfer_bytes': 13,
+                'transfer_throughput': 52.0,
+                'transfer_rtt': 0.1,
+            })
+        return d
+
+    def testWindowedOldSlave(self):
+        self.setupStep(
+            transfer.FileDownload(mastersrc=self.srcfile, slavedest='dest',
+                                  window=8),
+            slave_version={'*': '2.16'})
+
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                slavedest='dest', workdir='wkdir', blocksize=16384,
+                maxsize=None, mode=None,
+                reader=ExpectRemoteRef(transfer._FileReader)))
+            + Expect.behavior(downloadString)
+            + 0)
+
+        self.expectOutcome(result=SUCCESS,
+                           status_text=["downloading", "to", "dest"])
+        d = self.runStep()
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.step_statistics['transfer_bytes'], 13)
+        return d
+
+
 class TestStringDownload(unittest.TestCase):
 
     # check that ConfigErrors is raised on invalid 'mode' argument
@@ -0,0 +1,133 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import bz2
+import cStringIO
+import gzip
+import os
+
+from buildbot.test.util import dirs
+from buildbot.util import framedfile
+from twisted.trial import unittest
+
+
+class FramedFile(unittest.TestCase, dirs.DirsMixin):
+
+    data = "".join(["line %d\n" % i for i in range(1000)])
+
+    def setUp(self):
+        self.setUpDirs('framed')
+        self.filename = os.path.join('framed', 'data')
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def write(self, method, frameSize=1000):
+        with open(self.filename, 'wb') as out:
+            with open(self.filename + framedfile.FRAME_INDEX_SUFFIX,
+                      'wb') as idx:
+                return framedfile.writeFramedFile(
+                    cStringIO.StringIO(self.data), out, idx, method,
+                    frameSize)
+
+    def test_write_length(self):
+        self.assertEqual(self.write('bz2'), len(self.data))
+
+    def test_frames_are_standard_streams(self):
+        self.write('gz')
+        # a gzip file with many members is still a gzip file
+        self.assertEqual(gzip.open(self.filename).read(), self.data)
+
+    def test_frames_are_bz2_streams(self):
+        self.write('bz2')
+        f = framedfile.FramedFile(self.filename, 'bz2')
+        coffset, clength = f.frames[1][:2]
+        with open(self.filename, 'rb') as raw:
+            raw.seek(coffset)
+            self.assertEqual(bz2.decompress(raw.read(clength)),
+                             self.data[1000:2000])
+
+    def do_test_read(self, method):
+        self.write(method)
+        f = framedfile.FramedFile(self.filename, method)
+        self.assertEqual(f.read(), self.data)
+        f.seek(2995)
+        self.assertEqual(f.read(10), self.data[2995:3005])
+        self.assertEqual(f.tell(), 3005)
+        f.seek(-5, 2)
+        self.assertEqual(f.read(), self.data[-5:])
+        self.assertEqual(f.read(), '')
+        f.close()
+
+    def test_read_bz2(self):
+        self.do_test_read('bz2')
+
+    def test_read_gz(self):
+        self.do_test_read('gz')
+
+    def test_read_decompresses_only_needed_frames(self):
+        self.write('bz2')
+        f = framedfile.FramedFile(self.filename, 'bz2')
+        calls = []
+
+        def decompress(data):
+            calls.append(data)
+            return bz2.decompress(data)
+        f.decompress = decompress
+        f.seek(-10, 2)
+        f.read()
+        f.seek(-20, 2)
+        f.read(5)
+        self.assertEqual(len(calls), 1)
+
+    def do_test_index(self, method, blockSize):
+        self.write(method)
+        with open(self.filename + framedfile.FRAME_INDEX_SUFFIX, 'rb') as f:
+            written = f.read()
+        index = cStringIO.StringIO()
+        with open(self.filename, 'rb') as f:
+            length = framedfile.indexFramedFile(f, index, method, blockSize)
+        self.assertEqual(length, len(self.data))
+        self.assertEqual(index.getvalue(), written)
+
+    def test_index_bz2(self):
+        self.do_test_index('bz2', 65536)
+
+    def test_index_gz(self):
+        self.do_test_index('gz', 65536)
+
+    def test_index_small_blocks(self):
+        # frames end in the middle of blocks, and at their ends
+        for blockSize in 1, 7, 100:
+            self.do_test_index('bz2', blockSize)
+            self.do_test_index('gz', blockSize)
+
+    def test_index_single_stream(self):
+        with open(self.filename, 'wb') as out:
+            out.write(bz2.compress(self.data))
+        index = cStringIO.StringIO()
+        with open(self.filename, 'rb') as f:
+            framedfile.indexFramedFile(f, index, 'bz2', 1000)
+        f = framedfile.FramedFile(self.filename, 'bz2', index.getvalue())
+        self.assertEqual(len(f.frames), 1)
+        self.assertEqual(f.read(), self.data)
+
+    def test_empty(self):
+        self.data = ''
+        self.write('gz')
+        f = framedfile.FramedFile(self.filename, 'gz')
+        self.assertEqual(f.read(), '')
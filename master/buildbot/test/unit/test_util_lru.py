@@ -254,6 +254,99 @@ class LRUCacheTest(unittest.TestCase):
         self.assertEqual(self.lru.get('p'), set(['PPP']))
         self.assertEqual(self.lru.get('q'), set(['QQQ']))  # not updated
 
+    def test_weight(self):
+        self.lru = lru.LRUCache(short, 10, weight_fn=len, max_weight=2)
+        a = self.lru.get('a')
+        self.lru.get('b')
+        self.assertEqual(self.lru.weight, 2)
+        self.lru.get('c')
+        self.assertEqual(sorted(self.lru.keys()), ['b', 'c'])
+        self.assertEqual(self.lru.weight, 2)
+        self.lru.inv()
+
+        # a refhit is weighed again, and evicted with the next miss
+        self.check_result(self.lru.get('a'), a, exp_refhits=1)
+        self.assertEqual(self.lru.weight, 3)
+        self.lru.get('d')
+        self.assertEqual(sorted(self.lru.keys()), ['a', 'd'])
+        self.lru.inv()
+
+    def test_weight_keeps_most_recent(self):
+        self.lru = lru.LRUCache(short, 10, weight_fn=lambda v: 5,
+                                max_weight=2)
+        self.lru.get('a')
+        self.lru.get('b')
+        self.assertEqual(self.lru.keys(), ['b'])
+        self.assertEqual(self.lru.weight, 5)
+
+    def test_set_max_weight(self):
+        self.lru = lru.LRUCache(short, 10, weight_fn=len)
+        for c in 'abcd':
+            self.lru.get(c)
+        self.assertEqual(self.lru.weight, 4)
+        self.lru.set_max_weight(3)
+        self.assertEqual(sorted(self.lru.keys()), ['b', 'c', 'd'])
+        self.lru.inv()
+
+    def test_put_reweighs(self):
+        self.lru = lru.LRUCache(short, 10, weight_fn=len)
+        self.lru.get('p')
+        self.lru.put('p', set(['P', 'PP']))
+        self.assertEqual(self.lru.weight, 2)
+        self.lru.inv()
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        lru.inv_failed = False
+        self.budget = lru.MemoryBudget(4)
+
+    def tearDown(self):
+        self.assertFalse(lru.inv_failed, "invariant failed; see logs")
+
+    def test_evicts_from_heaviest(self):
+        light = lru.LRUCache(short, 10, weight_fn=lambda v: 1)
+        heavy = lru.LRUCache(long, 10, weight_fn=lambda v: 2)
+        self.budget.add(light)
+        self.budget.add(heavy)
+        light.get('a')
+        heavy.get('b')
+        heavy.get('c')
+        self.assertEqual(self.budget.get_weight(), 3)
+        light.get('d')
+        self.assertEqual(sorted(heavy.keys()), ['c'])
+        self.assertEqual(sorted(light.keys()), ['a', 'd'])
+        self.assertEqual(self.budget.get_weight(), 4)
+        light.inv()
+        heavy.inv()
+
+    def test_unweighed_caches(self):
+        unweighed = lru.LRUCache(short, 10)
+        self.budget.add(unweighed)
+        for c in 'abcdef':
+            unweighed.get(c)
+        self.assertEqual(len(unweighed.keys()), 6)
+
+    def test_set_max_weight(self):
+        cache = lru.LRUCache(short, 10, weight_fn=lambda v: 1)
+        self.budget.add(cache)
+        for c in 'abcd':
+            cache.get(c)
+        self.budget.set_max_weight(2)
+        self.assertEqual(sorted(cache.keys()), ['c', 'd'])
+        self.budget.set_max_weight(None)
+        cache.get('e')
+        self.assertEqual(sorted(cache.keys()), ['c', 'd', 'e'])
+
+    def test_caches_weakly_referenced(self):
+        cache = lru.LRUCache(short, 10, weight_fn=lambda v: 1)
+        cache.get('a')
+        self.budget.add(cache)
+        del cache
+        gc.collect()
+        self.assertEqual(self.budget.get_weight(), 0)
+
 
 class AsyncLRUCacheTest(unittest.TestCase):
 
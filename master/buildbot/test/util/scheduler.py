@@ -61,7 +61,7 @@ class FakeMaster(object):
 
     # caches
 
-    def get_cache(self, cache_name, miss_fn):
+    def get_cache(self, cache_name, miss_fn, weight_fn=None):
         c = mock.Mock(name=cache_name)
         c.get = miss_fn
         return c
@@ -0,0 +1,189 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Block-compressed files that support random access.
+
+A framed file is a sequence of independently compressed frames, each of
+which is a complete bz2 stream or gzip member, so the file as a whole can
+still be decompressed with the standard tools.  A sidecar frame index,
+stored next to the data with a L{FRAME_INDEX_SUFFIX} suffix, holds one
+fixed-size record per frame giving the frame's offset and length in the
+compressed file and the offset and length of the data it decompresses to.
+"""
+
+import bisect
+import bz2
+import struct
+import zlib
+
+from cStringIO import StringIO
+from gzip import GzipFile
+
+FRAME_INDEX_SUFFIX = '.frames'
+frameRecord = struct.Struct("!QLQL")
+
+
+def _gzip_compress(data):
+    buf = StringIO()
+    f = GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def _gzip_decompress(data):
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+
+codecs = {
+    'bz2': (bz2.compress, bz2.decompress),
+    'gz': (_gzip_compress, _gzip_decompress),
+}
+
+# incremental decompressors, which stop at the end of a frame
+decompressors = {
+    'bz2': bz2.BZ2Decompressor,
+    'gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+}
+
+
+def writeFramedFile(infile, outfile, indexfile, method, frameSize):
+    """
+    Compress everything read from C{infile} into C{outfile} in frames of
+    C{frameSize} uncompressed bytes, writing the frame index to
+    C{indexfile}.  All three are open file objects.
+
+    @param method: compression method, one of the keys of L{codecs}
+    @returns: the number of uncompressed bytes written
+    """
+    compress = codecs[method][0]
+    coffset = uoffset = 0
+    while True:
+        data = infile.read(frameSize)
+        if not data:
+            break
+        frame = compress(data)
+        outfile.write(frame)
+        indexfile.write(frameRecord.pack(coffset, len(frame),
+                                         uoffset, len(data)))
+        coffset += len(frame)
+        uoffset += len(data)
+    return uoffset
+
+
+def indexFramedFile(infile, indexfile, method, blockSize=65536):
+    """
+    Write the frame index of the compressed data read from C{infile} to
+    C{indexfile}, as L{writeFramedFile} would have, by decompressing the
+    data to find where each frame ends.  Data compressed as one stream,
+    rather than in frames, is indexed as a single frame.
+
+    @param method: compression method, one of the keys of L{codecs}
+    @returns: the number of uncompressed bytes in C{infile}
+    """
+    coffset = uoffset = 0
+    decompressor = None
+    data = infile.read(blockSize)
+    while data:
+        if decompressor is None:
+            decompressor = decompressors[method]()
+            clength = ulength = 0
+        try:
+            ulength += len(decompressor.decompress(data))
+        except EOFError:
+            # a bz2 frame that ended with the previous block
+            rest, ended = data, True
+        else:
+            rest = decompressor.unused_data
+            ended = bool(rest)
+        clength += len(data) - len(rest)
+        if ended:
+            indexfile.write(frameRecord.pack(coffset, clength,
+                                             uoffset, ulength))
+            coffset += clength
+            uoffset += ulength
+            decompressor = None
+        data = rest or infile.read(blockSize)
+    if decompressor is not None:
+        # the last frame ends with the file
+        indexfile.write(frameRecord.pack(coffset, clength, uoffset, ulength))
+        uoffset += ulength
+    return uoffset
+
+
+class FramedFile(object):
+
+    """
+    A read-only, seekable file object over a framed file.  Reads decompress
+    only the frames that they touch; the most recently decompressed frame is
+    kept so that sequential reads decompress each frame once.  The frame
+    index is read from its file unless its content is given as C{index}.
+    """
+
+    def __init__(self, filename, method, index=None):
+        self.decompress = codecs[method][1]
+        if index is None:
+            f = open(filename + FRAME_INDEX_SUFFIX, 'rb')
+            try:
+                index = f.read()
+            finally:
+                f.close()
+        self.frames = [frameRecord.unpack_from(index, i)
+                       for i in xrange(0, len(index), frameRecord.size)]
+        self.starts = [frame[2] for frame in self.frames]
+        if self.frames:
+            self.length = self.frames[-1][2] + self.frames[-1][3]
+        else:
+            self.length = 0
+        self.fp = open(filename, 'rb')
+        self.pos = 0
+        self.cached = None
+        self.cachedData = None
+
+    def _getFrame(self, i):
+        if self.cached != i:
+            coffset, clength = self.frames[i][:2]
+            self.fp.seek(coffset)
+            self.cachedData = self.decompress(self.fp.read(clength))
+            self.cached = i
+        return self.cachedData
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.length
+        self.pos = max(offset, 0)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.length
+        if size >= 0:
+            end = min(self.pos + size, end)
+        pieces = []
+        while self.pos < end:
+            i = bisect.bisect_right(self.starts, self.pos) - 1
+            data = self._getFrame(i)
+            start = self.pos - self.frames[i][2]
+            piece = data[start:start + end - self.pos]
+            pieces.append(piece)
+            self.pos += len(piece)
+        return "".join(pieces)
+
+    def close(self):
+        self.fp.close()
+        self.cached = self.cachedData = None
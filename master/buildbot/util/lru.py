@@ -18,6 +18,7 @@ from collections import deque
 from itertools import ifilterfalse
 from twisted.internet import defer
 from twisted.python import log
+from weakref import WeakKeyDictionary
 from weakref import WeakValueDictionary
 
 
@@ -26,15 +27,21 @@ class LRUCache(object):
     """
     A least-recently-used cache, with a fixed maximum size.
 
+    If C{weight_fn} is given, it is called with each value as it enters the
+    cache and should return the approximate number of bytes the value holds;
+    the cache then also evicts entries while their total weight exceeds
+    C{max_weight}, or while the L{MemoryBudget} it belongs to is exceeded.
+
     See buildbot manual for more information.
     """
 
     __slots__ = ('max_size max_queue miss_fn queue cache weakrefs '
-                 'refcount hits refhits misses'.split())
+                 'refcount hits refhits misses weight_fn weights weight '
+                 'max_weight budget __weakref__'.split())
     sentinel = object()
     QUEUE_SIZE_FACTOR = 10
 
-    def __init__(self, miss_fn, max_size=50):
+    def __init__(self, miss_fn, max_size=50, weight_fn=None, max_weight=None):
         self.max_size = max_size
         self.max_queue = max_size * self.QUEUE_SIZE_FACTOR
         self.queue = deque()
@@ -43,11 +50,16 @@ class LRUCache(object):
         self.hits = self.misses = self.refhits = 0
         self.refcount = defaultdict(lambda: 0)
         self.miss_fn = miss_fn
+        self.weight_fn = weight_fn
+        self.weights = {}
+        self.weight = 0
+        self.max_weight = max_weight
+        self.budget = None
 
     def put(self, key, value):
         if key in self.cache:
-            self.cache[key] = value
-            self.weakrefs[key] = value
+            self._add(key, value)
+            self._purge()
         elif key in self.weakrefs:
             self.weakrefs[key] = value
 
@@ -61,8 +73,7 @@ class LRUCache(object):
 
         result = self.miss_fn(key, **miss_fn_kwargs)
         if result is not None:
-            self.cache[key] = result
-            self.weakrefs[key] = result
+            self._add(key, result)
             self._ref_key(key)
             self._purge()
 
@@ -79,6 +90,13 @@ class LRUCache(object):
         self.max_queue = max_size * self.QUEUE_SIZE_FACTOR
         self._purge()
 
+    def set_max_weight(self, max_weight):
+        if self.max_weight == max_weight:
+            return
+
+        self.max_weight = max_weight
+        self._purge()
+
     def inv(self):
         global inv_failed
 
@@ -103,6 +121,25 @@ class LRUCache(object):
             log.msg("      got:", sorted(self.refcount.items()))
             inv_failed = True
 
+        # only cached values are weighed, and the total is kept up to date
+        if set(self.weights) - cache_keys:
+            log.msg("INV: uncached keys weighed:",
+                    set(self.weights) - cache_keys)
+            inv_failed = True
+        if sum(self.weights.itervalues()) != self.weight:
+            log.msg("INV: weight %d is not the sum of weights %r"
+                    % (self.weight, self.weights))
+            inv_failed = True
+
+    def _add(self, key, value):
+        """Store the value for key, weighing it if necessary."""
+        self.cache[key] = value
+        self.weakrefs[key] = value
+        if self.weight_fn is not None:
+            weight = self.weight_fn(value)
+            self.weight += weight - self.weights.get(key, 0)
+            self.weights[key] = weight
+
     def _ref_key(self, key):
         """Record a reference to the argument key."""
         queue = self.queue
@@ -136,32 +173,45 @@ class LRUCache(object):
 
         result = self.weakrefs[key]
         self.refhits += 1
-        self.cache[key] = result
+        self._add(key, result)
         self._ref_key(key)
         return result
 
     def _purge(self):
         """
-        Trim the cache down to max_size by evicting the
-        least-recently-used entries.
+        Trim the cache down to max_size and max_weight by evicting the
+        least-recently-used entries, then enforce the budget, if any.
         """
-        if len(self.cache) <= self.max_size:
-            return
-
         cache = self.cache
-        refcount = self.refcount
-        queue = self.queue
         max_size = self.max_size
+        max_weight = self.max_weight
 
-        # purge least recently used entries, using refcount to count entries
-        # that appear multiple times in the queue
         while len(cache) > max_size:
-            refc = 1
-            while refc:
-                k = queue.popleft()
-                refc = refcount[k] = refcount[k] - 1
-            del cache[k]
-            del refcount[k]
+            self._evict()
+
+        # the most recently used entry is kept, however heavy it is
+        if max_weight is not None:
+            while self.weight > max_weight and len(cache) > 1:
+                self._evict()
+
+        if self.budget is not None:
+            self.budget.enforce()
+
+    def _evict(self):
+        """Evict the least-recently-used entry."""
+        refcount = self.refcount
+        queue = self.queue
+
+        # use refcount to skip over entries that appear multiple times in
+        # the queue
+        refc = 1
+        while refc:
+            k = queue.popleft()
+            refc = refcount[k] = refcount[k] - 1
+        del self.cache[k]
+        del refcount[k]
+        if k in self.weights:
+            self.weight -= self.weights.pop(k)
 
 
 class AsyncLRUCache(LRUCache):
@@ -173,8 +223,9 @@ class AsyncLRUCache(LRUCache):
 
     __slots__ = ['concurrent']
 
-    def __init__(self, miss_fn, max_size=50):
-        LRUCache.__init__(self, miss_fn, max_size=max_size)
+    def __init__(self, miss_fn, max_size=50, weight_fn=None, max_weight=None):
+        LRUCache.__init__(self, miss_fn, max_size=max_size,
+                          weight_fn=weight_fn, max_weight=max_weight)
         self.concurrent = {}
 
     def get(self, key, **miss_fn_kwargs):
@@ -204,8 +255,7 @@ class AsyncLRUCache(LRUCache):
 
         def handle_result(result):
             if result is not None:
-                self.cache[key] = result
-                self.weakrefs[key] = result
+                self._add(key, result)
 
                 # reference the key once, possibly standing in for multiple
                 # concurrent accesses
@@ -230,5 +280,46 @@ class AsyncLRUCache(LRUCache):
         return d
 
 
+class MemoryBudget(object):
+
+    """
+    A limit on the total weight of the entries of several caches.  Caches
+    are added with L{add}; whenever one of them grows, entries are evicted
+    from the heaviest cache until the total fits within C{max_weight}.
+    Each cache keeps at least one entry.
+    """
+
+    def __init__(self, max_weight=None):
+        self.max_weight = max_weight
+        self.caches = WeakKeyDictionary()
+
+    def add(self, cache):
+        cache.budget = self
+        self.caches[cache] = None
+        self.enforce()
+
+    def get_weight(self):
+        return sum(c.weight for c in self.caches.keys())
+
+    def set_max_weight(self, max_weight):
+        self.max_weight = max_weight
+        self.enforce()
+
+    def enforce(self):
+        if self.max_weight is None:
+            return
+
+        caches = self.caches.keys()
+        weight = sum(c.weight for c in caches)
+        while weight > self.max_weight:
+            candidates = [c for c in caches if c.weight and len(c.cache) > 1]
+            if not candidates:
+                break
+            heaviest = max(candidates, key=lambda c: c.weight)
+            before = heaviest.weight
+            heaviest._evict()
+            weight -= before - heaviest.weight
+
+
 # for tests
 inv_failed = False
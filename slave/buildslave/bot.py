@@ -17,6 +17,9 @@ import os.path
 import signal
 import socket
 import sys
+import zlib
+
+from collections import deque
 
 from twisted.application import internet
 from twisted.application import service
@@ -62,9 +65,35 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # when the step is started
     remoteStep = None
 
+    # when the master asks for compressed updates, output of at least this
+    # many bytes is sent zlib-compressed, at this compression level
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_LEVEL = 6
+
+    # set by the bot when the master accepts ordered 'output' updates, which
+    # lets RunProcess interleave output from several logs in one update
+    orderedUpdates = False
+
+    # at most this many updates are sent without being acknowledged by the
+    # master; further updates wait in updateQueue, where adjacent output is
+    # coalesced into updates of up to COALESCE_LIMIT bytes
+    MAX_PENDING_UPDATES = 8
+    COALESCE_LIMIT = 128 * 1024
+
+    # once more than this many updates are waiting in updateQueue, the
+    # command is asked to stop producing output until the queue has drained
+    # to half that
+    MAX_QUEUED_UPDATES = 64
+
     def __init__(self, name):
         # service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self.pendingUpdates = 0
+        self.updateQueue = deque()
+        self.ackLatency = None
+        self.maxQueueDepth = 0
+        self.maxAckLatency = 0
+        self.commandPaused = False
 
     def __repr__(self):
         return "<SlaveBuilder '%s' at %d>" % (self.name, id(self))
@@ -112,6 +141,8 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self.updateQueue.clear()
+        self._checkQueueDepth()
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -142,8 +173,11 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         except KeyError:
             raise UnknownCommand("unrecognized SlaveCommand '%s'" % command)
         self.command = factory(self, stepId, args)
+        self.commandPaused = False
 
         log.msg(" startCommand:%s [id %s]" % (command, stepId))
+        self.maxQueueDepth = 0
+        self.maxAckLatency = 0
         self.remoteStep = stepref
         self.remoteStep.notifyOnDisconnect(self.lostRemoteStep)
         d = self.command.doStart()
@@ -179,26 +213,168 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         L{buildbot.process.step.RemoteCommand} object, giving it a sequence
         number in the process. It adds the update to a queue, and asks the
         master to acknowledge the update so it can be removed from that
-        queue."""
+        queue.
+
+        No more than MAX_PENDING_UPDATES updates are left unacknowledged;
+        while the master is catching up, output updates are coalesced in
+        the queue, and if the queue still grows past MAX_QUEUED_UPDATES the
+        command's output is paused until it drains."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
             # service is running or not. If we aren't running, don't send any
             # status messages.
             return
-        # the update[1]=0 comes from the leftover 'updateNum', which the
-        # master still expects to receive. Provide it to avoid significant
-        # interoperability issues between new slaves and old masters.
         if self.remoteStep:
+            self._queueUpdate(self.remoteStep, data)
+            self._sendQueued()
+
+    def _queueUpdate(self, remote, data):
+        if self.updateQueue:
+            last_remote, kind, last_data = self.updateQueue[-1]
+            if last_remote is remote and kind == 'update':
+                merged = self._coalesceUpdates(last_data, data)
+                if merged is not None:
+                    self.updateQueue[-1] = (remote, kind, merged)
+                    return
+        self.updateQueue.append((remote, 'update', data))
+
+    def _outputEntries(self, data):
+        # return the output in an update as a list of (key, logname, text),
+        # or None if the update carries anything else
+        if data.keys() == ['output']:
+            entries = data['output']
+        elif len(data) != 1:
+            return None
+        elif 'log' in data:
+            entries = [('log',) + tuple(data['log'])]
+        elif data.keys()[0] in ('stdout', 'stderr', 'header'):
+            key, text = data.items()[0]
+            entries = [(key, None, text)]
+        else:
+            return None
+        for key, logname, text in entries:
+            if not isinstance(text, str):
+                return None
+        return entries
+
+    def _coalesceUpdates(self, first, second):
+        # merge two output updates into one, or return None if they cannot
+        # be merged
+        entries = self._outputEntries(first)
+        if entries is None:
+            return None
+        more = self._outputEntries(second)
+        if more is None:
+            return None
+        size = sum([len(text) for key, logname, text in entries + more])
+        if size > self.COALESCE_LIMIT:
+            return None
+        merged = list(entries)
+        for key, logname, text in more:
+            if merged[-1][:2] == (key, logname):
+                merged[-1] = (key, logname, merged[-1][2] + text)
+            else:
+                merged.append((key, logname, text))
+        if len(merged) == 1:
+            key, logname, text = merged[0]
+            if key == 'log':
+                return {'log': (logname, text)}
+            return {key: text}
+        if self.orderedUpdates:
+            return {'output': merged}
+        return None
+
+    def _sendQueued(self):
+        while self.updateQueue:
+            remote, kind, data = self.updateQueue[0]
+            if kind == 'complete':
+                self.updateQueue.popleft()
+                self._sendComplete(remote, data)
+                continue
+            if self.pendingUpdates >= self.MAX_PENDING_UPDATES:
+                self.maxQueueDepth = max(self.maxQueueDepth,
+                                         len(self.updateQueue))
+                break
+            self.updateQueue.popleft()
+            if self.bot.compressUpdates:
+                data = self._compressUpdate(data)
+            # the update[1]=0 comes from the leftover 'updateNum', which the
+            # master still expects to receive. Provide it to avoid significant
+            # interoperability issues between new slaves and old masters.
             update = [data, 0]
             updates = [update]
-            d = self.remoteStep.callRemote("update", updates)
+            self.pendingUpdates += 1
+            d = remote.callRemote("update", updates)
             d.addCallback(self.ackUpdate)
             d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+            d.addCallback(self._updateDone, reactor.seconds())
+        self._checkQueueDepth()
+
+    def _checkQueueDepth(self):
+        # pause the command's output while too many updates are queued, and
+        # resume it once the queue has drained
+        depth = len(self.updateQueue)
+        if self.commandPaused:
+            if depth <= self.MAX_QUEUED_UPDATES // 2 or not self.command:
+                self.commandPaused = False
+                if self.command:
+                    self.command.resumeProducing()
+        elif depth > self.MAX_QUEUED_UPDATES and self.command:
+            self.commandPaused = True
+            self.command.pauseProducing()
+
+    def _compressUpdate(self, data):
+        if 'output' in data:
+            return self._compressOutput(data)
+        # move large output into a 'compressed' list of (key, logname, data)
+        compressed = []
+        for key in ('stdout', 'stderr', 'header', 'log'):
+            if key not in data:
+                continue
+            if key == 'log':
+                logname, text = data[key]
+            else:
+                logname, text = None, data[key]
+            if not isinstance(text, str) or \
+                    len(text) < self.COMPRESS_MIN_SIZE:
+                continue
+            if not compressed:
+                data = data.copy()
+            del data[key]
+            compressed.append((key, logname,
+                               zlib.compress(text, self.COMPRESS_LEVEL)))
+        if compressed:
+            data['compressed'] = compressed
+        return data
+
+    def _compressOutput(self, data):
+        # compress an ordered 'output' batch as a single zlib frame, sending
+        # an index of (key, logname, length) to split it up again
+        output = data['output']
+        for key, logname, text in output:
+            if not isinstance(text, str):
+                return data
+        joined = ''.join([text for key, logname, text in output])
+        if len(joined) < self.COMPRESS_MIN_SIZE:
+            return data
+        data = data.copy()
+        del data['output']
+        index = [(key, logname, len(text))
+                 for key, logname, text in output]
+        data['compressed_output'] = (index,
+                                     zlib.compress(joined, self.COMPRESS_LEVEL))
+        return data
 
     def ackUpdate(self, acknum):
         self.activity()  # update the "last activity" timer
 
+    def _updateDone(self, _, sent):
+        self.pendingUpdates -= 1
+        self.ackLatency = reactor.seconds() - sent
+        self.maxAckLatency = max(self.maxAckLatency, self.ackLatency)
+        self._sendQueued()
+
     def ackComplete(self, dummy):
         self.activity()  # update the "last activity" timer
 
@@ -218,17 +394,26 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         else:
             # failure is None
             log.msg("SlaveBuilder.commandComplete", self.command)
+        if self.maxQueueDepth:
+            log.msg(" updates were queued: max queue depth %d, "
+                    "max ack latency %.3fs"
+                    % (self.maxQueueDepth, self.maxAckLatency))
         self.command = None
         if not self.running:
             log.msg(" but we weren't running, quitting silently")
             return
         if self.remoteStep:
             self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
-            d = self.remoteStep.callRemote("complete", failure)
-            d.addCallback(self.ackComplete)
-            d.addErrback(self._ackFailed, "sendComplete")
+            # the completion goes out after any queued updates
+            self.updateQueue.append((self.remoteStep, 'complete', failure))
+            self._sendQueued()
             self.remoteStep = None
 
+    def _sendComplete(self, remote, failure):
+        d = remote.callRemote("complete", failure)
+        d.addCallback(self.ackComplete)
+        d.addErrback(self._ackFailed, "sendComplete")
+
     def remote_shutdown(self):
         log.msg("slave shutting down on command from master")
         log.msg("NOTE: master is using deprecated slavebuilder.shutdown method")
@@ -241,6 +426,12 @@ class Bot(pb.Referenceable, service.MultiService):
     usePTY = None
     name = "bot"
 
+    # set by the master, if it wants output updates compressed
+    compressUpdates = False
+
+    # set by the master, if it accepts ordered 'output' updates
+    orderedUpdates = False
+
     def __init__(self, basedir, usePTY, unicode_encoding=None):
         service.MultiService.__init__(self)
         self.basedir = basedir
@@ -276,6 +467,7 @@ class Bot(pb.Referenceable, service.MultiService):
                 b = SlaveBuilder(name)
                 b.usePTY = self.usePTY
                 b.unicode_encoding = self.unicode_encoding
+                b.orderedUpdates = self.orderedUpdates
                 b.setServiceParent(self)
                 b.setBuilddir(builddir)
                 self.builders[name] = b
@@ -307,6 +499,18 @@ class Bot(pb.Referenceable, service.MultiService):
     def remote_print(self, message):
         log.msg("message from master:", message)
 
+    def remote_setUpdateCompression(self, compress):
+        log.msg("master %s compressed updates"
+                % (compress and "wants" or "does not want"))
+        self.compressUpdates = compress
+
+    def remote_setOrderedUpdates(self, ordered):
+        log.msg("master %s ordered updates"
+                % (ordered and "accepts" or "does not accept"))
+        self.orderedUpdates = ordered
+        for b in self.builders.itervalues():
+            b.orderedUpdates = ordered
+
     def remote_getSlaveInfo(self):
         """This command retrieves data from the files in SLAVEDIR/info/* and
         sends the contents to the buildmaster. These are used to describe
@@ -37,7 +37,7 @@ from buildslave.interfaces import ISlaveCommand
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "2.16"
+command_version = "2.23"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -71,6 +71,13 @@ command_version = "2.16"
 #  >= 2.15: 'interruptSignal' option is added to SlaveShellCommand
 #  >= 2.16: 'sigtermTime' option is added to SlaveShellCommand
 #  >= 2.17: listdir command added to read a directory
+#  >= 2.18: uploadFile, uploadDirectory and downloadFile accept 'window' and
+#           'maxblocksize' for pipelined transfers
+#  >= 2.19: uploadDirectory accepts 'stream' to archive while sending
+#  >= 2.20: uploadContent command added to upload only files the master lacks
+#  >= 2.21: the bot accepts setUpdateCompression to send compressed output
+#  >= 2.22: the bot accepts setOrderedUpdates to batch output from several logs
+#  >= 2.23: 'outputBuffering' option is added to SlaveShellCommand
 
 
 class Command:
@@ -187,6 +194,21 @@ class Command:
         this matters."""
         pass
 
+    def pauseProducing(self):
+        """Called by the builder while too many status updates are waiting
+        to be sent; the command should produce no more output until
+        resumeProducing() is called.  Commands running a child process in
+        self.command pause their reading of its output."""
+        command = getattr(self, 'command', None)
+        if command is not None and hasattr(command, 'pauseProducing'):
+            command.pauseProducing()
+
+    def resumeProducing(self):
+        """Called by the builder once its status updates have drained."""
+        command = getattr(self, 'command', None)
+        if command is not None and hasattr(command, 'resumeProducing'):
+            command.resumeProducing()
+
     # utility methods, mostly used by SlaveShellCommand and the like
 
     def _abandonOnFailure(self, rc):
@@ -21,6 +21,7 @@ commandRegistry = {
     "uploadFile": "buildslave.commands.transfer.SlaveFileUploadCommand",
     "uploadDirectory": "buildslave.commands.transfer.SlaveDirectoryUploadCommand",
     "downloadFile": "buildslave.commands.transfer.SlaveFileDownloadCommand",
+    "uploadContent": "buildslave.commands.transfer.SlaveContentUploadCommand",
     "svn": "buildslave.commands.svn.SVN",
     "bk": "buildslave.commands.bk.BK",
     "cvs": "buildslave.commands.cvs.CVS",
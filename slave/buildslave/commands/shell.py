@@ -27,6 +27,9 @@ class SlaveShellCommand(base.Command):
         assert args['workdir'] is not None
         workdir = os.path.join(self.builder.basedir, args['workdir'])
 
+        kwargs = {}
+        if args.get('outputBuffering'):
+            kwargs['outputBuffering'] = args['outputBuffering']
         c = runprocess.RunProcess(
             self.builder,
             args['command'],
@@ -42,6 +45,7 @@ class SlaveShellCommand(base.Command):
             logfiles=args.get('logfiles', {}),
             usePTY=args.get('usePTY', "slave-config"),
             logEnviron=args.get('logEnviron', True),
+            **kwargs
         )
         if args.get('interruptSignal'):
             c.interruptSignal = args['interruptSignal']
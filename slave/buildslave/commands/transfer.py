@@ -16,15 +16,148 @@
 import os
 import tarfile
 import tempfile
+import threading
+
+from collections import deque
+
+try:
+    from hashlib import sha1
+    assert sha1
+except ImportError:
+    # For Python 2.4
+    from sha import new as sha1
 
 from twisted.internet import defer
+from twisted.internet import threads
+from twisted.python import failure
 from twisted.python import log
 
+from buildslave import util
 from buildslave.commands.base import Command
 
 
 class TransferCommand(Command):
 
+    """
+    Base class for the transfer commands.
+
+    By default, transfers are stop-and-wait: each block is sent (or
+    requested) only once the master has acknowledged the previous one.  If
+    the master passes a C{window} argument greater than one, up to that many
+    blocks are kept in flight at once, and the block size is adapted between
+    C{blocksize} and C{maxblocksize} according to the measured round-trip
+    time: blocks grow while acknowledgements take less than C{targetRtt}
+    seconds, and shrink when they take more than twice as long.  Windowed
+    transfers report their statistics to the master in a C{transfer} update.
+
+    Subclasses using the pipeline implement L{_sendBlock} and L{_blockDone}.
+    """
+
+    window = 1
+    targetRtt = 0.25
+    # blocks are sent as PB strings, which Banana limits to 640KB
+    MAX_BLOCKSIZE = 512 * 1024
+
+    def setupWindow(self, args):
+        self.window = args.get('window', 1)
+        maxblocksize = min(args.get('maxblocksize', self.blocksize),
+                           self.MAX_BLOCKSIZE)
+        self.maxblocksize = max(maxblocksize, self.blocksize)
+        self.minblocksize = self.blocksize
+        self.pipelineStats = None
+
+    def _startPipeline(self, fire_when_done):
+        self.inflight = deque()
+        self.filling = False
+        self.pipelineDone = False
+        self.pipelineFailure = None
+        self.pipelineFinished = fire_when_done
+        self.pipelineStats = dict(bytes=0, blocks=0, rtt=None,
+                                  started=util.now(self._reactor))
+        self._fillPipeline()
+
+    def _fillPipeline(self):
+        # guard against re-entry when remote calls complete synchronously
+        if self.filling:
+            return
+        self.filling = True
+        try:
+            while not self.pipelineDone and len(self.inflight) < self.window:
+                entry = dict(sent=util.now(self._reactor))
+                try:
+                    d = self._sendBlock()
+                except Exception:
+                    # finish once the blocks in flight have returned
+                    self.pipelineFailure = failure.Failure()
+                    self.pipelineDone = True
+                    break
+                if d is None:
+                    self.pipelineDone = True
+                    break
+                self.inflight.append(entry)
+                d.addBoth(self._blockReturned, entry)
+        finally:
+            self.filling = False
+
+        if self.pipelineDone and not self.inflight \
+                and self.pipelineFinished:
+            d, self.pipelineFinished = self.pipelineFinished, None
+            stats = self.pipelineStats
+            stats['elapsed'] = util.now(self._reactor) - stats.pop('started')
+            stats['blocksize'] = self.blocksize
+            if self.pipelineFailure:
+                d.errback(self.pipelineFailure)
+            else:
+                d.callback(None)
+
+    def _blockReturned(self, res, entry):
+        entry['result'] = res
+        entry['rtt'] = util.now(self._reactor) - entry['sent']
+        # handle results in the order the blocks were sent
+        while self.inflight and 'result' in self.inflight[0]:
+            entry = self.inflight.popleft()
+            res = entry['result']
+            if self.pipelineFailure:
+                continue
+            if isinstance(res, failure.Failure):
+                self.pipelineFailure = res
+                self.pipelineDone = True
+                continue
+            self._adaptBlocksize(entry['rtt'])
+            if self._blockDone(res):
+                self.pipelineDone = True
+        self._fillPipeline()
+
+    def _adaptBlocksize(self, rtt):
+        stats = self.pipelineStats
+        stats['blocks'] += 1
+        if stats['rtt'] is None:
+            stats['rtt'] = rtt
+        else:
+            stats['rtt'] = 0.875 * stats['rtt'] + 0.125 * rtt
+        if rtt < self.targetRtt:
+            self.blocksize = min(self.blocksize * 2, self.maxblocksize)
+        elif rtt > self.targetRtt * 2:
+            self.blocksize = max(self.blocksize // 2, self.minblocksize)
+
+    def _sendBlock(self):
+        """
+        Send (or request) the next block of data.
+
+        @returns: Deferred firing with the master's reply, or None if there
+        is nothing more to send
+        """
+        raise NotImplementedError
+
+    def _blockDone(self, res):
+        """
+        Handle the master's reply to a block, in the order the blocks were
+        sent.
+
+        @returns: True if the transfer is complete
+        """
+        raise NotImplementedError
+
     def finished(self, res):
         if self.debug:
             log.msg('finished: stderr=%r, rc=%r' % (self.stderr, self.rc))
@@ -34,6 +167,9 @@ class TransferCommand(Command):
         upd = {'rc': self.rc}
         if self.stderr:
             upd['stderr'] = self.stderr
+        stats = getattr(self, 'pipelineStats', None)
+        if stats and 'elapsed' in stats:
+            upd['transfer'] = stats
         self.builder.sendUpdate(upd)
         return res
 
@@ -72,6 +208,7 @@ class SlaveFileUploadCommand(TransferCommand):
         self.keepstamp = args.get('keepstamp', False)
         self.stderr = None
         self.rc = 0
+        self.setupWindow(args)
 
     def start(self):
         if self.debug:
@@ -130,6 +267,8 @@ class SlaveFileUploadCommand(TransferCommand):
         return d
 
     def _loop(self, fire_when_done):
+        if self.window > 1:
+            return self._startPipeline(fire_when_done)
         d = defer.maybeDeferred(self._writeBlock)
 
         def _done(finished):
@@ -146,10 +285,17 @@ class SlaveFileUploadCommand(TransferCommand):
     def _writeBlock(self):
         """Write a block of data to the remote writer"""
 
+        d = self._sendBlock()
+        if d is None:
+            return True
+        d.addCallback(self._blockDone)
+        return d
+
+    def _sendBlock(self):
         if self.interrupted or self.fp is None:
             if self.debug:
                 log.msg('SlaveFileUploadCommand._writeBlock(): end')
-            return True
+            return None
 
         length = self.blocksize
         if self.remaining is not None and length > self.remaining:
@@ -169,17 +315,126 @@ class SlaveFileUploadCommand(TransferCommand):
                     'allowed=%d readlen=%d' % (length, len(data)))
         if len(data) == 0:
             log.msg("EOF: callRemote(close)")
-            return True
+            return None
 
         if self.remaining is not None:
             self.remaining = self.remaining - len(data)
             assert self.remaining >= 0
-        d = self.writer.callRemote('write', data)
-        d.addCallback(lambda res: False)
+        if self.pipelineStats is not None:
+            self.pipelineStats['bytes'] += len(data)
+        return self.writer.callRemote('write', data)
+
+    def _blockDone(self, res):
+        return False
+
+
+class TarPipe(object):
+
+    """
+    A pipe between a tarfile writing an archive in a thread, and the reactor
+    reading it in blocks.  At most C{maxBlocks} blocks are buffered; beyond
+    that, the writing thread waits for the reactor to catch up.
+    """
+
+    def __init__(self, reactor, blocksize, maxBlocks=8):
+        self.reactor = reactor
+        self.blocksize = blocksize
+        self.slots = threading.Semaphore(maxBlocks)
+        self.buf = []
+        self.buflen = 0
+        self.blocks = deque()
+        self.waiters = deque()
+        self.eof = False
+        self.failure = None
+        self.aborted = False
+
+    # the writing thread's side
+
+    def write(self, data):
+        self.buf.append(data)
+        self.buflen += len(data)
+        if self.buflen >= self.blocksize:
+            data = ''.join(self.buf)
+            while len(data) >= self.blocksize:
+                self._put(data[:self.blocksize])
+                data = data[self.blocksize:]
+            self.buf = [data]
+            self.buflen = len(data)
+
+    def _put(self, block):
+        self.slots.acquire()
+        if self.aborted:
+            raise IOError("transfer aborted")
+        self.reactor.callFromThread(self._blockReady, block)
+
+    def finish(self):
+        if self.buflen:
+            self._put(''.join(self.buf))
+            self.buf = []
+            self.buflen = 0
+
+    # the reactor's side
+
+    def read(self):
+        """
+        Get the next block of the archive.
+
+        @returns: Deferred firing with the block, or with an empty string at
+        the end of the archive
+        """
+        if self.blocks:
+            return defer.succeed(self._take())
+        if self.failure:
+            return defer.fail(self.failure)
+        if self.eof:
+            return defer.succeed('')
+        d = defer.Deferred()
+        self.waiters.append(d)
         return d
 
+    def _take(self):
+        self.slots.release()
+        return self.blocks.popleft()
+
+    def _blockReady(self, block):
+        self.blocks.append(block)
+        while self.waiters and self.blocks:
+            self.waiters.popleft().callback(self._take())
+
+    def done(self, res):
+        """Called when the writing thread has finished, successfully or not"""
+        if isinstance(res, failure.Failure):
+            self.failure = res
+        else:
+            self.eof = True
+        while self.waiters:
+            d = self.waiters.popleft()
+            if self.failure:
+                d.errback(self.failure)
+            else:
+                d.callback('')
+
+    def abort(self):
+        # let a writing thread that is waiting for room go on, and fail
+        self.aborted = True
+        self.slots.release()
+
 
 class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
+
+    """
+    Upload a directory from slave to build master, as a tar archive
+    Arguments:
+
+        - ['workdir']:   base directory to use
+        - ['slavesrc']:  name of the slave-side directory to read from
+        - ['writer']:    RemoteReference to a transfer._DirectoryWriter object
+        - ['maxsize']:   max size (in bytes) of the archive to write
+        - ['blocksize']: max size for each data block
+        - ['compress']:  compression method for the archive: None, 'gz' or 'bz2'
+        - ['stream']:    create the archive in a thread while it is being sent,
+                         rather than in a temporary file beforehand
+    """
     debug = False
 
     def setup(self, args):
@@ -189,8 +444,12 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.compress = args['compress']
+        self.stream = args.get('stream', False)
         self.stderr = None
         self.rc = 0
+        self.setupWindow(args)
+        self.fp = None
+        self.pipe = None
 
     def start(self):
         if self.debug:
@@ -202,22 +461,30 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         if self.debug:
             log.msg("path: %r" % self.path)
 
-        # Create temporary archive
-        fd, self.tarname = tempfile.mkstemp()
-        fileobj = os.fdopen(fd, 'w')
         if self.compress == 'bz2':
             mode = 'w|bz2'
         elif self.compress == 'gz':
             mode = 'w|gz'
         else:
             mode = 'w'
-        archive = tarfile.open(name=self.tarname, mode=mode, fileobj=fileobj)
-        archive.add(self.path, '')
-        archive.close()
-        fileobj.close()
 
-        # Transfer it
-        self.fp = open(self.tarname, 'rb')
+        if self.stream:
+            # create the archive in a thread, while it is sent
+            self.pipe = TarPipe(self._reactor, self.blocksize)
+            self.tarred = threads.deferToThread(self._tar, mode)
+            self.tarred.addBoth(self.pipe.done)
+        else:
+            # Create temporary archive
+            fd, self.tarname = tempfile.mkstemp()
+            fileobj = os.fdopen(fd, 'w')
+            archive = tarfile.open(name=self.tarname, mode=mode,
+                                   fileobj=fileobj)
+            archive.add(self.path, '')
+            archive.close()
+            fileobj.close()
+
+            # Transfer it
+            self.fp = open(self.tarname, 'rb')
 
         self.sendStatus({'header': "sending %s" % self.path})
 
@@ -233,13 +500,216 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
             d1.addErrback(unpack_err)
             d1.addCallback(lambda ignored: res)
             return d1
-        d.addCallback(unpack)
+
+        def failed(f):
+            self.rc = 1
+            return f
+        d.addCallbacks(unpack, failed)
         d.addBoth(self.finished)
         return d
 
+    def _tar(self, mode):
+        # runs in a thread
+        if mode == 'w':
+            mode = 'w|'
+        archive = tarfile.open(mode=mode, fileobj=self.pipe)
+        archive.add(self.path, '')
+        archive.close()
+        self.pipe.finish()
+
+    def _sendBlock(self):
+        if not self.stream:
+            return SlaveFileUploadCommand._sendBlock(self)
+
+        if self.interrupted or self.pipe.eof and not self.pipe.blocks:
+            return None
+
+        # the archiving thread picks up any change of block size
+        self.pipe.blocksize = self.blocksize
+        d = self.pipe.read()
+
+        @d.addCallback
+        def send(data):
+            if not data:
+                return _EOF
+            if self.remaining is not None:
+                if len(data) > self.remaining:
+                    data = data[:self.remaining]
+                    if self.stderr is None:
+                        self.stderr = 'Maximum filesize reached, ' \
+                            'truncating file \'%s\'' % self.path
+                        self.rc = 1
+                if not data:
+                    return _EOF
+                self.remaining -= len(data)
+            if self.pipelineStats is not None:
+                self.pipelineStats['bytes'] += len(data)
+            return self.writer.callRemote('write', data)
+        return d
+
+    def _blockDone(self, res):
+        return res is _EOF
+
     def finished(self, res):
-        self.fp.close()
-        os.remove(self.tarname)
+        if self.pipe:
+            self.pipe.abort()
+        if self.fp:
+            self.fp.close()
+            os.remove(self.tarname)
+        return TransferCommand.finished(self, res)
+
+
+# returned by SlaveDirectoryUploadCommand._sendBlock at the end of the archive
+_EOF = object()
+
+
+class SlaveContentUploadCommand(SlaveFileUploadCommand):
+
+    """
+    Upload a file or a directory from slave to build master, sending only the
+    files whose content the master does not already have.  The slave first
+    sends a manifest of SHA1 hashes; the master answers with the names of the
+    files it needs, and those are then sent one after the other.
+    Arguments:
+
+        - ['workdir']:   base directory to use
+        - ['slavesrc']:  name of the slave-side file or directory to read from
+        - ['writer']:    RemoteReference to a transfer._ContentWriter object
+        - ['maxsize']:   max number of bytes to send
+        - ['blocksize']: max size for each data block
+    """
+    debug = False
+
+    def setup(self, args):
+        self.workdir = args['workdir']
+        self.filename = args['slavesrc']
+        self.writer = args['writer']
+        self.remaining = args['maxsize']
+        self.blocksize = args['blocksize']
+        self.stderr = None
+        self.rc = 0
+        self.setupWindow(args)
+        self.fp = None
+        self.calls = None
+
+    def start(self):
+        if self.debug:
+            log.msg('SlaveContentUploadCommand started')
+
+        self.path = os.path.join(self.builder.basedir,
+                                 self.workdir,
+                                 os.path.expanduser(self.filename))
+
+        self.sendStatus({'header': "sending %s" % self.path})
+
+        if not os.path.exists(self.path):
+            self.stderr = "Cannot read '%s' for upload" % self.path
+            self.rc = 1
+            return defer.maybeDeferred(self.finished, None)
+
+        # hashing may read a lot of data, so keep it off the reactor thread
+        d = threads.deferToThread(self._manifest)
+        d.addCallback(lambda manifest:
+                      self.writer.callRemote('manifest', manifest))
+
+        @d.addCallback
+        def send(needed):
+            if self.debug:
+                log.msg('master needs %d files' % len(needed))
+            self.calls = self._calls(needed)
+            d1 = defer.Deferred()
+            self._loop(d1)
+            return d1
+
+        @d.addCallback
+        def close(_):
+            return self.writer.callRemote('close')
+
+        def failed(f):
+            self.rc = 1
+            return f
+        d.addErrback(failed)
+        d.addBoth(self.finished)
+        return d
+
+    def _manifest(self):
+        # runs in a thread; returns a list of (name, sha1, size, mode), with
+        # a sha1 of None for directories
+        if not os.path.isdir(self.path):
+            return [('',) + self._hash(self.path)]
+        manifest = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            dirnames.sort()
+            reldir = dirpath[len(self.path):].lstrip(os.sep)
+            if reldir:
+                manifest.append((reldir.replace(os.sep, '/'), None, 0,
+                                 os.stat(dirpath).st_mode & 07777))
+            for filename in sorted(filenames):
+                name = os.path.join(reldir, filename)
+                path = os.path.join(self.path, name)
+                if not os.path.isfile(path):
+                    continue
+                manifest.append((name.replace(os.sep, '/'),)
+                                + self._hash(path))
+        return manifest
+
+    def _hash(self, path):
+        digest = sha1()
+        f = open(path, 'rb')
+        try:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            f.close()
+        st = os.stat(path)
+        return (digest.hexdigest(), st.st_size, st.st_mode & 07777)
+
+    def _calls(self, needed):
+        # generate the remote calls that send the needed files
+        for name in needed:
+            path = self.path
+            if name:
+                path = os.path.join(path, *name.split('/'))
+            self.fp = open(path, 'rb')
+            yield ('begin', name)
+            while True:
+                length = self.blocksize
+                if self.remaining is not None:
+                    length = min(length, self.remaining)
+                    if length <= 0:
+                        if self.stderr is None:
+                            self.stderr = 'Maximum filesize reached, ' \
+                                'truncating file \'%s\'' % path
+                            self.rc = 1
+                        return
+                data = self.fp.read(length)
+                if not data:
+                    break
+                if self.remaining is not None:
+                    self.remaining -= len(data)
+                if self.pipelineStats is not None:
+                    self.pipelineStats['bytes'] += len(data)
+                yield ('write', data)
+            self.fp.close()
+            self.fp = None
+            yield ('finish',)
+
+    def _sendBlock(self):
+        if self.interrupted:
+            return None
+        try:
+            call = self.calls.next()
+        except StopIteration:
+            return None
+        return self.writer.callRemote(*call)
+
+    def finished(self, res):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
         return TransferCommand.finished(self, res)
 
 
@@ -267,6 +737,7 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.mode = args['mode']
         self.stderr = None
         self.rc = 0
+        self.setupWindow(args)
 
     def start(self):
         if self.debug:
@@ -316,6 +787,10 @@ class SlaveFileDownloadCommand(TransferCommand):
         return d
 
     def _loop(self, fire_when_done):
+        if self.window > 1:
+            self.bytes_requested = 0
+            self.requested = deque()
+            return self._startPipeline(fire_when_done)
         d = defer.maybeDeferred(self._readBlock)
 
         def _done(finished):
@@ -365,6 +840,41 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.fp.write(data)
         return False
 
+    def _sendBlock(self):
+        if self.interrupted or self.fp is None:
+            if self.debug:
+                log.msg('SlaveFileDownloadCommand._sendBlock(): end')
+            return None
+
+        length = self.blocksize
+        if self.bytes_remaining is not None:
+            # don't ask for more than the bytes that remain once the reads
+            # already in flight have been answered
+            length = min(length, self.bytes_remaining - self.bytes_requested)
+            if length <= 0:
+                if not self.inflight and self.stderr is None:
+                    self.stderr = "Maximum filesize reached, truncating " \
+                        "file '%s'" % self.path
+                    self.rc = 1
+                return None
+            self.bytes_requested += length
+        self.requested.append(length)
+        return self.reader.callRemote('read', length)
+
+    def _blockDone(self, data):
+        length = self.requested.popleft()
+        if self.bytes_remaining is not None:
+            self.bytes_requested -= length
+        self.pipelineStats['bytes'] += len(data)
+        finished = self._writeData(data)
+        if not finished and self.bytes_remaining is not None \
+                and self.bytes_remaining <= 0 and self.stderr is None:
+            self.stderr = "Maximum filesize reached, truncating file '%s'" \
+                % self.path
+            self.rc = 1
+            finished = True
+        return finished
+
     def finished(self, res):
         if self.fp is not None:
             self.fp.close()
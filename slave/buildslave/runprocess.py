@@ -215,6 +215,70 @@ class RunProcessPP(protocol.ProcessProtocol):
         self.command.finished(sig, rc)
 
 
+class FixedBufferPolicy(object):
+
+    """
+    Send buffered output once C{size} bytes have been collected, or
+    C{timeout} seconds after the first byte was buffered.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+
+    def added(self, length, now):
+        pass
+
+    def flushed(self, now, ackLatency):
+        pass
+
+
+class AdaptiveBufferPolicy(object):
+
+    """
+    Tune the buffer size and timeout to the output: slow output is sent
+    within C{minTimeout} seconds, while fast output is collected into
+    buffers holding about C{fillTime} seconds of it, up to C{maxSize}
+    bytes.  The timeout is stretched to the master's ack latency, since
+    sending updates faster than the master acknowledges them only fills
+    the slave's update queue.
+    """
+
+    minSize = 4 * 1024
+    maxSize = 1024 * 1024
+    minTimeout = 0.2
+    maxTimeout = 5
+    fillTime = 1.0
+
+    def __init__(self):
+        self.size = self.minSize
+        self.timeout = self.minTimeout
+        self.rate = None
+        self.pending = 0
+        self.firstAdded = None
+
+    def added(self, length, now):
+        if self.firstAdded is None:
+            self.firstAdded = now
+        self.pending += length
+
+    def flushed(self, now, ackLatency):
+        if self.firstAdded is not None:
+            # the output rate while output was arriving; a buffer that filled
+            # within a single reactor turn counts as a millisecond
+            rate = self.pending / max(now - self.firstAdded, 0.001)
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate = (self.rate + rate) / 2
+            self.size = int(min(max(self.rate * self.fillTime, self.minSize),
+                                self.maxSize))
+            self.pending = 0
+            self.firstAdded = None
+        self.timeout = min(max(ackLatency or 0, self.minTimeout),
+                           self.maxTimeout)
+
+
 class RunProcess:
 
     """
@@ -227,11 +291,14 @@ class RunProcess:
     interruptSignal = "KILL"
     CHUNK_LIMIT = 128 * 1024
 
-    # Don't send any data until at least BUFFER_SIZE bytes have been collected
-    # or BUFFER_TIMEOUT elapsed
+    # With outputBuffering='fixed', don't send any data until at least
+    # BUFFER_SIZE bytes have been collected or BUFFER_TIMEOUT elapsed
     BUFFER_SIZE = 64 * 1024
     BUFFER_TIMEOUT = 5
 
+    # set while reading the process's output is paused
+    paused = False
+
     # For sending elapsed time:
     startTime = None
     elapsedTime = None
@@ -250,7 +317,7 @@ class RunProcess:
                  timeout=None, maxTime=None, sigtermTime=None,
                  initialStdin=None, keepStdout=False, keepStderr=False,
                  logEnviron=True, logfiles={}, usePTY="slave-config",
-                 useProcGroup=True):
+                 useProcGroup=True, outputBuffering=None):
         """
 
         @param keepStdout: if True, we keep a copy of all the stdout text
@@ -264,6 +331,10 @@ class RunProcess:
 
         @param useProcGroup: (default True) use a process group for non-PTY
             process invocations
+
+        @param outputBuffering: "adaptive" (the default) to tune output
+            buffering to the output rate and the master's ack latency, or
+            "fixed" to buffer BUFFER_SIZE bytes or BUFFER_TIMEOUT seconds
         """
 
         self.builder = builder
@@ -349,6 +420,13 @@ class RunProcess:
         self.buffered = deque()
         self.buflen = 0
         self.sendBuffersTimer = None
+        if outputBuffering == "fixed":
+            self.bufferPolicy = FixedBufferPolicy(self.BUFFER_SIZE,
+                                                  self.BUFFER_TIMEOUT)
+        elif outputBuffering in (None, "adaptive"):
+            self.bufferPolicy = AdaptiveBufferPolicy()
+        else:
+            raise ValueError("unknown outputBuffering %r" % (outputBuffering,))
 
         if usePTY == "slave-config":
             self.usePTY = self.builder.usePTY
@@ -529,9 +607,12 @@ class RunProcess:
             self.workdir,
             usePTY=self.usePTY)
 
+        if self.paused:
+            self.process.pauseProducing()
+
         # set up timeouts
 
-        if self.timeout:
+        if self.timeout and not self.paused:
             self.ioTimeoutTimer = self._reactor.callLater(self.timeout, self.doTimeout)
 
         if self.maxTime:
@@ -632,6 +713,52 @@ class RunProcess:
         """
         Send all the content in our buffers.
         """
+        if self.builder.orderedUpdates:
+            self._sendOrderedBuffers()
+        else:
+            self._sendKeyedBuffers()
+        self.buflen = 0
+        self.bufferPolicy.flushed(self._reactor.seconds(),
+                                  self.builder.ackLatency)
+        if self.sendBuffersTimer:
+            if self.sendBuffersTimer.active():
+                self.sendBuffersTimer.cancel()
+            self.sendBuffersTimer = None
+
+    def _sendOrderedBuffers(self):
+        """
+        Send the buffers as ordered 'output' lists of (key, logname, data),
+        so output from different logs can share a single update.
+        """
+        output = []
+        msg_size = 0
+        while self.buffered:
+            logname, data = self.buffered.popleft()
+            if isinstance(logname, tuple):
+                key, logname = logname
+            else:
+                key, logname = logname, None
+
+            for chunk in self._chunkForSend(data):
+                if len(chunk) == 0:
+                    continue
+                if output and output[-1][:2] == [key, logname]:
+                    output[-1][2].append(chunk)
+                else:
+                    output.append([key, logname, [chunk]])
+                msg_size += len(chunk)
+                if msg_size >= self.CHUNK_LIMIT:
+                    self._sendOutput(output)
+                    output = []
+                    msg_size = 0
+        if output:
+            self._sendOutput(output)
+
+    def _sendOutput(self, output):
+        self.sendStatus({'output': [(key, logname, "".join(chunks))
+                                    for key, logname, chunks in output]})
+
+    def _sendKeyedBuffers(self):
         msg = {}
         msg_size = 0
         lastlog = None
@@ -644,9 +771,9 @@ class RunProcess:
             # out the message so far.  This is because the message is
             # transferred as a dictionary, which makes the ordering of keys
             # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
+            # different logs.  Masters that accept ordered updates get a
+            # list of (key, logname, data) tuples instead; see
+            # _sendOrderedBuffers.
             # On our first pass through this loop lastlog is None
             if lastlog is None:
                 lastlog = logname
@@ -673,29 +800,26 @@ class RunProcess:
                     msg = {}
                     logdata = msg.setdefault(logname, [])
                     msg_size = 0
-        self.buflen = 0
         if logdata:
             self._sendMessage(msg)
-        if self.sendBuffersTimer:
-            if self.sendBuffersTimer.active():
-                self.sendBuffersTimer.cancel()
-            self.sendBuffersTimer = None
 
     def _addToBuffers(self, logname, data):
         """
         Add data to the buffer for logname
-        Start a timer to send the buffers if BUFFER_TIMEOUT elapses.
-        If adding data causes the buffer size to grow beyond BUFFER_SIZE, then
-        the buffers will be sent.
+        Start a timer to send the buffers if the buffer policy's timeout
+        elapses.  If adding data causes the buffer size to grow beyond the
+        policy's size, then the buffers will be sent.
         """
         n = len(data)
 
         self.buflen += n
         self.buffered.append((logname, data))
-        if self.buflen > self.BUFFER_SIZE:
+        self.bufferPolicy.added(n, self._reactor.seconds())
+        if self.buflen > self.bufferPolicy.size:
             self._sendBuffers()
         elif not self.sendBuffersTimer:
-            self.sendBuffersTimer = self._reactor.callLater(self.BUFFER_TIMEOUT, self._bufferTimeout)
+            self.sendBuffersTimer = self._reactor.callLater(
+                self.bufferPolicy.timeout, self._bufferTimeout)
 
     def addStdout(self, data):
         if self.sendStdout:
@@ -755,6 +879,28 @@ class RunProcess:
         else:
             log.msg("Hey, command %s finished twice" % self)
 
+    def pauseProducing(self):
+        """Stop reading the process's output until resumeProducing() is
+        called.  The output timeout does not run while reading is paused."""
+        if self.paused:
+            return
+        self.paused = True
+        if self.process is not None and self.deferred:
+            self.process.pauseProducing()
+        if self.ioTimeoutTimer:
+            self.ioTimeoutTimer.cancel()
+            self.ioTimeoutTimer = None
+
+    def resumeProducing(self):
+        if not self.paused:
+            return
+        self.paused = False
+        if self.process is not None and self.deferred:
+            self.process.resumeProducing()
+            if self.timeout:
+                self.ioTimeoutTimer = self._reactor.callLater(self.timeout,
+                                                              self.doTimeout)
+
     def doTimeout(self):
         self.ioTimeoutTimer = None
         msg = "command timed out: %d seconds without output" % self.timeout
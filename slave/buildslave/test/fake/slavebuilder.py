@@ -25,11 +25,14 @@ class FakeSlaveBuilder:
     """
     debug = False
 
-    def __init__(self, usePTY=False, basedir="/slavebuilder/basedir"):
+    def __init__(self, usePTY=False, basedir="/slavebuilder/basedir",
+                 orderedUpdates=False):
         self.updates = []
         self.basedir = basedir
         self.usePTY = usePTY
         self.unicode_encoding = 'utf-8'
+        self.orderedUpdates = orderedUpdates
+        self.ackLatency = None
 
     def sendUpdate(self, data):
         if self.debug:
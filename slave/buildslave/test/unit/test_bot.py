@@ -16,6 +16,7 @@
 import mock
 import os
 import shutil
+import zlib
 
 from twisted.internet import defer
 from twisted.internet import reactor
@@ -63,6 +64,25 @@ class TestBot(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_setUpdateCompression(self):
+        d = self.bot.callRemote("setUpdateCompression", True)
+
+        def check(_):
+            self.assertTrue(self.real_bot.compressUpdates)
+        d.addCallback(check)
+        return d
+
+    def test_setOrderedUpdates(self):
+        d = self.bot.callRemote("setBuilderList", [('mybld', 'myblddir')])
+        d.addCallback(lambda _:
+                      self.bot.callRemote("setOrderedUpdates", True))
+
+        def check(_):
+            self.assertTrue(self.real_bot.orderedUpdates)
+            self.assertTrue(self.real_bot.builders['mybld'].orderedUpdates)
+        d.addCallback(check)
+        return d
+
     def test_getVersion(self):
         d = self.bot.callRemote("getVersion")
 
@@ -205,6 +225,24 @@ class FakeStep(object):
         self.finished_d.callback(None)
 
 
+class SlowStep(FakeStep):
+
+    "A FakeStep that only acknowledges updates when told to."
+
+    def __init__(self):
+        FakeStep.__init__(self)
+        self.unacked = []
+
+    def remote_update(self, updates):
+        FakeStep.remote_update(self, updates)
+        d = defer.Deferred()
+        self.unacked.append(d)
+        return d
+
+    def ack(self):
+        self.unacked.pop(0).callback(0)
+
+
 class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
 
     @defer.deferredGenerator
@@ -291,6 +329,175 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_startCommand_compressed(self):
+        st = FakeStep()
+        self.bot.compressUpdates = True
+
+        output = 'hello\n' * 1000
+        self.patch_runprocess(
+            Expect(['echo', 'hello'], os.path.join(self.basedir, 'sb', 'workdir'))
+            + {'hdr': 'headers'} + {'stdout': output} + {'rc': 0}
+            + 0,
+        )
+
+        d = self.sb.callRemote("startCommand", FakeRemote(st),
+                               "13", "shell", dict(
+                                   command=['echo', 'hello'],
+                                   workdir='workdir',
+                               ))
+        d.addCallback(lambda _: st.wait_for_finish())
+
+        def check(_):
+            self.assertEqual(st.actions[0],
+                             ['update', [[{'hdr': 'headers'}, 0]]])
+            [[update, num]] = st.actions[1][1]
+            [(key, logname, zdata)] = update['compressed']
+            self.assertEqual((key, logname), ('stdout', None))
+            self.assertTrue(len(zdata) < len(output))
+            self.assertEqual(zlib.decompress(zdata), output)
+            self.assertEqual(st.actions[2], ['update', [[{'rc': 0}, 0]]])
+        d.addCallback(check)
+        return d
+
+    def test_startCommand_compressedOutput(self):
+        st = FakeStep()
+        self.bot.compressUpdates = True
+
+        output = [('stdout', None, 'hello\n' * 500),
+                  ('stderr', None, 'oops\n'),
+                  ('log', 'foo', 'hello\n' * 500)]
+        self.patch_runprocess(
+            Expect(['echo', 'hello'], os.path.join(self.basedir, 'sb', 'workdir'))
+            + {'output': output} + {'rc': 0}
+            + 0,
+        )
+
+        d = self.sb.callRemote("startCommand", FakeRemote(st),
+                               "13", "shell", dict(
+                                   command=['echo', 'hello'],
+                                   workdir='workdir',
+                               ))
+        d.addCallback(lambda _: st.wait_for_finish())
+
+        def check(_):
+            [[update, num]] = st.actions[0][1]
+            self.assertFalse('output' in update)
+            index, zdata = update['compressed_output']
+            self.assertEqual(index, [('stdout', None, 3000),
+                                     ('stderr', None, 5),
+                                     ('log', 'foo', 3000)])
+            self.assertEqual(zlib.decompress(zdata),
+                             ''.join([text for stream, logname, text in output]))
+        d.addCallback(check)
+        return d
+
+    def test_sendUpdate_flowControl(self):
+        sb = self.sb.original
+        sb.MAX_PENDING_UPDATES = 2
+        st = SlowStep()
+        sb.remoteStep = FakeRemote(st)
+
+        sb.sendUpdate({'stdout': 'a'})
+        sb.sendUpdate({'stdout': 'b'})
+        sb.sendUpdate({'stdout': 'c'})
+        sb.sendUpdate({'stdout': 'd'})
+        sb.sendUpdate({'rc': 0})
+        sb.sendUpdate({'stdout': 'e'})
+        self.assertEqual(len(st.actions), 2)
+        self.assertEqual(sb.pendingUpdates, 2)
+        self.assertEqual(len(sb.updateQueue), 3)
+
+        sb.commandComplete(None)
+        self.assertEqual(len(sb.updateQueue), 4)
+
+        st.ack()
+        self.assertEqual(st.actions[2], ['update', [[{'stdout': 'cd'}, 0]]])
+        st.ack()
+        st.ack()
+        self.assertEqual(st.actions[3:], [
+            ['update', [[{'rc': 0}, 0]]],
+            ['update', [[{'stdout': 'e'}, 0]]],
+            ['complete', None],
+        ])
+        self.assertEqual(sb.maxQueueDepth, 4)
+        self.assertFalse(sb.updateQueue)
+        while st.unacked:
+            st.ack()
+        self.assertEqual(sb.pendingUpdates, 0)
+        self.assertNotEqual(sb.ackLatency, None)
+
+    def test_sendUpdate_pausesCommand(self):
+        sb = self.sb.original
+        sb.MAX_PENDING_UPDATES = 1
+        sb.MAX_QUEUED_UPDATES = 4
+        st = SlowStep()
+        sb.remoteStep = FakeRemote(st)
+        sb.command = mock.Mock()
+
+        # rc updates are never coalesced, so each one takes a queue slot
+        for i in range(6):
+            sb.sendUpdate({'rc': i})
+        self.assertEqual(len(sb.updateQueue), 5)
+        self.assertEqual(sb.command.pauseProducing.call_count, 1)
+        self.assertFalse(sb.command.resumeProducing.called)
+
+        st.ack()
+        st.ack()
+        self.assertFalse(sb.command.resumeProducing.called)
+        st.ack()
+        self.assertEqual(len(sb.updateQueue), 2)
+        self.assertEqual(sb.command.resumeProducing.call_count, 1)
+        self.assertFalse(sb.commandPaused)
+
+    def test_lostRemoteStep_resumesCommand(self):
+        sb = self.sb.original
+        sb.MAX_PENDING_UPDATES = 1
+        sb.MAX_QUEUED_UPDATES = 1
+        sb.stopCommandOnShutdown = False
+        sb.remoteStep = FakeRemote(SlowStep())
+        sb.command = mock.Mock()
+
+        for i in range(3):
+            sb.sendUpdate({'rc': i})
+        self.assertTrue(sb.commandPaused)
+        sb.lostRemoteStep(sb.remoteStep)
+        self.assertEqual(sb.command.resumeProducing.call_count, 1)
+        self.assertFalse(sb.commandPaused)
+
+    def test_sendUpdate_coalesceOrdered(self):
+        sb = self.sb.original
+        sb.MAX_PENDING_UPDATES = 1
+        sb.orderedUpdates = True
+        st = SlowStep()
+        sb.remoteStep = FakeRemote(st)
+
+        sb.sendUpdate({'stdout': 'a'})
+        sb.sendUpdate({'stdout': 'b'})
+        sb.sendUpdate({'stderr': 'c'})
+        sb.sendUpdate({'output': [('stderr', None, 'd'), ('log', 'l', 'e')]})
+        sb.sendUpdate({'log': ('l', 'f')})
+        st.ack()
+
+        self.assertEqual(st.actions[1], ['update', [[{'output': [
+            ('stdout', None, 'b'), ('stderr', None, 'cd'),
+            ('log', 'l', 'ef')]}, 0]]])
+
+    def test_sendUpdate_coalesceLimit(self):
+        sb = self.sb.original
+        sb.MAX_PENDING_UPDATES = 1
+        sb.COALESCE_LIMIT = 4
+        st = SlowStep()
+        sb.remoteStep = FakeRemote(st)
+
+        sb.sendUpdate({'stdout': 'a'})
+        sb.sendUpdate({'stdout': 'bb'})
+        sb.sendUpdate({'stdout': 'cc'})
+        sb.sendUpdate({'stdout': 'ddd'})
+        sb.sendUpdate({'stderr': 'e'})
+        self.assertEqual([data for _, _, data in sb.updateQueue],
+                         [{'stdout': 'bbcc'}, {'stdout': 'ddd'},
+                          {'stderr': 'e'}])
+
     def test_startCommand_interruptCommand(self):
         # set up a fake step to receive updates
         st = FakeStep()
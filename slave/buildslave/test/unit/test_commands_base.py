@@ -13,6 +13,8 @@
 #
 # Copyright Buildbot Team Members
 
+import mock
+
 from twisted.internet import defer
 from twisted.trial import unittest
 
@@ -129,3 +131,15 @@ class TestDummyCommand(CommandTestMixin, unittest.TestCase):
             self.assertState(True, False, True, True, "finishes with interrupted set")
         d.addCallback(check)
         return d
+
+    def test_pauseProducing(self):
+        cmd = self.make_command(DummyCommand, {})
+        # without a child process, pausing does nothing
+        cmd.pauseProducing()
+        cmd.resumeProducing()
+
+        cmd.command = mock.Mock()
+        cmd.pauseProducing()
+        cmd.command.pauseProducing.assert_called_once_with()
+        cmd.resumeProducing()
+        cmd.command.resumeProducing.assert_called_once_with()
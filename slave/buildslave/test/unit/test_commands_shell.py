@@ -50,4 +50,27 @@ class TestSlaveShellCommand(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_outputBuffering(self):
+        self.make_command(shell.SlaveShellCommand, dict(
+            command=['echo', 'hello'],
+            workdir='workdir',
+            outputBuffering='fixed',
+        ))
+
+        self.patch_runprocess(
+            Expect(['echo', 'hello'], self.basedir_workdir,
+                   outputBuffering='fixed')
+            + {'stdout': 'hello\n'} + {'rc': 0}
+            + 0,
+        )
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates(
+                [{'stdout': 'hello\n'}, {'rc': 0}],
+                self.builder.show())
+        d.addCallback(check)
+        return d
+
     # TODO: test all functionality that SlaveShellCommand adds atop RunProcess
@@ -19,6 +19,7 @@ import shutil
 import sys
 import tarfile
 
+from hashlib import sha1
 from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.python import failure
@@ -30,16 +31,27 @@ from buildslave.test.fake.remote import FakeRemote
 from buildslave.test.util.command import CommandTestMixin
 
 
+def popTransferStats(updates):
+    # the statistics sent with the final update depend on timing, so remove
+    # them before comparing updates
+    for update in updates:
+        if isinstance(update, dict) and 'transfer' in update:
+            return update.pop('transfer')
+
+
 class FakeMasterMethods(object):
     # a fake to represent any of:
     # - FileWriter
     # - FileDirectoryWriter
     # - FileReader
+    # - ContentWriter
 
     def __init__(self, add_update):
         self.add_update = add_update
 
         self.delay_write = False
+        self.pending_writes = 0
+        self.max_pending_writes = 0
         self.count_writes = False
         self.keep_data = False
         self.write_out_of_space_at = None
@@ -49,6 +61,9 @@ class FakeMasterMethods(object):
 
         self.unpack_fail = False
 
+        self.have_content = ()
+        self.manifest = None
+
         self.written = False
         self.read = False
         self.data = ''
@@ -69,7 +84,14 @@ class FakeMasterMethods(object):
             self.data += data
 
         if self.delay_write:
+            self.pending_writes += 1
+            self.max_pending_writes = max(self.max_pending_writes,
+                                          self.pending_writes)
             d = defer.Deferred()
+
+            @d.addCallback
+            def written(_):
+                self.pending_writes -= 1
             reactor.callLater(0.01, d.callback, None)
             return d
 
@@ -96,6 +118,18 @@ class FakeMasterMethods(object):
         if self.unpack_fail:
             return defer.fail(failure.Failure(RuntimeError("out of space")))
 
+    def remote_manifest(self, manifest):
+        self.add_update('manifest')
+        self.manifest = manifest
+        return [name for name, sha, size, mode in manifest
+                if sha is not None and name not in self.have_content]
+
+    def remote_begin(self, name):
+        self.add_update('begin %s' % name)
+
+    def remote_finish(self):
+        self.add_update('finish')
+
     def remote_utime(self, accessed_modified):
         self.add_update('utime - %s' % accessed_modified[0])
 
@@ -280,6 +314,219 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def popTransferStats(self):
+        return popTransferStats(self.get_updates())
+
+    def test_windowed(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            stats = self.popTransferStats()
+            self.assertEqual((stats['bytes'], stats['blocks']), (180, 3))
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'write 64', 'write 52', 'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(self.fakemaster.data, "this is some data\n" * 10)
+        d.addCallback(check)
+        return d
+
+    def test_windowed_in_flight(self):
+        self.fakemaster.delay_write = True
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=16,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.popTransferStats()
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write(s)', 'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(self.fakemaster.max_pending_writes, 4)
+            self.assertEqual(self.fakemaster.data, "this is some data\n" * 10)
+        d.addCallback(check)
+        return d
+
+    def test_windowed_adaptive_blocksize(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=32,
+            keepstamp=False,
+            window=4,
+            maxblocksize=128,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # the fake master acknowledges immediately, so blocks double in
+            # size up to maxblocksize
+            stats = self.popTransferStats()
+            self.assertEqual(stats['blocksize'], 128)
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 32', 'write 64', 'write 84', 'close',
+                {'rc': 0}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_windowed_adaptive_blocksize_shrinks(self):
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=32,
+            keepstamp=False,
+            window=4,
+            maxblocksize=128,
+        ))
+        self.cmd.pipelineStats = dict(blocks=0, rtt=None)
+        self.cmd._adaptBlocksize(0.01)
+        self.cmd._adaptBlocksize(0.01)
+        self.assertEqual(self.cmd.blocksize, 128)
+        self.cmd._adaptBlocksize(0.3)
+        self.assertEqual(self.cmd.blocksize, 128)
+        self.cmd._adaptBlocksize(1.0)
+        self.assertEqual(self.cmd.blocksize, 64)
+        self.cmd._adaptBlocksize(1.0)
+        self.cmd._adaptBlocksize(1.0)
+        self.assertEqual(self.cmd.blocksize, 32)
+
+    def test_windowed_maxblocksize_clamped(self):
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=32,
+            keepstamp=False,
+            window=4,
+            maxblocksize=16 * 1024 * 1024,
+        ))
+        self.assertEqual(self.cmd.maxblocksize,
+                         transfer.TransferCommand.MAX_BLOCKSIZE)
+
+    def test_windowed_read_error(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            window=4,
+        ))
+        sendBlock = self.cmd._sendBlock
+        calls = []
+
+        def _sendBlock():
+            calls.append(None)
+            if len(calls) == 2:
+                raise IOError("disk went away")
+            return sendBlock()
+        self.cmd._sendBlock = _sendBlock
+
+        d = self.run_command()
+        self.assertFailure(d, IOError)
+
+        def check(_):
+            self.popTransferStats()
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'close',
+                {'rc': 1}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_windowed_truncated(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=100,
+            blocksize=64,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.popTransferStats()
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'write 36', 'close',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'" % self.datafile}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_windowed_out_of_space(self):
+        self.fakemaster.write_out_of_space_at = 70
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, RuntimeError)
+
+        def check(_):
+            self.popTransferStats()
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'close',
+                {'rc': 1}
+            ])
+        d.addCallback(check)
+        return d
+
 
 class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
@@ -302,21 +549,24 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
         if os.path.exists(self.datadir):
             shutil.rmtree(self.datadir)
 
-    def test_simple(self, compress=None):
+    def test_simple(self, compress=None, **extra_args):
         self.fakemaster.keep_data = True
 
-        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+        args = dict(
             workdir='workdir',
             slavesrc='data',
             writer=FakeRemote(self.fakemaster),
             maxsize=None,
             blocksize=512,
             compress=compress,
-        ))
+        )
+        args.update(extra_args)
+        self.make_command(transfer.SlaveDirectoryUploadCommand, args)
 
         d = self.run_command()
 
         def check(_):
+            popTransferStats(self.get_updates())
             self.assertUpdates([
                 {'header': 'sending %s' % self.datadir},
                 'write(s)', 'unpack',  # note no 'close"
@@ -348,6 +598,72 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
     if sys.version_info[:2] <= (2, 4):
         test_simple_bz2.skip = "bz2 stream decompression not supported on Python-2.4"
 
+    def test_stream(self):
+        return self.test_simple(stream=True)
+
+    def test_stream_gz(self):
+        return self.test_simple('gz', stream=True)
+
+    def test_stream_bz2(self):
+        return self.test_simple('bz2', stream=True)
+
+    def test_stream_windowed(self):
+        self.fakemaster.delay_write = True
+        d = self.test_simple(stream=True, window=4, blocksize=128)
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(self.fakemaster.max_pending_writes, 4)
+        return d
+
+    def test_stream_truncated(self):
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=512,
+            compress=None,
+            stream=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'write(s)', 'unpack',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'"
+                 % self.datadir}
+            ])
+            # the archiving thread gives up, rather than waiting forever
+            return self.cmd.tarred
+        d.addCallback(check)
+        return d
+
+    def test_stream_missing(self):
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data-nosuch',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None,
+            stream=True,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, OSError)
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % (self.datadir + '-nosuch')},
+                {'rc': 1}
+            ])
+        d.addCallback(check)
+        return d
+
     def test_out_of_space_unpack(self):
         self.fakemaster.keep_data = True
         self.fakemaster.unpack_fail = True
@@ -378,6 +694,146 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
     # are already tested
 
 
+class TestSlaveContentUpload(CommandTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpCommand()
+
+        self.fakemaster = FakeMasterMethods(self.add_update)
+
+        # write a directory to upload
+        self.datadir = os.path.join(self.basedir, 'workdir', 'data')
+        if os.path.exists(self.datadir):
+            shutil.rmtree(self.datadir)
+        os.makedirs(os.path.join(self.datadir, 'sub'))
+        open(os.path.join(self.datadir, "aa"), "wb").write("lots of a" * 100)
+        open(os.path.join(self.datadir, "sub", "bb"), "wb").write(
+            "and a little b" * 17)
+
+    def tearDown(self):
+        self.tearDownCommand()
+
+        if os.path.exists(self.datadir):
+            shutil.rmtree(self.datadir)
+
+    def make(self, slavesrc='data', **extra_args):
+        args = dict(
+            workdir='workdir',
+            slavesrc=slavesrc,
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+        )
+        args.update(extra_args)
+        self.make_command(transfer.SlaveContentUploadCommand, args)
+
+    def test_simple(self):
+        self.fakemaster.keep_data = True
+        self.make()
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'manifest',
+                'begin aa', 'write(s)', 'finish',
+                'begin sub/bb', 'finish',
+                'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(
+                [(name, size, mode & 0700)
+                 for name, sha, size, mode in self.fakemaster.manifest],
+                [('aa', 900, 0600), ('sub', 0, 0700), ('sub/bb', 238, 0600)])
+            self.assertEqual(self.fakemaster.manifest[0][1],
+                             sha1("lots of a" * 100).hexdigest())
+            self.assertEqual(self.fakemaster.data,
+                             "lots of a" * 100 + "and a little b" * 17)
+        d.addCallback(check)
+        return d
+
+    def test_unchanged(self):
+        self.fakemaster.have_content = ('aa', 'sub/bb')
+        self.make()
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'manifest', 'close',
+                {'rc': 0}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_file(self):
+        self.make(slavesrc=os.path.join('data', 'aa'))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % os.path.join(self.datadir, 'aa')},
+                'manifest', 'begin ', 'write(s)', 'finish', 'close',
+                {'rc': 0}
+            ])
+            self.assertEqual(self.fakemaster.manifest[0][:3],
+                             ('', sha1("lots of a" * 100).hexdigest(), 900))
+        d.addCallback(check)
+        return d
+
+    def test_windowed(self):
+        self.fakemaster.delay_write = True
+        self.fakemaster.keep_data = True
+        self.make(window=4, blocksize=128)
+
+        d = self.run_command()
+
+        def check(_):
+            stats = popTransferStats(self.get_updates())
+            self.assertEqual(stats['bytes'], 1138)
+            self.assertEqual(self.fakemaster.max_pending_writes, 4)
+            self.assertEqual(self.fakemaster.data,
+                             "lots of a" * 100 + "and a little b" * 17)
+        d.addCallback(check)
+        return d
+
+    def test_truncated(self):
+        self.make(maxsize=1000)
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'manifest',
+                'begin aa', 'write(s)', 'finish',
+                'begin sub/bb', 'close',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'"
+                 % os.path.join(self.datadir, 'sub', 'bb')}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_missing(self):
+        self.make(slavesrc='data-nosuch')
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % (self.datadir + '-nosuch')},
+                {'rc': 1,
+                 'stderr': "Cannot read '%s' for upload"
+                 % (self.datadir + '-nosuch')}
+            ])
+        d.addCallback(check)
+        return d
+
+
 class TestDownloadFile(CommandTestMixin, unittest.TestCase):
 
     def setUp(self):
@@ -475,6 +931,87 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_windowed(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data = '1234' * 13
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=0777,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            stats = popTransferStats(self.get_updates())
+            self.assertEqual(stats['bytes'], 52)
+            self.assertUpdates([
+                'read 32', 'read 32', 'read 32', 'close',
+                {'rc': 0}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_windowed_delayed(self):
+        self.fakemaster.data = test_data = 'tenchars--' * 100
+        self.fakemaster.delay_read = True
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=0777,
+            window=4,
+            maxblocksize=256,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            popTransferStats(self.get_updates())
+            self.assertUpdates(['read(s)', 'close', {'rc': 0}])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_windowed_truncated(self):
+        self.fakemaster.data = test_data = 'tenchars--' * 10
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=50,
+            blocksize=32,
+            mode=0777,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            popTransferStats(self.get_updates())
+            self.assertUpdates([
+                'read(s)', 'close',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'"
+                 % os.path.join(self.basedir, '.', 'data')}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data[:50])
+        d.addCallback(check)
+        return d
+
     def test_truncated(self):
         self.fakemaster.data = test_data = 'tenchars--' * 10
 
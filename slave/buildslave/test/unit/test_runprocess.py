@@ -443,6 +443,43 @@ class TestRunProcess(BasedirMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def testPauseProducing(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  timeout=10)
+        s._reactor = clock = task.Clock()
+        s.process = Mock()
+        s.deferred = defer.Deferred()
+        s.ioTimeoutTimer = clock.callLater(10, s.doTimeout)
+        s.kill = Mock()
+
+        s.pauseProducing()
+        s.pauseProducing()
+        self.assertEqual(s.process.pauseProducing.call_count, 1)
+        # no output arrives while paused, but that is not a timeout
+        clock.advance(20)
+        self.assertFalse(s.kill.called)
+
+        s.resumeProducing()
+        self.assertEqual(s.process.resumeProducing.call_count, 1)
+        clock.advance(10)
+        self.assertTrue(s.kill.called)
+
+    def testPausedBeforeStart(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  timeout=10)
+        s.pauseProducing()
+        d = s.start()
+        self.assertEqual(s.ioTimeoutTimer, None)
+        reactor.callLater(0.1, s.resumeProducing)
+
+        def check(ign):
+            self.failUnless({'stdout': nl('hello\n')} in b.updates, b.show())
+            self.failUnless({'rc': 0} in b.updates, b.show())
+        d.addCallback(check)
+        return d
+
     def testEnvironInt(self):
         b = FakeSlaveBuilder(False, self.basedir)
         self.assertRaises(RuntimeError, lambda:
@@ -758,6 +795,85 @@ class TestLogging(BasedirMixin, unittest.TestCase):
             {'stdout': 'world'},
         ])
 
+    def testSendBufferedOrdered(self):
+        b = FakeSlaveBuilder(False, self.basedir, orderedUpdates=True)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._addToBuffers('stdout', 'hello ')
+        s._addToBuffers('stdout', 'there ')
+        s._addToBuffers('stderr', 'DIEEEEEEE')
+        s._addToBuffers(('log', 'foo'), 'logged')
+        s._addToBuffers('stdout', 'world')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [
+            {'output': [('stdout', None, 'hello there '),
+                        ('stderr', None, 'DIEEEEEEE'),
+                        ('log', 'foo', 'logged'),
+                        ('stdout', None, 'world')]},
+        ])
+
+    def testSendOrderedChunked(self):
+        b = FakeSlaveBuilder(False, self.basedir, orderedUpdates=True)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        limit = runprocess.RunProcess.CHUNK_LIMIT
+        s._addToBuffers('stderr', 'oops')
+        s._addToBuffers('stdout', "x" * (limit * 3 / 2))
+        self.failUnlessEqual(b.updates, [
+            {'output': [('stderr', None, 'oops'),
+                        ('stdout', None, "x" * limit)]},
+            {'output': [('stdout', None, "x" * (limit / 2))]},
+        ])
+
+    def testAdaptiveBufferingSlowOutput(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._reactor = clock = task.Clock()
+        s._addToBuffers('stdout', 'hello')
+        self.failUnlessEqual(b.updates, [])
+        clock.advance(runprocess.AdaptiveBufferPolicy.minTimeout)
+        self.failUnlessEqual(b.updates, [{'stdout': 'hello'}])
+
+    def testAdaptiveBufferingFastOutput(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._reactor = task.Clock()
+        s._addToBuffers('stdout', 'x' * (runprocess.AdaptiveBufferPolicy.minSize + 1))
+        self.failUnlessEqual(len(b.updates), 1)
+        # that filled the buffer instantly, so it grows to its maximum
+        self.failUnlessEqual(s.bufferPolicy.size,
+                             runprocess.AdaptiveBufferPolicy.maxSize)
+        s._addToBuffers('stdout', 'x' * runprocess.RunProcess.BUFFER_SIZE)
+        self.failUnlessEqual(len(b.updates), 1)
+
+    def testAdaptiveBufferingAckLatency(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        b.ackLatency = 2
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._reactor = clock = task.Clock()
+        s._addToBuffers('stdout', 'hello')
+        clock.advance(runprocess.AdaptiveBufferPolicy.minTimeout)
+        s._addToBuffers('stdout', 'world')
+        clock.advance(1)
+        self.failUnlessEqual(len(b.updates), 1)
+        clock.advance(1)
+        self.failUnlessEqual(b.updates[1], {'stdout': 'world'})
+
+    def testFixedBuffering(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  outputBuffering='fixed')
+        s._reactor = clock = task.Clock()
+        s._addToBuffers('stdout', 'hello')
+        clock.advance(runprocess.RunProcess.BUFFER_TIMEOUT - 1)
+        self.failUnlessEqual(b.updates, [])
+        clock.advance(1)
+        self.failUnlessEqual(b.updates, [{'stdout': 'hello'}])
+
+    def testUnknownBuffering(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        self.assertRaises(ValueError, runprocess.RunProcess, b,
+                          stdoutCommand('hello'), self.basedir,
+                          outputBuffering='sometimes')
+
     def testSendChunked(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)